@@ -0,0 +1,514 @@
+"""
+Offline benchmark zpracování účtenek - bez volání Google AI a bez nákladů.
+
+Skript načte extract-bill-json.py, nahradí v něm genai.Client falešným
+klientem a spustí vybrané režimy nad syntetickým adresářem obrázků.
+Falešný klient přehrává nahrané odpovědi včetně usage_metadata s nastavitelnou
+latencí, chybovostí a podílem odpovědí 429, takže se projeví i opakování
+a omezovač kvóty. Každý běh jde v samostatném procesu, aby špička paměti
+(peak RSS) odpovídala jen jemu.
+
+Nahrávky (--nahravky) mohou být:
+  - adresář po skutečném běhu: *.json výstupy + tokeny z knihy spotřeby (nebo report_spotreby.csv)
+  - JSONL soubor s řádky {"text": "...", "usage": {"prompt_token_count": ..., ...}}
+Bez nahrávek se použije jedna vestavěná ukázková odpověď.
+
+Příklady:
+    python benchmark-bill-json.py
+    python benchmark-bill-json.py --pocty 10 1000 10000 --rezimy 2 4 --latence 1.5
+    python benchmark-bill-json.py --nahravky example --chybovost 0.02 --podil-429 0.01 --vystup zaklad.json
+    python benchmark-bill-json.py --porovnat zaklad.json
+"""
+import argparse
+import importlib.util
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+from types import SimpleNamespace
+
+# resource (peak RSS) není na Windows k dispozici
+try:
+    import resource
+except ImportError:
+    resource = None
+
+SKRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "extract-bill-json.py")
+
+NAZVY_REZIMU = {
+    "2": "dávka",
+    "3": "jednotlivo",
+    "4": "souběžně",
+    "5": "batch API",
+}
+
+# Ukázková odpověď pro jednu účtenku, pokud nejsou k dispozici nahrávky skutečného běhu
+VYCHOZI_NAHRAVKA = {
+    "text": json.dumps([
+        {"typ": "informace_o_prodejci", "nazev": "Potraviny u Nádraží s.r.o.", "ico": "12345678",
+         "adresa": "Nádražní 1, 110 00 Praha"},
+        {"typ": "polozka_nakupu", "nazev_polozky": "Rohlík", "mnozstvi": 4, "cena_za_kus": 3.5, "celkem": 14.0},
+        {"typ": "polozka_nakupu", "nazev_polozky": "Mléko 1 l", "mnozstvi": 1, "cena_za_kus": 24.9, "celkem": 24.9},
+        {"typ": "souhrn_plateb", "celkova_castka": 38.9, "mena": "CZK", "zpusob_platby": "karta"},
+        {"typ": "danovy_rozpis", "sazba": "12 %", "zaklad": 34.73, "dan": 4.17},
+        {"typ": "detaily_transakce", "datum": "2025-06-20", "cas": "14:32", "cislo_uctenky": "0042/17"},
+    ], ensure_ascii=False),
+    "usage": {"prompt_token_count": 1600, "candidates_token_count": 700, "total_token_count": 2300},
+}
+
+def nacist_skript():
+    """Načte extract-bill-json.py jako modul (název se pomlčkami nejde importovat)."""
+    spec = importlib.util.spec_from_file_location("extract_bill_json", SKRIPT)
+    modul = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = modul
+    spec.loader.exec_module(modul)
+    return modul
+
+def nacist_nahravky(cesta, modul):
+    """
+    Načte nahrané odpovědi pro jednu účtenku.
+
+    Returns:
+        list: Slovníky {"data": naparsovaný JSON, "usage": usage_metadata jako slovník}
+    """
+    zaznamy = []
+    if cesta is None:
+        zaznamy.append(VYCHOZI_NAHRAVKA)
+    elif os.path.isdir(cesta):
+        # Výstupy předchozího běhu - report má jen celkový počet tokenů, poměr vstup/výstup převezmeme z ukázky
+        tokeny = {}
+        if os.path.exists(os.path.join(cesta, modul.KNIHA_SPOTREBY_SOUBOR)) \
+                or os.path.exists(os.path.join(cesta, modul.REPORT_SOUBOR)):
+            for radek in modul.kniha_spotreby(cesta).radky(status="USPECH"):
+                if radek[4] in ("USPECH", "USPECH_JEDNOTLIVO"):
+                    tokeny[os.path.splitext(radek[1])[0]] = int(radek[2])
+        vychozi = VYCHOZI_NAHRAVKA["usage"]
+        podil_vstupu = vychozi["prompt_token_count"] / vychozi["total_token_count"]
+        for soubor in sorted(os.listdir(cesta)):
+            if not soubor.endswith(".json"):
+                continue
+            with open(os.path.join(cesta, soubor), encoding="utf-8") as f:
+                text = f.read()
+            celkem = tokeny.get(os.path.splitext(soubor)[0], vychozi["total_token_count"])
+            vstup = int(celkem * podil_vstupu)
+            zaznamy.append({"text": text, "usage": {"prompt_token_count": vstup,
+                                                    "candidates_token_count": celkem - vstup,
+                                                    "total_token_count": celkem}})
+    else:
+        with open(cesta, encoding="utf-8") as f:
+            zaznamy = [json.loads(radek) for radek in f if radek.strip()]
+
+    nahravky = []
+    for zaznam in zaznamy:
+        try:
+            data = modul.nacist_json_odpovedi(zaznam["text"])
+        except (json.JSONDecodeError, KeyError):
+            continue
+        nahravky.append({"data": data, "usage": zaznam.get("usage") or VYCHOZI_NAHRAVKA["usage"]})
+    if not nahravky:
+        raise ValueError(f"V '{cesta}' nejsou žádné použitelné nahrávky odpovědí.")
+    return nahravky
+
+class ChybaApi(Exception):
+    """Chyba falešného API - nese HTTP kód stejně jako google.genai.errors.APIError."""
+
+    def __init__(self, code, zprava):
+        super().__init__(f"{code} {zprava}")
+        self.code = code
+
+class FalesneModely:
+    """Náhrada client.models - přehrává nahrávky se zpožděním a náhodnými chybami."""
+
+    def __init__(self, modul, nahravky, latence, latence_na_obrazek, chybovost, podil_429, seed, kontexty):
+        self.modul = modul
+        self.nahravky = nahravky
+        self.latence = latence
+        self.latence_na_obrazek = latence_na_obrazek
+        self.chybovost = chybovost
+        self.podil_429 = podil_429
+        self.kontexty = kontexty
+        self.pocet_volani = 0
+        self.pocet_chyb = 0
+        self.tokeny = 0
+        self.naklady = 0.0
+        self._nahoda = random.Random(seed)
+        self._dalsi_nahravka = 0
+        self._zamek = threading.Lock()
+
+    def generate_content(self, model, contents, config=None):
+        casti = [cast for obsah in contents for cast in (obsah.parts or [])]
+        pocet_obrazku = sum(1 for cast in casti if getattr(cast, "inline_data", None) is not None)
+        texty = [cast.text for cast in casti if getattr(cast, "text", None)]
+        nazev_kontextu = getattr(config, "cached_content", None)
+        prompt = self.kontexty.get(nazev_kontextu) or (texty[0] if texty else "")
+
+        with self._zamek:
+            self.pocet_volani += 1
+            los = self._nahoda.random()
+            zpozdeni = self.latence * self._nahoda.lognormvariate(0, 0.25) + self.latence_na_obrazek * pocet_obrazku
+            vybrane = []
+            for _ in range(pocet_obrazku):
+                vybrane.append(self.nahravky[self._dalsi_nahravka % len(self.nahravky)])
+                self._dalsi_nahravka += 1
+
+        time.sleep(zpozdeni)
+        if los < self.podil_429 + self.chybovost:
+            with self._zamek:
+                self.pocet_chyb += 1
+            if los < self.podil_429:
+                raise ChybaApi(429, "RESOURCE_EXHAUSTED")
+            raise ChybaApi(503, "UNAVAILABLE")
+
+        if prompt == self.modul.PROMPT_DAVKA:
+            text = json.dumps([{"obrazek_index": i, "data": nahravka["data"]} for i, nahravka in enumerate(vybrane)],
+                              ensure_ascii=False)
+        else:
+            text = json.dumps(vybrane[0]["data"] if vybrane else [], ensure_ascii=False)
+
+        vstup = sum(n["usage"].get("prompt_token_count", 0) for n in vybrane)
+        vystup = sum(n["usage"].get("candidates_token_count", 0) for n in vybrane)
+        cached = self.modul.odhadnout_tokeny_textu(prompt) if nazev_kontextu in self.kontexty else None
+        usage = SimpleNamespace(prompt_token_count=vstup, candidates_token_count=vystup,
+                                total_token_count=vstup + vystup, cached_content_token_count=cached)
+        with self._zamek:
+            self.tokeny += vstup + vystup
+            self.naklady += self.modul.naklady_odpovedi(usage, model)
+        return SimpleNamespace(text=text, usage_metadata=usage)
+
+class FalesneKontextoveCache:
+    """Náhrada client.caches - jen si pamatuje, který prompt je pod kterým názvem."""
+
+    def __init__(self, modul, kontexty):
+        self.modul = modul
+        self.kontexty = kontexty
+
+    def create(self, model, config):
+        prompt = config["contents"][0]["parts"][0]["text"]
+        nazev = f"cachedContents/benchmark-{len(self.kontexty) + 1}"
+        self.kontexty[nazev] = prompt
+        usage = SimpleNamespace(total_token_count=self.modul.odhadnout_tokeny_textu(prompt))
+        return SimpleNamespace(name=nazev, usage_metadata=usage)
+
+    def update(self, name, config):
+        pass
+
+    def delete(self, name):
+        self.kontexty.pop(name, None)
+
+class FalesneSoubory:
+    """Náhrada client.files - nahrané soubory drží v paměti."""
+
+    def __init__(self):
+        self.soubory = {}
+
+    def upload(self, file, config=None):
+        nazev = f"files/benchmark-{len(self.soubory) + 1}"
+        with open(file, "rb") as f:
+            self.soubory[nazev] = f.read()
+        return SimpleNamespace(name=nazev)
+
+    def download(self, file):
+        return self.soubory[file]
+
+class FalesneDavkoveUlohy:
+    """
+    Náhrada client.batches - lokální služba asynchronních úloh.
+
+    Úloha zpracuje všechny řádky JSONL hned při vytvoření (odpovědi z nahrávek,
+    chybovost po řádcích), ale jako hotovou ji hlásí až po uplynutí latence
+    úlohy. Do počítadel falešných modelů přičítá tokeny a náklady se slevou Batch API.
+    """
+
+    def __init__(self, modul, modely, soubory, latence, latence_na_pozadavek):
+        self.modul = modul
+        self.modely = modely
+        self.soubory = soubory
+        self.latence = latence
+        self.latence_na_pozadavek = latence_na_pozadavek
+        self.ulohy = {}
+        # Doba od vytvoření úlohy po první dotaz, který ji zastihl hotovou
+        self.doby = []
+
+    def create(self, model, src, config=None):
+        nazev = f"batches/benchmark-{len(self.ulohy) + 1}"
+        vysledky = []
+        pocet = 0
+        for radek in self.soubory.download(src).decode("utf-8").splitlines():
+            pozadavek = json.loads(radek)
+            pocet += 1
+            modely = self.modely
+            with modely._zamek:
+                modely.pocet_volani += 1
+                los = modely._nahoda.random()
+                nahravka = modely.nahravky[modely._dalsi_nahravka % len(modely.nahravky)]
+                modely._dalsi_nahravka += 1
+            if los < modely.chybovost + modely.podil_429:
+                with modely._zamek:
+                    modely.pocet_chyb += 1
+                vysledky.append({"key": pozadavek["key"], "error": {"code": 503, "message": "UNAVAILABLE"}})
+                continue
+            usage = nahravka["usage"]
+            usage_ns = SimpleNamespace(**usage)
+            with modely._zamek:
+                modely.tokeny += usage["prompt_token_count"] + usage["candidates_token_count"]
+                modely.naklady += self.modul.naklady_odpovedi(usage_ns, model) * self.modul.SLEVA_BATCH_API
+            vysledky.append({"key": pozadavek["key"], "response": {
+                "candidates": [{"content": {"parts": [{"text": json.dumps(nahravka["data"], ensure_ascii=False)}]}}],
+                "usageMetadata": {"promptTokenCount": usage["prompt_token_count"],
+                                  "candidatesTokenCount": usage["candidates_token_count"],
+                                  "totalTokenCount": usage["total_token_count"]},
+            }})
+        nazev_vysledku = f"files/{nazev.split('/')[1]}-vysledky"
+        self.soubory.soubory[nazev_vysledku] = "\n".join(json.dumps(v, ensure_ascii=False) for v in vysledky).encode()
+        self.ulohy[nazev] = {
+            "display_name": (config or {}).get("display_name"),
+            "zacatek": time.perf_counter(),
+            "trvani": self.latence + self.latence_na_pozadavek * pocet,
+            "vysledky": nazev_vysledku,
+        }
+        return self.get(nazev)
+
+    def get(self, name):
+        uloha = self.ulohy[name]
+        uplynulo = time.perf_counter() - uloha["zacatek"]
+        hotovo = uplynulo >= uloha["trvani"]
+        if hotovo and "doba" not in uloha:
+            uloha["doba"] = uplynulo
+            self.doby.append(uplynulo)
+        return SimpleNamespace(name=name, display_name=uloha["display_name"],
+                               state="JOB_STATE_SUCCEEDED" if hotovo else "JOB_STATE_RUNNING",
+                               dest=SimpleNamespace(file_name=uloha["vysledky"]) if hotovo else None)
+
+    def list(self):
+        return [self.get(nazev) for nazev in self.ulohy]
+
+class FalesnyKlient:
+    """Náhrada genai.Client s rozhraním, které používá extract-bill-json.py."""
+
+    def __init__(self, modul, nahravky, latence=0.2, latence_na_obrazek=0.05, chybovost=0.0, podil_429=0.0,
+                 seed=0):
+        kontexty = {}
+        self.models = FalesneModely(modul, nahravky, latence, latence_na_obrazek, chybovost, podil_429, seed,
+                                    kontexty)
+        self.caches = FalesneKontextoveCache(modul, kontexty)
+        self.files = FalesneSoubory()
+        self.batches = FalesneDavkoveUlohy(modul, self.models, self.files, latence, latence_na_obrazek)
+
+def merici_vykonavac(modul, latence):
+    """Vrátí podtřídu VykonavacPozadavku, která měří dobu každého požadavku včetně čekání a opakování."""
+    class MericiVykonavac(modul.VykonavacPozadavku):
+        def generovat(self, *args, **kwargs):
+            zacatek = time.perf_counter()
+            try:
+                return super().generovat(*args, **kwargs)
+            finally:
+                latence.append(time.perf_counter() - zacatek)
+    return MericiVykonavac
+
+def pripravit_adresar(cil, pocet, zdroj, modul):
+    """
+    Naplní adresář daným počtem obrázků - odkazy (hardlinky) na vzorové obrázky ze zdroje.
+
+    Bez cache a manifestu na shodném obsahu nezáleží, takže i 10 000 obrázků nezabere místo navíc.
+    """
+    vzory = modul.najit_obrazky(zdroj)
+    if not vzory:
+        raise ValueError(f"Ve zdrojovém adresáři '{zdroj}' nejsou žádné obrázky.")
+    for i in range(pocet):
+        vzor = vzory[i % len(vzory)]
+        cesta = os.path.join(cil, f"uctenka_{i:05d}{os.path.splitext(vzor)[1].lower()}")
+        try:
+            os.link(vzor, cesta)
+        except OSError:
+            shutil.copyfile(vzor, cesta)
+
+def spustit_beh(parametry):
+    """
+    Provede jeden běh benchmarku (jeden režim, jeden počet obrázků) v tomto procesu.
+
+    Returns:
+        dict: Naměřené hodnoty běhu
+    """
+    modul = nacist_skript()
+    nahravky = nacist_nahravky(parametry["nahravky"], modul)
+    klient = FalesnyKlient(modul, nahravky, parametry["latence"], parametry["latence_na_obrazek"],
+                           parametry["chybovost"], parametry["podil_429"], parametry["seed"])
+    latence = []
+
+    # Pipeline si klienta vytváří sama - podstrčíme jí falešného a API klíč nepotřebujeme
+    modul.genai = SimpleNamespace(Client=lambda **kwargs: klient)
+    modul.nacti_api_klic = lambda: "benchmark"
+    modul.VykonavacPozadavku = merici_vykonavac(modul, latence)
+
+    rezim = parametry["rezim"]
+    pocet = parametry["pocet"]
+    with tempfile.TemporaryDirectory(prefix="benchmark-uctenek-") as adresar:
+        pripravit_adresar(adresar, pocet, parametry["zdroj"], modul)
+        spolecne = {"strukturovany_vystup": parametry["strukturovany_vystup"]}
+        if rezim == "2":
+            spustit = lambda: modul.zpracovat_davku_uctenek(adresar, velikost_davky=parametry["velikost_davky"],
+                                                            **spolecne)
+        elif rezim == "3":
+            spustit = lambda: modul.zpracovat_davku_jednotlivo(adresar, **spolecne)
+        elif rezim == "5":
+            # Na stav úlohy se ptáme často, ať měříme její dobu, ne čekání
+            spustit = lambda: modul.zpracovat_davkovou_ulohou(
+                adresar, strukturovany_vystup=parametry["strukturovany_vystup"],
+                interval=max(parametry["latence"] / 20, 0.005))
+        else:
+            spustit = lambda: modul.zpracovat_davku_soubezne(adresar, max_soubezne=parametry["soubezne"],
+                                                             **spolecne)
+
+        # Výpisy pipeline by měření jen zdržovaly
+        zacatek = time.perf_counter()
+        with open(os.devnull, "w", encoding="utf-8") as ticho, redirect_stdout(ticho):
+            spustit()
+        trvani = time.perf_counter() - zacatek
+        # V režimu 5 je "požadavkem" celá úloha - latence je doba od odeslání po dokončení
+        latence.extend(klient.batches.doby)
+
+        hotovo = sum(1 for soubor in os.listdir(adresar) if soubor.endswith(".json"))
+        # Kniha spotřeby zapisuje na pozadí - dopíšeme ji dřív, než dočasný adresář zmizí
+        modul.zavrit_knihy_spotreby()
+
+    peak_rss_mb = None
+    if resource is not None:
+        # ru_maxrss je na Linuxu v KiB, na macOS v bajtech
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak_rss_mb = maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+    return {
+        "rezim": rezim,
+        "pocet": pocet,
+        "hotovo": hotovo,
+        "trvani_s": trvani,
+        "obrazku_za_s": hotovo / trvani if trvani else 0.0,
+        "pozadavku": len(latence),
+        "volani_api": klient.models.pocet_volani,
+        "chyb_api": klient.models.pocet_chyb,
+        "latence_p50_s": modul.percentil(latence, 50),
+        "latence_p95_s": modul.percentil(latence, 95),
+        "peak_rss_mb": peak_rss_mb,
+        "tokenu_na_obrazek": klient.models.tokeny / hotovo if hotovo else 0.0,
+        "usd_na_obrazek": klient.models.naklady / hotovo if hotovo else 0.0,
+    }
+
+def spustit_v_procesu(parametry):
+    """Spustí jeden běh v novém procesu, aby peak RSS nezahrnoval předchozí běhy."""
+    vysledek = subprocess.run([sys.executable, os.path.abspath(__file__), "--beh", json.dumps(parametry)],
+                              capture_output=True, text=True)
+    if vysledek.returncode != 0:
+        raise RuntimeError(f"Běh {parametry['rezim']}/{parametry['pocet']} selhal:\n{vysledek.stderr}")
+    return json.loads(vysledek.stdout.strip().splitlines()[-1])
+
+def vypsat_tabulku(vysledky):
+    """Vypíše naměřené hodnoty jako tabulku."""
+    print(f"{'režim':<12}{'obrázků':>9}{'hotovo':>8}{'img/s':>9}{'p50 [s]':>9}{'p95 [s]':>9}"
+          f"{'požad.':>8}{'chyb':>6}{'RSS [MB]':>10}{'tok/img':>9}{'USD/img':>11}")
+    for v in vysledky:
+        rss = f"{v['peak_rss_mb']:.0f}" if v["peak_rss_mb"] is not None else "-"
+        print(f"{v['rezim'] + ' ' + NAZVY_REZIMU[v['rezim']]:<12}{v['pocet']:>9}{v['hotovo']:>8}"
+              f"{v['obrazku_za_s']:>9.2f}{v['latence_p50_s']:>9.3f}{v['latence_p95_s']:>9.3f}"
+              f"{v['volani_api']:>8}{v['chyb_api']:>6}{rss:>10}{v['tokenu_na_obrazek']:>9.0f}"
+              f"{v.get('usd_na_obrazek', 0.0):>11.6f}")
+
+def porovnat(vysledky, soubor_zakladu, tolerance):
+    """
+    Porovná běhy se základem z dřívějšího --vystup.
+
+    Returns:
+        bool: True, pokud se žádný běh nezhoršil víc než o toleranci
+    """
+    with open(soubor_zakladu, encoding="utf-8") as f:
+        zaklad = {(v["rezim"], v["pocet"]): v for v in json.load(f)["vysledky"]}
+
+    v_poradku = True
+    print(f"\nPorovnání se základem '{soubor_zakladu}' (tolerance {tolerance:.0%}):")
+    for v in vysledky:
+        puvodni = zaklad.get((v["rezim"], v["pocet"]))
+        if puvodni is None:
+            continue
+        zmeny = []
+        if puvodni["obrazku_za_s"] and v["obrazku_za_s"] < puvodni["obrazku_za_s"] * (1 - tolerance):
+            zmeny.append(f"propustnost {puvodni['obrazku_za_s']:.2f} -> {v['obrazku_za_s']:.2f} img/s")
+        if puvodni["latence_p95_s"] and v["latence_p95_s"] > puvodni["latence_p95_s"] * (1 + tolerance):
+            zmeny.append(f"p95 {puvodni['latence_p95_s']:.3f} -> {v['latence_p95_s']:.3f} s")
+        if puvodni["tokenu_na_obrazek"] and v["tokenu_na_obrazek"] > puvodni["tokenu_na_obrazek"] * (1 + tolerance):
+            zmeny.append(f"tokeny {puvodni['tokenu_na_obrazek']:.0f} -> {v['tokenu_na_obrazek']:.0f} na obrázek")
+        if puvodni.get("usd_na_obrazek") and v["usd_na_obrazek"] > puvodni["usd_na_obrazek"] * (1 + tolerance):
+            zmeny.append(f"náklady ${puvodni['usd_na_obrazek']:.6f} -> ${v['usd_na_obrazek']:.6f} na obrázek")
+        popis = f"režim {v['rezim']}, {v['pocet']} obrázků"
+        if zmeny:
+            v_poradku = False
+            print(f"  ❌ {popis}: " + "; ".join(zmeny))
+        else:
+            print(f"  ✅ {popis}")
+    return v_poradku
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark zpracování účtenek s falešným Google AI klientem.")
+    parser.add_argument("--rezimy", nargs="+", choices=sorted(NAZVY_REZIMU), default=["2", "3", "4"],
+                        help="Režimy z menu extract-bill-json.py (default: 2 3 4)")
+    parser.add_argument("--pocty", nargs="+", type=int, default=[10, 100],
+                        help="Počty obrázků v syntetickém adresáři (default: 10 100)")
+    parser.add_argument("--zdroj", default=os.path.join(os.path.dirname(SKRIPT), "example"),
+                        help="Adresář se vzorovými obrázky (default: example)")
+    parser.add_argument("--nahravky", help="Adresář s výstupy skutečného běhu nebo JSONL s odpověďmi")
+    parser.add_argument("--latence", type=float, default=0.2, help="Medián latence požadavku v sekundách")
+    parser.add_argument("--latence-na-obrazek", type=float, default=0.05,
+                        help="Latence navíc za každý obrázek v požadavku v sekundách")
+    parser.add_argument("--chybovost", type=float, default=0.0, help="Podíl požadavků končících chybou 503")
+    parser.add_argument("--podil-429", type=float, default=0.0, help="Podíl požadavků končících chybou 429")
+    parser.add_argument("--velikost-davky", type=int, default=5, help="Velikost dávky pro režim 2")
+    parser.add_argument("--soubezne", type=int, default=8, help="Počet souběžných požadavků pro režim 4")
+    parser.add_argument("--strukturovany-vystup", action="store_true", help="Zapnout JSON výstup podle schématu")
+    parser.add_argument("--seed", type=int, default=0, help="Seed náhodné latence a chyb")
+    parser.add_argument("--vystup", help="Uložit výsledky do JSON souboru (základ pro --porovnat)")
+    parser.add_argument("--porovnat", help="Porovnat s dříve uloženými výsledky; při zhoršení skončí kódem 1")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Povolené zhoršení pro --porovnat")
+    parser.add_argument("--beh", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.beh:
+        print(json.dumps(spustit_beh(json.loads(args.beh))))
+        return 0
+
+    spolecne = {
+        "zdroj": args.zdroj,
+        "nahravky": args.nahravky,
+        "latence": args.latence,
+        "latence_na_obrazek": args.latence_na_obrazek,
+        "chybovost": args.chybovost,
+        "podil_429": args.podil_429,
+        "velikost_davky": args.velikost_davky,
+        "soubezne": args.soubezne,
+        "strukturovany_vystup": args.strukturovany_vystup,
+        "seed": args.seed,
+    }
+
+    vysledky = []
+    for rezim in args.rezimy:
+        for pocet in args.pocty:
+            print(f"▶️  Režim {rezim} ({NAZVY_REZIMU[rezim]}), {pocet} obrázků...", flush=True)
+            vysledky.append(spustit_v_procesu({**spolecne, "rezim": rezim, "pocet": pocet}))
+
+    print()
+    vypsat_tabulku(vysledky)
+
+    if args.vystup:
+        with open(args.vystup, "w", encoding="utf-8") as f:
+            json.dump({"parametry": spolecne, "vysledky": vysledky}, f, ensure_ascii=False, indent=2)
+        print(f"\nVýsledky uloženy do '{args.vystup}'")
+
+    if args.porovnat and not porovnat(vysledky, args.porovnat, args.tolerance):
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
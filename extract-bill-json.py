@@ -1,121 +1,87 @@
 import os
 import json
+import argparse
+import atexit
+import base64
 import csv
+import hashlib
+import http.server
+import importlib
+import io
+import queue
+import random
+import re
+import signal
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from types import SimpleNamespace
+from itertools import combinations
 from datetime import datetime
-from google import genai
-from google.genai import types
+from urllib.parse import parse_qs, urlsplit
 
-def vypocitat_naklady(tokeny, model_name="gemini-2.5-flash-lite-preview-06-17"):
+class _OdlozenyModul:
     """
-    Vypočítá náklady na základě počtu tokenů a modelu.
-    
-    Args:
-        tokeny: Počet tokenů
-        model_nam                # Přidáme do reportu - rozdelíme tokeny a náklady na počet súborov
-                tokeny_na_subor = celkove_tokeny / len(davka_obrazky)
-                naklady_na_subor = celkove_naklady / len(davka_obrazky)
-                
-                data_reportu.append([
-                    cas, 
-                    os.path.basename(puvodni_obrazek), 
-                    int(tokeny_na_subor),  # Zaokrúhlime na celé číslo
-                    naklady_na_subor,     # Presné náklady na súbor
-                    'USPECH_DAVKA', 
-                    f'Dávka {len(davka_obrazky)} obrázkov - tokeny/náklady rozdelené na súbor'
-                ])modelu
-    
-    Returns:
-        float: Náklady v USD
-    """
-    # Oficiální ceny z https://ai.google.dev/pricing (v USD za 1M tokenů)
-    # Aktualizované k 22.6.2025
-    ceny_modelu = {
-        "gemini-2.5-flash-lite-preview-06-17": 0.10,  # Input: $0.10, Output: $0.40 za 1M tokenů
-        "gemini-2.5-flash": 0.30,  # Input: $0.30, Output: $2.50 za 1M tokenů  
-        "gemini-2.0-flash": 0.10,  # Input: $0.10, Output: $0.40 za 1M tokenů
-        "gemini-2.0-flash-lite": 0.075,  # Input: $0.075, Output: $0.30 za 1M tokenů
-        "gemini-1.5-flash": 0.075,  # Input: $0.075, Output: $0.30 za 1M tokenů
-        "gemini-1.5-flash-8b": 0.0375,  # Input: $0.0375, Output: $0.15 za 1M tokenů
-        "gemini-1.5-pro": 1.25,  # Input: $1.25, Output: $5.00 za 1M tokenů
-        "gemini-2.5-pro": 1.25  # Input: $1.25, Output: $10.00 za 1M tokenů
-    }
-    
-    # Používame najnižšiu cenu (input) pre jednoduchosť - v skutočnosti by sme mali rozlišovať input/output
-    cena_za_milion = ceny_modelu.get(model_name, 0.10)  # default cena
-    naklady_usd = (tokeny / 1_000_000) * cena_za_milion
-    return naklady_usd
-
-def ulozit_report_spotreby(adresar, data_reportu):
-    """
-    Uloží report o spotřebě tokenů a nákladech do CSV souboru.
+    Zástupce modulu, který se naimportuje až při prvním použití.
     
-    Args:
-        adresar: Adresář kde se má uložit report
-        data_reportu: Seznam s daty ve formátu [čas, soubor, tokeny, náklady_usd, status]
+    Import google-genai trvá přes sekundu, přitom --help, reporty, export ani
+    vyhledávání SDK vůbec nepotřebují.
     """
-    report_soubor = os.path.join(adresar, "report_spotreby.csv")
     
-    # Zkontrolujeme, zda soubor existuje
-    soubor_existuje = os.path.exists(report_soubor)
+    def __init__(self, nazev):
+        self._nazev = nazev
+        self._modul = None
     
-    with open(report_soubor, mode='a', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        
-        # Napíšeme hlavičku jen pokud soubor neexistuje
-        if not soubor_existuje:
-            writer.writerow(['cas', 'soubor', 'tokeny', 'naklady_usd', 'status', 'poznamka'])
-        
-        # Napíšeme data
-        for radek in data_reportu:
-            writer.writerow(radek)
+    def __getattr__(self, atribut):
+        if self._modul is None:
+            try:
+                self._modul = importlib.import_module(self._nazev)
+            except ImportError as e:
+                raise ImportError(f"Modul '{self._nazev}' není nainstalovaný (pip install google-genai)") from e
+        return getattr(self._modul, atribut)
 
-def nacti_api_klic(soubor="api_key.txt"):
-    """Bezpečně načte API klíč z textového souboru."""
-    try:
-        with open(soubor, 'r') as f:
-            return f.read().strip()
-    except FileNotFoundError:
-        print(f"Chyba: Soubor '{soubor}' s API klíčem nebyl nalezen.")
-        print("Prosím, vytvořte jej a vložte do něj svůj API klíč.")
-        return None
 
-def extrahovat_data_z_uctenky(nazev_obrazku):
-    """
-    Načte obrázek účtenky, pošle ho Google AI a uloží výsledek do JSON souboru se stejným názvem.
-    """
-    print("Načítám API klíč...")
-    api_key = nacti_api_klic()
-    if not api_key:
-        return
+genai = _OdlozenyModul("google.genai")
+types = _OdlozenyModul("google.genai.types")
 
-    try:
-        print(f"Načítám obrázek '{nazev_obrazku}'...")
-        with open(nazev_obrazku, "rb") as f:
-            obrazek_data = f.read()
-    except FileNotFoundError:
-        print(f"Chyba: Obrázek '{nazev_obrazku}' nebyl nalezen v tomto adresáři.")
-        return
-    
-    # Vytvoříme název výstupního JSON souboru ze stejného adresáře a názvu jako obrázek
-    zakladni_nazev = os.path.splitext(nazev_obrazku)[0]  # Odstraní příponu (.png, .jpg, atd.)
-    nazev_vystupu = f"{zakladni_nazev}.json"
-    adresar = os.path.dirname(nazev_obrazku) or "."
+# Pillow je volitelný - bez něj nefunguje jen předzpracování obrázků
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
 
-    print("Inicializuji Google AI klienta...")
-    client = genai.Client(api_key=api_key)
-
-    model = "gemini-2.5-flash-lite-preview-06-17"
-    
-    # <<< ZMĚNA: Místo base64 kódu se nyní načítají data obrázku ze souboru
-    contents = [
-        types.Content(
-            role="user",
-            parts=[
-                types.Part.from_bytes(
-                    mime_type="image/png", # Ujistěte se, že typ odpovídá vašemu obrázku (např. image/jpeg)
-                    data=obrazek_data
-                ),
-                types.Part.from_text(text="""# ROLE A CÍL
+# pillow-heif je volitelný - bez něj Pillow neotevře fotky HEIC z iPhonu (Gemini je přijme i tak,
+# jen je nejde předzpracovat ani porovnat s ostatními fotkami)
+try:
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+except ImportError:
+    pass
+
+# pypdfium2 je volitelný - bez něj se vícestránkové PDF posílá celé v jednom požadavku
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+# inotify_simple je volitelný - bez něj sledování adresářů jejich obsah pravidelně prochází
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:
+    INotify = None
+
+MODEL_DEFAULT = "gemini-2.5-flash-lite-preview-06-17"
+
+# Výchozí kaskáda modelů od nejlevnějšího - dražší model dostane jen účtenku, která neprošla kontrolou
+KASKADA_MODELU = (MODEL_DEFAULT, "gemini-2.5-flash", "gemini-2.5-pro")
+
+# Prompt pro extrakci jedné účtenky (režimy 1, 3 a 4)
+PROMPT_EXTRAKCE = """# ROLE A CÍL
 Jsi autonomní systém pro inteligentní extrakci dat z dokumentů. Tvým úkolem je analyzovat přiložený obrázek účtenky, porozumět její struktuře a převést VŠECHNY informace do logicky uspořádaného formátu JSON. Každá účtenka je jiná, proto se nespoléhej na pevně danou šablonu, ale na svou schopnost porozumět kontextu.
 
 # METODIKA PRÁCE
@@ -134,431 +100,6482 @@ Postupuj jako člověk, který se snaží data uspořádat do přehledné strukt
 - \"Informace o platbě kartou jsou pohromadě, vytvořím pro ně blok 'detaily_platebni_transakce'.\"
 
 # ZÁVĚREČNÝ POKYN
-Aplikuj tuto metodiku na přiloženou účtenku. Vytvoř logický, přehledný a kompletní JSON přepis. Nesnaž se napodobit žádný konkrétní příklad, ale vytvoř tu nejlepší možnou strukturu pro data, která vidíš. Začni generovat:"""),
-            ],
-        ),
-    ]
+Aplikuj tuto metodiku na přiloženou účtenku. Vytvoř logický, přehledný a kompletní JSON přepis. Nesnaž se napodobit žádný konkrétní příklad, ale vytvoř tu nejlepší možnou strukturu pro data, která vidíš. Začni generovat:"""
 
-    print("Odesílám požadavek a čekám na odpověď...")
+# Prompt pro dávkovou extrakci více účtenek v jednom požadavku (režim 2)
+PROMPT_DAVKA = """# ROLE A CÍL
+Jsi expertní systém pro dávkovou extrakci dat z více dokumentů najednou. Tvým úkolem je analyzovat VŠECHNY přiložené obrázky účtenek. Pro KAŽDÝ obrázek musíš extrahovat veškeré informace a vytvořit pro něj samostatný JSON objekt. Všechny tyto JSON objekty pak zabal do jednoho hlavního JSON pole.
+
+# METODIKA PRÁCE
+1. **Iteruj přes obrázky:** Postupně projdi každý obrázek, který ti byl poslán.
+2. **Analyzuj každý obrázek samostatně:** Pro každý jednotlivý obrázek aplikuj následující logiku:
+   - Zmapuj dokument a identifikuj bloky informací
+   - Přesně přepisuj všechna data
+   - Vytvoř logicky strukturovaný JSON objekt
+   - Přidej identifikátor: Do JSON objektu přidej klíč "obrazek_index" s pořadovým číslem obrázku (0, 1, 2...)
+3. **Zkompletuj výstup:** Vytvoř pole JSON objektů ve formátu: [{"obrazek_index": 0, "data": {...}}, {"obrazek_index": 1, "data": {...}}, ...]
+
+# ZÁVĚREČNÝ POKYN
+Aplikuj tuto metodiku na VŠECHNY přiložené obrázky. Vytvoř JEDEN JSON výstup obsahující pole objektů, jeden pro každý obrázek."""
+
+# Schémata pro strukturovaný výstup (response_mime_type="application/json")
+# Jedna účtenka je pole logických bloků, dávka je pole obálek s indexem obrázku a jeho daty
+SCHEMA_UCTENKY = {
+    "type": "array",
+    "items": {"type": "object"},
+}
+SCHEMA_DAVKY = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "obrazek_index": {"type": "integer", "minimum": 0},
+            "data": {"type": "object"},
+        },
+        "required": ["obrazek_index", "data"],
+    },
+}
+
+# Podporované vstupy - typ se určuje podle obsahu (magic bytes), přípona slouží jen k vyhledání souborů
+# a jako záloha, když obsah nepoznáme
+MIME_PODLE_PRIPONY = {
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".webp": "image/webp",
+    ".heic": "image/heic",
+    ".heif": "image/heif",
+    ".pdf": "application/pdf",
+}
+PRIPONY_OBRAZKU = tuple(MIME_PODLE_PRIPONY)
+
+# Vícestránkové PDF se vykreslí po stránkách (delší strana v pixelech) a stránky se extrahují souběžně.
+# Celé PDF poslané najednou stojí 258 tokenů za stránku
+PDF_MAX_STRANA = 1536
+PDF_SOUBEZNE_STRANKY = 4
+TOKENY_STRANKY_PDF = 258
+
+# Metriky běhu (JSON Lines) se ukládají vedle knihy spotřeby
+METRIKY_SOUBOR = "metriky_zpracovani.jsonl"
+
+# Výchozí umístění cache výsledků extrakce (stejně jako api_key.txt v aktuálním adresáři)
+CACHE_SOUBOR = ".cache_extrakce.sqlite"
+
+# Index perceptuálních hashů zpracovaných účtenek pro hledání opakovaných fotek
+DUPLICITY_SOUBOR = ".duplicity_uctenek.sqlite"
+# Jemný hash (strana mřížky) a jeho nejvyšší vzdálenost pro potvrzení stejného snímku (zhruba 5 % z 1024 bitů)
+DUPLICITY_JEMNA_MRIZKA = 32
+DUPLICITY_MAX_JEMNA_VZDALENOST = 48
+
+# Kvóty modelů (požadavky za minutu, vstupní tokeny za minutu) podle https://ai.google.dev/gemini-api/docs/rate-limits
+# Hodnoty odpovídají placenému Tier 1 - pokud má váš projekt jiný tier, upravte je zde
+LIMITY_MODELU = {
+    "gemini-2.5-flash-lite-preview-06-17": (4000, 4_000_000),
+    "gemini-2.5-flash": (1000, 1_000_000),
+    "gemini-2.0-flash": (2000, 4_000_000),
+    "gemini-2.0-flash-lite": (4000, 4_000_000),
+    "gemini-1.5-flash": (2000, 4_000_000),
+    "gemini-1.5-flash-8b": (4000, 4_000_000),
+    "gemini-1.5-pro": (1000, 4_000_000),
+    "gemini-2.5-pro": (150, 2_000_000),
+}
+
+# Ceny modelů v USD za 1M tokenů podle https://ai.google.dev/gemini-api/docs/pricing (k 22.6.2025)
+# Výstupní tokeny stojí 4-8x víc než vstupní. Ceny lze upravit bez zásahu do kódu
+# souborem ceny_modelu.json v aktuálním adresáři (stejně jako api_key.txt)
+CENY_MODELU = {
+    "gemini-2.5-flash-lite-preview-06-17": {"vstup": 0.10, "vystup": 0.40},
+    "gemini-2.5-flash": {"vstup": 0.30, "vystup": 2.50},
+    "gemini-2.0-flash": {"vstup": 0.10, "vystup": 0.40},
+    "gemini-2.0-flash-lite": {"vstup": 0.075, "vystup": 0.30},
+    "gemini-1.5-flash": {"vstup": 0.075, "vystup": 0.30},
+    "gemini-1.5-flash-8b": {"vstup": 0.0375, "vystup": 0.15},
+    "gemini-1.5-pro": {"vstup": 1.25, "vystup": 5.00},
+    "gemini-2.5-pro": {"vstup": 1.25, "vystup": 10.00},
+}
+CENY_MODELU_SOUBOR = "ceny_modelu.json"
+
+# Tokeny načtené z kontextové cache se účtují za 25 % ceny vstupu, uložení cache
+# stojí navíc $1.00 za 1M tokenů a hodinu (https://ai.google.dev/gemini-api/docs/pricing)
+SLEVA_CACHED_TOKENU = 0.25
+CENA_ULOZENI_CACHE_ZA_HODINU = 1.00
+
+# Nejmenší obsah, který Gemini do kontextové cache přijme (https://ai.google.dev/gemini-api/docs/caching).
+# Kratší prompt API odmítne, proto se to ověří předem a cache se vůbec nezakládá
+MIN_TOKENU_KONTEXTOVE_CACHE = {
+    "gemini-2.5-flash-lite-preview-06-17": 1024,
+    "gemini-2.5-flash": 1024,
+    "gemini-2.0-flash": 4096,
+    "gemini-2.0-flash-lite": 4096,
+    "gemini-1.5-flash": 4096,
+    "gemini-1.5-flash-8b": 4096,
+    "gemini-1.5-pro": 4096,
+    "gemini-2.5-pro": 4096,
+}
+
+# Asynchronní úlohy Batch API stojí polovinu běžné ceny (https://ai.google.dev/gemini-api/docs/batch-mode).
+# Stav rozpracované úlohy se ukládá do zpracovávaného adresáře, takže odeslání i čekání jde kdykoliv navázat
+SLEVA_BATCH_API = 0.5
+ULOHA_SOUBOR = ".davkova_uloha.json"
+ULOHA_POZADAVKY_SOUBOR = ".davkova_uloha.jsonl"
+
+# HTTP kódy, u kterých má smysl požadavek zopakovat (překročená kvóta, přetížený server)
+OPAKOVATELNE_KODY = (429, 500, 502, 503, 504)
+
+# Report o spotřebě - kniha spotřeby v SQLite, CSV jen pro import a export
+REPORT_SOUBOR = "report_spotreby.csv"
+KNIHA_SPOTREBY_SOUBOR = "report_spotreby.sqlite"
+SLOUPCE_REPORTU = ['cas', 'soubor', 'tokeny', 'naklady_usd', 'status', 'poznamka', 'prodejce', 'model']
+
+# Zámek pro registr knih spotřeby - při souběžném zpracování zapisuje více vláken najednou
+_zamek_reportu = threading.Lock()
+_knihy_spotreby = {}
+
+# Tabulka cen načtená při prvním výpočtu nákladů
+_ceny_modelu = None
+
+# Název uzlu při zpracování z více strojů nad sdíleným úložištěm (None = jediný stroj).
+# SQLite ve WAL režimu mezi stroji přes NFS nefunguje, proto má pak každý uzel
+# vlastní knihu spotřeby, manifest a metriky (report_spotreby.<uzel>.sqlite)
+_uzel = None
+
+# Adresář se soubory zápůjček (lease) uvnitř zpracovávaného adresáře
+ZAPUJCKY_ADRESAR = ".zapujcky"
+
+# Vyhledávací index extrahovaných účtenek (v aktuálním adresáři jako cache výsledků).
+# Pokud je nastavený, kniha spotřeby do něj po zápisu zaindexuje každý nový výstup
+INDEX_UCTENEK_SOUBOR = ".index_uctenek.sqlite"
+_index_uctenek = None
+
+# Souhrnný proud výsledků (JSON Lines, jeden soubor za běh) - volitelně vedle JSON souboru
+# u každého obrázku, nebo místo něj (viz nastavit_proud_vysledku)
+PROUD_VYSLEDKU_PREDPONA = "vysledky"
+_proud_vysledku = None
+_json_soubory = True
+
+# Lokální služba - nahrané účtenky (a jejich JSON výstupy) se ukládají do adresáře služby
+SLUZBA_ADRESAR = "sluzba"
+SLUZBA_MAX_BAJTU = 20 * 1024 * 1024
+
+def nastavit_uzel(uzel):
+    """Nastaví název uzlu pro stavové soubory (None = společné soubory jednoho stroje)."""
+    global _uzel
+    _uzel = uzel
+
+def soubor_uzlu(nazev):
+    """Název stavového souboru - s nastaveným uzlem dostane jeho příponu (report_spotreby.uzel1.sqlite)."""
+    if _uzel is None:
+        return nazev
+    zaklad, pripona = os.path.splitext(nazev)
+    return f"{zaklad}.{_uzel}{pripona}"
+
+def nacist_ceny_modelu(soubor=CENY_MODELU_SOUBOR):
+    """
+    Vrátí tabulku cen modelů - CENY_MODELU doplněné o ceny ze souboru.
     
-    # <<< ZMĚNA: Používáme `generate_content` pro získání celé odpovědi najednou
+    Soubor je JSON ve tvaru {"model": {"vstup": 0.10, "vystup": 0.40}, ...}.
+    Uvedené ceny přepíšou výchozí, nové modely se přidají. Tabulka se načte
+    jen jednou za běh.
+    
+    Args:
+        soubor: Cesta k JSON souboru s cenami
+    
+    Returns:
+        dict: model -> {"vstup": USD za 1M tokenů, "vystup": USD za 1M tokenů}
+    """
+    global _ceny_modelu
+    if _ceny_modelu is not None:
+        return _ceny_modelu
+    
+    ceny = {model: dict(cena) for model, cena in CENY_MODELU.items()}
     try:
-        response = client.models.generate_content(
-            model=model,
-            contents=contents
+        with open(soubor, 'r', encoding='utf-8') as f:
+            for model, cena in json.load(f).items():
+                ceny.setdefault(model, dict(ceny[MODEL_DEFAULT])).update(
+                    {klic: float(hodnota) for klic, hodnota in cena.items()})
+        print(f"💲 Ceny modelů načteny ze souboru '{soubor}'.")
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, TypeError, AttributeError) as e:
+        print(f"⚠️  Ceny ze souboru '{soubor}' se nepodařilo načíst ({e}), používám výchozí.")
+    _ceny_modelu = ceny
+    return ceny
+
+def vypocitat_naklady(tokeny, model_name=MODEL_DEFAULT, cached_tokeny=0, vystupni_tokeny=0):
+    """
+    Vypočítá náklady na základě počtu tokenů a modelu.
+    
+    Args:
+        tokeny: Počet vstupních tokenů (prompt_token_count, včetně tokenů z cache)
+        model_name: Název modelu
+        cached_tokeny: Kolik ze vstupních tokenů bylo načteno z kontextové cache (účtují se se slevou)
+        vystupni_tokeny: Počet výstupních tokenů (odpověď včetně tokenů přemýšlení)
+    
+    Returns:
+        float: Náklady v USD
+    """
+    ceny = nacist_ceny_modelu()
+    cena = ceny.get(model_name) or ceny[MODEL_DEFAULT]
+    # Tokeny z kontextové cache stojí jen zlomek ceny vstupu
+    naklady_usd = ((tokeny - cached_tokeny) / 1_000_000) * cena["vstup"] \
+                  + (cached_tokeny / 1_000_000) * cena["vstup"] * SLEVA_CACHED_TOKENU \
+                  + (vystupni_tokeny / 1_000_000) * cena["vystup"]
+    return naklady_usd
+
+def tokeny_odpovedi(usage_metadata):
+    """
+    Rozloží usage_metadata odpovědi na tokeny účtované různou cenou.
+    
+    Returns:
+        tuple: (vstupní tokeny, z toho načtené z cache, výstupní tokeny)
+    """
+    vstup = getattr(usage_metadata, "prompt_token_count", None) or 0
+    cached = getattr(usage_metadata, "cached_content_token_count", None) or 0
+    # Tokeny přemýšlení (Gemini 2.5) se účtují jako výstup
+    vystup = (getattr(usage_metadata, "candidates_token_count", None) or 0) \
+             + (getattr(usage_metadata, "thoughts_token_count", None) or 0)
+    if not vstup and not vystup:
+        # Bez rozpisu známe jen součet - počítáme ho jako vstup
+        vstup = getattr(usage_metadata, "total_token_count", None) or 0
+    return vstup, min(cached, vstup), vystup
+
+def naklady_odpovedi(usage_metadata, model_name=MODEL_DEFAULT):
+    """Náklady jedné odpovědi v USD podle jejích vstupních, cachovaných a výstupních tokenů."""
+    vstup, cached, vystup = tokeny_odpovedi(usage_metadata)
+    return vypocitat_naklady(vstup, model_name, cached, vystup)
+
+def _rozdelit_umerne(celek, vahy):
+    """Rozdělí celé číslo podle vah na celá čísla se stejným součtem (metoda největších zbytků)."""
+    if not vahy:
+        return []
+    soucet_vah = sum(vahy)
+    if soucet_vah <= 0:
+        vahy, soucet_vah = [1] * len(vahy), len(vahy)
+    presne = [celek * vaha / soucet_vah for vaha in vahy]
+    casti = [int(hodnota) for hodnota in presne]
+    poradi = sorted(range(len(vahy)), key=lambda i: presne[i] - casti[i], reverse=True)
+    for i in poradi[:max(0, celek - sum(casti))]:
+        casti[i] += 1
+    return casti
+
+def rozpocitat_naklady_davky(usage_metadata, model_name, vahy_vstupu, vahy_vystupu):
+    """
+    Rozpočítá tokeny a náklady dávky na jednotlivé obrázky.
+    
+    Gemini vrací usage_metadata jen za celý požadavek. Vstupní tokeny (včetně
+    sdíleného promptu) se proto dělí podle odhadu tokenů jednotlivých obrázků,
+    výstupní podle délky jejich části odpovědi. Součet přes obrázky dává
+    přesně tokeny a náklady celé dávky.
+    
+    Args:
+        usage_metadata: usage_metadata odpovědi na dávku
+        model_name: Název modelu
+        vahy_vstupu: Odhad vstupních tokenů každého obrázku
+        vahy_vystupu: Délka výstupu každého obrázku (např. znaky JSONu)
+    
+    Returns:
+        list: (tokeny, náklady v USD) pro každý obrázek ve stejném pořadí jako váhy
+    """
+    vstup, cached, vystup = tokeny_odpovedi(usage_metadata)
+    vstupy = _rozdelit_umerne(vstup, vahy_vstupu)
+    cachovane = _rozdelit_umerne(cached, vahy_vstupu)
+    vystupy = _rozdelit_umerne(vystup, vahy_vystupu)
+    return [(v + w, vypocitat_naklady(v, model_name, c, w)) for v, c, w in zip(vstupy, cachovane, vystupy)]
+
+class KnihaSpotreby:
+    """
+    Kniha spotřeby jednoho adresáře - SQLite ve WAL režimu s indexy na čas, soubor a status.
+    
+    Řádky reportu se jen vloží do fronty, zapisuje je vlákno na pozadí: vše,
+    co se ve frontě nasbíralo, vloží jednou transakcí. Víc procesů nad stejným
+    adresářem si díky WAL a busy_timeout nepřekáží. Stav v manifestu se
+    zaznamená až po commitu, takže manifest dál slouží jako checkpoint.
+    Původní report_spotreby.csv se při prvním otevření jednou naimportuje.
+    """
+    
+    def __init__(self, adresar, max_davka=500):
+        """
+        Args:
+            adresar: Adresář, ve kterém kniha (a případný starý CSV report) leží
+            max_davka: Nejvýše kolik zápisů z fronty vložit jednou transakcí
+        """
+        self.adresar = adresar
+        self.cesta = os.path.join(adresar, soubor_uzlu(KNIHA_SPOTREBY_SOUBOR))
+        self.max_davka = max_davka
+        self._fronta = queue.Queue()
+        
+        db = self._pripojit()
+        try:
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS spotreba (
+                    id INTEGER PRIMARY KEY,
+                    cas TEXT NOT NULL,
+                    soubor TEXT NOT NULL,
+                    tokeny INTEGER NOT NULL DEFAULT 0,
+                    naklady_usd REAL NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL,
+                    poznamka TEXT,
+                    prodejce TEXT,
+                    model TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_spotreba_cas ON spotreba (cas);
+                CREATE INDEX IF NOT EXISTS idx_spotreba_soubor ON spotreba (soubor);
+                CREATE INDEX IF NOT EXISTS idx_spotreba_status ON spotreba (status);
+                CREATE TABLE IF NOT EXISTS meta (klic TEXT PRIMARY KEY, hodnota TEXT);
+            """)
+            # Kniha z doby před kaskádou modelů nemá sloupec model
+            if "model" not in {radek[1] for radek in db.execute("PRAGMA table_info(spotreba)")}:
+                db.execute("ALTER TABLE spotreba ADD COLUMN model TEXT")
+            self._importovat_stary_report(db)
+        finally:
+            db.close()
+        
+        self._vlakno = threading.Thread(target=self._zapisovac, name="kniha-spotreby", daemon=True)
+        self._vlakno.start()
+    
+    def _pripojit(self):
+        db = sqlite3.connect(self.cesta, timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+    
+    @staticmethod
+    def _radek(radek):
+        """Převede řádek reportu (seznam nebo slovník z CSV) na hodnoty sloupců knihy."""
+        if isinstance(radek, dict):
+            radek = [radek.get(sloupec) for sloupec in SLOUPCE_REPORTU]
+        radek = list(radek) + [None] * (len(SLOUPCE_REPORTU) - len(radek))
+        cas, soubor, tokeny, naklady, status, poznamka, prodejce, model = radek[:len(SLOUPCE_REPORTU)]
+        return (cas, soubor, int(float(tokeny or 0)), float(naklady or 0.0), status, poznamka or None,
+                prodejce or None, model or None)
+    
+    def _vlozit(self, db, radky):
+        db.executemany(
+            "INSERT INTO spotreba (cas, soubor, tokeny, naklady_usd, status, poznamka, prodejce, model) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [self._radek(radek) for radek in radky],
         )
+    
+    def _importovat_stary_report(self, db):
+        """Jednorázově převezme report_spotreby.csv, který adresář používal před knihou."""
+        # Kniha uzlu převezme jen CSV svého uzlu, společný starý report by se jinak započítal vícekrát
+        stary_report = os.path.join(self.adresar, soubor_uzlu(REPORT_SOUBOR))
+        if not os.path.exists(stary_report):
+            return
+        # IMMEDIATE - dva procesy otevírající knihu současně CSV nenaimportují dvakrát
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if db.execute("SELECT 1 FROM meta WHERE klic = 'importovan_csv'").fetchone() is None:
+                with open(stary_report, newline='', encoding='utf-8') as f:
+                    radky = list(csv.DictReader(f))
+                self._vlozit(db, radky)
+                db.execute("INSERT INTO meta (klic, hodnota) VALUES ('importovan_csv', ?)",
+                           (datetime.now().isoformat(timespec="seconds"),))
+                print(f"📥 Do knihy spotřeby převzato {len(radky)} řádků z '{stary_report}'")
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+    
+    def _zapisovac(self):
+        db = self._pripojit()
+        konec = False
+        while not konec:
+            polozky = [self._fronta.get()]
+            # Vše, co mezitím přibylo, zapíšeme jednou transakcí
+            while len(polozky) < self.max_davka:
+                try:
+                    polozky.append(self._fronta.get_nowait())
+                except queue.Empty:
+                    break
+            
+            radky = []
+            for polozka in polozky:
+                if polozka is None:
+                    konec = True
+                else:
+                    radky.extend(polozka[0])
+            try:
+                if radky:
+                    with db:
+                        self._vlozit(db, radky)
+            except Exception as e:
+                print(f"⚠️  Zápis do knihy spotřeby '{self.cesta}' selhal ({e}), řádky ukládám do CSV.")
+                self._zapsat_zalozni_csv(radky)
+            
+            # Stav zapisujeme až po reportu - manifest je checkpoint, ze kterého pokračuje přerušený běh
+            index = _index_uctenek
+            for polozka in polozky:
+                try:
+                    if polozka is not None:
+                        for sledujici in (polozka[1], index):
+                            if sledujici is None:
+                                continue
+                            for radek in polozka[0]:
+                                sledujici.zaznamenat(os.path.join(self.adresar, radek[1]), radek[4])
+                except Exception as e:
+                    # Např. zamčený manifest na NFS - obrázek se příště zpracuje znovu, vlákno ale musí žít dál,
+                    # jinak by vyprazdnit() a zavrit() čekaly věčně
+                    print(f"⚠️  Zaznamenání stavu po zápisu do knihy spotřeby '{self.cesta}' selhalo: {e}")
+                finally:
+                    self._fronta.task_done()
+        db.close()
+    
+    def _zapsat_zalozni_csv(self, radky):
+        try:
+            zalozni_report = os.path.join(self.adresar, soubor_uzlu(REPORT_SOUBOR))
+            soubor_existuje = os.path.exists(zalozni_report)
+            with open(zalozni_report, mode='a', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                if not soubor_existuje:
+                    writer.writerow(SLOUPCE_REPORTU)
+                writer.writerows(radky)
+        except OSError as e:
+            print(f"⚠️  Ani záložní CSV se nepodařilo zapsat: {e}")
+    
+    def zapsat(self, data_reportu, manifest=None):
+        """Zařadí řádky reportu k zápisu (neblokuje)."""
+        self._fronta.put(([list(radek) for radek in data_reportu], manifest))
+    
+    def vyprazdnit(self):
+        """Počká, až vlákno na pozadí zapíše vše, co je ve frontě."""
+        self._fronta.join()
+    
+    def zavrit(self):
+        """Zapíše zbytek fronty a ukončí vlákno na pozadí."""
+        if self._vlakno.is_alive():
+            self._fronta.put(None)
+            self._vlakno.join()
+    
+    def _podminky(self, od=None, do=None, status=None):
+        podminky, parametry = [], []
+        if od:
+            podminky.append("cas >= ?")
+            parametry.append(od)
+        if do:
+            # Datum bez času bereme včetně celého dne
+            podminky.append("cas < ?" if len(do) > 10 else "substr(cas, 1, 10) <= ?")
+            parametry.append(do)
+        if status:
+            podminky.append("status LIKE ?")
+            parametry.append(status.rstrip("%") + "%")
+        return (" WHERE " + " AND ".join(podminky)) if podminky else "", parametry
+    
+    def radky(self, od=None, do=None, status=None):
+        """
+        Vrátí řádky knihy v pořadí zápisu.
         
-        # Získáme počet tokenů a vypočítáme náklady
-        tokeny = response.usage_metadata.total_token_count
-        naklady_usd = vypocitat_naklady(tokeny, model)
+        Args:
+            od, do: Volitelný rozsah času (YYYY-MM-DD nebo YYYY-MM-DD HH:MM:SS)
+            status: Volitelný prefix statusu (např. "USPECH" nebo "CHYBA")
         
-        print(f"Spotřebováno tokenů: {tokeny}")
-        print(f"Náklady: ${naklady_usd:.6f} USD")
+        Returns:
+            list: Řádky ve sloupcích SLOUPCE_REPORTU
+        """
+        self.vyprazdnit()
+        kde, parametry = self._podminky(od, do, status)
+        db = self._pripojit()
+        try:
+            return db.execute(f"SELECT {', '.join(SLOUPCE_REPORTU)} FROM spotreba{kde} ORDER BY id",
+                              parametry).fetchall()
+        finally:
+            db.close()
+    
+    # Povolené skupiny pro souhrn - klíč z příkazové řádky -> SQL výraz
+    SKUPINY = {
+        "den": "substr(cas, 1, 10)",
+        "mesic": "substr(cas, 1, 7)",
+        "soubor": "soubor",
+        "status": "status",
+        "prodejce": "coalesce(prodejce, '?')",
+        "model": "coalesce(model, '?')",
+    }
+    
+    def souhrn(self, podle=("mesic",), od=None, do=None, status=None):
+        """
+        Sečte počty, tokeny a náklady po skupinách.
         
-        # <<< ZMĚNA: Ukládáme výstup do souboru
-        # Odstraníme z odpovědi případné značky pro kód ```json a ```
-        cisty_json_text = response.text.replace("```json\n", "").replace("\n```", "").strip()
+        Args:
+            podle: Seznam skupin z KnihaSpotreby.SKUPINY (např. ("prodejce", "mesic"))
+            od, do, status: Filtry jako u radky()
+        
+        Returns:
+            list: Řádky (skupiny..., počet, tokeny, náklady_usd)
+        """
+        self.vyprazdnit()
+        vyrazy = [self.SKUPINY[skupina] for skupina in podle]
+        kde, parametry = self._podminky(od, do, status)
+        sloupce = ", ".join(vyrazy + ["count(*)", "sum(tokeny)", "sum(naklady_usd)"])
+        dotaz = f"SELECT {sloupce} FROM spotreba{kde}"
+        if vyrazy:
+            dotaz += f" GROUP BY {', '.join(vyrazy)} ORDER BY {', '.join(vyrazy)}"
+        db = self._pripojit()
+        try:
+            return db.execute(dotaz, parametry).fetchall()
+        finally:
+            db.close()
+    
+    def importovat_csv(self, soubor):
+        """
+        Naimportuje řádky z CSV reportu (6 sloupců původního formátu, 7 se sloupcem prodejce nebo 8 s modelem).
+        
+        Returns:
+            int: Počet naimportovaných řádků
+        """
+        self.vyprazdnit()
+        with open(soubor, newline='', encoding='utf-8') as f:
+            radky = list(csv.DictReader(f))
+        db = self._pripojit()
+        try:
+            with db:
+                self._vlozit(db, radky)
+        finally:
+            db.close()
+        return len(radky)
+    
+    def exportovat_csv(self, soubor, od=None, do=None, status=None):
+        """
+        Vyexportuje knihu do CSV (atomicky - rozepsaný soubor nikdo neuvidí).
+        
+        Returns:
+            int: Počet vyexportovaných řádků
+        """
+        radky = self.radky(od, do, status)
+        docasny = f"{soubor}.tmp"
+        with open(docasny, "w", newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(SLOUPCE_REPORTU)
+            writer.writerows(radky)
+        os.replace(docasny, soubor)
+        return len(radky)
 
-        with open(nazev_vystupu, "w", encoding="utf-8") as f:
-            f.write(cisty_json_text)
+def kniha_spotreby(adresar):
+    """Vrátí sdílenou KnihaSpotreby pro adresář (jednu na proces, aby zápisy šly jedním vláknem)."""
+    klic = os.path.abspath(adresar)
+    with _zamek_reportu:
+        kniha = _knihy_spotreby.get(klic)
+        if kniha is None:
+            kniha = _knihy_spotreby[klic] = KnihaSpotreby(adresar)
+        return kniha
+
+@atexit.register
+def zavrit_knihy_spotreby():
+    """Zapíše fronty všech otevřených knih spotřeby - volá se i automaticky při ukončení."""
+    with _zamek_reportu:
+        knihy = list(_knihy_spotreby.values())
+        _knihy_spotreby.clear()
+    for kniha in knihy:
+        kniha.zavrit()
+
+def najit_prodejce(data):
+    """
+    Zkusí v extrahovaných datech najít název prodejce (pro souhrny v knize spotřeby).
+    
+    Struktura dat je volná, proto jen hledáme blok nebo klíč, jehož název
+    zmiňuje prodejce/obchod, a v něm textový název.
+    
+    Returns:
+        str nebo None
+    """
+    slova = ("prodej", "obchod", "firma", "hlavicka", "vendor", "merchant")
+    klice_nazvu = ("nazev_prodejce", "prodejce", "obchodni_nazev", "nazev_firmy", "nazev_obchodu", "nazev", "jmeno",
+                   "name")
+    
+    def nazev_z_objektu(objekt):
+        for klic in klice_nazvu:
+            hodnota = objekt.get(klic)
+            if isinstance(hodnota, str) and hodnota.strip():
+                return hodnota.strip()
+        return None
+    
+    bloky = data if isinstance(data, list) else [data]
+    for blok in bloky:
+        if not isinstance(blok, dict):
+            continue
+        if any(slovo in str(blok.get("typ", "")).lower() for slovo in slova):
+            nazev = nazev_z_objektu(blok)
+            if nazev:
+                return nazev
+        for klic, hodnota in blok.items():
+            if not any(slovo in klic.lower() for slovo in slova):
+                continue
+            if isinstance(hodnota, str) and hodnota.strip():
+                return hodnota.strip()
+            if isinstance(hodnota, dict):
+                nazev = nazev_z_objektu(hodnota)
+                if nazev:
+                    return nazev
+    return None
+
+def parsovat_castku(hodnota):
+    """
+    Převede částku z účtenky na číslo ("1 234,50 Kč" -> 1234.5).
+    
+    Desetinná čárka i tečka se rozliší podle pozice: poslední z nich s jednou
+    nebo dvěma číslicemi za sebou je desetinný oddělovač, ostatní oddělují tisíce.
+    
+    Returns:
+        float nebo None
+    """
+    if isinstance(hodnota, bool):
+        return None
+    if isinstance(hodnota, (int, float)):
+        return float(hodnota)
+    if not isinstance(hodnota, str):
+        return None
+    nalez = re.search(r"-?\d[\d\s.,']*", hodnota)
+    if not nalez:
+        return None
+    cislo = re.sub(r"[\s']", "", nalez.group()).rstrip(".,")
+    oddelovac = max(cislo.rfind(","), cislo.rfind("."))
+    if oddelovac != -1 and len(cislo) - oddelovac - 1 in (1, 2):
+        cislo = re.sub(r"[.,]", "", cislo[:oddelovac]) + "." + cislo[oddelovac + 1:]
+    else:
+        cislo = re.sub(r"[.,]", "", cislo)
+    try:
+        return float(cislo)
+    except ValueError:
+        return None
+
+def parsovat_datum(hodnota):
+    """
+    Najde v textu datum (31.12.2024, 31. 12. 24, 2024-12-31, 31/12/2024).
+    
+    Returns:
+        str: Datum ve tvaru YYYY-MM-DD, nebo None
+    """
+    if not isinstance(hodnota, str):
+        return None
+    nalez = re.search(r"(\d{4})-(\d{1,2})-(\d{1,2})", hodnota)
+    if nalez:
+        rok, mesic, den = (int(cast) for cast in nalez.groups())
+    else:
+        nalez = re.search(r"(?<!\d)(\d{1,2})\s*[./-]\s*(\d{1,2})\s*[./-]\s*(\d{4}|\d{2})(?!\d)", hodnota)
+        if not nalez:
+            return None
+        den, mesic, rok = (int(cast) for cast in nalez.groups())
+        if rok < 100:
+            rok += 2000
+    try:
+        return datetime(rok, mesic, den).strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+def _projit_hodnoty(data, kontext=""):
+    """Projde JSON účtenky - vrací (kontext = typy bloků a klíče nad hodnotou, klíč, hodnota) pro každý list."""
+    if isinstance(data, dict):
+        kontext = f"{kontext} {str(data.get('typ', '')).lower()}"
+        for klic, hodnota in data.items():
+            if isinstance(hodnota, (dict, list)):
+                yield from _projit_hodnoty(hodnota, f"{kontext} {klic.lower()}")
+            else:
+                yield kontext, klic.lower(), hodnota
+    elif isinstance(data, list):
+        for prvek in data:
+            yield from _projit_hodnoty(prvek, kontext)
+
+def _projit_objekty(data, kontext=""):
+    """Projde JSON účtenky - vrací (kontext, objekt) pro každý vnořený slovník."""
+    if isinstance(data, dict):
+        yield kontext, data
+        kontext = f"{kontext} {str(data.get('typ', '')).lower()}"
+        for klic, hodnota in data.items():
+            if isinstance(hodnota, (dict, list)):
+                yield from _projit_objekty(hodnota, f"{kontext} {klic.lower()}")
+    elif isinstance(data, list):
+        for prvek in data:
+            yield from _projit_objekty(prvek, kontext)
+
+def _hodnota_klice(objekt, slova, vynechat=()):
+    """První hodnota objektu, jejíž klíč obsahuje některé ze slov (v pořadí slov) a žádné z vynechaných."""
+    for slovo in slova:
+        for klic, hodnota in objekt.items():
+            klic = klic.lower()
+            if slovo in klic and not any(jine in klic for jine in vynechat) and not isinstance(hodnota, (dict, list)):
+                return hodnota
+    return None
+
+def normalizovat_uctenku(data):
+    """
+    Vytáhne z volně strukturovaného JSON účtenky společná pole pro vyhledávání.
+    
+    Klíče si model vymýšlí sám (informace_o_prodejci, polozka_nakupu,
+    danovy_rozpis...), proto se pole hledají podle slov v názvech klíčů
+    a typů bloků. Co se najít nepodaří, zůstane None.
+    
+    Returns:
+        dict: prodejce, datum (YYYY-MM-DD), celkem, mena, dph [(sazba, základ, daň)],
+              polozky [(název, množství, cena)], text (všechny texty pro fulltext)
+    """
+    datum = None
+    kandidati_celkem = []
+    mena = None
+    texty = []
+    for kontext, klic, hodnota in _projit_hodnoty(data):
+        if isinstance(hodnota, str):
+            texty.append(hodnota)
+        if datum is None and ("datum" in klic or "date" in klic) and "splatnost" not in klic:
+            datum = parsovat_datum(hodnota)
+        if mena is None and ("mena" in klic or "currency" in klic) and isinstance(hodnota, str):
+            mena = hodnota.strip().upper() or None
+        # Celková částka - klíče "celkem", "k_uhrade", "total"... mimo položky, DPH a mezisoučty
+        if any(slovo in klic for slovo in ("celkem", "celkova", "k_uhrade", "uhrada", "total", "suma", "zaplaceno")) \
+                and not any(slovo in klic for slovo in ("bez_dph", "zaklad", "dph", "dan", "sleva", "vraceno",
+                                                         "pocet", "mnozstvi")) \
+                and not any(slovo in kontext for slovo in ("polozk", "dph", "danov", "item")):
+            castka = parsovat_castku(hodnota)
+            if castka is not None:
+                kandidati_celkem.append((castka, hodnota))
+    if datum is None:
+        datum = next(filter(None, (parsovat_datum(text) for text in texty)), None)
+    
+    # Mezisoučty jsou menší než částka k úhradě, proto bereme největší kandidáty
+    celkem = None
+    if kandidati_celkem:
+        celkem, puvodni = max(kandidati_celkem, key=lambda kandidat: kandidat[0])
+        if mena is None and isinstance(puvodni, str):
+            if "kč" in puvodni.lower() or "czk" in puvodni.lower():
+                mena = "CZK"
+            elif "€" in puvodni or "eur" in puvodni.lower():
+                mena = "EUR"
+    if mena in ("KČ", "KC"):
+        mena = "CZK"
+    
+    dph = []
+    polozky = []
+    for kontext, objekt in _projit_objekty(data):
+        typ = str(objekt.get("typ", "")).lower()
+        # Řádek daňového rozpisu - sazba a k ní základ nebo daň
+        sazba = _hodnota_klice(objekt, ("sazba", "rate"))
+        if sazba is not None:
+            zaklad = parsovat_castku(_hodnota_klice(objekt, ("zaklad", "base")))
+            dan = parsovat_castku(_hodnota_klice(objekt, ("dan", "dph", "vat", "tax"),
+                                                  vynechat=("sazba", "rate", "zaklad", "base")))
+            if zaklad is not None or dan is not None:
+                dph.append((parsovat_castku(sazba), zaklad, dan))
+                continue
+        # Položka nákupu - blok typu položka, nebo objekt v seznamu položek
+        if any(slovo in f"{kontext} {typ}" for slovo in ("polozk", "item", "zbozi")):
+            nazev = _hodnota_klice(objekt, ("nazev", "popis", "name", "zbozi"))
+            if isinstance(nazev, str) and nazev.strip():
+                cena = parsovat_castku(_hodnota_klice(objekt, ("celkem", "celkova", "cena", "castka", "price"),
+                                                      vynechat=("jednotk",)))
+                mnozstvi = parsovat_castku(_hodnota_klice(objekt, ("mnozstvi", "pocet", "ks", "qty")))
+                polozky.append((nazev.strip(), mnozstvi, cena))
+    
+    return {
+        "prodejce": najit_prodejce(data),
+        "datum": datum,
+        "celkem": celkem,
+        "mena": mena,
+        "dph": dph,
+        "polozky": polozky,
+        "text": " ".join(texty),
+    }
+
+def overit_uctenku(data, tolerance=1.0):
+    """
+    Zkontroluje, zda extrahovaná účtenka dává aritmeticky smysl.
+    
+    Kontroluje čitelné datum, celkovou částku, součet položek proti celkové
+    částce, základ × sazba = daň u každého řádku DPH a součet základů a daní
+    proti celkové částce. Rozdíl do tolerance (nebo do 0,5 % částky) se
+    toleruje - zaokrouhlení hotovostní platby, haléřové rozdíly v DPH.
+    
+    Args:
+        data: Extrahovaná data účtenky
+        tolerance: Povolený rozdíl v jednotkách měny
+    
+    Returns:
+        list: Popisy nalezených nesrovnalostí (prázdný = účtenka prošla)
+    """
+    def sedi(hodnota, ocekavano):
+        return abs(hodnota - ocekavano) <= max(tolerance, abs(ocekavano) * 0.005)
+    
+    pole = normalizovat_uctenku(data)
+    celkem = pole["celkem"]
+    problemy = []
+    if pole["datum"] is None:
+        problemy.append("chybí čitelné datum")
+    if celkem is None:
+        problemy.append("chybí celková částka")
+    
+    ceny = [cena for _, _, cena in pole["polozky"]]
+    if celkem is not None and ceny and None not in ceny and not sedi(sum(ceny), celkem):
+        problemy.append(f"součet položek {sum(ceny):.2f} nesedí na celkem {celkem:.2f}")
+    
+    for sazba, zaklad, dan in pole["dph"]:
+        if None not in (sazba, zaklad, dan) and not sedi(dan, zaklad * sazba / 100):
+            problemy.append(f"DPH {sazba:g} %: ze základu {zaklad:.2f} vychází {zaklad * sazba / 100:.2f}, ne {dan:.2f}")
+    if celkem is not None and pole["dph"] and all(None not in radek[1:] for radek in pole["dph"]):
+        s_dph = sum(zaklad + dan for _, zaklad, dan in pole["dph"])
+        if not sedi(s_dph, celkem):
+            problemy.append(f"základ + DPH {s_dph:.2f} nesedí na celkem {celkem:.2f}")
+    return problemy
+
+def nastavit_index_uctenek(index):
+    """Nastaví IndexUctenek, do kterého kniha spotřeby zaindexuje každý nově uložený výstup (None = bez indexu)."""
+    global _index_uctenek
+    _index_uctenek = index
+
+class IndexUctenek:
+    """
+    Vyhledávací index nad extrahovanými JSON soubory účtenek.
+    
+    Společná pole (prodejce, datum, celková částka, řádky DPH, položky) se
+    normalizují do SQLite tabulek s indexy a texty do FTS5 tabulky bez ohledu
+    na diakritiku, takže dotaz "prodejce X nad 500 Kč" nepotřebuje otevřít
+    jediný soubor. Leží v aktuálním adresáři jako cache výsledků a sdílí se
+    mezi vlákny (zapisují do něj vlákna knih spotřeby).
+    """
+    
+    def __init__(self, cesta=INDEX_UCTENEK_SOUBOR):
+        self.cesta = cesta
+        self._zamek = threading.Lock()
+        self._db = sqlite3.connect(cesta, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS uctenky (
+                id INTEGER PRIMARY KEY,
+                soubor TEXT NOT NULL UNIQUE,
+                mtime REAL NOT NULL,
+                prodejce TEXT,
+                datum TEXT,
+                celkem REAL,
+                mena TEXT,
+                zaindexovano TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_uctenky_datum ON uctenky (datum);
+            CREATE INDEX IF NOT EXISTS idx_uctenky_celkem ON uctenky (celkem);
+            CREATE INDEX IF NOT EXISTS idx_uctenky_prodejce ON uctenky (prodejce COLLATE NOCASE);
+            CREATE TABLE IF NOT EXISTS dph (
+                uctenka INTEGER NOT NULL,
+                sazba REAL,
+                zaklad REAL,
+                dan REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_dph_uctenka ON dph (uctenka);
+            CREATE INDEX IF NOT EXISTS idx_dph_sazba ON dph (sazba);
+            CREATE TABLE IF NOT EXISTS polozky (
+                uctenka INTEGER NOT NULL,
+                nazev TEXT NOT NULL,
+                mnozstvi REAL,
+                cena REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_polozky_uctenka ON polozky (uctenka);
+            CREATE VIRTUAL TABLE IF NOT EXISTS fulltext USING fts5(
+                prodejce, polozky, text, tokenize = "unicode61 remove_diacritics 2"
+            );
+        """)
+        self._db.commit()
+    
+    def _odebrat(self, soubor):
+        radek = self._db.execute("SELECT id FROM uctenky WHERE soubor = ?", (soubor,)).fetchone()
+        if radek is None:
+            return
+        for dotaz in ("DELETE FROM dph WHERE uctenka = ?", "DELETE FROM polozky WHERE uctenka = ?",
+                      "DELETE FROM fulltext WHERE rowid = ?", "DELETE FROM uctenky WHERE id = ?"):
+            self._db.execute(dotaz, radek)
+    
+    def zaindexovat(self, soubor_json):
+        """
+        Zaindexuje (nebo přeindexuje) jeden JSON výstup.
         
-        # Uložíme report o spotřebě
-        cas = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        data_reportu = [[cas, os.path.basename(nazev_obrazku), tokeny, naklady_usd, 'USPECH', '']]
-        ulozit_report_spotreby(adresar, data_reportu)
+        Returns:
+            bool: True, pokud se soubor podařilo načíst
+        """
+        soubor = os.path.abspath(soubor_json)
+        try:
+            mtime = os.stat(soubor).st_mtime
+            with open(soubor, encoding="utf-8") as f:
+                pole = normalizovat_uctenku(json.load(f))
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"⚠️  '{soubor_json}' nelze zaindexovat: {e}")
+            return False
+        with self._zamek, self._db:
+            self._odebrat(soubor)
+            uctenka = self._db.execute(
+                "INSERT INTO uctenky (soubor, mtime, prodejce, datum, celkem, mena, zaindexovano) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (soubor, mtime, pole["prodejce"], pole["datum"], pole["celkem"], pole["mena"],
+                 datetime.now().strftime('%Y-%m-%d %H:%M:%S')),
+            ).lastrowid
+            self._db.executemany("INSERT INTO dph VALUES (?, ?, ?, ?)",
+                                 [(uctenka, *radek) for radek in pole["dph"]])
+            self._db.executemany("INSERT INTO polozky VALUES (?, ?, ?, ?)",
+                                 [(uctenka, *polozka) for polozka in pole["polozky"]])
+            self._db.execute("INSERT INTO fulltext (rowid, prodejce, polozky, text) VALUES (?, ?, ?, ?)",
+                             (uctenka, pole["prodejce"] or "", " ".join(polozka[0] for polozka in pole["polozky"]),
+                              pole["text"]))
+        return True
+    
+    def zaznamenat(self, cesta_obrazku, status):
+        """Zaindexuje výstup obrázku po zápisu do knihy spotřeby (stejné rozhraní jako ManifestZpracovani)."""
+        if status.startswith("CHYBA"):
+            return
+        try:
+            self.zaindexovat(f"{os.path.splitext(cesta_obrazku)[0]}.json")
+        except sqlite3.Error as e:
+            # Index jde kdykoliv dorovnat příkazem 'index', zpracování kvůli němu nezastavíme
+            print(f"⚠️  Zápis do indexu účtenek selhal: {e}")
+    
+    def aktualizovat(self, adresare, pripony=PRIPONY_OBRAZKU):
+        """
+        Dorovná index podle adresářů - zaindexuje nové a změněné výstupy, odebere smazané.
+        
+        Výstupem je JSON se stejným názvem jako některý obrázek adresáře, stavové
+        soubory (úlohy Batch API, ceny...) se tak do indexu nedostanou.
+        
+        Returns:
+            tuple: (zaindexováno: int, odebráno: int)
+        """
+        zaindexovano = odebrano = 0
+        for adresar in adresare:
+            adresar = os.path.abspath(adresar)
+            nazvy = os.listdir(adresar)
+            zaklady = {os.path.splitext(nazev)[0] for nazev in nazvy if nazev.lower().endswith(pripony)}
+            vystupy = {}
+            for nazev in nazvy:
+                zaklad, pripona = os.path.splitext(nazev)
+                if pripona == ".json" and zaklad in zaklady:
+                    cesta = os.path.join(adresar, nazev)
+                    vystupy[cesta] = os.stat(cesta).st_mtime
+            with self._zamek:
+                znamy = dict(self._db.execute(
+                    "SELECT soubor, mtime FROM uctenky WHERE soubor LIKE ? ESCAPE '\\'",
+                    (adresar.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + os.sep + "%",),
+                ))
+            for cesta, mtime in vystupy.items():
+                if znamy.get(cesta) != mtime and self.zaindexovat(cesta):
+                    zaindexovano += 1
+            with self._zamek, self._db:
+                for cesta in znamy:
+                    # Jen soubory přímo v adresáři - podadresáře se procházejí samostatně
+                    if os.path.dirname(cesta) == adresar and cesta not in vystupy:
+                        self._odebrat(cesta)
+                        odebrano += 1
+        return zaindexovano, odebrano
+    
+    def hledat(self, text=None, prodejce=None, od=None, do=None, min_castka=None, max_castka=None,
+               sazba_dph=None, mena=None, limit=50):
+        """
+        Vyhledá účtenky podle fulltextu a normalizovaných polí.
+        
+        Args:
+            text: Slova hledaná kdekoliv na účtence (bez ohledu na diakritiku, i jako začátky slov)
+            prodejce: Slova v názvu prodejce
+            od, do: Rozsah data účtenky (YYYY-MM-DD, včetně)
+            min_castka, max_castka: Rozsah celkové částky
+            sazba_dph: Účtenka musí mít řádek DPH s touto sazbou (%)
+            mena: Kód měny (CZK, EUR...)
+            limit: Nejvýše kolik účtenek vrátit (nejnovější první)
+        
+        Returns:
+            list: Slovníky se sloupci soubor, prodejce, datum, celkem, mena
+        """
+        def dotaz_fts(slova):
+            # Každé slovo jako prefix v uvozovkách - uživatelský vstup tak nemůže rozbít syntaxi FTS5
+            return " ".join('"{}"*'.format(slovo.replace('"', '""')) for slovo in slova.split())
+        
+        podminky, parametry = [], []
+        fulltext = []
+        if text and text.split():
+            fulltext.append(dotaz_fts(text))
+        if prodejce and prodejce.split():
+            fulltext.append(f"prodejce : ({dotaz_fts(prodejce)})")
+        if fulltext:
+            podminky.append("u.id IN (SELECT rowid FROM fulltext WHERE fulltext MATCH ?)")
+            parametry.append(" AND ".join(fulltext))
+        for sloupec, operator, hodnota in (("u.datum", ">=", od), ("u.datum", "<=", do),
+                                           ("u.celkem", ">=", min_castka), ("u.celkem", "<=", max_castka)):
+            if hodnota is not None:
+                podminky.append(f"{sloupec} {operator} ?")
+                parametry.append(hodnota)
+        if sazba_dph is not None:
+            podminky.append("u.id IN (SELECT uctenka FROM dph WHERE sazba = ?)")
+            parametry.append(sazba_dph)
+        if mena:
+            podminky.append("u.mena = ?")
+            parametry.append(mena.upper())
+        dotaz = "SELECT u.soubor, u.prodejce, u.datum, u.celkem, u.mena FROM uctenky u"
+        if podminky:
+            dotaz += " WHERE " + " AND ".join(podminky)
+        dotaz += " ORDER BY u.datum DESC, u.id DESC LIMIT ?"
+        with self._zamek:
+            radky = self._db.execute(dotaz, (*parametry, limit)).fetchall()
+        return [dict(zip(("soubor", "prodejce", "datum", "celkem", "mena"), radek)) for radek in radky]
+    
+    def pocet(self):
+        with self._zamek:
+            return self._db.execute("SELECT COUNT(*) FROM uctenky").fetchone()[0]
+    
+    def smazat_vse(self):
+        """Vyprázdní index (např. po změně normalizace polí)."""
+        with self._zamek, self._db:
+            for tabulka in ("uctenky", "dph", "polozky", "fulltext"):
+                self._db.execute(f"DELETE FROM {tabulka}")
+    
+    def zavrit(self):
+        """Zavře spojení s databází."""
+        with self._zamek:
+            self._db.close()
+
+def ulozit_report_spotreby(adresar, data_reportu, manifest=None):
+    """
+    Uloží řádky reportu o spotřebě tokenů a nákladech do knihy spotřeby adresáře.
+    
+    Zápis proběhne na pozadí (viz KnihaSpotreby), funkce neblokuje.
+    
+    Args:
+        adresar: Adresář kde se má uložit report
+        data_reportu: Seznam s daty ve formátu [čas, soubor, tokeny, náklady_usd, status, poznámka(, prodejce)]
+        manifest: Volitelný ManifestZpracovani - zaznamená se do něj stav každého souboru
+    """
+    kniha_spotreby(adresar).zapsat(data_reportu, manifest)
+
+def percentil(hodnoty, procento):
+    """Percentil seřazením (bez interpolace) - pro prázdný seznam vrátí 0."""
+    if not hodnoty:
+        return 0.0
+    serazene = sorted(hodnoty)
+    return serazene[min(len(serazene) - 1, int(round(procento / 100 * (len(serazene) - 1))))]
+
+class MereniPolozky:
+    """
+    Časy etap jednoho obrázku nebo jedné dávky.
+    
+    Etapy: cteni, cache, priprava (MIME typ, předzpracování), sestaveni
+    (požadavku), kvota (čekání na omezovač), sit (odeslání a odpověď),
+    cekani_opakovani, parsovani a zapis. U dávky se čtení, příprava a zápis
+    měří i pro každý obrázek zvlášť.
+    """
+    
+    def __init__(self, druh, nazev, obrazku=1):
+        self.druh = druh
+        self.nazev = nazev
+        self.obrazku = obrazku
+        # Rozpočet a režim běhu - podle nich VykonavacPozadavku.generovat povoluje placené požadavky
+        self.rozpocet = None
+        self.rezim = None
+        self.etapy = {}
+        self.etapy_obrazku = {}
+        self.opakovani = 0
+        self._zacatek = time.perf_counter()
+    
+    @contextmanager
+    def etapa(self, nazev, obrazek=None):
+        """Změří blok kódu jako etapu (opakované etapy se sčítají)."""
+        zacatek = time.perf_counter()
+        try:
+            yield
+        finally:
+            trvani = time.perf_counter() - zacatek
+            self.etapy[nazev] = self.etapy.get(nazev, 0.0) + trvani
+            if obrazek is not None:
+                etapy = self.etapy_obrazku.setdefault(os.path.basename(obrazek), {})
+                etapy[nazev] = etapy.get(nazev, 0.0) + trvani
+    
+    def trvani(self):
+        return time.perf_counter() - self._zacatek
+
+class MetrikyBehu:
+    """
+    Sběr časů etap za celý běh - zápis do JSON Lines, souhrn a Prometheus textfile.
+    
+    Každá dokončená položka (obrázek nebo dávka) se hned připíše jako jeden
+    řádek JSON do souboru metrik, takže i přerušený běh po sobě nechá data.
+    Bez souboru se metriky jen sčítají pro souhrn. Sdílí se mezi vlákny.
+    """
+    
+    def __init__(self, soubor=None, prometheus_soubor=None, rezim=None):
+        """
+        Args:
+            soubor: Cesta k JSON Lines souboru, nebo None (bez zápisu)
+            prometheus_soubor: Volitelná cesta k textfile pro node_exporter, zapíše se v zavrit()
+            rezim: Označení režimu do metrik (např. "2")
+        """
+        self.soubor = soubor
+        self.prometheus_soubor = prometheus_soubor
+        self.rezim = rezim
+        self.zaznamy = []
+        self.tokeny = 0
+        self.naklady = 0.0
+        self.uspesnych = 0
+        self.urovne = {}
+        # Volitelný RozpocetBehu - dostává spotřebu každé dokončené položky
+        self.rozpocet = None
+        self._zacatek = time.perf_counter()
+        self._zamek = threading.Lock()
+    
+    @property
+    def rozpocet_vycerpan(self):
+        """Zda rozpočet běhu už zastavil další požadavky."""
+        return self.rozpocet is not None and self.rozpocet.zastaveno
+    
+    def polozka(self, druh, nazev, obrazku=1):
+        """Začne měřit obrázek (druh "obrazek") nebo dávku (druh "davka")."""
+        mereni = MereniPolozky(druh, nazev, obrazku)
+        mereni.rozpocet = self.rozpocet
+        mereni.rezim = self.rezim
+        return mereni
+    
+    def dokoncit(self, mereni, status, uspesnych=0, tokeny=0, naklady=0.0):
+        """Uzavře měření položky a zapíše ho."""
+        zaznam = {
+            "cas": datetime.now().isoformat(timespec="milliseconds"),
+            "rezim": self.rezim,
+            "druh": mereni.druh,
+            "nazev": mereni.nazev,
+            "obrazku": mereni.obrazku,
+            "uspesnych": uspesnych,
+            "status": status,
+            "tokeny": tokeny,
+            "naklady_usd": naklady,
+            "opakovani": mereni.opakovani,
+            "celkem_s": round(mereni.trvani(), 6),
+            "etapy_s": {etapa: round(trvani, 6) for etapa, trvani in mereni.etapy.items()},
+        }
+        if mereni.etapy_obrazku:
+            zaznam["etapy_obrazku_s"] = {
+                obrazek: {etapa: round(trvani, 6) for etapa, trvani in etapy.items()}
+                for obrazek, etapy in mereni.etapy_obrazku.items()
+            }
+        with self._zamek:
+            self.zaznamy.append(zaznam)
+            self.uspesnych += uspesnych
+            self.tokeny += tokeny
+            self.naklady += naklady
+            if self.soubor is not None:
+                with open(self.soubor, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(zaznam, ensure_ascii=False) + "\n")
+        if self.rozpocet is not None:
+            self.rozpocet.zaznamenat(self.rezim, mereni.obrazku, tokeny, naklady)
+    
+    def zaznamenat_uroven(self, model, proslo, tokeny=0, naklady=0.0):
+        """Započítá pokus jedné úrovně kaskády modelů (viz KaskadaModelu)."""
+        with self._zamek:
+            uroven = self.urovne.setdefault(model, {"pokusu": 0, "proslo": 0, "tokeny": 0, "naklady": 0.0})
+            uroven["pokusu"] += 1
+            uroven["proslo"] += bool(proslo)
+            uroven["tokeny"] += tokeny
+            uroven["naklady"] += naklady
+    
+    def souhrn(self):
+        """
+        Spočítá souhrn běhu.
+        
+        Returns:
+            dict: propustnost, percentily latence položek, součty a průměry etap
+        """
+        with self._zamek:
+            zaznamy = list(self.zaznamy)
+        trvani = time.perf_counter() - self._zacatek
+        uspesnych = sum(z["uspesnych"] for z in zaznamy)
+        latence = [z["celkem_s"] for z in zaznamy]
+        etapy = {}
+        for z in zaznamy:
+            for etapa, hodnota in z["etapy_s"].items():
+                etapy.setdefault(etapa, []).append(hodnota)
+        return {
+            "trvani_s": trvani,
+            "polozek": len(zaznamy),
+            "uspesnych": uspesnych,
+            "obrazku_za_s": uspesnych / trvani if trvani else 0.0,
+            "latence_p50_s": percentil(latence, 50),
+            "latence_p95_s": percentil(latence, 95),
+            "latence_max_s": max(latence, default=0.0),
+            "opakovani": sum(z["opakovani"] for z in zaznamy),
+            "etapy": {etapa: {"soucet_s": sum(h), "pocet": len(h), "p95_s": percentil(h, 95)}
+                      for etapa, h in etapy.items()},
+            "statusy": {status: sum(1 for z in zaznamy if z["status"] == status)
+                        for status in sorted({z["status"] for z in zaznamy})},
+        }
+    
+    def vypsat(self):
+        """Vypíše propustnost, latence a nejdražší etapy."""
+        souhrn = self.souhrn()
+        if not souhrn["polozek"]:
+            return
+        print(f"Propustnost: {souhrn['obrazku_za_s']:.2f} obrázků/s "
+              f"({souhrn['uspesnych']} obrázků za {souhrn['trvani_s']:.1f} s)")
+        print(f"Latence položky: p50 {souhrn['latence_p50_s']:.2f} s, p95 {souhrn['latence_p95_s']:.2f} s, "
+              f"max {souhrn['latence_max_s']:.2f} s")
+        if souhrn["opakovani"]:
+            print(f"Opakovaných požadavků: {souhrn['opakovani']}")
+        etapy = sorted(souhrn["etapy"].items(), key=lambda polozka: -polozka[1]["soucet_s"])
+        print("Etapy (součet / p95): " + ", ".join(
+            f"{etapa} {hodnoty['soucet_s']:.2f} s / {hodnoty['p95_s']:.3f} s" for etapa, hodnoty in etapy))
+        with self._zamek:
+            urovne = {model: dict(uroven) for model, uroven in self.urovne.items()}
+        if urovne:
+            print("Kaskáda modelů (pokusy, prošlo kontrolou, tokeny, náklady):")
+            for model, uroven in urovne.items():
+                print(f"  {model}: {uroven['pokusu']}, {uroven['proslo']} "
+                      f"({uroven['proslo'] / uroven['pokusu']:.0%}), {uroven['tokeny']}, ${uroven['naklady']:.6f} USD")
+    
+    def zapsat_prometheus(self):
+        """Zapíše souhrn ve formátu Prometheus textfile (atomicky přes dočasný soubor)."""
+        if self.prometheus_soubor is None:
+            return
+        souhrn = self.souhrn()
+        rezim = f'rezim="{self.rezim}"'
+        radky = [
+            "# HELP faktury_polozky_celkem Zpracované položky (obrázky a dávky) podle výsledku",
+            "# TYPE faktury_polozky_celkem counter",
+        ]
+        for status, pocet in souhrn["statusy"].items():
+            radky.append(f'faktury_polozky_celkem{{{rezim},status="{status}"}} {pocet}')
+        radky += [
+            "# HELP faktury_obrazky_uspesne_celkem Úspěšně zpracované obrázky",
+            "# TYPE faktury_obrazky_uspesne_celkem counter",
+            f"faktury_obrazky_uspesne_celkem{{{rezim}}} {souhrn['uspesnych']}",
+            "# HELP faktury_opakovani_celkem Opakované požadavky na API",
+            "# TYPE faktury_opakovani_celkem counter",
+            f"faktury_opakovani_celkem{{{rezim}}} {souhrn['opakovani']}",
+            "# HELP faktury_tokeny_celkem Spotřebované tokeny",
+            "# TYPE faktury_tokeny_celkem counter",
+            f"faktury_tokeny_celkem{{{rezim}}} {self.tokeny}",
+            "# HELP faktury_naklady_usd_celkem Náklady v USD",
+            "# TYPE faktury_naklady_usd_celkem counter",
+            f"faktury_naklady_usd_celkem{{{rezim}}} {self.naklady:.6f}",
+            "# HELP faktury_propustnost_obrazku_za_sekundu Úspěšné obrázky za sekundu běhu",
+            "# TYPE faktury_propustnost_obrazku_za_sekundu gauge",
+            f"faktury_propustnost_obrazku_za_sekundu{{{rezim}}} {souhrn['obrazku_za_s']:.6f}",
+            "# HELP faktury_polozka_sekundy Doba zpracování položky",
+            "# TYPE faktury_polozka_sekundy summary",
+            f'faktury_polozka_sekundy{{{rezim},quantile="0.5"}} {souhrn["latence_p50_s"]:.6f}',
+            f'faktury_polozka_sekundy{{{rezim},quantile="0.95"}} {souhrn["latence_p95_s"]:.6f}',
+            f"faktury_polozka_sekundy_count{{{rezim}}} {souhrn['polozek']}",
+            "# HELP faktury_etapa_sekundy Doba etap zpracování",
+            "# TYPE faktury_etapa_sekundy summary",
+        ]
+        for etapa, hodnoty in sorted(souhrn["etapy"].items()):
+            radky.append(f'faktury_etapa_sekundy{{{rezim},etapa="{etapa}",quantile="0.95"}} {hodnoty["p95_s"]:.6f}')
+            radky.append(f'faktury_etapa_sekundy_sum{{{rezim},etapa="{etapa}"}} {hodnoty["soucet_s"]:.6f}')
+            radky.append(f'faktury_etapa_sekundy_count{{{rezim},etapa="{etapa}"}} {hodnoty["pocet"]}')
+        with self._zamek:
+            urovne = {model: dict(uroven) for model, uroven in self.urovne.items()}
+        if urovne:
+            radky += [
+                "# HELP faktury_kaskada_pokusy_celkem Pokusy úrovní kaskády modelů podle výsledku kontroly účtenky",
+                "# TYPE faktury_kaskada_pokusy_celkem counter",
+            ]
+            for model, uroven in urovne.items():
+                radky.append(f'faktury_kaskada_pokusy_celkem{{{rezim},model="{model}",kontrola="prosla"}} '
+                             f'{uroven["proslo"]}')
+                radky.append(f'faktury_kaskada_pokusy_celkem{{{rezim},model="{model}",kontrola="neprosla"}} '
+                             f'{uroven["pokusu"] - uroven["proslo"]}')
+            radky += [
+                "# HELP faktury_kaskada_naklady_usd_celkem Náklady úrovní kaskády modelů v USD",
+                "# TYPE faktury_kaskada_naklady_usd_celkem counter",
+            ]
+            for model, uroven in urovne.items():
+                radky.append(f'faktury_kaskada_naklady_usd_celkem{{{rezim},model="{model}"}} {uroven["naklady"]:.6f}')
+        radky += [
+            "# HELP faktury_posledni_beh_timestamp_seconds Čas konce posledního běhu",
+            "# TYPE faktury_posledni_beh_timestamp_seconds gauge",
+            f"faktury_posledni_beh_timestamp_seconds{{{rezim}}} {time.time():.0f}",
+        ]
+        
+        # node_exporter nesmí přečíst rozepsaný soubor
+        docasny = f"{self.prometheus_soubor}.tmp"
+        with open(docasny, "w", encoding="utf-8") as f:
+            f.write("\n".join(radky) + "\n")
+        os.replace(docasny, self.prometheus_soubor)
+    
+    def zavrit(self):
+        """Dokončí běh - zapíše Prometheus textfile, pokud je nastavený."""
+        try:
+            self.zapsat_prometheus()
+        except OSError as e:
+            print(f"⚠️  Prometheus metriky se nepodařilo zapsat: {e}")
+
+class RozpocetVycerpan(RuntimeError):
+    """Požadavek neodešel, protože by překročil RozpocetBehu."""
+
+class RozpocetBehu:
+    """
+    Strop tokenů a nákladů na jeden běh nebo na den.
+    
+    Každý placený požadavek (dávka, její půlky, opakování chybějících
+    výsledků, dražší modely kaskády, stránky PDF) projde přes
+    VykonavacPozadavku.generovat, který si ho nejdřív nechá povolit() - odhad
+    podle klouzavého průměru posledních položek daného režimu (tokeny
+    a náklady na obrázek) se přičte k útratě a k požadavkům, které ještě
+    běží. Po odpovědi se útrata započítá a rezervace uvolní (zaplatit()).
+    Průměr na obrázek hlásí MetrikyBehu po každé dokončené položce. Když by
+    požadavek strop překročil, další požadavky už neodejdou
+    (RozpocetVycerpan) - rozpracované se dokončí a zbylé obrázky zpracuje
+    příští běh (manifest je nezná jako hotové). Denní rozpočet započítá
+    i dnešní spotřebu z knihy spotřeby adresáře a místo zastavení může běh
+    pozastavit do půlnoci. Sdílí se mezi vlákny.
+    
+    Denní rozpočet vidí jen knihu spotřeby zpracovávaného adresáře - útratu
+    jiných adresářů, démona sledovat ani služby nezapočítá. Úloha Batch API
+    (zpracovat_davkovou_ulohou) si odhad ceny svých požadavků započítá už při
+    přípravě, skutečnou cenu zapíše do knihy až vyzvednutí.
+    """
+    
+    def __init__(self, max_usd=None, max_tokenu=None, za_den=False, pozastavit=False, okno=50):
+        """
+        Args:
+            max_usd: Strop nákladů v USD (None = bez stropu)
+            max_tokenu: Strop tokenů (None = bez stropu)
+            za_den: Strop platí pro kalendářní den (podle knihy spotřeby), ne pro jeden běh
+            pozastavit: Po vyčerpání denního rozpočtu počkat do dalšího dne místo zastavení
+            okno: Z kolika posledních položek režimu počítat průměr na obrázek
+        """
+        self.max_usd = max_usd
+        self.max_tokenu = max_tokenu
+        self.za_den = za_den
+        self.pozastavit = pozastavit and za_den
+        self.okno = okno
+        self.utraceno_usd = 0.0
+        self.utraceno_tokenu = 0
+        self.zastaveno = False
+        self._rozpracovano = 0
+        self._polozky = {}
+        self._adresar = None
+        self._den = None
+        self._pozastaveno = False
+        # Podmínka - povolit() čeká, až rozpracované požadavky zaplatí
+        self._zamek = threading.Condition()
+    
+    def pripojit(self, adresar):
+        """U denního rozpočtu načte dnešní spotřebu z knihy spotřeby adresáře (volá otevrit_metriky)."""
+        self._adresar = adresar
+        if self.za_den:
+            spotreba_dne = self._spotreba_dne()
+            with self._zamek:
+                self._prevzit_den(spotreba_dne)
+    
+    def _spotreba_dne(self):
+        """Dnešní spotřeba podle knihy - volá se bez zámku, souhrn() nejdřív počká na zápis fronty knihy."""
+        den = datetime.now().strftime('%Y-%m-%d')
+        _, tokeny, naklady = kniha_spotreby(self._adresar).souhrn([], od=den)[0]
+        return den, tokeny or 0, naklady or 0.0
+    
+    def _prevzit_den(self, spotreba_dne):
+        # Kniha spotřeby už obsahuje i to, co tento běh utratil dřív - hodnotu proto nahrazujeme, nepřičítáme
+        self._den, self.utraceno_tokenu, self.utraceno_usd = spotreba_dne
+    
+    def zaplatit(self, obrazku, tokeny, naklady):
+        """Započítá odpověď povoleného požadavku a uvolní jeho rezervaci (volá VykonavacPozadavku.generovat)."""
+        with self._zamek:
+            self.utraceno_tokenu += tokeny
+            self.utraceno_usd += naklady
+            self._rozpracovano -= obrazku
+            self._zamek.notify_all()
+    
+    def zaznamenat(self, rezim, obrazku, tokeny, naklady):
+        """Započítá dokončenou položku (obrázek nebo dávku) do průměru ceny režimu - volá MetrikyBehu.dokoncit."""
+        with self._zamek:
+            # Zásahy cache a duplikáty nic nestojí, do průměru ceny režimu by nepatřily
+            if tokeny:
+                self._polozky.setdefault(rezim, deque(maxlen=self.okno)).append((obrazku, tokeny, naklady))
+    
+    def na_obrazek(self, rezim=None):
+        """
+        Klouzavý průměr spotřeby na obrázek.
+        
+        Args:
+            rezim: Režim ("2", "3", "4"...), None = všechny režimy dohromady
+        
+        Returns:
+            tuple: (tokeny, náklady v USD) na obrázek, nebo None, pokud režim ještě nic nezaplatil
+        """
+        with self._zamek:
+            return self._na_obrazek(rezim)
+    
+    def _na_obrazek(self, rezim):
+        polozky = self._polozky.get(rezim, ()) if rezim is not None else \
+            [polozka for polozky in self._polozky.values() for polozka in polozky]
+        obrazku = sum(polozka[0] for polozka in polozky)
+        if not obrazku:
+            return None
+        return sum(polozka[1] for polozka in polozky) / obrazku, sum(polozka[2] for polozka in polozky) / obrazku
+    
+    def _vejde_se(self, obrazku, odhad):
+        tokeny, naklady = odhad if odhad is not None else (0, 0.0)
+        potreba = self._rozpracovano + obrazku
+        if self.max_usd is not None and self.utraceno_usd + potreba * naklady > self.max_usd:
+            return False
+        if self.max_tokenu is not None and self.utraceno_tokenu + potreba * tokeny > self.max_tokenu:
+            return False
+        return True
+    
+    def vejde_se(self, obrazku, rezim=None):
+        """Zda by se obrazku obrázků při průměrné ceně režimu ještě vešlo do rozpočtu."""
+        with self._zamek:
+            return self._vejde_se(obrazku, self._na_obrazek(rezim))
+    
+    def popis(self):
+        """Stav čerpání jako text."""
+        casti = []
+        if self.max_usd is not None:
+            casti.append(f"${self.utraceno_usd:.4f} z ${self.max_usd:.4f} USD")
+        if self.max_tokenu is not None:
+            casti.append(f"{self.utraceno_tokenu} z {self.max_tokenu} tokenů")
+        return ", ".join(casti) + (" dnes" if self.za_den else "")
+    
+    def povolit(self, rezim, obrazku=1, odhad_pozadavku=None):
+        """
+        Rozhodne, zda smí odejít požadavek na obrazku obrázků; povolený požadavek se započítá jako rozpracovaný,
+        dokud ho zaplatit() neuzavře.
+        
+        Bez změřené ceny režimu se použije průměr ostatních režimů, a dokud
+        nic nestálo nic, odhad vstupu samotného požadavku. Nevejde-li se
+        požadavek jen kvůli rezervacím rozpracovaných požadavků, počká na jejich
+        skutečnou cenu. Pozastavený denní rozpočet blokuje do dalšího dne.
+        
+        Args:
+            rezim: Režim běhu (klíč klouzavého průměru)
+            obrazku: Kolik obrázků požadavek nese
+            odhad_pozadavku: Volitelné (tokeny, náklady) požadavku pro začátek běhu, kdy ještě není z čeho průměrovat
+        
+        Returns:
+            bool: True = požadavek smí odejít, False = rozpočet je vyčerpaný a běh se má zastavit
+        """
+        while True:
+            spotreba_dne = None
+            if self.za_den and self._den != datetime.now().strftime('%Y-%m-%d'):
+                # Knihu čteme mimo zámek, ať ostatní vlákna mezitím můžou platit a povolovat
+                spotreba_dne = self._spotreba_dne()
+            with self._zamek:
+                if self.zastaveno:
+                    return False
+                if spotreba_dne is not None and self._den != spotreba_dne[0]:
+                    self._prevzit_den(spotreba_dne)
+                    self._pozastaveno = False
+                odhad = self._na_obrazek(rezim) or self._na_obrazek(None)
+                if odhad is None and odhad_pozadavku is not None:
+                    odhad = (odhad_pozadavku[0] / obrazku, odhad_pozadavku[1] / obrazku)
+                if self._vejde_se(obrazku, odhad):
+                    self._rozpracovano += obrazku
+                    return True
+                if self._rozpracovano > 0:
+                    self._zamek.wait()
+                    continue
+                if not self.pozastavit:
+                    self.zastaveno = True
+                    print(f"\n⛔ Rozpočet vyčerpán ({self.popis()}) - další požadavky neposílám, "
+                          f"zbylé obrázky zpracuje příští běh.")
+                    return False
+                if not self._pozastaveno:
+                    self._pozastaveno = True
+                    print(f"\n⏸️  Denní rozpočet vyčerpán ({self.popis()}) - pokračuji po půlnoci.")
+            zitra = datetime.combine(datetime.now().date(), datetime.min.time()).timestamp() + 24 * 3600
+            time.sleep(min(max(zitra - time.time(), 1.0), 60.0))
+
+def otevrit_metriky(adresar, prometheus_soubor=None, rezim=None, rozpocet=None):
+    """
+    Vytvoří MetrikyBehu zapisující do METRIKY_SOUBOR (případně souboru uzlu) v daném adresáři.
+    
+    S rozpočtem (RozpocetBehu) mu metriky hlásí spotřebu každé položky.
+    """
+    metriky = MetrikyBehu(os.path.join(adresar, soubor_uzlu(METRIKY_SOUBOR)), prometheus_soubor, rezim)
+    if rozpocet is not None:
+        rozpocet.pripojit(adresar)
+        metriky.rozpocet = rozpocet
+    return metriky
+
+def nacti_api_klic(soubor="api_key.txt"):
+    """Bezpečně načte API klíč z textového souboru."""
+    try:
+        with open(soubor, 'r') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        print(f"Chyba: Soubor '{soubor}' s API klíčem nebyl nalezen.")
+        print("Prosím, vytvořte jej a vložte do něj svůj API klíč.")
+        return None
+
+def vytvorit_klienta():
+    """
+    Načte API klíč a vytvoří jednoho klienta Google AI.
+    
+    Klienta je vhodné vytvořit jednou a sdílet ho mezi všemi požadavky,
+    aby se znovu využil jeho connection pool.
+    
+    Returns:
+        genai.Client nebo None, pokud se nepodařilo načíst API klíč
+    """
+    api_key = nacti_api_klic()
+    if not api_key:
+        return None
+    return genai.Client(api_key=api_key)
+
+def odhadnout_tokeny_textu(text):
+    """Hrubý odhad počtu tokenů textu (česky zhruba 3 znaky na token)."""
+    return len(text) // 3 + 1
+
+class OmezovacRychlosti:
+    """
+    Token bucket pro kvótu jednoho modelu - zvlášť pro požadavky a pro tokeny za minutu.
+    
+    Oba kbelíky se plní rovnoměrně (RPM/60 a TPM/60 za sekundu) a jejich
+    kapacita odpovídá minutové kvótě. Odhad tokenů se po odpovědi opraví
+    podle skutečné spotřeby, kbelík tokenů tak může jít i do mínusu.
+    """
+    
+    def __init__(self, rpm, tpm):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._pozadavky = float(rpm)
+        self._tokeny = float(tpm)
+        self._posledni = time.monotonic()
+        self._zamek = threading.Lock()
+    
+    def _doplnit(self):
+        ted = time.monotonic()
+        uplynulo = ted - self._posledni
+        self._posledni = ted
+        self._pozadavky = min(self.rpm, self._pozadavky + uplynulo * self.rpm / 60)
+        self._tokeny = min(self.tpm, self._tokeny + uplynulo * self.tpm / 60)
+    
+    def ziskat(self, odhad_tokenu):
+        """Počká, dokud kvóta nedovolí odeslat požadavek s daným odhadem tokenů."""
+        # Požadavek větší než celá minutová kvóta by jinak čekal navždy
+        odhad_tokenu = min(odhad_tokenu, self.tpm)
+        while True:
+            with self._zamek:
+                self._doplnit()
+                if self._pozadavky >= 1 and self._tokeny >= odhad_tokenu:
+                    self._pozadavky -= 1
+                    self._tokeny -= odhad_tokenu
+                    return
+                chybi_pozadavku = max(0.0, 1 - self._pozadavky) * 60 / self.rpm
+                chybi_tokenu = max(0.0, odhad_tokenu - self._tokeny) * 60 / self.tpm
+                cekani = max(chybi_pozadavku, chybi_tokenu)
+            time.sleep(cekani)
+    
+    def upravit(self, odhad_tokenu, skutecne_tokeny):
+        """Opraví kbelík tokenů o rozdíl mezi odhadem a skutečnou spotřebou."""
+        with self._zamek:
+            self._tokeny -= skutecne_tokeny - min(odhad_tokenu, self.tpm)
+    
+    def vyprazdnit(self):
+        """Vyprázdní oba kbelíky - volá se po 429, kdy server kvótu vidí jako vyčerpanou."""
+        with self._zamek:
+            self._doplnit()
+            self._pozadavky = min(self._pozadavky, 0.0)
+            self._tokeny = min(self._tokeny, 0.0)
+
+class VykonavacPozadavku:
+    """
+    Sdílený vykonavatel požadavků generate_content pro všechny režimy.
+    
+    Před každým požadavkem počká na kvótu modelu (OmezovacRychlosti) a při
+    chybách 429/5xx nebo výpadku spojení požadavek opakuje s exponenciálním
+    čekáním a náhodným rozptylem (full jitter), nejvýše max_pokusu krát.
+    S max_soubezne nepustí najednou víc požadavků, i když je posílá víc vláken,
+    než má volající (např. stránky PDF z KaskadaModelu.generovat_stranky).
+    """
+    
+    def __init__(self, client, limity=None, max_pokusu=6, zakladni_cekani=1.0, max_cekani=60.0, max_soubezne=None):
+        """
+        Args:
+            client: genai.Client
+            limity: Slovník model -> (RPM, TPM), výchozí LIMITY_MODELU
+            max_pokusu: Kolikrát nejvýše požadavek odeslat (včetně prvního pokusu)
+            zakladni_cekani: Čekání po prvním neúspěchu v sekundách, s každým pokusem se zdvojnásobí
+            max_cekani: Horní mez jednoho čekání v sekundách
+            max_soubezne: Nejvýše kolik požadavků může čekat na odpověď současně (None = bez omezení)
+        """
+        self.client = client
+        self.limity = LIMITY_MODELU if limity is None else limity
+        self.max_pokusu = max_pokusu
+        self.zakladni_cekani = zakladni_cekani
+        self.max_cekani = max_cekani
+        self.max_soubezne = max_soubezne
+        self.pocet_pozadavku = 0
+        self.pocet_opakovani = 0
+        self._omezovace = {}
+        self._zamek = threading.Lock()
+        self._mista = threading.BoundedSemaphore(max_soubezne) if max_soubezne else None
+    
+    def omezovac(self, model):
+        """Vrátí (a případně vytvoří) omezovač pro daný model."""
+        with self._zamek:
+            if model not in self._omezovace:
+                # Neznámý model dostane nejpřísnější známý limit
+                rpm, tpm = self.limity.get(model, min(self.limity.values()))
+                self._omezovace[model] = OmezovacRychlosti(rpm, tpm)
+            return self._omezovace[model]
+    
+    @contextmanager
+    def _misto(self, mereni):
+        """Obsadí jedno z max_soubezne míst na dobu požadavku (čekání na místo se měří jako kvóta)."""
+        if self._mista is None:
+            yield
+            return
+        with mereni.etapa("kvota"):
+            self._mista.acquire()
+        try:
+            yield
+        finally:
+            self._mista.release()
+    
+    @staticmethod
+    def je_opakovatelna(chyba):
+        """Rozhodne, zda chyba API stojí za opakování."""
+        kod = getattr(chyba, "code", None) or getattr(chyba, "status_code", None)
+        if kod is not None:
+            return kod in OPAKOVATELNE_KODY
+        # Chyby bez HTTP kódu - timeouty a spadlá spojení (httpx i vestavěné)
+        return isinstance(chyba, (ConnectionError, TimeoutError)) or type(chyba).__name__ in (
+            "ConnectError", "ReadTimeout", "WriteTimeout", "ConnectTimeout", "RemoteProtocolError",
+        )
+    
+    def generovat(self, model, contents, config=None, odhad_tokenu=3000, mereni=None):
+        """
+        Odešle požadavek generate_content s ohledem na kvótu a s opakováním.
+        
+        Args:
+            model: Název modelu
+            contents: Obsah požadavku
+            config: Volitelné GenerateContentConfig
+            odhad_tokenu: Odhad vstupních tokenů požadavku pro limit TPM
+            mereni: Volitelné MereniPolozky - zaznamenají se etapy kvota, sit, cekani_opakovani a počet opakování
+        
+        Returns:
+            Odpověď generate_content
+        
+        Raises:
+            RozpocetVycerpan, pokud by požadavek překročil rozpočet běhu (mereni.rozpocet)
+            Poslední chybu API, pokud se požadavek nepodařilo odeslat ani po max_pokusu pokusech
+            nebo pokud chyba není opakovatelná
+        """
+        if mereni is None:
+            mereni = MereniPolozky("pozadavek", model)
+        rozpocet = mereni.rozpocet
+        if rozpocet is None:
+            return self._generovat(model, contents, config, odhad_tokenu, mereni)
+        if not rozpocet.povolit(mereni.rezim, mereni.obrazku,
+                                (odhad_tokenu, vypocitat_naklady(odhad_tokenu, model))):
+            raise RozpocetVycerpan(f"Rozpočet vyčerpán ({rozpocet.popis()})")
+        tokeny, naklady = 0, 0.0
+        try:
+            response = self._generovat(model, contents, config, odhad_tokenu, mereni)
+            tokeny = getattr(response.usage_metadata, "total_token_count", None) or 0
+            naklady = naklady_odpovedi(response.usage_metadata, model)
+            return response
+        finally:
+            rozpocet.zaplatit(mereni.obrazku, tokeny, naklady)
+    
+    def _generovat(self, model, contents, config, odhad_tokenu, mereni):
+        omezovac = self.omezovac(model)
+        for pokus in range(1, self.max_pokusu + 1):
+            with mereni.etapa("kvota"):
+                omezovac.ziskat(odhad_tokenu)
+            with self._zamek:
+                self.pocet_pozadavku += 1
+            try:
+                with self._misto(mereni), mereni.etapa("sit"):
+                    response = self.client.models.generate_content(model=model, contents=contents, config=config)
+            except Exception as e:
+                if not self.je_opakovatelna(e) or pokus == self.max_pokusu:
+                    raise
+                if getattr(e, "code", None) == 429:
+                    omezovac.vyprazdnit()
+                cekani = random.uniform(0, min(self.max_cekani, self.zakladni_cekani * 2 ** (pokus - 1)))
+                print(f"⏳ Chyba API ({e}), pokus {pokus}/{self.max_pokusu} - zkusím znovu za {cekani:.1f} s")
+                with self._zamek:
+                    self.pocet_opakovani += 1
+                mereni.opakovani += 1
+                with mereni.etapa("cekani_opakovani"):
+                    time.sleep(cekani)
+                continue
+            
+            skutecne = getattr(response.usage_metadata, "prompt_token_count", None)
+            if skutecne is not None:
+                omezovac.upravit(odhad_tokenu, skutecne)
+            return response
+
+def zajistit_vykonavac(client):
+    """Vrátí VykonavacPozadavku - předaný, nebo nový obalující předaného klienta."""
+    if isinstance(client, VykonavacPozadavku):
+        return client
+    return VykonavacPozadavku(client)
+
+def vytvorit_vykonavac(max_soubezne=None):
+    """
+    Načte API klíč a vytvoří sdíleného vykonavatele požadavků s jedním klientem.
+    
+    Args:
+        max_soubezne: Nejvýše kolik požadavků poslat současně, včetně stránek PDF (None = bez omezení)
+    
+    Returns:
+        VykonavacPozadavku nebo None, pokud se nepodařilo načíst API klíč
+    """
+    client = vytvorit_klienta()
+    if not client:
+        return None
+    return VykonavacPozadavku(client, max_soubezne=max_soubezne)
+
+def mime_typ_z_obsahu(data):
+    """
+    Pozná typ souboru podle prvních bajtů (magic bytes).
+    
+    Returns:
+        str: MIME typ, nebo None, pokud obsah nepoznáme
+    """
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data.startswith(b"%PDF-"):
+        return "application/pdf"
+    # HEIF kontejner (ISO BMFF) - box ftyp a značka formátu; iPhone ukládá HEVC obrázky jako heic
+    if data[4:8] == b"ftyp":
+        znacka = data[8:12]
+        if znacka in (b"heic", b"heix", b"heim", b"heis", b"hevc", b"hevx"):
+            return "image/heic"
+        if znacka in (b"mif1", b"msf1", b"heif"):
+            return "image/heif"
+    return None
+
+def urcit_mime_typ(cesta, data=None):
+    """
+    Určí MIME typ souboru podle obsahu, a teprve když ho nepoznáme, podle přípony.
+    
+    Args:
+        cesta: Cesta k souboru
+        data: Obsah souboru nebo aspoň jeho prvních 16 bajtů (jinak se přečtou ze souboru)
+    """
+    if data is None:
+        try:
+            with open(cesta, "rb") as f:
+                data = f.read(16)
+        except OSError:
+            data = b""
+    return mime_typ_z_obsahu(data) or MIME_PODLE_PRIPONY.get(os.path.splitext(cesta)[1].lower(), "image/png")
+
+def pocet_stran_pdf(data):
+    """Počet stránek PDF - s pypdfium2 přesně, jinak odhadem podle objektů /Type /Page."""
+    if pdfium is not None:
+        try:
+            dokument = pdfium.PdfDocument(data)
+            try:
+                return len(dokument)
+            finally:
+                dokument.close()
+        except Exception:
+            pass
+    return max(1, len(re.findall(rb"/Type\s*/Page(?![a-zA-Z])", data)))
+
+def duvod_bez_kontextove_cache(model, prompt):
+    """
+    Předem zjistí, zda Gemini prompt do kontextové cache vůbec přijme.
+    
+    Args:
+        model: Model, pro který by se cache vytvářela
+        prompt: Text promptu, který by se do cache uložil
+    
+    Returns:
+        str s vysvětlením, proč cache použít nejde, nebo None (u neznámého modelu rozhodne až API)
+    """
+    minimum = MIN_TOKENU_KONTEXTOVE_CACHE.get(model)
+    tokenu = odhadnout_tokeny_textu(prompt)
+    if minimum is None or tokenu >= minimum:
+        return None
+    return (f"prompt má jen asi {tokenu} tokenů, model {model} ale do kontextové cache "
+            f"přijme nejméně {minimum}")
+
+class SpravceKontextoveCache:
+    """
+    Spravuje kontextovou cache Gemini (client.caches) s textem promptu.
+    
+    Prompt se zaregistruje jednou a požadavky na něj pak jen odkazují přes
+    GenerateContentConfig(cached_content=...), takže se jeho tokeny neposílají
+    ani neplatí v plné ceně u každého obrázku. Cache se vytvoří líně při
+    prvním požadavku a před vypršením TTL se prodlouží. Prompt kratší než
+    minimum pro cache daného modelu se na API vůbec neposílá; v tom případě,
+    stejně jako když API vytvoření odmítne, vrací nazev() None a volající
+    posílá prompt jako dřív.
+    
+    Příkazová řádka cache nenabízí: PROMPT_EXTRAKCE ani PROMPT_DAVKA minima
+    žádného modelu nedosahují. Zapnout ji jde jen parametrem kontextova_cache
+    funkcí zpracování, až bude prompt (např. s příklady účtenek) dost dlouhý.
+    """
+    
+    def __init__(self, client, model, prompt, ttl_sekund=3600, obnovit_pred_sekund=300, hodiny=time.time):
+        """
+        Args:
+            client: genai.Client (nebo jakýkoli objekt s rozhraním client.caches)
+            model: Model, pro který se cache vytváří (cache je vázaná na model)
+            prompt: Text promptu, který se uloží do cache
+            ttl_sekund: Platnost cache po vytvoření a po každém prodloužení
+            obnovit_pred_sekund: Jak dlouho před vypršením cache prodloužit
+            hodiny: Zdroj času (kvůli testům)
+        """
+        self.client = client
+        self.model = model
+        self.prompt = prompt
+        self.ttl_sekund = ttl_sekund
+        self.obnovit_pred_sekund = obnovit_pred_sekund
+        self.hodiny = hodiny
+        self.tokenu_v_cache = 0
+        self._nazev = None
+        self._vytvoreno = None
+        self._vyprsi = 0.0
+        self._ulozeno_sekund = 0.0  # doba uložení dřívějších, už vypršelých instancí cache
+        self._nedostupna = False
+        self._zamek = threading.Lock()
+        duvod = duvod_bez_kontextove_cache(model, prompt)
+        if duvod is not None:
+            # Zbytečný požadavek na caches.create by jen selhal - rovnou posíláme prompt v každém požadavku
+            print(f"⚠️  Kontextová cache se nepoužije: {duvod}. Prompt se bude posílat v každém požadavku.")
+            self._nedostupna = True
+    
+    def nazev(self):
+        """
+        Vrátí název platné cache - podle potřeby ji vytvoří nebo prodlouží.
+        
+        Returns:
+            str nebo None, pokud cache není k dispozici
+        """
+        with self._zamek:
+            if self._nedostupna:
+                return None
+            ted = self.hodiny()
+            if self._nazev is None or ted >= self._vyprsi:
+                self._vytvorit(ted)
+            elif self._vyprsi - ted < self.obnovit_pred_sekund:
+                self._prodlouzit(ted)
+            return self._nazev
+    
+    def _vytvorit(self, ted):
+        try:
+            # SDK přijímá konfiguraci i jako obyčejný slovník - správa cache tak nepotřebuje import google-genai
+            cache = self.client.caches.create(
+                model=self.model,
+                config={
+                    "display_name": "faktury-prompt",
+                    "contents": [{"role": "user", "parts": [{"text": self.prompt}]}],
+                    "ttl": f"{self.ttl_sekund}s",
+                },
+            )
+        except Exception as e:
+            print(f"⚠️  Kontextovou cache se nepodařilo vytvořit ({e}), prompt se bude posílat v každém požadavku.")
+            self._nedostupna = True
+            self._nazev = None
+            return
+        if self._vytvoreno is not None:
+            self._ulozeno_sekund += min(ted, self._vyprsi) - self._vytvoreno
+        self._nazev = cache.name
+        self._vytvoreno = ted
+        self._vyprsi = ted + self.ttl_sekund
+        usage = getattr(cache, "usage_metadata", None)
+        self.tokenu_v_cache = getattr(usage, "total_token_count", None) or odhadnout_tokeny_textu(self.prompt)
+        print(f"🗄️  Prompt uložen do kontextové cache '{self._nazev}' ({self.tokenu_v_cache} tokenů, TTL {self.ttl_sekund} s)")
+    
+    def _prodlouzit(self, ted):
+        try:
+            self.client.caches.update(
+                name=self._nazev,
+                config={"ttl": f"{self.ttl_sekund}s"},
+            )
+            self._vyprsi = ted + self.ttl_sekund
+        except Exception as e:
+            # Cache mohla mezitím zmizet - při příštím požadavku ji vytvoříme znovu
+            print(f"⚠️  Prodloužení kontextové cache selhalo ({e}), vytvořím novou.")
+            self._vytvorit(ted)
+    
+    def naklady_ulozeni(self):
+        """Odhad nákladů v USD za dosavadní uložení cache."""
+        if self._vytvoreno is None:
+            return 0.0
+        hodin = (self._ulozeno_sekund + min(self.hodiny(), self._vyprsi) - self._vytvoreno) / 3600
+        return self.tokenu_v_cache / 1_000_000 * CENA_ULOZENI_CACHE_ZA_HODINU * hodin
+    
+    def smazat(self):
+        """Smaže cache na serveru, aby se dál neplatilo za její uložení."""
+        with self._zamek:
+            if self._nazev is None:
+                return
+            try:
+                self.client.caches.delete(name=self._nazev)
+            except Exception as e:
+                print(f"⚠️  Kontextovou cache '{self._nazev}' se nepodařilo smazat: {e}")
+            # Po smazání už se neplatí - uložení počítáme jen do teď
+            self._vyprsi = min(self._vyprsi, self.hodiny())
+            self._nazev = None
+            self._nedostupna = True
+
+def sestavit_pozadavek(prompt, casti_obrazku, kontext=None, prompt_na_zacatku=False, schema=None):
+    """
+    Sestaví obsah a konfiguraci požadavku - s promptem v textu, nebo s odkazem na kontextovou cache.
+    
+    Args:
+        prompt: Text promptu
+        casti_obrazku: Seznam types.Part s obrázky
+        kontext: Volitelný SpravceKontextoveCache s tímto promptem
+        prompt_na_zacatku: Prompt před obrázky (dávka) nebo za nimi (jeden obrázek)
+        schema: Volitelné JSON schéma - model pak vrací přímo JSON odpovídající schématu
+    
+    Returns:
+        tuple: (contents, config nebo None)
+    """
+    parametry = {}
+    if schema is not None:
+        parametry["response_mime_type"] = "application/json"
+        parametry["response_json_schema"] = schema
+    
+    nazev_kontextu = kontext.nazev() if kontext is not None else None
+    if nazev_kontextu is not None:
+        parametry["cached_content"] = nazev_kontextu
+        casti = list(casti_obrazku)
+    else:
+        cast_promptu = types.Part.from_text(text=prompt)
+        casti = [cast_promptu, *casti_obrazku] if prompt_na_zacatku else [*casti_obrazku, cast_promptu]
+    
+    config = types.GenerateContentConfig(**parametry) if parametry else None
+    return [types.Content(role="user", parts=casti)], config
+
+def nacist_json_odpovedi(text):
+    """
+    Naparsuje textovou odpověď modelu jako JSON.
+    
+    Bez strukturovaného výstupu model občas obalí JSON do bloku ```json ... ```,
+    ten se odstraní. Vyhodí json.JSONDecodeError, pokud text není platný JSON.
+    """
+    text = (text or "").strip()
+    blok = re.fullmatch(r"```(?:json)?\s*(.*?)\s*```", text, re.DOTALL)
+    if blok:
+        text = blok.group(1)
+    return json.loads(text)
+
+def zkontrolovat_data_uctenky(data):
+    """
+    Ověří, že extrahovaná data jedné účtenky jsou JSON pole nebo objekt.
+    
+    Raises:
+        ValueError: Pokud data nemají očekávaný tvar
+    """
+    if not isinstance(data, (list, dict)):
+        raise ValueError(f"Data účtenky nejsou JSON pole ani objekt, ale {type(data).__name__}.")
+    if isinstance(data, list) and not all(isinstance(blok, dict) for blok in data):
+        raise ValueError("Pole dat účtenky obsahuje prvky, které nejsou objekty.")
+    return data
+
+def rozdelit_vysledky_davky(vysledky, pocet_obrazku):
+    """
+    Ověří obálky výsledků dávky a přiřadí data k indexům obrázků.
+    
+    Neplatné obálky (chybějící nebo duplicitní index, index mimo rozsah,
+    data ve špatném tvaru) se přeskočí - jejich obrázky pak v odpovědi chybí.
+    
+    Args:
+        vysledky: Naparsovaná odpověď dávky (pole obálek)
+        pocet_obrazku: Počet obrázků odeslaných v dávce
+    
+    Returns:
+        dict: {obrazek_index: data}
+    """
+    if not isinstance(vysledky, list):
+        raise ValueError("Odpověď od AI není ve formátu pole.")
+    
+    platne = {}
+    for vysledek in vysledky:
+        obrazek_index = vysledek.get('obrazek_index') if isinstance(vysledek, dict) else None
+        if isinstance(obrazek_index, bool) or not isinstance(obrazek_index, int) \
+                or not 0 <= obrazek_index < pocet_obrazku or obrazek_index in platne:
+            print(f"Varování: Neplatný index obrázku v odpovědi: {obrazek_index}")
+            continue
+        
+        data = vysledek.get('data', vysledek)  # Pokud není 'data', použijeme celý objekt
+        if isinstance(data, dict) and 'obrazek_index' in data:
+            data = {klic: hodnota for klic, hodnota in data.items() if klic != 'obrazek_index'}
+        try:
+            platne[obrazek_index] = zkontrolovat_data_uctenky(data)
+        except ValueError as e:
+            print(f"Varování: Neplatná data obrázku {obrazek_index}: {e}")
+    return platne
+
+class KaskadaModelu:
+    """
+    Modely seřazené od nejlevnějšího - dražší model dostane jen účtenku, která u levnějšího neprošla kontrolou.
+    
+    Výsledek každého modelu se ověří funkcí overit_uctenku. Projde-li,
+    přijme se; jinak (nebo když odpověď není platný JSON) jde účtenka
+    dalšímu modelu. Výsledek posledního modelu se přijme vždy, nesrovnalosti
+    se jen poznamenají do reportu. Kaskáda s jediným modelem nic neověřuje.
+    """
+    
+    def __init__(self, modely, tolerance=1.0):
+        """
+        Args:
+            modely: Názvy modelů od nejlevnějšího (např. MODEL_DEFAULT, "gemini-2.5-flash", "gemini-2.5-pro")
+            tolerance: Povolený rozdíl částek při kontrole (viz overit_uctenku)
+        """
+        self.modely = list(modely)
+        self.tolerance = tolerance
+        self.overovat = len(self.modely) > 1
+    
+    @property
+    def nazev(self):
+        """Název pro klíč cache - výsledek kaskády není totéž co výsledek jejího prvního modelu."""
+        return " > ".join(self.modely)
+    
+    def vyssi(self):
+        """Kaskáda bez prvního modelu (pro účtenky, které první model zpracoval jinde, např. v dávce)."""
+        kaskada = KaskadaModelu(self.modely[1:], self.tolerance)
+        kaskada.overovat = True
+        return kaskada
+    
+    def generovat(self, vykonavac, casti_obrazku, odhad_tokenu, pokusy, mereni, kontext=None, schema=None,
+                  metriky=None):
+        """
+        Extrahuje účtenku modely kaskády, dokud výsledek neprojde kontrolou.
+        
+        Args:
+            vykonavac: VykonavacPozadavku
+            casti_obrazku: Části požadavku s obrázkem
+            odhad_tokenu: Odhad tokenů požadavku pro omezovač kvóty
+            pokusy: Seznam, do kterého se připíše (model, tokeny, náklady, nesrovnalosti) každého
+                    pokusu - volající ho má, i když pozdější pokus skončí výjimkou
+            mereni: MereniPolozky obrázku
+            kontext: Volitelný SpravceKontextoveCache - použije se jen u modelu, pro který vznikl
+            schema: Volitelné schéma vynuceného JSON výstupu
+            metriky: Volitelné MetrikyBehu - započítají se pokusy úrovní
+        
+        Returns:
+            tuple: (data, odpověď přijatého modelu, nesrovnalosti přijatého výsledku)
+        
+        Raises:
+            json.JSONDecodeError, ValueError: Odpověď posledního modelu není platný JSON účtenky
+        """
+        for uroven, model in enumerate(self.modely):
+            posledni = uroven == len(self.modely) - 1
+            with mereni.etapa("sestaveni"):
+                contents, config = sestavit_pozadavek(
+                    PROMPT_EXTRAKCE, casti_obrazku,
+                    kontext if kontext is not None and kontext.model == model else None, schema=schema)
+            response = vykonavac.generovat(model, contents, config=config, odhad_tokenu=odhad_tokenu, mereni=mereni)
+            tokeny = response.usage_metadata.total_token_count
+            naklady = naklady_odpovedi(response.usage_metadata, model)
+            try:
+                with mereni.etapa("parsovani"):
+                    data = zkontrolovat_data_uctenky(nacist_json_odpovedi(response.text))
+                    problemy = overit_uctenku(data, self.tolerance) if self.overovat else []
+            except (json.JSONDecodeError, ValueError) as e:
+                if posledni:
+                    pokusy.append((model, tokeny, naklady, [f"neplatný JSON: {e}"]))
+                    if self.overovat and metriky is not None:
+                        metriky.zaznamenat_uroven(model, False, tokeny, naklady)
+                    raise
+                data, problemy = None, [f"neplatný JSON: {e}"]
+            pokusy.append((model, tokeny, naklady, problemy))
+            if self.overovat and metriky is not None:
+                metriky.zaznamenat_uroven(model, not problemy, tokeny, naklady)
+            if not problemy or posledni:
+                return data, response, problemy
+            print(f"↗️  {model}: {'; '.join(problemy)} - posílám modelu {self.modely[uroven + 1]}")
+    
+    def generovat_stranky(self, vykonavac, stranky, pokusy, strany, mereni, kontext=None, schema=None,
+                          metriky=None, max_soubezne=PDF_SOUBEZNE_STRANKY):
+        """
+        Jako generovat, ale pro vícestránkový dokument - každá stránka jde v samostatném požadavku.
+        
+        Stránky jedné úrovně kaskády se extrahují souběžně, výsledky se spojí
+        (spojit_stranky) a kontroluje se až celý dokument - součty bývají
+        jen na poslední stránce. Neprojde-li, jde celý dokument dalšímu modelu.
+        
+        Args:
+            vykonavac: VykonavacPozadavku
+            stranky: Seznam (části požadavku, odhad tokenů) pro každou stránku
+            pokusy: Jako u generovat - za každou úroveň se připíše součet všech stránek
+            strany: Seznam, do kterého se připíše (model, tokeny, náklady) každé stránky přijatého výsledku
+            mereni: MereniPolozky dokumentu (časy stránek se sčítají)
+            kontext: Volitelný SpravceKontextoveCache - použije se jen u modelu, pro který vznikl
+            schema: Volitelné schéma vynuceného JSON výstupu
+            metriky: Volitelné MetrikyBehu - započítají se pokusy úrovní
+            max_soubezne: Kolik stránek jednoho dokumentu připravit souběžně; kolik jich opravdu čeká
+                          na odpověď, omezuje ještě vykonavac (jeho max_soubezne platí pro celý běh)
+        
+        Returns:
+            tuple: (data, odpověď se součtem usage_metadata stránek, nesrovnalosti přijatého výsledku)
+        
+        Raises:
+            json.JSONDecodeError, ValueError: Odpověď posledního modelu na některou stránku není platný JSON
+        """
+        for uroven, model in enumerate(self.modely):
+            posledni = uroven == len(self.modely) - 1
+            kontext_modelu = kontext if kontext is not None and kontext.model == model else None
+            
+            def extrahovat_stranku(stranka):
+                casti_obrazku, odhad_tokenu = stranka
+                with mereni.etapa("sestaveni"):
+                    contents, config = sestavit_pozadavek(PROMPT_EXTRAKCE, casti_obrazku, kontext_modelu,
+                                                          schema=schema)
+                return vykonavac.generovat(model, contents, config=config, odhad_tokenu=odhad_tokenu, mereni=mereni)
+            
+            with ThreadPoolExecutor(max_workers=min(max_soubezne, len(stranky))) as executor:
+                futures = [executor.submit(extrahovat_stranku, stranka) for stranka in stranky]
+            # Zaplacené stránky započítáme, i když jiná stránka skončila chybou
+            odpovedi, chyba = [], None
+            for future in futures:
+                try:
+                    odpovedi.append(future.result())
+                except Exception as e:
+                    chyba = chyba or e
+            tokeny_stran = [odpoved.usage_metadata.total_token_count for odpoved in odpovedi]
+            naklady_stran = [naklady_odpovedi(odpoved.usage_metadata, model) for odpoved in odpovedi]
+            tokeny, naklady = sum(tokeny_stran), sum(naklady_stran)
+            if chyba is not None:
+                pokusy.append((model, tokeny, naklady, [f"chyba stránky: {chyba}"]))
+                raise chyba
+            
+            try:
+                with mereni.etapa("parsovani"):
+                    data = spojit_stranky([zkontrolovat_data_uctenky(nacist_json_odpovedi(odpoved.text))
+                                           for odpoved in odpovedi])
+                    problemy = overit_uctenku(data, self.tolerance) if self.overovat else []
+            except (json.JSONDecodeError, ValueError) as e:
+                if posledni:
+                    pokusy.append((model, tokeny, naklady, [f"neplatný JSON: {e}"]))
+                    if self.overovat and metriky is not None:
+                        metriky.zaznamenat_uroven(model, False, tokeny, naklady)
+                    raise
+                data, problemy = None, [f"neplatný JSON: {e}"]
+            pokusy.append((model, tokeny, naklady, problemy))
+            if self.overovat and metriky is not None:
+                metriky.zaznamenat_uroven(model, not problemy, tokeny, naklady)
+            if not problemy or posledni:
+                strany.extend(zip([model] * len(odpovedi), tokeny_stran, naklady_stran))
+                return data, SimpleNamespace(text=None, usage_metadata=secist_usage(odpovedi)), problemy
+            print(f"↗️  {model}: {'; '.join(problemy)} - posílám modelu {self.modely[uroven + 1]}")
+
+def radky_eskalace(cas, nazev_souboru, pokusy):
+    """Řádky reportu za pokusy kaskády, jejichž výsledek se zahodil (všechny kromě posledního)."""
+    return [[cas, nazev_souboru, tokeny, naklady, 'ESKALACE', "; ".join(problemy), None, model]
+            for model, tokeny, naklady, problemy in pokusy[:-1]]
+
+def radky_stranek(cas, nazev_souboru, strany, prodejce=None):
+    """Řádky reportu se spotřebou jednotlivých stránek přijatého výsledku (viz KaskadaModelu.generovat_stranky)."""
+    return [[cas, nazev_souboru, tokeny, naklady, 'STRANKA', f"strana {cislo}/{len(strany)}", prodejce, model]
+            for cislo, (model, tokeny, naklady) in enumerate(strany, 1)]
+
+def extrahovat_dokument(kaskada, vykonavac, stranky, pokusy, strany, mereni, kontext=None, schema=None,
+                        metriky=None):
+    """
+    Extrahuje připravený dokument (viz pripravit_dokument) - jednu stránku přes generovat, víc přes generovat_stranky.
+    
+    Returns:
+        tuple: (data, odpověď, nesrovnalosti) jako KaskadaModelu.generovat
+    """
+    odhad_promptu = odhadnout_tokeny_textu(PROMPT_EXTRAKCE)
+    casti = [([types.Part.from_bytes(mime_type=mime_type, data=data)], odhad + odhad_promptu)
+             for data, mime_type, odhad, _ in stranky]
+    if len(casti) == 1:
+        return kaskada.generovat(vykonavac, casti[0][0], casti[0][1], pokusy, mereni, kontext=kontext,
+                                 schema=schema, metriky=metriky)
+    return kaskada.generovat_stranky(vykonavac, casti, pokusy, strany, mereni, kontext=kontext, schema=schema,
+                                     metriky=metriky)
+
+def nastavit_proud_vysledku(proud, json_soubory=True):
+    """
+    Nastaví, kam se ukládají výsledky obrázků.
+    
+    Args:
+        proud: ProudVysledku, do kterého se připíše každý výsledek, nebo None
+        json_soubory: Zapisovat i JSON soubor vedle každého obrázku (False jen spolu s proudem)
+    """
+    global _proud_vysledku, _json_soubory
+    _proud_vysledku = proud
+    _json_soubory = json_soubory or proud is None
+
+def zapsat_vystup(nazev_obrazku, json_text, data=None):
+    """
+    Zapíše výsledek obrázku - do JSON souboru vedle obrázku a/nebo do nastaveného proudu výsledků.
+    
+    Args:
+        nazev_obrazku: Cesta k obrázku
+        json_text: Výsledek jako JSON text
+        data: Tentýž výsledek už naparsovaný (jinak se pro proud naparsuje z json_text)
+    
+    Returns:
+        str: Cesta k JSON souboru vedle obrázku (i když se nezapisuje)
+    """
+    nazev_vystupu = f"{os.path.splitext(nazev_obrazku)[0]}.json"
+    if _json_soubory:
+        with open(nazev_vystupu, "w", encoding="utf-8") as f:
+            f.write(json_text)
+    proud = _proud_vysledku
+    if proud is not None:
+        proud.zapsat(nazev_obrazku, json.loads(json_text) if data is None else data)
+    return nazev_vystupu
+
+class ProudVysledku:
+    """
+    Výsledky běhu připisované do jednoho souboru JSON Lines.
+    
+    Místo tisíců malých JSON souborů vznikne jeden soubor za běh (uzel,
+    proces), který se po dosažení max_bajtu uzavře a pokračuje se dalším
+    (vysledky-...-0001.jsonl). Každý řádek se hned předá systému (flush),
+    fsync proběhne nejpozději po fsync_interval sekundách, při rotaci
+    a při zavření. Řádek obsahuje cestu k obrázku, čas, normalizovaná pole
+    (viz normalizovat_uctenku) a celý výsledek. Sdílí se mezi vlákny.
+    """
+    
+    def __init__(self, adresar, max_bajtu=256 * 1024 * 1024, fsync_interval=5.0):
+        """
+        Args:
+            adresar: Adresář pro soubory proudu (vytvoří se)
+            max_bajtu: Velikost, po které se soubor uzavře a začne se psát do dalšího
+            fsync_interval: Nejdelší doba v sekundách, po kterou zapsané řádky nemusí být na disku
+        """
+        os.makedirs(adresar, exist_ok=True)
+        self.adresar = adresar
+        self.max_bajtu = max_bajtu
+        self.fsync_interval = fsync_interval
+        self.zaklad = (f"{PROUD_VYSLEDKU_PREDPONA}-{datetime.now():%Y%m%d-%H%M%S}-"
+                       f"{_uzel or socket.gethostname()}-{os.getpid()}")
+        self.soubory = []
+        self.zapsano = 0
+        self._soubor = None
+        self._velikost = 0
+        self._neulozeno = False
+        self._zamek = threading.Lock()
+        self._konec = threading.Event()
+        # fsync i v klidu (démon) - jinak by poslední řádky čekaly na další výsledek
+        self._vlakno = threading.Thread(target=self._synchronizovat, name="proud-vysledku", daemon=True)
+        self._vlakno.start()
+    
+    def _otevrit(self):
+        cesta = os.path.join(self.adresar, f"{self.zaklad}-{len(self.soubory):04d}.jsonl")
+        self._soubor = open(cesta, "ab")
+        self._velikost = self._soubor.tell()
+        self.soubory.append(cesta)
+    
+    def _fsync(self):
+        if self._soubor is not None and self._neulozeno:
+            os.fsync(self._soubor.fileno())
+            self._neulozeno = False
+    
+    def _uzavrit_soubor(self):
+        self._fsync()
+        self._soubor.close()
+        self._soubor = None
+    
+    def _synchronizovat(self):
+        while not self._konec.wait(self.fsync_interval):
+            with self._zamek:
+                self._fsync()
+    
+    def zapsat(self, nazev_obrazku, data):
+        """Připíše výsledek obrázku jako jeden řádek."""
+        pole = normalizovat_uctenku(data)
+        del pole["text"]
+        radek = json.dumps({
+            "obrazek": os.path.abspath(nazev_obrazku),
+            "cas": datetime.now().isoformat(timespec="seconds"),
+            "pole": pole,
+            "data": data,
+        }, ensure_ascii=False) + "\n"
+        bajty = radek.encode("utf-8")
+        with self._zamek:
+            if self._soubor is None:
+                self._otevrit()
+            self._soubor.write(bajty)
+            self._soubor.flush()
+            self._neulozeno = True
+            self._velikost += len(bajty)
+            self.zapsano += 1
+            if self._velikost >= self.max_bajtu:
+                # Další výsledek už otevře nový soubor
+                self._uzavrit_soubor()
+    
+    def zavrit(self):
+        """Uloží zbytek na disk a uzavře aktuální soubor."""
+        self._konec.set()
+        self._vlakno.join()
+        with self._zamek:
+            if self._soubor is not None:
+                self._uzavrit_soubor()
+
+def zavrit_proud_vysledku():
+    """Uzavře nastavený proud výsledků a vrátí zápis do JSON souborů u obrázků."""
+    proud = _proud_vysledku
+    if proud is not None:
+        nastavit_proud_vysledku(None)
+        proud.zavrit()
+        print(f"📦 Proud výsledků: {proud.zapsano} výsledků v {len(proud.soubory)} souborech "
+              f"'{os.path.join(proud.adresar, proud.zaklad)}-*.jsonl'")
+
+def nacist_proudy_vysledku(vstupy):
+    """
+    Načte výsledky ze souborů proudu (nebo ze všech proudů v zadaných adresářích).
+    
+    Soubory se čtou v pořadí názvů, tedy podle času běhu; pokud je obrázek
+    ve více bězích, platí jeho poslední výsledek. Neúplný poslední řádek
+    (přerušený zápis) se přeskočí.
+    
+    Returns:
+        list: Řádky proudu (slovníky obrazek, cas, pole, data)
+    """
+    soubory = []
+    for vstup in vstupy:
+        if os.path.isdir(vstup):
+            soubory.extend(os.path.join(vstup, nazev) for nazev in sorted(os.listdir(vstup))
+                           if nazev.startswith(PROUD_VYSLEDKU_PREDPONA) and nazev.endswith(".jsonl"))
+        else:
+            soubory.append(vstup)
+    vysledky = {}
+    for soubor in soubory:
+        with open(soubor, encoding="utf-8") as f:
+            for cislo_radku, radek in enumerate(f, 1):
+                try:
+                    zaznam = json.loads(radek)
+                except json.JSONDecodeError:
+                    print(f"⚠️  {soubor}:{cislo_radku} není platný JSON, přeskakuji")
+                    continue
+                vysledky.pop(zaznam["obrazek"], None)
+                vysledky[zaznam["obrazek"]] = zaznam
+    return list(vysledky.values())
+
+def exportovat_vysledky(vstupy, cil):
+    """
+    Vyexportuje normalizovaná pole z proudů výsledků do Parquet nebo Arrow (Feather) souboru.
+    
+    Formát se určí podle přípony cíle (.parquet, jinak Arrow IPC). Sloupce:
+    obrazek, cas, prodejce, datum, celkem, mena, dph a polozky (seznamy
+    struktur) a data (celý výsledek jako JSON text). Vyžaduje pyarrow -
+    importuje se až tady, ať neprodlužuje start ostatních příkazů.
+    
+    Returns:
+        int: Počet vyexportovaných účtenek
+    """
+    try:
+        import pyarrow
+        import pyarrow.feather
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Export do Parquet/Arrow vyžaduje knihovnu pyarrow (pip install pyarrow).")
+    
+    castka = pyarrow.float64()
+    schema = pyarrow.schema([
+        ("obrazek", pyarrow.string()),
+        ("cas", pyarrow.string()),
+        ("prodejce", pyarrow.string()),
+        ("datum", pyarrow.string()),
+        ("celkem", castka),
+        ("mena", pyarrow.string()),
+        ("dph", pyarrow.list_(pyarrow.struct([("sazba", castka), ("zaklad", castka), ("dan", castka)]))),
+        ("polozky", pyarrow.list_(pyarrow.struct([("nazev", pyarrow.string()), ("mnozstvi", castka),
+                                                   ("cena", castka)]))),
+        ("data", pyarrow.string()),
+    ])
+    radky = []
+    for zaznam in nacist_proudy_vysledku(vstupy):
+        pole = zaznam["pole"]
+        radky.append({
+            "obrazek": zaznam["obrazek"],
+            "cas": zaznam["cas"],
+            "prodejce": pole["prodejce"],
+            "datum": pole["datum"],
+            "celkem": pole["celkem"],
+            "mena": pole["mena"],
+            "dph": [dict(zip(("sazba", "zaklad", "dan"), radek)) for radek in pole["dph"]],
+            "polozky": [dict(zip(("nazev", "mnozstvi", "cena"), polozka)) for polozka in pole["polozky"]],
+            "data": json.dumps(zaznam["data"], ensure_ascii=False),
+        })
+    tabulka = pyarrow.Table.from_pylist(radky, schema=schema)
+    if cil.lower().endswith(".parquet"):
+        pyarrow.parquet.write_table(tabulka, cil, compression="zstd")
+    else:
+        pyarrow.feather.write_feather(tabulka, cil, compression="zstd")
+    return len(radky)
+
+def ulozit_vystup_json(nazev_obrazku, data):
+    """
+    Zapíše ověřená data účtenky do JSON souboru se stejným názvem jako obrázek (a do proudu výsledků).
+    
+    Returns:
+        tuple: (cesta k JSON souboru, zapsaný JSON text)
+    """
+    json_text = json.dumps(data, ensure_ascii=False, indent=2)
+    return zapsat_vystup(nazev_obrazku, json_text, data), json_text
+
+def najit_obrazky(adresar, pripony=PRIPONY_OBRAZKU):
+    """
+    Najde v adresáři všechny soubory s podporovanými příponami.
+    
+    Returns:
+        list: Seřazený seznam cest k obrázkům
+    """
+    obrazky = []
+    for soubor in sorted(os.listdir(adresar)):
+        if soubor.lower().endswith(pripony):
+            obrazky.append(os.path.join(adresar, soubor))
+    return obrazky
+
+def parsovat_shard(text):
+    """
+    Převede zápis shardu "i/N" na dvojici (i, N).
+    
+    Shardy se číslují od 0, tedy 0/4 až 3/4. Vyhodí argparse.ArgumentTypeError,
+    takže jde použít přímo jako type= argumentu.
+    """
+    try:
+        index, pocet = (int(cast) for cast in text.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"shard musí být ve tvaru i/N, např. 0/4 (zadáno '{text}')")
+    if pocet <= 0 or not 0 <= index < pocet:
+        raise argparse.ArgumentTypeError(f"shard {text}: musí platit 0 <= i < N")
+    return index, pocet
+
+def vybrat_shard(obrazky, shard):
+    """
+    Vybere obrázky, které patří do shardu (i, N).
+    
+    Rozhoduje hash názvu souboru, takže každý uzel spočítá stejné rozdělení
+    bez jakékoliv domluvy a nové soubory nemění přiřazení těch stávajících.
+    """
+    index, pocet = shard
+    return [cesta for cesta in obrazky
+            if int.from_bytes(hashlib.sha256(os.path.basename(cesta).encode("utf-8")).digest()[:8], "big")
+            % pocet == index]
+
+class ZapujckyObrazku:
+    """
+    Zápůjčky (lease) obrázků pomocí souborů ve sdíleném adresáři.
+    
+    Kdo chce obrázek zpracovat, vytvoří s O_CREAT | O_EXCL soubor
+    .zapujcky/<obrázek>.lease - to je atomické i na NFSv3+, takže ho
+    vytvoří jen jeden uzel. Držené zápůjčky vlákno na pozadí průběžně
+    obnovuje (mtime). Zápůjčku, která se déle než platnost sekund neobnovila
+    (uzel spadl), převezme jiný uzel: přejmenuje ji na jedinečné jméno, což
+    se podaří jen jednomu, a vytvoří si novou. Uzly proto musí mít
+    synchronizované hodiny a platnost musí být výrazně delší než jeden požadavek.
+    """
+    
+    def __init__(self, adresar, vlastnik=None, platnost=600):
+        """
+        Args:
+            adresar: Zpracovávaný adresář (zápůjčky leží v jeho podadresáři .zapujcky)
+            vlastnik: Označení uzlu do souborů zápůjček (default: hostname:pid)
+            platnost: Po kolika sekundách bez obnovení zápůjčka propadne
+        """
+        self.adresar = os.path.join(adresar, ZAPUJCKY_ADRESAR)
+        os.makedirs(self.adresar, exist_ok=True)
+        self.vlastnik = vlastnik or f"{socket.gethostname()}:{os.getpid()}"
+        self.platnost = platnost
+        # Token odliší naše zápůjčky i od zápůjček stejného vlastníka z dřívějšího běhu
+        self._token = os.urandom(8).hex()
+        self._drzene = set()
+        self._zamek = threading.Lock()
+        self._konec = threading.Event()
+        self._vlakno = None
+    
+    def _cesta(self, obrazek):
+        return os.path.join(self.adresar, os.path.basename(obrazek) + ".lease")
+    
+    @staticmethod
+    def _precist(soubor):
+        """Obsah souboru zápůjčky, nebo None, pokud neexistuje nebo je rozepsaný."""
+        try:
+            with open(soubor, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def _je_nase(self, soubor):
+        obsah = self._precist(soubor)
+        return obsah is not None and obsah.get("token") == self._token
+    
+    def zabrat(self, obrazek):
+        """
+        Pokusí se obrázek zabrat pro tento uzel.
+        
+        Returns:
+            bool: True, pokud zápůjčku teď drží tento uzel
+        """
+        soubor = self._cesta(obrazek)
+        for _ in range(2):
+            try:
+                fd = os.open(soubor, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if not self._prevzit_proslou(soubor):
+                    return False
+                continue
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"vlastnik": self.vlastnik, "token": self._token,
+                           "zabrano": datetime.now().isoformat(timespec="seconds")}, f)
+            with self._zamek:
+                self._drzene.add(soubor)
+                if self._vlakno is None:
+                    self._vlakno = threading.Thread(target=self._obnovovat, name="zapujcky", daemon=True)
+                    self._vlakno.start()
+            return True
+        return False
+    
+    def _prevzit_proslou(self, soubor):
+        """Odstraní propadlou zápůjčku jiného uzlu. Vrátí True, pokud je cesta volná pro nový pokus."""
+        try:
+            vek = time.time() - os.stat(soubor).st_mtime
+        except FileNotFoundError:
+            # Zápůjčku mezitím někdo uvolnil
+            return True
+        if vek < self.platnost:
+            return False
+        puvodni = self._precist(soubor)
+        odlozena = f"{soubor}.{self._token}.propadla"
+        try:
+            os.rename(soubor, odlozena)
+        except FileNotFoundError:
+            # Převzal ji jiný uzel
+            return False
+        if self._precist(odlozena) != puvodni:
+            # Mezi kontrolou a přejmenováním ji jiný uzel převzal a vytvořil novou - vrátíme mu ji
+            try:
+                os.link(odlozena, soubor)
+            except OSError:
+                pass
+            os.unlink(odlozena)
+            return False
+        os.unlink(odlozena)
+        vlastnik = (puvodni or {}).get("vlastnik", "?")
+        print(f"♻️  Přebírám propadlou zápůjčku '{os.path.basename(soubor)}' uzlu {vlastnik} "
+              f"(neobnovena {vek:.0f} s)")
+        return True
+    
+    def uvolnit(self, obrazek):
+        """Uvolní zápůjčku obrázku, pokud ji tento uzel drží."""
+        soubor = self._cesta(obrazek)
+        with self._zamek:
+            if soubor not in self._drzene:
+                return
+            self._drzene.discard(soubor)
+        if self._je_nase(soubor):
+            try:
+                os.unlink(soubor)
+            except FileNotFoundError:
+                pass
+    
+    def _obnovovat(self):
+        """Vlákno na pozadí - obnovuje držené zápůjčky, než propadnou."""
+        while not self._konec.wait(self.platnost / 3):
+            with self._zamek:
+                drzene = list(self._drzene)
+            for soubor in drzene:
+                if not self._je_nase(soubor):
+                    # Uzel se zastavil déle než platnost a zápůjčku mezitím převzal jiný
+                    print(f"⚠️  Zápůjčku '{os.path.basename(soubor)}' převzal jiný uzel.")
+                    with self._zamek:
+                        self._drzene.discard(soubor)
+                    continue
+                try:
+                    os.utime(soubor)
+                except OSError as e:
+                    print(f"⚠️  Zápůjčku '{os.path.basename(soubor)}' se nepodařilo obnovit: {e}")
+    
+    def zavrit(self):
+        """Ukončí obnovování a uvolní všechny držené zápůjčky."""
+        self._konec.set()
+        if self._vlakno is not None:
+            self._vlakno.join()
+        with self._zamek:
+            drzene = list(self._drzene)
+        for soubor in drzene:
+            self.uvolnit(os.path.basename(soubor)[:-len(".lease")])
+
+def vystup_je_novejsi(obrazek):
+    """Zjistí, zda má obrázek JSON výstup novější než on sám (zpracoval ho už někdo jiný)."""
+    try:
+        return os.stat(f"{os.path.splitext(obrazek)[0]}.json").st_mtime >= os.stat(obrazek).st_mtime
+    except OSError:
+        return False
+
+def zabrat_obrazky(zapujcky, obrazky):
+    """
+    Zabere zápůjčky obrázků a vrátí ty, které má zpracovat tento uzel.
+    
+    Obrázek se přeskočí, pokud ho drží jiný uzel, nebo pokud už má výstup
+    novější než obrázek - to znamená, že ho jiný uzel mezitím dokončil a
+    zápůjčku uvolnil.
+    """
+    zabrane = []
+    for obrazek in obrazky:
+        if not zapujcky.zabrat(obrazek):
+            continue
+        if vystup_je_novejsi(obrazek):
+            zapujcky.uvolnit(obrazek)
+            continue
+        zabrane.append(obrazek)
+    return zabrane
+
+def vybrat_pro_uzel(adresar, obrazky, shard=None, zapujcky=False, platnost_zapujcek=600):
+    """
+    Připraví rozdělení práce mezi uzly podle --shard a zápůjček.
+    
+    Returns:
+        tuple: (obrázky shardu: list, ZapujckyObrazku nebo None)
+    """
+    if shard is not None:
+        obrazky = vybrat_shard(obrazky, shard)
+        print(f"Shard {shard[0]}/{shard[1]}: tomuto uzlu připadá {len(obrazky)} obrázků.")
+    return obrazky, ZapujckyObrazku(adresar, platnost=platnost_zapujcek) if zapujcky else None
+
+class CacheExtrakci:
+    """
+    Obsahově adresovaná cache výsledků extrakce uložená v SQLite.
+    
+    Klíčem je hash dat obrázku, textu promptu a názvu modelu, takže změna
+    promptu nebo modelu staré záznamy automaticky zneplatní (už se na ně
+    nikdy netrefíme a časem vypadnou při čištění). Hodnotou je vyčištěný
+    JSON text a usage metadata z původního požadavku.
+    """
+    
+    def __init__(self, cesta=CACHE_SOUBOR, max_vek_dni=90, max_velikost_mb=500):
+        """
+        Args:
+            cesta: Cesta k SQLite souboru s cache
+            max_vek_dni: Záznamy starší než tento počet dní se smažou (None = bez limitu)
+            max_velikost_mb: Při překročení se mažou nejdéle nepoužité záznamy (None = bez limitu)
+        """
+        self.cesta = cesta
+        self.max_vek_dni = max_vek_dni
+        self.max_velikost_mb = max_velikost_mb
+        self.zasahy = 0
+        self.minuti = 0
+        # Cache sdílejí vlákna souběžného režimu, přístup proto serializujeme zámkem
+        self._zamek = threading.Lock()
+        self._db = sqlite3.connect(cesta, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS vysledky (
+                klic TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                json_text TEXT NOT NULL,
+                usage_json TEXT NOT NULL,
+                velikost INTEGER NOT NULL,
+                ulozeno REAL NOT NULL,
+                pouzito REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_vysledky_pouzito ON vysledky (pouzito)")
+        self._db.commit()
+        self.vycistit()
+    
+    @staticmethod
+    def vytvorit_klic(obrazek_data, prompt, model):
+        """Spočítá klíč cache z dat obrázku, promptu a modelu."""
+        h = hashlib.sha256()
+        for cast in (model.encode("utf-8"), prompt.encode("utf-8"), obrazek_data):
+            # Délku přidáváme kvůli jednoznačnosti spojení jednotlivých částí
+            h.update(len(cast).to_bytes(8, "big"))
+            h.update(cast)
+        return h.hexdigest()
+    
+    def nacist(self, klic):
+        """
+        Vrátí uložený výsledek pro klíč.
+        
+        Returns:
+            tuple: (json_text: str, usage: dict) nebo None, pokud záznam neexistuje
+        """
+        with self._zamek:
+            radek = self._db.execute(
+                "SELECT json_text, usage_json FROM vysledky WHERE klic = ?", (klic,)
+            ).fetchone()
+            if radek is None:
+                self.minuti += 1
+                return None
+            self._db.execute("UPDATE vysledky SET pouzito = ? WHERE klic = ?", (time.time(), klic))
+            self._db.commit()
+            self.zasahy += 1
+        return radek[0], json.loads(radek[1])
+    
+    def ulozit(self, klic, model, json_text, usage):
+        """Uloží vyčištěný JSON text a usage metadata pod daný klíč."""
+        ted = time.time()
+        with self._zamek:
+            self._db.execute(
+                "INSERT OR REPLACE INTO vysledky VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (klic, model, json_text, json.dumps(usage), len(json_text.encode("utf-8")), ted, ted),
+            )
+            self._db.commit()
+    
+    def vycistit(self):
+        """
+        Smaže záznamy starší než max_vek_dni a poté nejdéle nepoužité záznamy,
+        dokud celková velikost nepřesahuje max_velikost_mb.
+        
+        Returns:
+            int: Počet smazaných záznamů
+        """
+        smazano = 0
+        with self._zamek:
+            if self.max_vek_dni is not None:
+                hranice = time.time() - self.max_vek_dni * 86400
+                smazano += self._db.execute("DELETE FROM vysledky WHERE ulozeno < ?", (hranice,)).rowcount
+            
+            if self.max_velikost_mb is not None:
+                limit = self.max_velikost_mb * 1024 * 1024
+                celkem = self._db.execute("SELECT COALESCE(SUM(velikost), 0) FROM vysledky").fetchone()[0]
+                if celkem > limit:
+                    # Procházíme od nejdéle nepoužitých a mažeme, dokud se nevejdeme do limitu
+                    ke_smazani = []
+                    for klic, velikost in self._db.execute("SELECT klic, velikost FROM vysledky ORDER BY pouzito"):
+                        if celkem <= limit:
+                            break
+                        ke_smazani.append((klic,))
+                        celkem -= velikost
+                    self._db.executemany("DELETE FROM vysledky WHERE klic = ?", ke_smazani)
+                    smazano += len(ke_smazani)
+            self._db.commit()
+        return smazano
+    
+    def zavrit(self):
+        """Zavře spojení s databází."""
+        with self._zamek:
+            self._db.close()
+
+class ManifestZpracovani:
+    """
+    Manifest zpracování jednoho adresáře uložený v SQLite.
+    
+    Pro každý vstupní obrázek si pamatuje mtime, velikost, hash obsahu a stav
+    posledního zpracování. Díky tomu inkrementální běh přeskočí obrázky s
+    aktuálním výstupem, zopakuje jen ty se stavem CHYBA* a přerušený běh
+    pokračuje tam, kde skončil (stav se ukládá hned po každém souboru).
+    """
+    
+    NAZEV_SOUBORU = ".manifest_zpracovani.sqlite"
+    
+    def __init__(self, adresar):
+        self.adresar = adresar
+        self._zamek = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(adresar, soubor_uzlu(self.NAZEV_SOUBORU)), check_same_thread=False)
+        # WAL a NORMAL synchronizace - commit po každém souboru musí být levný
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS soubory (
+                soubor TEXT PRIMARY KEY,
+                mtime REAL NOT NULL,
+                velikost INTEGER NOT NULL,
+                hash TEXT NOT NULL,
+                status TEXT NOT NULL,
+                aktualizovano TEXT NOT NULL
+            )
+        """)
+        self._db.commit()
+        # Celý manifest držíme v paměti, aby kontrola 10k souborů nepotřebovala 10k dotazů
+        self._zaznamy = {
+            radek[0]: radek[1:]
+            for radek in self._db.execute("SELECT soubor, mtime, velikost, hash, status FROM soubory")
+        }
+        # (mtime, velikost, hash) obrázků, jejichž obsah už je ověřený - další kontrola je nehashuje znovu
+        self._overene = {}
+    
+    @staticmethod
+    def hash_souboru(cesta):
+        """Spočítá sha256 obsahu souboru."""
+        h = hashlib.sha256()
+        with open(cesta, "rb") as f:
+            for blok in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(blok)
+        return h.hexdigest()
+    
+    def je_aktualni(self, cesta, existujici_soubory=None):
+        """
+        Zjistí, zda má obrázek aktuální a úspěšně vytvořený výstup.
+        
+        Nic nezapisuje - sledovač ji volá při každé události v adresáři. Stav
+        se do manifestu zaznamená až po zpracování obrázku (zaznamenat).
+        
+        Args:
+            cesta: Cesta k obrázku
+            existujici_soubory: Volitelná množina názvů souborů v adresáři (ušetří stat výstupu)
+        
+        Returns:
+            bool: True, pokud obrázek není třeba znovu zpracovat
+        """
+        nazev = os.path.basename(cesta)
+        nazev_vystupu = f"{os.path.splitext(nazev)[0]}.json"
+        if existujici_soubory is not None:
+            vystup_existuje = nazev_vystupu in existujici_soubory
+        else:
+            vystup_existuje = os.path.exists(os.path.join(self.adresar, nazev_vystupu))
+        if not vystup_existuje and (_json_soubory or nazev not in self._zaznamy):
+            # Bez JSON souborů (výsledky jen v proudu) rozhoduje záznam manifestu
+            return False
+        
+        stat = os.stat(cesta)
+        zaznam = self._zaznamy.get(nazev)
+        if zaznam is None:
+            # Výstup vznikl dřív, než jsme manifest vedli - bereme ho, pokud je novější než obrázek
+            vystup_mtime = os.stat(os.path.join(self.adresar, nazev_vystupu)).st_mtime
+            return vystup_mtime >= stat.st_mtime
+        
+        mtime, velikost, hash_obsahu, status = zaznam
+        if status.startswith('CHYBA'):
+            return False
+        if stat.st_mtime == mtime and stat.st_size == velikost:
+            return True
+        
+        # mtime nebo velikost se změnily (např. kopie ze zálohy) - rozhodne až hash obsahu
+        with self._zamek:
+            overeno = self._overene.get(nazev)
+        if overeno == (stat.st_mtime, stat.st_size, hash_obsahu):
+            return True
+        if self.hash_souboru(cesta) == hash_obsahu:
+            with self._zamek:
+                self._overene[nazev] = (stat.st_mtime, stat.st_size, hash_obsahu)
+            return True
+        return False
+    
+    def vybrat_ke_zpracovani(self, obrazky):
+        """
+        Z daného seznamu vybere obrázky, které je potřeba (znovu) zpracovat.
+        
+        Returns:
+            list: Obrázky bez aktuálního výstupu, nové, změněné nebo se stavem CHYBA*
+        """
+        existujici_soubory = set(os.listdir(self.adresar))
+        return [cesta for cesta in obrazky if not self.je_aktualni(cesta, existujici_soubory)]
+    
+    def zaznamenat(self, cesta, status):
+        """Zaznamená aktuální mtime, velikost, hash a stav zpracování obrázku."""
+        nazev = os.path.basename(cesta)
+        try:
+            stat = os.stat(cesta)
+            hash_obsahu = self.hash_souboru(cesta)
+        except OSError:
+            # Obrázek mezitím zmizel - nemáme co zaznamenat
+            return
+        aktualizovano = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with self._zamek:
+            self._db.execute(
+                "INSERT OR REPLACE INTO soubory VALUES (?, ?, ?, ?, ?, ?)",
+                (nazev, stat.st_mtime, stat.st_size, hash_obsahu, status, aktualizovano),
+            )
+            self._db.commit()
+            self._zaznamy[nazev] = (stat.st_mtime, stat.st_size, hash_obsahu, status)
+    
+    def zavrit(self):
+        """Zavře spojení s databází."""
+        with self._zamek:
+            self._db.close()
+
+def otevrit_manifest(adresar, obrazky):
+    """
+    Otevře manifest adresáře a vybere obrázky, které je potřeba zpracovat.
+    
+    Returns:
+        tuple: (manifest: ManifestZpracovani, obrázky ke zpracování: list)
+    """
+    manifest = ManifestZpracovani(adresar)
+    ke_zpracovani = manifest.vybrat_ke_zpracovani(obrazky)
+    print(f"Inkrementální režim: {len(obrazky) - len(ke_zpracovani)} obrázků je aktuálních, "
+          f"ke zpracování zbývá {len(ke_zpracovani)}.")
+    return manifest, ke_zpracovani
+
+def usage_do_slovniku(usage_metadata):
+    """Převede usage_metadata z odpovědi na obyčejný slovník vhodný pro uložení."""
+    return {
+        "prompt_token_count": getattr(usage_metadata, "prompt_token_count", None),
+        "candidates_token_count": getattr(usage_metadata, "candidates_token_count", None),
+        "total_token_count": getattr(usage_metadata, "total_token_count", None),
+    }
+
+def pouzit_vysledek_z_cache(cache, nazev_obrazku, obrazek_data, prompt, model, manifest=None):
+    """
+    Pokusí se vzít výsledek pro obrázek z cache.
+    
+    Při zásahu zapíše JSON vedle obrázku a do reportu přidá řádek se statusem
+    CACHE a nulovými tokeny i náklady.
+    
+    Returns:
+        str: JSON text výsledku, pokud byl nalezen v cache a uložen, jinak None
+    """
+    klic = CacheExtrakci.vytvorit_klic(obrazek_data, prompt, model)
+    zaznam = cache.nacist(klic)
+    if zaznam is None:
+        return None
+    
+    json_text, _ = zaznam
+    nazev_vystupu = zapsat_vystup(nazev_obrazku, json_text)
+    
+    try:
+        prodejce = najit_prodejce(json.loads(json_text))
+    except json.JSONDecodeError:
+        prodejce = None
+    
+    adresar = os.path.dirname(nazev_obrazku) or "."
+    cas = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    data_reportu = [[cas, os.path.basename(nazev_obrazku), 0, 0.0, 'CACHE', f'Výsledek z cache ({klic[:12]})',
+                     prodejce]]
+    ulozit_report_spotreby(adresar, data_reportu, manifest=manifest)
+    
+    print(f"♻️  Z cache: {os.path.basename(nazev_vystupu)}")
+    return json_text
+
+def extrahovat_data_z_uctenky(nazev_obrazku, cache=None, predzpracovani=None, strukturovany_vystup=False,
+                              prometheus_soubor=None, duplicity=None, kaskada=None):
+    """
+    Načte obrázek účtenky, pošle ho Google AI a uloží výsledek do JSON souboru se stejným názvem.
+    
+    Args:
+        nazev_obrazku: Cesta k obrázku
+        cache: Volitelná CacheExtrakci - při zásahu se API vůbec nevolá
+        predzpracovani: Volitelné Predzpracovani - obrázek se před odesláním zmenší a překóduje
+        strukturovany_vystup: Vynutit JSON odpověď podle SCHEMA_UCTENKY
+        prometheus_soubor: Volitelná cesta k Prometheus textfile s metrikami
+        duplicity: Volitelný IndexDuplicit - kopie už zpracovaného obrázku převezme jeho výsledek
+        kaskada: Volitelná KaskadaModelu - účtenku, která neprojde kontrolou, zpracuje dražší model
+    """
+    print("Načítám API klíč...")
+    api_key = nacti_api_klic()
+    if not api_key:
+        return
+    
+    # Vytvoříme název výstupního JSON souboru ze stejného adresáře a názvu jako obrázek
+    zakladni_nazev = os.path.splitext(nazev_obrazku)[0]  # Odstraní příponu (.png, .jpg, atd.)
+    nazev_vystupu = f"{zakladni_nazev}.json"
+    adresar = os.path.dirname(nazev_obrazku) or "."
+    
+    metriky = otevrit_metriky(adresar, prometheus_soubor, rezim="1")
+    mereni = metriky.polozka("obrazek", os.path.basename(nazev_obrazku))
+
+    try:
+        print(f"Načítám obrázek '{nazev_obrazku}'...")
+        with mereni.etapa("cteni"):
+            with open(nazev_obrazku, "rb") as f:
+                obrazek_data = f.read()
+    except FileNotFoundError:
+        print(f"Chyba: Obrázek '{nazev_obrazku}' nebyl nalezen v tomto adresáři.")
+        return
+
+    if kaskada is None:
+        kaskada = KaskadaModelu([MODEL_DEFAULT])
+    model = kaskada.nazev
+    
+    prompt_klice = prompt_pro_klic(PROMPT_EXTRAKCE, predzpracovani, SCHEMA_UCTENKY if strukturovany_vystup else None)
+    klic_cache = CacheExtrakci.vytvorit_klic(obrazek_data, prompt_klice, model)
+    if cache is not None:
+        with mereni.etapa("cache"):
+            z_cache = pouzit_vysledek_z_cache(cache, nazev_obrazku, obrazek_data, prompt_klice, model)
+        if z_cache:
+            metriky.dokoncit(mereni, 'CACHE', uspesnych=1)
+            metriky.zavrit()
+            print(f"Hotovo! Výsledek byl nalezen v cache a uložen do souboru '{nazev_vystupu}'.")
+            return
+    if duplicity is not None:
+        with mereni.etapa("duplicity"):
+            duplikat = pouzit_duplikat(duplicity, nazev_obrazku, obrazek_data)
+        if duplikat:
+            metriky.dokoncit(mereni, 'DUPLIKAT', uspesnych=1)
+            metriky.zavrit()
+            print(f"Hotovo! Výsledek stejné účtenky byl uložen do souboru '{nazev_vystupu}'.")
+            return
+
+    print("Inicializuji Google AI klienta...")
+    vykonavac = VykonavacPozadavku(genai.Client(api_key=api_key))
+    
+    with mereni.etapa("priprava"):
+        stranky = pripravit_dokument(nazev_obrazku, obrazek_data, predzpracovani)
+    poznamka = stranky[0][3] if len(stranky) == 1 else f"PDF {len(stranky)} stran zpracováno po stránkách"
+    if poznamka:
+        print(f"Obrázek {poznamka}")
+    
+    print("Odesílám požadavek a čekám na odpověď...")
+    
+    # <<< ZMĚNA: Používáme `generate_content` pro získání celé odpovědi najednou
+    tokeny, naklady_usd = 0, 0.0
+    pokusy = []
+    strany = []
+    try:
+        # <<< ZMĚNA: Místo base64 kódu se nyní načítají data obrázku ze souboru
+        # Odpověď se naparsuje a ověří ještě v kaskádě - na disk jde jen platný JSON
+        data, response, problemy = extrahovat_dokument(
+            kaskada, vykonavac, stranky, pokusy, strany, mereni,
+            schema=SCHEMA_UCTENKY if strukturovany_vystup else None, metriky=metriky)
+        model_vysledku, tokeny_vysledku, naklady_vysledku, _ = pokusy[-1]
+        
+        # Získáme počet tokenů a vypočítáme náklady
+        tokeny = sum(pokus[1] for pokus in pokusy)
+        naklady_usd = sum(pokus[2] for pokus in pokusy)
+        
+        vstup, _, vystup = tokeny_odpovedi(response.usage_metadata)
+        print(f"Spotřebováno tokenů: {tokeny} (vstup {vstup}, výstup {vystup} u modelu {model_vysledku})")
+        if strany:
+            print("Po stránkách: " + ", ".join(f"{cislo}. {tokeny_strany}"
+                                               for cislo, (_, tokeny_strany, _) in enumerate(strany, 1)))
+        print(f"Náklady: ${naklady_usd:.6f} USD")
+        if problemy:
+            print(f"⚠️  Nesrovnalosti ve výsledku: {'; '.join(problemy)}")
+        
+        # <<< ZMĚNA: Ukládáme výstup do souboru
+        with mereni.etapa("zapis"):
+            nazev_vystupu, json_text = ulozit_vystup_json(nazev_obrazku, data)
+            
+            if cache is not None:
+                cache.ulozit(klic_cache, model_vysledku, json_text, usage_do_slovniku(response.usage_metadata))
+            
+            # Uložíme report o spotřebě
+            cas = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            if problemy:
+                poznamka = (f'{poznamka}; ' if poznamka else '') + f'nesrovnalosti: {"; ".join(problemy)}'
+            # U dokumentu po stránkách nesou spotřebu řádky STRANKA, výsledný řádek už jen stav
+            prodejce = najit_prodejce(data)
+            data_reportu = radky_eskalace(cas, os.path.basename(nazev_obrazku), pokusy) \
+                + radky_stranek(cas, os.path.basename(nazev_obrazku), strany, prodejce) + [
+                [cas, os.path.basename(nazev_obrazku), 0 if strany else tokeny_vysledku,
+                 0.0 if strany else naklady_vysledku, 'USPECH', poznamka, prodejce, model_vysledku]]
+            ulozit_report_spotreby(adresar, data_reportu)
+            if duplicity is not None:
+                duplicity.potvrdit(nazev_obrazku)
+        metriky.dokoncit(mereni, 'USPECH', uspesnych=1, tokeny=tokeny, naklady=naklady_usd)
+        
+        print(f"Hotovo! Data byla úspěšně extrahována a uložena do souboru '{nazev_vystupu}'.")
+        print(f"Report o spotřebě uložen do '{os.path.join(adresar, soubor_uzlu(KNIHA_SPOTREBY_SOUBOR))}'")
+        etapy = ", ".join(f"{etapa} {trvani:.2f} s" for etapa, trvani in mereni.etapy.items())
+        print(f"Časy etap: {etapy}")
+
+    except (json.JSONDecodeError, ValueError) as e:
+        # Tokeny už byly spotřebované, proto je zapíšeme i k chybě
+        cas = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        tokeny = sum(pokus[1] for pokus in pokusy)
+        naklady_usd = sum(pokus[2] for pokus in pokusy)
+        data_reportu = radky_eskalace(cas, os.path.basename(nazev_obrazku), pokusy)
+        if pokusy:
+            data_reportu.append([cas, os.path.basename(nazev_obrazku), pokusy[-1][1], pokusy[-1][2], 'CHYBA_JSON',
+                                 str(e), None, pokusy[-1][0]])
+        else:
+            data_reportu.append([cas, os.path.basename(nazev_obrazku), 0, 0.0, 'CHYBA_JSON', str(e)])
+        ulozit_report_spotreby(adresar, data_reportu)
+        metriky.dokoncit(mereni, 'CHYBA_JSON', tokeny=tokeny, naklady=naklady_usd)
+        print(f"Odpověď neobsahuje platný JSON, výstup nebyl uložen: {e}")
+        if isinstance(e, json.JSONDecodeError):
+            print("Surová odpověď:")
+            print(e.doc)
+
+    except Exception as e:
+        # V případě chyby také uložíme do reportu - i s pokusy nižších modelů kaskády, které už se zaplatily
+        cas = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        data_reportu = radky_eskalace(cas, os.path.basename(nazev_obrazku), pokusy + [None]) + [
+            [cas, os.path.basename(nazev_obrazku), 0, 0.0, 'CHYBA', str(e)]]
+        ulozit_report_spotreby(adresar, data_reportu)
+        metriky.dokoncit(mereni, 'CHYBA', tokeny=sum(pokus[1] for pokus in pokusy),
+                         naklady=sum(pokus[2] for pokus in pokusy))
+        print(f"Nastala chyba při komunikaci s Google AI: {e}")
+    
+    finally:
+        metriky.zavrit()
+
+def zjistit_rozmery_obrazku(cesta):
+    """
+    Zjistí rozměry obrázku jen z hlavičky souboru (bez dekódování).
+    
+    PNG a JPEG čte přímo, ostatní formáty (WebP, HEIC s pillow-heif) přes
+    Pillow, který při otevření také čte jen hlavičku.
+    
+    Returns:
+        tuple: (šířka, výška) nebo None, pokud formát nerozpoznáme
+    """
+    try:
+        with open(cesta, "rb") as f:
+            hlavicka = f.read(26)
+            if hlavicka[:8] == b"\x89PNG\r\n\x1a\n":
+                return int.from_bytes(hlavicka[16:20], "big"), int.from_bytes(hlavicka[20:24], "big")
+            if hlavicka[:2] != b"\xff\xd8":
+                if Image is None or hlavicka.startswith(b"%PDF-"):
+                    return None
+                try:
+                    with Image.open(cesta) as obrazek:
+                        return obrazek.size
+                except Exception:
+                    return None
+            
+            # JPEG - projdeme segmenty až k SOFn, který nese rozměry
+            f.seek(2)
+            while True:
+                znacka = f.read(2)
+                if len(znacka) < 2 or znacka[0] != 0xFF:
+                    return None
+                typ = znacka[1]
+                if typ in (0xD8, 0x01) or 0xD0 <= typ <= 0xD7:
+                    continue  # značky bez délky
+                delka = int.from_bytes(f.read(2), "big")
+                if 0xC0 <= typ <= 0xCF and typ not in (0xC4, 0xC8, 0xCC):
+                    segment = f.read(5)
+                    return int.from_bytes(segment[3:5], "big"), int.from_bytes(segment[1:3], "big")
+                f.seek(delka - 2, os.SEEK_CUR)
+    except OSError:
+        return None
+
+def odhadnout_tokeny_souboru(cesta, data=None):
+    """Odhad vstupních tokenů souboru - obrázku podle rozměrů, PDF podle počtu stránek."""
+    if urcit_mime_typ(cesta, data) == "application/pdf":
+        if data is None:
+            try:
+                with open(cesta, "rb") as f:
+                    data = f.read()
+            except OSError:
+                return TOKENY_STRANKY_PDF
+        return pocet_stran_pdf(data) * TOKENY_STRANKY_PDF
+    return odhadnout_tokeny_obrazku(zjistit_rozmery_obrazku(cesta))
+
+def odhadnout_tokeny_obrazku(rozmery):
+    """
+    Odhadne počet vstupních tokenů, které Gemini účtuje za obrázek.
+    
+    Obrázek s oběma rozměry do 384 px stojí 258 tokenů, větší obrázky se
+    dělí na dlaždice 768x768 px a každá dlaždice stojí 258 tokenů.
+    
+    Args:
+        rozmery: (šířka, výška) nebo None, pokud rozměry neznáme
+    """
+    if rozmery is None:
+        return 4 * 258  # typická fotka účtenky na výšku
+    sirka, vyska = rozmery
+    if sirka <= 384 and vyska <= 384:
+        return 258
+    return -(-sirka // 768) * -(-vyska // 768) * 258
+
+def zabalit_do_davek(obrazky, max_obrazku=5, max_bajtu=14 * 1024 * 1024, max_tokenu=30_000):
+    """
+    Rozdělí obrázky do dávek podle rozpočtu bajtů a odhadu tokenů.
+    
+    Dávka se uzavře, jakmile by další obrázek překročil kterýkoli z limitů.
+    Obrázek, který se sám do limitu nevejde, jde v samostatné dávce.
+    
+    Args:
+        obrazky: Seznam cest k obrázkům
+        max_obrazku: Maximální počet obrázků v dávce
+        max_bajtu: Rozpočet velikosti dat obrázků v jednom požadavku
+                   (inline požadavek má limit 20 MB, base64 data zvětší o třetinu)
+        max_tokenu: Rozpočet odhadovaných vstupních tokenů obrázků v jednom požadavku
+    
+    Returns:
+        list: Seznam dávek (seznamů cest)
+    """
+    davky = []
+    davka, bajtu, tokenu = [], 0, 0
+    for cesta in obrazky:
+        try:
+            velikost = os.path.getsize(cesta)
+        except OSError:
+            velikost = 0  # chybu nahlásí až načtení v dávce
+        odhad = odhadnout_tokeny_souboru(cesta)
+        
+        if davka and (len(davka) >= max_obrazku or bajtu + velikost > max_bajtu or tokenu + odhad > max_tokenu):
+            davky.append(davka)
+            davka, bajtu, tokenu = [], 0, 0
+        davka.append(cesta)
+        bajtu += velikost
+        tokenu += odhad
+    if davka:
+        davky.append(davka)
+    return davky
+
+def najit_oblast_uctenky(sedy):
+    """
+    Najde obdélník, ve kterém leží účtenka.
+    
+    Účtenka je světlý papír na tmavším pozadí - hledáme obdélník kolem světlých
+    pixelů. Práh se hledá na zmenšené kopii, ať je to rychlé i u 12 Mpx fotek.
+    
+    Args:
+        sedy: Obrázek v odstínech šedi (PIL.Image)
+    
+    Returns:
+        tuple: (levý, horní, pravý, dolní) nebo None, pokud se účtenku nepodařilo spolehlivě najít
+    """
+    nahled = sedy.copy()
+    nahled.thumbnail((256, 256))
+    maska = ImageOps.autocontrast(nahled).point(lambda hodnota: 255 if hodnota > 170 else 0)
+    ramecek = maska.getbbox()
+    if not ramecek:
+        return None
+    meritko_x = sedy.width / nahled.width
+    meritko_y = sedy.height / nahled.height
+    levy, horni, pravy, dolni = ramecek
+    okraj = 2  # pixely náhledu, ať neuřízneme okraj textu
+    ramecek = (
+        max(0, int((levy - okraj) * meritko_x)),
+        max(0, int((horni - okraj) * meritko_y)),
+        min(sedy.width, int((pravy + okraj) * meritko_x)),
+        min(sedy.height, int((dolni + okraj) * meritko_y)),
+    )
+    # Příliš malý výřez je spíš odlesk než účtenka - pak raději neořezáváme
+    plocha = (ramecek[2] - ramecek[0]) * (ramecek[3] - ramecek[1])
+    if plocha < 0.2 * sedy.width * sedy.height:
+        return None
+    return ramecek
+
+def _oblast_pro_hash(obrazek):
+    """Otočí obrázek podle EXIF, převede na odstíny šedi a ořízne na účtenku."""
+    sedy = ImageOps.grayscale(ImageOps.exif_transpose(obrazek))
+    ramecek = najit_oblast_uctenky(sedy)
+    if ramecek:
+        sedy = sedy.crop(ramecek)
+    return sedy
+
+def _dhash(sedy, velikost):
+    pixely = sedy.resize((velikost + 1, velikost), Image.LANCZOS).tobytes()
+    hash_obrazku = 0
+    for radek in range(velikost):
+        zacatek = radek * (velikost + 1)
+        for sloupec in range(velikost):
+            hash_obrazku = (hash_obrazku << 1) | (pixely[zacatek + sloupec] > pixely[zacatek + sloupec + 1])
+    return hash_obrazku
+
+def spocitat_dhash(obrazek_data, velikost=8):
+    """
+    Spočítá rozdílový perceptuální hash (dHash) účtenky.
+    
+    Obrázek se otočí podle EXIF, ořízne na účtenku, převede na odstíny šedi
+    a zmenší na (velikost + 1) x velikost pixelů; každý bit říká, zda je pixel
+    světlejší než jeho pravý soused. Kopie téhož snímku se proto liší jen
+    v několika bitech, i když mají jiné rozlišení, kompresi nebo okraje.
+    Pozor - stejně se liší i dvě různé účtenky stejného obchodu, hash proto
+    slouží jen k výběru kandidátů (viz otisk_obrazku).
+    
+    Args:
+        obrazek_data: Data obrázku
+        velikost: Strana mřížky - hash má velikost * velikost bitů
+    
+    Returns:
+        int: Hash obrázku
+    """
+    return _dhash(_oblast_pro_hash(Image.open(io.BytesIO(obrazek_data))), velikost)
+
+def snimek_z_exif(obrazek):
+    """
+    Identifikace snímku z EXIF - fotoaparát a čas pořízení (s desetinami sekundy, pokud jsou).
+    
+    Returns:
+        str: např. "Pixel 7|2025:06:01 10:00:00.123", nebo None, pokud obrázek čas pořízení nemá
+    """
+    exif = obrazek.getexif()
+    detaily = exif.get_ifd(0x8769)  # Exif IFD
+    cas = detaily.get(36867) or exif.get(306)  # DateTimeOriginal, jinak DateTime
+    if not cas:
+        return None
+    zlomky = detaily.get(37521)  # SubSecTimeOriginal
+    return f"{exif.get(272) or ''}|{cas}" + (f".{zlomky}" if zlomky else "")
+
+def otisk_obrazku(obrazek_data):
+    """
+    Spočítá všechno, podle čeho IndexDuplicit pozná opakovaný obrázek.
+    
+    Returns:
+        tuple: (dHash 64 bitů pro hledání kandidátů, dHash DUPLICITY_JEMNA_MRIZKA^2 bitů,
+                SHA-256 dat, snímek z EXIF nebo None)
+    """
+    obrazek = Image.open(io.BytesIO(obrazek_data))
+    snimek = snimek_z_exif(obrazek)
+    sedy = _oblast_pro_hash(obrazek)
+    return _dhash(sedy, 8), _dhash(sedy, DUPLICITY_JEMNA_MRIZKA), hashlib.sha256(obrazek_data).hexdigest(), snimek
+
+class IndexHashu:
+    """
+    Vyhledávání hashů do dané Hammingovy vzdálenosti (multi-index hashing).
+    
+    Hash se rozdělí na `casti` úseků a každý úsek se indexuje ve vlastní
+    tabulce. Pokud se dva hashe liší nejvýše v r bitech, musí se podle
+    Dirichletova principu aspoň jeden úsek lišit nejvýše v r // casti bitech.
+    Stačí proto v každé tabulce projít několik desítek sousedních hodnot
+    úseku a vzdálenost ověřit jen u takto nalezených kandidátů - hledání
+    nezávisí na počtu hashů jako lineární průchod.
+    """
+    
+    def __init__(self, bitu=64, casti=4):
+        self.bitu_casti = bitu // casti
+        self.casti = casti
+        self._tabulky = [{} for _ in range(casti)]
+        self._hodnoty = {}
+        self._masky = {}
+    
+    @property
+    def pocet(self):
+        return len(self._hodnoty)
+    
+    def _useky(self, hash_obrazku):
+        maska = (1 << self.bitu_casti) - 1
+        return [(hash_obrazku >> (i * self.bitu_casti)) & maska for i in range(self.casti)]
+    
+    def _masky_do(self, max_bitu):
+        """Všechny masky úseku s nejvýše max_bitu nastavenými bity (počítá se jednou)."""
+        if max_bitu not in self._masky:
+            self._masky[max_bitu] = [
+                sum(1 << bit for bit in bity)
+                for pocet_bitu in range(min(max_bitu, self.bitu_casti) + 1)
+                for bity in combinations(range(self.bitu_casti), pocet_bitu)
+            ]
+        return self._masky[max_bitu]
+    
+    def pridat(self, hash_obrazku, hodnota):
+        """Přidá hash s hodnotou. Stejný hash podruhé nepřidá (zůstane první hodnota)."""
+        if hash_obrazku in self._hodnoty:
+            return
+        self._hodnoty[hash_obrazku] = hodnota
+        for tabulka, usek in zip(self._tabulky, self._useky(hash_obrazku)):
+            tabulka.setdefault(usek, []).append(hash_obrazku)
+    
+    def najit(self, hash_obrazku, max_vzdalenost):
+        """
+        Najde všechny hashe do dané vzdálenosti.
+        
+        Returns:
+            list: (vzdálenost, hodnota) seřazené od nejbližšího
+        """
+        masky = self._masky_do(max_vzdalenost // self.casti)
+        kandidati = set()
+        for tabulka, usek in zip(self._tabulky, self._useky(hash_obrazku)):
+            for maska in masky:
+                kandidati.update(tabulka.get(usek ^ maska, ()))
+        nalezene = []
+        for kandidat in kandidati:
+            vzdalenost = (hash_obrazku ^ kandidat).bit_count()
+            if vzdalenost <= max_vzdalenost:
+                nalezene.append((vzdalenost, self._hodnoty[kandidat]))
+        return sorted(nalezene, key=lambda polozka: polozka[0])
+
+class IndexDuplicit:
+    """
+    Index už zpracovaných obrázků pro rozpoznání jejich kopií.
+    
+    Rozpozná jen kopie téhož souboru nebo snímku: stejná data (SHA-256), nebo
+    stejný snímek podle EXIF (fotoaparát a čas pořízení) - tedy zmenšenou,
+    překomprimovanou nebo přeuloženou kopii téže fotky - s blízkým jemným
+    hashem. Další, samostatně pořízenou fotku téže účtenky nepozná a ta se
+    zpracuje znovu; převzít výsledek jiné účtenky by bylo horší.
+    
+    Podobný perceptuální hash je jen kandidát - různé účtenky stejného
+    obchodu se stejnou hlavičkou a rozvržením mají hash klidně totožný.
+    Kopie proto musí navíc ležet ve stejném adresáři jako originál.
+    
+    Hashe leží v SQLite (stejně jako cache výsledků v aktuálním adresáři), při
+    otevření se načtou do IndexHashu v paměti. Otisk nového obrázku se spočítá
+    v najit() a do indexu se přidá až potvrdit(), tedy po úspěšné extrakci.
+    Sdílí se mezi vlákny.
+    """
+    
+    # Kolik otisků rozpracovaných obrázků si pamatujeme - otisk obrázku, který
+    # se nepotvrdí (chyba, rozpočet...), časem vypadne a nic nedrží
+    MAX_CEKAJICICH = 256
+    
+    def __init__(self, cesta=DUPLICITY_SOUBOR, max_vzdalenost=4):
+        """
+        Args:
+            cesta: Cesta k SQLite souboru s indexem
+            max_vzdalenost: Nejvyšší Hammingova vzdálenost (z 64 bitů), při které je obrázek kandidátem na duplikát
+        """
+        if Image is None:
+            raise RuntimeError("Hledání duplicit vyžaduje knihovnu Pillow (pip install pillow).")
+        self.cesta = cesta
+        self.max_vzdalenost = max_vzdalenost
+        self.duplikatu = 0
+        self._zamek = threading.Lock()
+        self._db = sqlite3.connect(cesta, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS obrazky (
+                obrazek TEXT PRIMARY KEY,
+                hash TEXT NOT NULL,
+                vystup TEXT NOT NULL,
+                zaznamenano TEXT NOT NULL,
+                jemny_hash TEXT,
+                sha256 TEXT,
+                snimek TEXT
+            )
+        """)
+        # Index z doby, kdy stačila shoda hashe - staré záznamy bez otisku se za originál nikdy neuznají
+        sloupce = {radek[1] for radek in self._db.execute("PRAGMA table_info(obrazky)")}
+        for sloupec in ("jemny_hash", "sha256", "snimek"):
+            if sloupec not in sloupce:
+                self._db.execute(f"ALTER TABLE obrazky ADD COLUMN {sloupec} TEXT")
+        self._db.commit()
+        self._index = IndexHashu()
+        # Aktuální otisk každého obrázku - index neumí mazat, přepsané hashe při hledání přeskočíme
+        self._otisky = {}
+        # Otisky obrázků, které se právě zpracovávají a ještě nejsou potvrzené
+        self._cekajici = OrderedDict()
+        for obrazek, hash_hex, vystup, jemny_hex, sha256, snimek in self._db.execute(
+                "SELECT obrazek, hash, vystup, jemny_hash, sha256, snimek FROM obrazky"):
+            otisk = (int(hash_hex, 16), int(jemny_hex, 16) if jemny_hex else None, sha256, snimek)
+            self._vlozit(obrazek, otisk, vystup)
+    
+    def _vlozit(self, obrazek, otisk, vystup):
+        self._otisky[obrazek] = otisk
+        self._index.pridat(otisk[0], (obrazek, vystup, otisk[0]))
+    
+    @staticmethod
+    def _potvrzuje(otisk, otisk_originalu):
+        """Zda otisky patří ke stejnému obrázku - stejná data, nebo stejný snímek s blízkým jemným hashem."""
+        _, jemny, sha256, snimek = otisk
+        _, jemny_originalu, sha256_originalu, snimek_originalu = otisk_originalu
+        if sha256_originalu is not None and sha256 == sha256_originalu:
+            return True
+        return (snimek is not None and snimek == snimek_originalu and jemny_originalu is not None
+                and (jemny ^ jemny_originalu).bit_count() <= DUPLICITY_MAX_JEMNA_VZDALENOST)
+    
+    def najit(self, nazev_obrazku, obrazek_data):
+        """
+        Najde už zpracovaný obrázek ve stejném adresáři, který je kopií tohoto.
+        
+        Returns:
+            tuple: (vzdálenost, cesta k originálu, cesta k jeho JSON výstupu), nebo None
+        """
+        obrazek = os.path.abspath(nazev_obrazku)
+        otisk = otisk_obrazku(obrazek_data)
+        with self._zamek:
+            kandidati = self._index.najit(otisk[0], self.max_vzdalenost)
+            for vzdalenost, (original, vystup, hash_originalu) in kandidati:
+                # Znovu zpracovávaný soubor není duplikátem sám sebe; originál bez výstupu nepomůže
+                otisk_originalu = self._otisky.get(original)
+                if original == obrazek or otisk_originalu is None or otisk_originalu[0] != hash_originalu:
+                    continue
+                if os.path.dirname(original) != os.path.dirname(obrazek):
+                    continue
+                if not self._potvrzuje(otisk, otisk_originalu) or not os.path.exists(vystup):
+                    continue
+                self._cekajici.pop(obrazek, None)
+                self.duplikatu += 1
+                return vzdalenost, original, vystup
+            self._cekajici[obrazek] = otisk
+            self._cekajici.move_to_end(obrazek)
+            while len(self._cekajici) > self.MAX_CEKAJICICH:
+                self._cekajici.popitem(last=False)
+        return None
+    
+    def zapomenout(self, nazev_obrazku):
+        """Zahodí otisk obrázku, který se nezpracoval (do indexu se nepřidá)."""
+        with self._zamek:
+            self._cekajici.pop(os.path.abspath(nazev_obrazku), None)
+    
+    def potvrdit(self, nazev_obrazku):
+        """Přidá úspěšně zpracovaný obrázek do indexu (otisk z najit(), jinak se spočítá znovu)."""
+        obrazek = os.path.abspath(nazev_obrazku)
+        with self._zamek:
+            otisk = self._cekajici.pop(obrazek, None)
+        if otisk is None:
+            try:
+                with open(obrazek, "rb") as f:
+                    otisk = otisk_obrazku(f.read())
+            except Exception as e:
+                print(f"⚠️  Hash '{os.path.basename(obrazek)}' se nepodařilo spočítat: {e}")
+                return
+        hash_obrazku, jemny, sha256, snimek = otisk
+        vystup = f"{os.path.splitext(obrazek)[0]}.json"
+        with self._zamek:
+            self._db.execute("INSERT OR REPLACE INTO obrazky VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (obrazek, f"{hash_obrazku:x}", vystup, datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                              f"{jemny:x}", sha256, snimek))
+            self._db.commit()
+            self._vlozit(obrazek, otisk, vystup)
+    
+    def potvrdit_hotove(self, obrazky):
+        """Potvrdí obrázky, které mají po zpracování výstup novější než obrázek (dávkové režimy), ostatní zapomene."""
+        for obrazek in obrazky:
+            if vystup_je_novejsi(obrazek):
+                self.potvrdit(obrazek)
+            else:
+                self.zapomenout(obrazek)
+    
+    def zavrit(self):
+        """Zavře spojení s databází."""
+        with self._zamek:
+            self._db.close()
+
+def pouzit_duplikat(duplicity, nazev_obrazku, obrazek_data, manifest=None):
+    """
+    Pokud je obrázek kopií už zpracovaného souboru nebo snímku (viz IndexDuplicit), převezme jeho výsledek.
+    
+    Zkopíruje JSON originálu vedle obrázku a do reportu přidá řádek se statusem
+    DUPLIKAT, nulovými tokeny i náklady a cestou k originálu v poznámce.
+    
+    Returns:
+        str: JSON text převzatého výsledku, pokud byl obrázek vyřízen jako duplikát, jinak None
+    """
+    if mime_typ_z_obsahu(obrazek_data) == "application/pdf":
+        # Perceptuální hash má smysl jen u fotek
+        return None
+    try:
+        shoda = duplicity.najit(nazev_obrazku, obrazek_data)
+    except Exception as e:
+        # Obrázek, který Pillow nepřečte, pošleme normálně - Gemini si s ním možná poradí
+        print(f"⚠️  Hash '{os.path.basename(nazev_obrazku)}' se nepodařilo spočítat ({e}), duplicity nekontroluji")
+        return None
+    if shoda is None:
+        return None
+    
+    vzdalenost, original, vystup_originalu = shoda
+    try:
+        with open(vystup_originalu, encoding="utf-8") as f:
+            json_text = f.read()
+        zapsat_vystup(nazev_obrazku, json_text)
+    except OSError as e:
+        print(f"⚠️  Výsledek originálu '{original}' se nepodařilo převzít ({e}), zpracuji obrázek znovu")
+        return None
+    
+    try:
+        prodejce = najit_prodejce(json.loads(json_text))
+    except json.JSONDecodeError:
+        prodejce = None
+    adresar = os.path.dirname(nazev_obrazku) or "."
+    cas = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    data_reportu = [[cas, os.path.basename(nazev_obrazku), 0, 0.0, 'DUPLIKAT',
+                     f'Duplikát {original} (Hammingova vzdálenost {vzdalenost})', prodejce]]
+    ulozit_report_spotreby(adresar, data_reportu, manifest=manifest)
+    
+    print(f"👯 Duplikát: {os.path.basename(nazev_obrazku)} je kopií obrázku "
+          f"{os.path.basename(original)} (vzdálenost {vzdalenost})")
+    return json_text
+
+def predzpracovat_obrazek(obrazek_data, max_delsi_strana=1536, odstiny_sedi=True, orezat=True,
+                          format_vystupu="JPEG", kvalita=80):
+    """
+    Připraví obrázek účtenky pro OCR tak, aby stál co nejméně tokenů a bajtů.
+    
+    Postupně: otočí podle EXIF, volitelně ořízne na světlou plochu účtenky,
+    převede na odstíny šedi, zmenší delší stranu na max_delsi_strana a znovu
+    zakóduje do JPEG/WebP.
+    
+    Args:
+        obrazek_data: Původní data obrázku
+        max_delsi_strana: Delší strana výsledku v pixelech (None = nezmenšovat)
+        odstiny_sedi: Převést na odstíny šedi
+        orezat: Oříznout na oblast účtenky
+        format_vystupu: "JPEG" nebo "WEBP"
+        kvalita: Kvalita ztrátové komprese (1-100)
+    
+    Returns:
+        tuple: (data: bytes, mime_type: str, rozměry před: tuple, rozměry po: tuple)
+    """
+    obrazek = Image.open(io.BytesIO(obrazek_data))
+    rozmery_pred = obrazek.size
+    obrazek = ImageOps.exif_transpose(obrazek)
+    sedy = ImageOps.grayscale(obrazek)
+    
+    if orezat:
+        ramecek = najit_oblast_uctenky(sedy)
+        if ramecek:
+            obrazek = obrazek.crop(ramecek)
+            sedy = sedy.crop(ramecek)
+    
+    if odstiny_sedi:
+        obrazek = sedy
+    elif obrazek.mode not in ("RGB", "L"):
+        obrazek = obrazek.convert("RGB")
+    
+    if max_delsi_strana and max(obrazek.size) > max_delsi_strana:
+        obrazek.thumbnail((max_delsi_strana, max_delsi_strana), Image.LANCZOS)
+    
+    vystup = io.BytesIO()
+    obrazek.save(vystup, format=format_vystupu, quality=kvalita)
+    mime_type = "image/webp" if format_vystupu.upper() == "WEBP" else "image/jpeg"
+    return vystup.getvalue(), mime_type, rozmery_pred, obrazek.size
+
+def predzpracovat_soubor(cesta, nastaveni):
+    """Načte soubor a předzpracuje ho - funkce pro proces v ProcessPoolExecutor."""
+    with open(cesta, "rb") as f:
+        obrazek_data = f.read()
+    data, mime_type, rozmery_pred, rozmery_po = predzpracovat_obrazek(obrazek_data, **nastaveni)
+    return {
+        "data": data,
+        "mime_type": mime_type,
+        "bajtu_pred": len(obrazek_data),
+        "bajtu_po": len(data),
+        "tokeny_pred": odhadnout_tokeny_obrazku(rozmery_pred),
+        "tokeny_po": odhadnout_tokeny_obrazku(rozmery_po),
+    }
+
+class Predzpracovani:
+    """
+    Předzpracování obrázků v samostatných procesech.
+    
+    Obrázky naplánované přes naplanovat() se zpracovávají v ProcessPoolExecutor
+    s omezeným předstihem, takže dekódování a komprese běží souběžně s čekáním
+    na síť a v paměti nikdy neleží víc než predstih hotových obrázků. Obrázek,
+    který se nakonec neodešle (cache, duplikát, jiný uzel, rozpočet), musí
+    volající vrátit přes zrusit(), jinak by zabíral místo v předstihu.
+    """
+    
+    def __init__(self, max_delsi_strana=1536, odstiny_sedi=True, orezat=True, format_vystupu="JPEG",
+                 kvalita=80, procesu=None, predstih=16):
+        """
+        Args:
+            max_delsi_strana, odstiny_sedi, orezat, format_vystupu, kvalita: viz predzpracovat_obrazek
+            procesu: Počet procesů (None = počet CPU)
+            predstih: Kolik obrázků nejvýše předzpracovat dopředu
+        """
+        if Image is None:
+            raise RuntimeError("Předzpracování obrázků vyžaduje knihovnu Pillow (pip install pillow).")
+        self.nastaveni = {
+            "max_delsi_strana": max_delsi_strana,
+            "odstiny_sedi": odstiny_sedi,
+            "orezat": orezat,
+            "format_vystupu": format_vystupu,
+            "kvalita": kvalita,
+        }
+        self.predstih = predstih
+        self._executor = ProcessPoolExecutor(max_workers=procesu)
+        self._fronta = deque()
+        self._futures = {}
+        self._zamek = threading.Lock()
+    
+    def podpis(self):
+        """Textový popis nastavení - přidává se ke klíči cache, aby změna nastavení zneplatnila záznamy."""
+        return "\n# PREDZPRACOVANI " + json.dumps(self.nastaveni, sort_keys=True)
+    
+    def naplanovat(self, cesty):
+        """Zařadí obrázky do fronty k předzpracování v daném pořadí (PDF se nepředzpracovávají)."""
+        # Typ určujeme podle obsahu jako pripravit_obrazek - čte se jen hlavička, mimo zámek
+        cesty = [cesta for cesta in cesty if urcit_mime_typ(cesta) != "application/pdf"]
+        with self._zamek:
+            self._fronta.extend(cesty)
+            self._doplnit()
+    
+    def zrusit(self, cesty):
+        """Zahodí naplánované i hotové předzpracování obrázků, které ho nakonec nepotřebují."""
+        cesty = set(cesty)
+        with self._zamek:
+            if any(cesta in cesty for cesta in self._fronta):
+                self._fronta = deque(cesta for cesta in self._fronta if cesta not in cesty)
+            for cesta in cesty & self._futures.keys():
+                self._futures.pop(cesta).cancel()
+            self._doplnit()
+    
+    def _doplnit(self):
+        while self._fronta and len(self._futures) < self.predstih:
+            cesta = self._fronta.popleft()
+            if cesta not in self._futures:
+                self._futures[cesta] = self._executor.submit(predzpracovat_soubor, cesta, self.nastaveni)
+    
+    def ziskat(self, cesta):
+        """
+        Vrátí předzpracovaný obrázek (počká na něj, případně ho zpracuje hned).
+        
+        Returns:
+            dict: data, mime_type, bajtu_pred, bajtu_po, tokeny_pred, tokeny_po
+        """
+        with self._zamek:
+            future = self._futures.pop(cesta, None)
+            if future is None:
+                future = self._executor.submit(predzpracovat_soubor, cesta, self.nastaveni)
+            self._doplnit()
+        return future.result()
+    
+    def zavrit(self):
+        """Ukončí procesy předzpracování."""
+        self._executor.shutdown(cancel_futures=True)
+
+def popsat_predzpracovani(vysledek):
+    """Krátký popis úspory předzpracování do poznámky reportu."""
+    return (f"předzpracováno {vysledek['bajtu_pred'] / 1024:.0f} kB -> {vysledek['bajtu_po'] / 1024:.0f} kB, "
+            f"~{vysledek['tokeny_pred']} -> ~{vysledek['tokeny_po']} tokenů obrázku")
+
+def pripravit_obrazek(cesta, obrazek_data, predzpracovani=None):
+    """
+    Připraví data obrázku k odeslání - předzpracovaná, nebo původní.
+    
+    PDF se posílá tak, jak je (Gemini ho čte sám), předzpracování se ho netýká.
+    
+    Returns:
+        tuple: (data: bytes, mime_type: str, odhad tokenů obrázku: int, poznámka do reportu: str)
+    """
+    mime_type = urcit_mime_typ(cesta, obrazek_data)
+    if predzpracovani is not None and mime_type != "application/pdf":
+        try:
+            vysledek = predzpracovani.ziskat(cesta)
+            return vysledek["data"], vysledek["mime_type"], vysledek["tokeny_po"], popsat_predzpracovani(vysledek)
+        except Exception as e:
+            print(f"⚠️  Předzpracování '{os.path.basename(cesta)}' selhalo ({e}), posílám původní obrázek")
+    return obrazek_data, mime_type, odhadnout_tokeny_souboru(cesta, obrazek_data), ""
+
+def vykreslit_stranku_pdf(cesta, index, max_strana=PDF_MAX_STRANA):
+    """
+    Vykreslí jednu stránku PDF do JPEG v odstínech šedi - funkce pro proces v ProcessPoolExecutor.
+    
+    Returns:
+        tuple: (data: bytes, rozměry: tuple)
+    """
+    dokument = pdfium.PdfDocument(cesta)
+    try:
+        stranka = dokument[index]
+        sirka, vyska = stranka.get_size()
+        obrazek = stranka.render(scale=max_strana / max(sirka, vyska), grayscale=True).to_pil()
+        stranka.close()
+    finally:
+        dokument.close()
+    vystup = io.BytesIO()
+    obrazek.convert("L").save(vystup, format="JPEG", quality=85)
+    return vystup.getvalue(), obrazek.size
+
+_vykreslovani_pdf = None
+_zamek_pdf = threading.Lock()
+
+def vykreslit_stranky_pdf(cesta, pocet):
+    """
+    Vykreslí všechny stránky PDF souběžně ve sdíleném ProcessPoolExecutor.
+    
+    Returns:
+        list: (data, rozměry) každé stránky v pořadí stránek
+    """
+    global _vykreslovani_pdf
+    with _zamek_pdf:
+        if _vykreslovani_pdf is None:
+            _vykreslovani_pdf = ProcessPoolExecutor()
+            atexit.register(_vykreslovani_pdf.shutdown, cancel_futures=True)
+        futures = [_vykreslovani_pdf.submit(vykreslit_stranku_pdf, cesta, index) for index in range(pocet)]
+    return [future.result() for future in futures]
+
+def pripravit_dokument(cesta, obrazek_data, predzpracovani=None):
+    """
+    Připraví soubor k odeslání po stránkách.
+    
+    Obrázek i jednostránkové PDF jsou jedna stránka (viz pripravit_obrazek).
+    Vícestránkové PDF se s pypdfium2 a Pillow vykreslí po stránkách, aby se
+    stránky daly extrahovat souběžně; bez nich se pošle celé.
+    
+    Returns:
+        list: (data, mime_type, odhad tokenů, poznámka do reportu) pro každou stránku
+    """
+    if pdfium is not None and Image is not None and mime_typ_z_obsahu(obrazek_data) == "application/pdf":
+        pocet = pocet_stran_pdf(obrazek_data)
+        if pocet > 1:
+            try:
+                return [(data, "image/jpeg", odhadnout_tokeny_obrazku(rozmery), f"strana {cislo}/{pocet}")
+                        for cislo, (data, rozmery) in enumerate(vykreslit_stranky_pdf(cesta, pocet), 1)]
+            except Exception as e:
+                print(f"⚠️  PDF '{os.path.basename(cesta)}' se nepodařilo rozdělit na stránky ({e}), posílám ho celé")
+    return [pripravit_obrazek(cesta, obrazek_data, predzpracovani)]
+
+def spojit_stranky(stranky):
+    """
+    Spojí výsledky stránek jednoho dokumentu do jednoho JSON účtenky.
+    
+    Bloky jdou za sebou v pořadí stránek a dostanou klíč "strana". Blok,
+    který se na dalších stránkách opakuje beze změny (hlavička dodavatele,
+    zápatí), zůstane jen z první stránky.
+    
+    Args:
+        stranky: Data jednotlivých stránek (pole bloků nebo objekt)
+    
+    Returns:
+        list: Bloky celého dokumentu
+    """
+    bloky = []
+    videne = set()
+    for cislo, data in enumerate(stranky, 1):
+        for blok in data if isinstance(data, list) else [data]:
+            otisk = json.dumps(blok, sort_keys=True, ensure_ascii=False)
+            if otisk in videne:
+                continue
+            videne.add(otisk)
+            bloky.append({"strana": cislo, **blok})
+    return bloky
+
+def secist_usage(odpovedi):
+    """Součet usage_metadata odpovědí stránek - vypadá jako usage_metadata jedné odpovědi."""
+    klice = ("prompt_token_count", "candidates_token_count", "total_token_count", "cached_content_token_count",
+             "thoughts_token_count")
+    return SimpleNamespace(**{klic: sum(getattr(odpoved.usage_metadata, klic, None) or 0 for odpoved in odpovedi)
+                              for klic in klice})
+
+def prompt_pro_klic(prompt, predzpracovani=None, schema=None):
+    """
+    Text promptu pro klíč cache - přidá se k němu nastavení předzpracování i vynucené JSON schéma.
+    
+    Odpověď se schématem a bez něj se může lišit, takže výsledek jednoho
+    nastavení se nesmí vrátit z cache pro druhé.
+    """
+    if predzpracovani is not None:
+        prompt += predzpracovani.podpis()
+    if schema is not None:
+        prompt += "\nschema:" + json.dumps(schema, sort_keys=True, ensure_ascii=False)
+    return prompt
+
+def zpracovat_davku_uctenek(adresar="example", pripony=PRIPONY_OBRAZKU, velikost_davky=5, cache=None,
+                            inkrementalne=False, max_bajtu_davky=14 * 1024 * 1024, max_tokenu_davky=30_000,
+                            predzpracovani=None, kontextova_cache=False, strukturovany_vystup=False,
+                            prometheus_soubor=None, shard=None, zapujcky=False, platnost_zapujcek=600,
+                            duplicity=None, max_bajtu_v_pameti=64 * 1024 * 1024, kaskada=None, obrazky=None,
+                            rozpocet=None):
+    """
+    Zpracuje obrázky účtenek v dávkách.
+    
+    Dávky se balí podle rozpočtu bajtů a odhadovaných tokenů, velikost_davky
+    je jen horní mez počtu obrázků. Neúspěšná dávka se rozpůlí a zkusí znovu,
+    takže ani velká dávka nepřijde kvůli jednomu obrázku celá nazmar.
+    
+    Args:
+        adresar: Adresář s obrázky
+        pripony: Podporované přípony souborů
+        velikost_davky: Nejvýše kolik obrázků zpracovat najednou (default: 5)
+        cache: Volitelná CacheExtrakci - obrázky nalezené v cache se do dávek nezařadí
+        inkrementalne: Přeskočit obrázky s aktuálním výstupem podle manifestu adresáře
+        max_bajtu_davky: Rozpočet velikosti obrázků v jedné dávce
+        max_tokenu_davky: Rozpočet odhadovaných tokenů obrázků v jedné dávce
+        predzpracovani: Volitelné Predzpracovani - obrázky se před odesláním zmenší a překódují
+        kontextova_cache: Uložit dávkový prompt do kontextové cache Gemini místo posílání v každé dávce
+        strukturovany_vystup: Vynutit JSON odpověď podle SCHEMA_DAVKY - méně opakování kvůli formátu
+        prometheus_soubor: Volitelná cesta k Prometheus textfile se souhrnem běhu
+        shard: Volitelná dvojice (i, N) - zpracovat jen i-tý z N dílů adresáře (viz vybrat_shard)
+        zapujcky: Zabírat obrázky zápůjčkami, aby je souběžně nezpracoval jiný uzel (viz ZapujckyObrazku)
+        platnost_zapujcek: Po kolika sekundách bez obnovení zápůjčka spadlého uzlu propadne
+        duplicity: Volitelný IndexDuplicit - kopie už zpracovaných obrázků se do dávek nezařadí
+        max_bajtu_v_pameti: Kolik dat obrázků smí být najednou načteno - odeslaná dávka i ta načítaná dopředu
+        kaskada: Volitelná KaskadaModelu - dávky zpracuje její první model, účtenky, které neprojdou
+                 kontrolou, pak jednotlivě další modely
+        obrazky: Volitelný seznam obrázků adresáře ke zpracování (jinak všechny s příponami pripony)
+        rozpocet: Volitelný RozpocetBehu - po jeho vyčerpání se další dávky neodešlou
+    """
+    print(f"Hledám obrázky v adresáři '{adresar}'...")
+    
+    # Najdeme všechny soubory s podporovanými příponami
+    if obrazky is None:
+        obrazky = najit_obrazky(adresar, pripony)
+    
+    if not obrazky:
+        print(f"V adresáři '{adresar}' nebyly nalezeny žádné obrázky s příponami {pripony}")
+        return
+    
+    print(f"Nalezeno {len(obrazky)} obrázků: {[os.path.basename(img) for img in obrazky]}")
+    obrazky, zapujcky = vybrat_pro_uzel(adresar, obrazky, shard, zapujcky, platnost_zapujcek)
+    pocet_nalezenych = len(obrazky)
+    
+    manifest = None
+    if inkrementalne:
+        manifest, obrazky = otevrit_manifest(adresar, obrazky)
+        if not obrazky:
+            print("Všechny obrázky mají aktuální výstup, není co zpracovat.")
+            return
+    
+    print(f"Zpracování v dávkách po nejvýše {velikost_davky} obrázcích...")
+    
+    # Načteme API klíč
+    print("Načítám API klíč...")
+    api_key = nacti_api_klic()
+    if not api_key:
+        return
+    
+    # Inicializujeme klienta - všechny dávky sdílejí jeden klient i limit kvóty
+    print("Inicializuji Google AI klienta...")
+    vykonavac = VykonavacPozadavku(genai.Client(api_key=api_key))
+    model = kaskada.modely[0] if kaskada is not None else MODEL_DEFAULT
+    eskalace = kaskada.vyssi() if kaskada is not None and len(kaskada.modely) > 1 else None
+    
+    # Zpracujeme obrázky v dávkách
+    celkem_zpracovano = pocet_nalezenych - len(obrazky)
+    pocet_ke_zpracovani = len(obrazky)
+    metriky = otevrit_metriky(adresar, prometheus_soubor, rezim="2", rozpocet=rozpocet)
+    
+    davky = zabalit_do_davek(obrazky, velikost_davky, max_bajtu_davky, max_tokenu_davky)
+    
+    # Předzpracování běží v procesech dopředu, zatímco čekáme na odpověď předchozí dávky
+    if predzpracovani is not None:
+        predzpracovani.naplanovat(obrazky)
+    
+    kontext = SpravceKontextoveCache(vykonavac.client, model, PROMPT_DAVKA) if kontextova_cache else None
+    
+    # Další dávka se načítá, zatímco předchozí čeká na odpověď. Obrázky, které už máme v cache (nebo jde
+    # o kopii zpracovaného obrázku), se vyřídí už při načítání - každý soubor se tak čte jen jednou
+    prednacitac = PrednacitacDavek(davky, model, cache=cache, predzpracovani=predzpracovani, metriky=metriky,
+                                   max_bajtu=max_bajtu_v_pameti, strukturovany_vystup=strukturovany_vystup,
+                                   vyridit_hotove=cache is not None or duplicity is not None,
+                                   duplicity=duplicity, manifest=manifest, eskalace=eskalace)
+    
+    try:
+        for cislo_davky, nactena in enumerate(prednacitac, 1):
+            celkem_zpracovano += len(nactena.vyrizene)
+            davka = [obrazek for obrazek in nactena.obrazky if obrazek not in nactena.vyrizene]
+            if not davka:
+                print(f"\n--- Dávka {cislo_davky}/{len(davky)} je celá z cache nebo duplicit ---")
+                continue
+            if zapujcky is not None:
+                # Zabíráme až těsně před odesláním, jinak by první uzel zabral celý adresář
+                zabrane = zabrat_obrazky(zapujcky, davka)
+                if not zabrane:
+                    print(f"\n--- Dávku {cislo_davky}/{len(davky)} zpracovávají jiné uzly ---")
+                    continue
+                if len(zabrane) < len(davka):
+                    # Část dávky mezitím zabral jiný uzel - zbytek načteme znovu až při odeslání
+                    nactena.uvolnit()
+                    nactena = None
+                davka = zabrane
+            if rozpocet is not None and rozpocet.zastaveno:
+                if zapujcky is not None:
+                    for obrazek_cesta in davka:
+                        zapujcky.uvolnit(obrazek_cesta)
+                break
+            print(f"\n--- Zpracovávám dávku {cislo_davky}/{len(davky)} ({len(davka)} obrázků) ---")
+            
+            # Zpracujeme jednu dávku
+            try:
+                uspesne, _, _ = zpracovat_jednu_davku(davka, vykonavac, model, adresar, cache=cache,
+                                                      manifest=manifest, predzpracovani=predzpracovani,
+                                                      kontext=kontext, strukturovany_vystup=strukturovany_vystup,
+                                                      metriky=metriky, nactena=nactena, eskalace=eskalace)
+            finally:
+                if zapujcky is not None:
+                    for obrazek_cesta in davka:
+                        zapujcky.uvolnit(obrazek_cesta)
+            if duplicity is not None:
+                duplicity.potvrdit_hotove(davka)
+            celkem_zpracovano += uspesne
+    finally:
+        prednacitac.zavrit()
+        if predzpracovani is not None:
+            # Dávky, které nedošly na řadu (jiný uzel, rozpočet), předzpracování nepotřebují
+            predzpracovani.zrusit(obrazky)
+        if kontext is not None:
+            kontext.smazat()
+        if zapujcky is not None:
+            zapujcky.zavrit()
+        metriky.zavrit()
+    
+    print(f"\nHotovo! Celkem zpracováno {celkem_zpracovano} obrázků z {pocet_nalezenych}.")
+    vypsat_souhrn(pocet_ke_zpracovani, metriky, kontext)
+
+class NactenaDavka:
+    """
+    Obrázky jedné dávky načtené a připravené k odeslání.
+    
+    Drží data obrázků jen do uvolnit() - volá se hned po návratu požadavku,
+    takže při ukládání výsledků ani při opakování půlek dávky už v paměti
+    nezůstávají.
+    """
+    
+    def __init__(self, obrazky, mereni):
+        self.obrazky = obrazky
+        self.mereni = mereni
+        # Obrázky, které opravdu odešly v požadavku - obrazek_index v odpovědi ukazuje do tohoto seznamu,
+        # takže přeskočený nečitelný obrázek neposune výsledky ostatních
+        self.odeslane = []
+        # Obrázky vyřízené při načítání z cache nebo jako duplikát - neodesílají se
+        self.vyrizene = []
+        self.casti_obrazku = []
+        # Klíče do cache počítáme hned při načtení, ať data nečteme dvakrát
+        self.klice_cache = {}
+        self.poznamky_predzpracovani = {}
+        self.odhady_obrazku = {}
+        self.odhad_tokenu = odhadnout_tokeny_textu(PROMPT_DAVKA)
+        self.bajtu = 0
+        self.cas = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.data_reportu = []
+        self._pri_uvolneni = None
+    
+    def uvolnit(self):
+        """Zahodí data obrázků (opakované volání nevadí)."""
+        self.casti_obrazku = []
+        pri_uvolneni, self._pri_uvolneni = self._pri_uvolneni, None
+        if pri_uvolneni is not None:
+            pri_uvolneni(self)
+
+def nacist_davku(davka_obrazky, model, cache=None, predzpracovani=None, metriky=None, strukturovany_vystup=False,
+                 vyridit_hotove=False, duplicity=None, manifest=None, eskalace=None):
+    """
+    Načte a připraví obrázky dávky k odeslání.
+    
+    Každý soubor se přečte jedním voláním read() - SDK chce pro inline data
+    bytes, takže mmap by jen přidal další kopii. Nečitelné obrázky se
+    přeskočí a zapíšou do data_reportu jako CHYBA_NACTENI.
+    Se strukturovaným výstupem se do klíčů cache započítá i SCHEMA_DAVKY.
+    
+    Args:
+        vyridit_hotove: Obrázky nalezené v cache (viz pouzit_vysledek_z_cache) nebo v duplicity
+                        (viz pouzit_duplikat) rovnou vyřídit z už přečtených dat a neodesílat je
+        duplicity: Volitelný IndexDuplicit (jen s vyridit_hotove)
+        manifest: Volitelný ManifestZpracovani pro řádky vyřízených obrázků
+        eskalace: Volitelná KaskadaModelu dražších modelů - v cache se hledá i jejich výsledek
+    
+    Returns:
+        NactenaDavka
+    """
+    if metriky is None:
+        metriky = MetrikyBehu()
+    nactena = NactenaDavka(davka_obrazky, metriky.polozka(
+        "davka", f"{os.path.basename(davka_obrazky[0])} (+{len(davka_obrazky) - 1})", len(davka_obrazky)))
+    mereni = nactena.mereni
+    prompt_klice = prompt_pro_klic(PROMPT_DAVKA, predzpracovani, SCHEMA_DAVKY if strukturovany_vystup else None)
+    prompt_klice_eskalace = prompt_pro_klic(PROMPT_EXTRAKCE, predzpracovani,
+                                            SCHEMA_UCTENKY if strukturovany_vystup else None)
+    
+    print("Načítám obrázky v dávce...")
+    for i, obrazek_cesta in enumerate(davka_obrazky):
+        try:
+            with mereni.etapa("cteni", obrazek_cesta):
+                with open(obrazek_cesta, "rb") as f:
+                    obrazek_data = f.read()
+            
+            if cache is not None:
+                with mereni.etapa("cache", obrazek_cesta):
+                    nactena.klice_cache[obrazek_cesta] = CacheExtrakci.vytvorit_klic(
+                        obrazek_data, prompt_klice, model)
+            
+            if vyridit_hotove:
+                status = vyridit_nacteny(obrazek_cesta, obrazek_data, cache, duplicity, prompt_klice, model,
+                                         prompt_klice_eskalace, eskalace, manifest, metriky)
+                if status is not None:
+                    nactena.vyrizene.append(obrazek_cesta)
+                    nactena.klice_cache.pop(obrazek_cesta, None)
+                    if predzpracovani is not None:
+                        predzpracovani.zrusit([obrazek_cesta])
+                    continue
+            
+            # Předzpracujeme obrázek (nebo jen určíme MIME typ podle přípony)
+            with mereni.etapa("priprava", obrazek_cesta):
+                obrazek_data, mime_type, odhad_obrazku, poznamka = pripravit_obrazek(obrazek_cesta, obrazek_data,
+                                                                                     predzpracovani)
+                nactena.casti_obrazku.append(types.Part.from_bytes(mime_type=mime_type, data=obrazek_data))
+            if poznamka:
+                nactena.poznamky_predzpracovani[obrazek_cesta] = poznamka
+            
+            nactena.odeslane.append(obrazek_cesta)
+            nactena.odhady_obrazku[obrazek_cesta] = odhad_obrazku
+            nactena.odhad_tokenu += odhad_obrazku
+            nactena.bajtu += len(obrazek_data)
+            print(f"  - Přidán obrázek {i+1}/{len(davka_obrazky)}: {os.path.basename(obrazek_cesta)}")
+            
+        except Exception as e:
+            print(f"Chyba při načítání obrázku '{obrazek_cesta}': {e}")
+            if predzpracovani is not None:
+                predzpracovani.zrusit([obrazek_cesta])
+            nactena.data_reportu.append([nactena.cas, os.path.basename(obrazek_cesta), 0, 0.0, 'CHYBA_NACTENI',
+                                         str(e)])
+            continue
+    # Vyřízené obrázky mají vlastní položky v metrikách - do průměrné ceny obrázku dávky nepatří
+    mereni.obrazku -= len(nactena.vyrizene)
+    return nactena
+
+def vyridit_nacteny(obrazek_cesta, obrazek_data, cache, duplicity, prompt_klice, model, prompt_klice_eskalace=None,
+                    eskalace=None, manifest=None, metriky=None):
+    """
+    Vyřídí už načtený obrázek z cache nebo jako duplikát, pokud to jde.
+    
+    Returns:
+        str: Status vyřízení ('CACHE' nebo 'DUPLIKAT'), nebo None, pokud se obrázek musí odeslat
+    """
+    if metriky is None:
+        metriky = MetrikyBehu()
+    mereni = metriky.polozka("obrazek", os.path.basename(obrazek_cesta))
+    if cache is not None:
+        with mereni.etapa("cache"):
+            z_cache = pouzit_vysledek_z_cache(cache, obrazek_cesta, obrazek_data, prompt_klice, model,
+                                              manifest=manifest)
+            if not z_cache and eskalace is not None:
+                # Účtenka, kterou už jednou zpracoval dražší model, nemusí znovu do dávky
+                z_cache = pouzit_vysledek_z_cache(cache, obrazek_cesta, obrazek_data, prompt_klice_eskalace,
+                                                  eskalace.nazev, manifest=manifest)
+        if z_cache:
+            metriky.dokoncit(mereni, 'CACHE', uspesnych=1)
+            return 'CACHE'
+    if duplicity is not None:
+        with mereni.etapa("duplicity"):
+            duplikat = pouzit_duplikat(duplicity, obrazek_cesta, obrazek_data, manifest=manifest)
+        if duplikat:
+            metriky.dokoncit(mereni, 'DUPLIKAT', uspesnych=1)
+            return 'DUPLIKAT'
+    return None
+
+class PrednacitacDavek:
+    """
+    Načítá dávky dopředu ve vlákně, zatímco předchozí dávka čeká na odpověď.
+    
+    Dávka k+1 se čte a připravuje během požadavku dávky k, takže se čtení
+    z disku překrývá se sítí. Načtené dávky (včetně té, která je právě
+    odeslaná) drží v paměti nejvýše max_bajtu dat obrázků - další dávka se
+    začne načítat, až se uvolní místo. Jedna dávka se načte vždy, i když
+    se do limitu sama nevejde.
+    """
+    
+    def __init__(self, davky, model, cache=None, predzpracovani=None, metriky=None,
+                 max_bajtu=64 * 1024 * 1024, predstih=1, strukturovany_vystup=False, vyridit_hotove=False,
+                 duplicity=None, manifest=None, eskalace=None):
+        """
+        Args:
+            davky: Seznam dávek (seznamů cest) - viz zabalit_do_davek
+            model, cache, predzpracovani, metriky, strukturovany_vystup: viz nacist_davku
+            vyridit_hotove, duplicity, manifest, eskalace: viz nacist_davku
+            max_bajtu: Kolik bajtů dat obrázků smí být načteno najednou
+            predstih: Kolik dávek nejvýše načíst dopředu
+        """
+        self.davky = davky
+        self.model = model
+        self.cache = cache
+        self.predzpracovani = predzpracovani
+        self.metriky = metriky
+        self.max_bajtu = max_bajtu
+        self.predstih = predstih
+        self.strukturovany_vystup = strukturovany_vystup
+        self.vyridit_hotove = vyridit_hotove
+        self.duplicity = duplicity
+        self.manifest = manifest
+        self.eskalace = eskalace
+        self.v_pameti = 0
+        self.nejvic_v_pameti = 0
+        self._hotove = deque()
+        self._podminka = threading.Condition()
+        self._konec = False
+        self._vlakno = None
+    
+    def _velikost(self, davka):
+        """Odhad dat dávky před načtením - velikost souborů (předzpracování ji jen zmenší)."""
+        velikost = 0
+        for cesta in davka:
+            try:
+                velikost += os.path.getsize(cesta)
+            except OSError:
+                pass
+        return velikost
+    
+    def _uvolneno(self, nactena):
+        with self._podminka:
+            self.v_pameti -= nactena.bajtu
+            self._podminka.notify_all()
+    
+    def _nacitat(self):
+        for davka in self.davky:
+            velikost = self._velikost(davka)
+            with self._podminka:
+                # Načítáme, jen pokud je fronta kratší než předstih a data se vejdou do limitu
+                # (nebo v paměti nic není - jinak by příliš velká dávka čekala navždy)
+                self._podminka.wait_for(lambda: self._konec or (
+                    len(self._hotove) < self.predstih
+                    and (self.v_pameti == 0 or self.v_pameti + velikost <= self.max_bajtu)))
+                if self._konec:
+                    return
+            try:
+                nactena = nacist_davku(davka, self.model, cache=self.cache, predzpracovani=self.predzpracovani,
+                                       metriky=self.metriky, strukturovany_vystup=self.strukturovany_vystup,
+                                       vyridit_hotove=self.vyridit_hotove, duplicity=self.duplicity,
+                                       manifest=self.manifest, eskalace=self.eskalace)
+            except Exception as e:
+                nactena = e
+            with self._podminka:
+                if isinstance(nactena, NactenaDavka):
+                    nactena._pri_uvolneni = self._uvolneno
+                    self.v_pameti += nactena.bajtu
+                    self.nejvic_v_pameti = max(self.nejvic_v_pameti, self.v_pameti)
+                self._hotove.append(nactena)
+                self._podminka.notify_all()
+    
+    def __iter__(self):
+        """Vrací načtené dávky v původním pořadí. Dávka se uvolní nejpozději při přechodu na další."""
+        self._vlakno = threading.Thread(target=self._nacitat, name="prednacitani-davek", daemon=True)
+        self._vlakno.start()
+        try:
+            for _ in self.davky:
+                with self._podminka:
+                    self._podminka.wait_for(lambda: self._hotove)
+                    nactena = self._hotove.popleft()
+                    self._podminka.notify_all()
+                if isinstance(nactena, Exception):
+                    raise nactena
+                try:
+                    yield nactena
+                finally:
+                    nactena.uvolnit()
+        finally:
+            self.zavrit()
+    
+    def zavrit(self):
+        """Zastaví načítání a zahodí dávky, které se už nezpracují."""
+        with self._podminka:
+            self._konec = True
+            nevyzvednute = [nactena for nactena in self._hotove if isinstance(nactena, NactenaDavka)]
+            self._hotove.clear()
+            self._podminka.notify_all()
+        for nactena in nevyzvednute:
+            nactena.uvolnit()
+        if self._vlakno is not None and self._vlakno is not threading.current_thread():
+            self._vlakno.join()
+
+def zpracovat_jednu_davku(davka_obrazky, vykonavac, model, adresar, cache=None, manifest=None, pulit_pri_chybe=True,
+                          predzpracovani=None, kontext=None, strukturovany_vystup=False, metriky=None, nactena=None,
+                          eskalace=None):
+    """
+    Zpracuje jednu dávku obrázků.
+    
+    Pokud dávka selže (chyba API, nečitelný JSON), rozpůlí se a obě poloviny
+    se zkusí znovu, rekurzivně až po jednotlivé obrázky. Obrázky, jejichž
+    výsledek v jinak platné odpovědi chybí nebo neprošel kontrolou, se zkusí
+    znovu každý samostatně. Chyba se do reportu zapíše jen u obrázků, které
+    selžou i samostatně.
+    
+    Args:
+        davka_obrazky: Seznam cest k obrázkům v dávce
+        vykonavac: Sdílený VykonavacPozadavku (nebo přímo genai.Client)
+        model: Název modelu
+        adresar: Adresář pro report
+        cache: Volitelná CacheExtrakci
+        manifest: Volitelný ManifestZpracovani
+        pulit_pri_chybe: Při chybě dávku rozpůlit a zkusit znovu (default: True)
+        predzpracovani: Volitelné Predzpracovani
+        kontext: Volitelný SpravceKontextoveCache s PROMPT_DAVKA
+        strukturovany_vystup: Vynutit JSON odpověď podle SCHEMA_DAVKY
+        metriky: Volitelné MetrikyBehu - zaznamenají se časy etap dávky i jejích obrázků
+        nactena: Volitelná NactenaDavka s již načtenými obrázky (viz PrednacitacDavek), jinak se načtou teď
+        eskalace: Volitelná KaskadaModelu dražších modelů - výsledek, který neprojde kontrolou
+                  (overit_uctenku), se neuloží a obrázek jimi zpracuje jednotlivě
+    
+    Returns:
+        tuple: (počet úspěšně zpracovaných obrázků: int, celkové_tokeny: int, celkové_náklady: float)
+    """
+    vykonavac = zajistit_vykonavac(vykonavac)
+    if metriky is None:
+        metriky = MetrikyBehu()
+    if nactena is None:
+        nactena = nacist_davku(davka_obrazky, model, cache=cache, predzpracovani=predzpracovani, metriky=metriky,
+                               strukturovany_vystup=strukturovany_vystup)
+    mereni = nactena.mereni
+    odeslane = nactena.odeslane
+    klice_cache = nactena.klice_cache
+    poznamky_predzpracovani = nactena.poznamky_predzpracovani
+    odhady_obrazku = nactena.odhady_obrazku
+    cas = nactena.cas
+    data_reportu = nactena.data_reportu
+    
+    if not odeslane:
+        ulozit_report_spotreby(adresar, data_reportu, manifest=manifest)
+        metriky.dokoncit(mereni, 'CHYBA_NACTENI')
+        return 0, 0, 0.0
+    
+    print(f"Odesílám dávkový požadavek ({len(odeslane)} obrázků) a čekám na odpověď...")
+    
+    celkove_tokeny = 0
+    celkove_naklady = 0.0
+    response = None
+    try:
+        try:
+            # Prompt přidáme až při odeslání (text, nebo odkaz na kontextovou cache)
+            with mereni.etapa("sestaveni"):
+                contents, config = sestavit_pozadavek(PROMPT_DAVKA, nactena.casti_obrazku, kontext,
+                                                      prompt_na_zacatku=True,
+                                                      schema=SCHEMA_DAVKY if strukturovany_vystup else None)
+            response = vykonavac.generovat(model, contents, config=config, odhad_tokenu=nactena.odhad_tokenu,
+                                           mereni=mereni)
+        finally:
+            # Data obrázků už nepotřebujeme - uvolníme je dřív, než se začne ukládat nebo opakovat půlky
+            contents = None
+            nactena.uvolnit()
+        
+        # Získáme počet tokenů a vypočítáme náklady
+        celkove_tokeny = response.usage_metadata.total_token_count
+        celkove_naklady = naklady_odpovedi(response.usage_metadata, model)
+        
+        print(f"Celkem tokenů pro dávku: {celkove_tokeny}")
+        print(f"Celkové náklady dávky: ${celkove_naklady:.6f} USD")
+        
+        # Odpověď naparsujeme a ověříme celou v paměti, než cokoliv zapíšeme na disk
+        with mereni.etapa("parsovani"):
+            vysledky = rozdelit_vysledky_davky(nacist_json_odpovedi(response.text), len(odeslane))
+        
+    except (json.JSONDecodeError, ValueError) as e:
+        print(f"Chyba při parsování JSON odpovědi: {e}")
+        if response is not None:
+            print("Surová odpověď:")
+            print(response.text)
+        metriky.dokoncit(mereni, 'CHYBA_JSON', tokeny=celkove_tokeny, naklady=celkove_naklady)
+        return _dokoncit_neuspesnou_davku(odeslane, 'CHYBA_JSON', e, data_reportu, celkove_tokeny, celkove_naklady,
+                                          vykonavac, model, adresar, cache, manifest, pulit_pri_chybe,
+                                          predzpracovani, kontext, strukturovany_vystup, metriky, eskalace)
+        
+    except RozpocetVycerpan as e:
+        # Dávka neodešla - obrázky nejsou chybné, zpracuje je příští běh
+        print(f"⛔ Dávka {len(odeslane)} obrázků neodešla: {e}")
+        if data_reportu:
+            ulozit_report_spotreby(adresar, data_reportu, manifest=manifest)
+        metriky.dokoncit(mereni, 'ROZPOCET')
+        return 0, 0, 0.0
+        
+    except Exception as e:
+        print(f"Nastala chyba při komunikaci s Google AI: {e}")
+        metriky.dokoncit(mereni, 'CHYBA_API', tokeny=celkove_tokeny, naklady=celkove_naklady)
+        return _dokoncit_neuspesnou_davku(odeslane, 'CHYBA_API', e, data_reportu, celkove_tokeny, celkove_naklady,
+                                          vykonavac, model, adresar, cache, manifest, pulit_pri_chybe,
+                                          predzpracovani, kontext, strukturovany_vystup, metriky, eskalace)
+    
+    # POZNÁMKA: Gemini API neposkytuje rozložení tokenů na jednotlivé obrázky v dávce,
+    # proto je rozpočítáme na obrázky s platným výsledkem podle odhadu jejich vstupu a délky výstupu
+    indexy = sorted(vysledky)
+    podily = dict(zip(indexy, rozpocitat_naklady_davky(
+        response.usage_metadata, model,
+        [odhady_obrazku[odeslane[i]] for i in indexy],
+        [len(json.dumps(vysledky[i], ensure_ascii=False)) for i in indexy])))
+    
+    # Uložíme každý platný výsledek do samostatného JSON souboru
+    print(f"Ukládám výsledky do {len(vysledky)} JSON souborů...")
+    
+    ulozene = set()
+    k_eskalaci = []
+    for obrazek_index, data in sorted(vysledky.items()):
+        # Získáme původní cestu k obrázku
+        puvodni_obrazek = odeslane[obrazek_index]
+        json_soubor = f"{os.path.splitext(puvodni_obrazek)[0]}.json"
+        tokeny_obrazku, naklady_obrazku = podily[obrazek_index]
+        
+        if eskalace is not None:
+            # Výsledek, který neprojde kontrolou, neukládáme - obrázek pošleme dražšímu modelu
+            problemy = overit_uctenku(data, eskalace.tolerance)
+            metriky.zaznamenat_uroven(model, not problemy, tokeny_obrazku, naklady_obrazku)
+            if problemy:
+                print(f"  ↗️  {os.path.basename(puvodni_obrazek)}: {'; '.join(problemy)} "
+                      f"- posílám modelu {eskalace.modely[0]}")
+                data_reportu.append([cas, os.path.basename(puvodni_obrazek), tokeny_obrazku, naklady_obrazku,
+                                     'ESKALACE', "; ".join(problemy), najit_prodejce(data), model])
+                k_eskalaci.append(puvodni_obrazek)
+                ulozene.add(puvodni_obrazek)
+                continue
+        
+        try:
+            with mereni.etapa("zapis", puvodni_obrazek):
+                json_soubor, json_text = ulozit_vystup_json(puvodni_obrazek, data)
+                
+                if puvodni_obrazek in klice_cache:
+                    # Usage metadata jsou za celou dávku, proto k nim přidáme i její velikost
+                    usage = usage_do_slovniku(response.usage_metadata)
+                    usage["obrazku_v_davce"] = len(odeslane)
+                    cache.ulozit(klice_cache[puvodni_obrazek], model, json_text, usage)
+            
+            print(f"  - Uloženo: {os.path.basename(json_soubor)} "
+                  f"(podíl: {tokeny_obrazku} tokenů, ${naklady_obrazku:.6f} USD)")
+            
+            # Přidáme do reportu - podíl obrázku na tokenech a nákladech dávky
+            data_reportu.append([
+                cas, 
+                os.path.basename(puvodni_obrazek), 
+                tokeny_obrazku,
+                naklady_obrazku,
+                'USPECH_DAVKA', 
+                f'Dávka {len(odeslane)} obrázků - podíl z {celkove_tokeny} tokenů '
+                f'(${celkove_naklady:.6f}) dávky'
+                + (f'; {poznamky_predzpracovani[puvodni_obrazek]}' if puvodni_obrazek in poznamky_predzpracovani else ''),
+                najit_prodejce(data),
+                model,
+            ])
+            ulozene.add(puvodni_obrazek)
+            
+        except Exception as e:
+            print(f"Chyba při ukládání {json_soubor}: {e}")
+            data_reportu.append([
+                cas, 
+                os.path.basename(puvodni_obrazek), 
+                tokeny_obrazku, 
+                naklady_obrazku, 
+                'CHYBA_UKLADANI', 
+                str(e)
+            ])
+            # Uložení selhalo na naší straně - opakovaný dotaz by nepomohl
+            ulozene.add(puvodni_obrazek)
+    
+    uspesne_zpracovano = sum(1 for radek in data_reportu if radek[4] == 'USPECH_DAVKA')
+    print(f"Dávka dokončena! Zpracováno {uspesne_zpracovano}/{len(odeslane)} obrázků.")
+    
+    # Obrázky, pro které odpověď neobsahovala platný výsledek, zkusíme znovu
+    chybejici = [cesta for cesta in odeslane if cesta not in ulozene]
+    if chybejici:
+        print(f"⚠️  V odpovědi chybí platné výsledky pro {len(chybejici)} obrázků.")
+    if not indexy:
+        # Bez jediného platného výsledku se cena dávky neměla na koho rozpočítat
+        data_reportu.append(radek_zaplacene_davky(cas, odeslane, 'CHYBA_JSON', "žádný platný výsledek",
+                                                  celkove_tokeny, celkove_naklady, model))
+    
+    # Uložíme report
+    with mereni.etapa("zapis"):
+        ulozit_report_spotreby(adresar, data_reportu, manifest=manifest)
+    status_davky = 'USPECH_DAVKA' if not chybejici else 'CASTECNE' if uspesne_zpracovano else 'CHYBA_JSON'
+    metriky.dokoncit(mereni, status_davky, uspesnych=uspesne_zpracovano, tokeny=celkove_tokeny,
+                     naklady=celkove_naklady)
+    
+    if k_eskalaci:
+        print(f"↗️  {len(k_eskalaci)} obrázků neprošlo kontrolou, zpracuji je jednotlivě dražšími modely...")
+        for obrazek_cesta in k_eskalaci:
+            if metriky.rozpocet_vycerpan:
+                break
+            uspesnych_pred = metriky.uspesnych
+            t, n = zpracovat_jeden_obrazek_s_metrami(obrazek_cesta, vykonavac, cache=cache, manifest=manifest,
+                                                     predzpracovani=predzpracovani,
+                                                     strukturovany_vystup=strukturovany_vystup, metriky=metriky,
+                                                     kaskada=eskalace)
+            uspesne_zpracovano += metriky.uspesnych - uspesnych_pred
+            celkove_tokeny += t
+            celkove_naklady += n
+    
+    if chybejici:
+        chyba = ValueError(f"Výsledek obrázku chybí nebo je neplatný v odpovědi dávky {len(odeslane)} obrázků")
+        if not pulit_pri_chybe or len(odeslane) == 1:
+            uspesne, tokeny, naklady = _dokoncit_neuspesnou_davku(
+                chybejici, 'CHYBA_JSON', chyba, [], 0, 0.0,
+                vykonavac, model, adresar, cache, manifest, pulit_pri_chybe, predzpracovani, kontext,
+                strukturovany_vystup, metriky, eskalace,
+            )
+            return uspesne_zpracovano + uspesne, celkove_tokeny + tokeny, celkove_naklady + naklady
+        
+        # Zbytek odpovědi byl v pořádku, takže celou dávku neopakujeme - jen chybějící obrázky po jednom
+        print(f"🔁 Zkouším znovu samostatně {len(chybejici)} obrázků...")
+        for obrazek_cesta in chybejici:
+            if metriky.rozpocet_vycerpan:
+                break
+            u, t, n = zpracovat_jednu_davku([obrazek_cesta], vykonavac, model, adresar, cache=cache,
+                                            manifest=manifest, predzpracovani=predzpracovani, kontext=kontext,
+                                            strukturovany_vystup=strukturovany_vystup, metriky=metriky,
+                                            eskalace=eskalace)
+            uspesne_zpracovano += u
+            celkove_tokeny += t
+            celkove_naklady += n
+    
+    return uspesne_zpracovano, celkove_tokeny, celkove_naklady
+
+def radek_zaplacene_davky(cas, obrazky, status, chyba, tokeny, naklady, model):
+    """Řádek reportu za zaplacenou odpověď dávky, ze které se nepoužil žádný výsledek (nese tokeny celé dávky)."""
+    if len(obrazky) == 1:
+        poznamka = str(chyba)
+    else:
+        poznamka = (f"Dávka {len(obrazky)} obrázků ({', '.join(os.path.basename(o) for o in obrazky)}) "
+                    f"- zaplacená odpověď bez použitelného výsledku: {chyba}")
+    return [cas, os.path.basename(obrazky[0]), tokeny, naklady, status, poznamka, None, model]
+
+def _dokoncit_neuspesnou_davku(obrazky, status, chyba, data_reportu, tokeny, naklady,
+                               vykonavac, model, adresar, cache, manifest, pulit_pri_chybe, predzpracovani=None,
+                               kontext=None, strukturovany_vystup=False, metriky=None, eskalace=None):
+    """
+    Dokončí dávku, která selhala pro dané obrázky.
+    
+    Víc obrázků rozpůlí a každou polovinu zpracuje znovu, u jednoho obrázku
+    (nebo bez půlení) zapíše chybu do reportu. Již připravené řádky reportu
+    (např. nečitelné obrázky) se uloží vždy, zaplacená odpověď dávky
+    (tokeny > 0) jedním řádkem s jejím součtem ještě před půlením.
+    
+    Returns:
+        tuple: (počet úspěšně zpracovaných obrázků, tokeny, náklady) včetně opakovaných pokusů
+    """
+    cas = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    zaplaceno = bool(tokeny or naklady)
+    if zaplaceno:
+        # Odpověď se zaplatila, i když je nepoužitelná - půlky ji znovu nezaplatí, report ji ukázat musí
+        data_reportu.append(radek_zaplacene_davky(cas, obrazky, status, chyba, tokeny, naklady, model))
+    if not pulit_pri_chybe or len(obrazky) == 1:
+        # U jediného obrázku je chybou přímo řádek se zaplacenou odpovědí
+        for obrazek_cesta in obrazky[1 if zaplaceno and len(obrazky) == 1 else 0:]:
+            data_reportu.append([cas, os.path.basename(obrazek_cesta), 0, 0.0, status, str(chyba)])
+        ulozit_report_spotreby(adresar, data_reportu, manifest=manifest)
+        return 0, tokeny, naklady
+    
+    if data_reportu:
+        ulozit_report_spotreby(adresar, data_reportu, manifest=manifest)
+    uspesne = 0
+    
+    stred = len(obrazky) // 2
+    print(f"🔁 Dávku {len(obrazky)} obrázků dělím na {stred} + {len(obrazky) - stred} a zkouším znovu...")
+    for polovina in (obrazky[:stred], obrazky[stred:]):
+        if metriky is not None and metriky.rozpocet_vycerpan:
+            break
+        u, t, n = zpracovat_jednu_davku(polovina, vykonavac, model, adresar, cache=cache, manifest=manifest,
+                                        predzpracovani=predzpracovani, kontext=kontext,
+                                        strukturovany_vystup=strukturovany_vystup, metriky=metriky,
+                                        eskalace=eskalace)
+        uspesne += u
+        tokeny += t
+        naklady += n
+    return uspesne, tokeny, naklady
+
+def zpracovat_davku_jednotlivo(adresar="example", pripony=PRIPONY_OBRAZKU, cache=None, inkrementalne=False,
+                               predzpracovani=None, kontextova_cache=False, strukturovany_vystup=False,
+                               prometheus_soubor=None, shard=None, zapujcky=False, platnost_zapujcek=600,
+                               duplicity=None, kaskada=None, obrazky=None, rozpocet=None):
+    """
+    Spracuje obrázky jednotlivo pre presnejšie sledovanie tokenov a nákladov.
+    Pomalšie, ale poskytuje presné údaje pre každý súbor.
+    
+    Args:
+        adresar: Adresář s obrázky
+        pripony: Podporované přípony souborů
+        cache: Volitelná CacheExtrakci
+        inkrementalne: Přeskočit obrázky s aktuálním výstupem podle manifestu adresáře
+        predzpracovani: Volitelné Predzpracovani - běží dopředu, zatímco se čeká na API
+        kontextova_cache: Uložit prompt do kontextové cache Gemini místo posílání s každým obrázkem
+        strukturovany_vystup: Vynutit JSON odpověď podle SCHEMA_UCTENKY
+        prometheus_soubor: Volitelná cesta k Prometheus textfile se souhrnem běhu
+        shard: Volitelná dvojice (i, N) - zpracovat jen i-tý z N dílů adresáře (viz vybrat_shard)
+        zapujcky: Zabírat obrázky zápůjčkami, aby je souběžně nezpracoval jiný uzel (viz ZapujckyObrazku)
+        platnost_zapujcek: Po kolika sekundách bez obnovení zápůjčka spadlého uzlu propadne
+        duplicity: Volitelný IndexDuplicit - kopie už zpracovaného obrázku převezme jeho výsledek
+        kaskada: Volitelná KaskadaModelu - účtenku, která neprojde kontrolou, zpracuje dražší model
+        obrazky: Volitelný seznam obrázků adresáře ke zpracování (jinak všechny s příponami pripony)
+        rozpocet: Volitelný RozpocetBehu - po jeho vyčerpání se další obrázky neodešlou
+    """
+    print(f"Hledám obrázky v adresáři '{adresar}'...")
+    
+    # Najdeme všechny soubory s podporovanými příponami
+    if obrazky is None:
+        obrazky = najit_obrazky(adresar, pripony)
+    
+    if not obrazky:
+        print(f"V adresáři '{adresar}' nebyly nalezeny žádné obrázky s příponami {pripony}")
+        return
+    
+    print(f"Nalezeno {len(obrazky)} obrázků: {[os.path.basename(img) for img in obrazky]}")
+    obrazky, zapujcky = vybrat_pro_uzel(adresar, obrazky, shard, zapujcky, platnost_zapujcek)
+    
+    manifest = None
+    if inkrementalne:
+        manifest, obrazky = otevrit_manifest(adresar, obrazky)
+        if not obrazky:
+            print("Všechny obrázky mají aktuální výstup, není co zpracovat.")
+            return
+    
+    print("Zpracovávám každý obrázek jednotlivo pre presné sledovanie tokenů...")
+    
+    # Jeden klient pro všechny obrázky - API klíč čteme jen jednou
+    vykonavac = vytvorit_vykonavac()
+    if not vykonavac:
+        return
+    
+    # Tokeny, náklady i časy etap sbírají metriky běhu
+    metriky = otevrit_metriky(adresar, prometheus_soubor, rezim="3", rozpocet=rozpocet)
+    
+    if predzpracovani is not None:
+        predzpracovani.naplanovat(obrazky)
+    
+    model = kaskada.modely[0] if kaskada is not None else MODEL_DEFAULT
+    kontext = SpravceKontextoveCache(vykonavac.client, model, PROMPT_EXTRAKCE) if kontextova_cache else None
+    
+    try:
+        # Zpracujeme každý obrázek jednotlivo
+        for i, obrazek_cesta in enumerate(obrazky, 1):
+            if rozpocet is not None and rozpocet.zastaveno:
+                break
+            if zapujcky is not None and not zabrat_obrazky(zapujcky, [obrazek_cesta]):
+                if predzpracovani is not None:
+                    predzpracovani.zrusit([obrazek_cesta])
+                print(f"\n--- Obrázek {i}/{len(obrazky)}: {os.path.basename(obrazek_cesta)} zpracovává jiný uzel ---")
+                continue
+            print(f"\n--- Zpracovávám obrázek {i}/{len(obrazky)}: {os.path.basename(obrazek_cesta)} ---")
+            
+            # Spracujeme jednotlivý obrázek
+            try:
+                zpracovat_jeden_obrazek_s_metrami(obrazek_cesta, vykonavac=vykonavac, cache=cache,
+                                                  manifest=manifest, predzpracovani=predzpracovani, kontext=kontext,
+                                                  strukturovany_vystup=strukturovany_vystup, metriky=metriky,
+                                                  duplicity=duplicity, kaskada=kaskada)
+            finally:
+                if zapujcky is not None:
+                    zapujcky.uvolnit(obrazek_cesta)
+    finally:
+        if predzpracovani is not None:
+            # Obrázky, které nedošly na řadu (jiný uzel, rozpočet), předzpracování nepotřebují
+            predzpracovani.zrusit(obrazky)
+        if kontext is not None:
+            kontext.smazat()
+        if zapujcky is not None:
+            zapujcky.zavrit()
+        metriky.zavrit()
+    
+    vypsat_souhrn(pocet_zpracovanych(obrazky, metriky), metriky, kontext)
+
+def zpracovat_davku_soubezne(adresar="example", pripony=PRIPONY_OBRAZKU, max_soubezne=8, cache=None,
+                             inkrementalne=False, predzpracovani=None, kontextova_cache=False,
+                             strukturovany_vystup=False, prometheus_soubor=None, shard=None, zapujcky=False,
+                             platnost_zapujcek=600, duplicity=None, kaskada=None, obrazky=None, rozpocet=None):
+    """
+    Zpracuje obrázky jednotlivo, ale více požadavků najednou.
+    
+    Každý obrázek jde v samostatném požadavku jako v režimu 3, takže tokeny
+    a náklady jsou přesné pro každý soubor. Všechna vlákna sdílejí jednoho
+    klienta (a tím i jeden connection pool), čekání na síť se překrývá.
+    
+    Args:
+        adresar: Adresář s obrázky
+        pripony: Podporované přípony souborů
+        max_soubezne: Maximální počet požadavků odeslaných současně (default: 8)
+        cache: Volitelná CacheExtrakci (sdílená všemi vlákny)
+        inkrementalne: Přeskočit obrázky s aktuálním výstupem podle manifestu adresáře
+        predzpracovani: Volitelné Predzpracovani - běží v procesech souběžně se síťovými požadavky
+        kontextova_cache: Uložit prompt do kontextové cache Gemini místo posílání s každým obrázkem
+        strukturovany_vystup: Vynutit JSON odpověď podle SCHEMA_UCTENKY
+        prometheus_soubor: Volitelná cesta k Prometheus textfile se souhrnem běhu
+        shard: Volitelná dvojice (i, N) - zpracovat jen i-tý z N dílů adresáře (viz vybrat_shard)
+        zapujcky: Zabírat obrázky zápůjčkami, aby je souběžně nezpracoval jiný uzel (viz ZapujckyObrazku)
+        platnost_zapujcek: Po kolika sekundách bez obnovení zápůjčka spadlého uzlu propadne
+        duplicity: Volitelný IndexDuplicit - kopie už zpracovaného obrázku převezme jeho výsledek
+        kaskada: Volitelná KaskadaModelu - účtenku, která neprojde kontrolou, zpracuje dražší model
+        obrazky: Volitelný seznam obrázků adresáře ke zpracování (jinak všechny s příponami pripony)
+        rozpocet: Volitelný RozpocetBehu - po jeho vyčerpání se další obrázky neodešlou
+    """
+    print(f"Hledám obrázky v adresáři '{adresar}'...")
+    
+    # Najdeme všechny soubory s podporovanými příponami
+    if obrazky is None:
+        obrazky = najit_obrazky(adresar, pripony)
+    
+    if not obrazky:
+        print(f"V adresáři '{adresar}' nebyly nalezeny žádné obrázky s příponami {pripony}")
+        return
+    
+    print(f"Nalezeno {len(obrazky)} obrázků: {[os.path.basename(img) for img in obrazky]}")
+    obrazky, zapujcky = vybrat_pro_uzel(adresar, obrazky, shard, zapujcky, platnost_zapujcek)
+    
+    manifest = None
+    if inkrementalne:
+        manifest, obrazky = otevrit_manifest(adresar, obrazky)
+        if not obrazky:
+            print("Všechny obrázky mají aktuální výstup, není co zpracovat.")
+            return
+    
+    print(f"Zpracovávám jednotlivo, nejvýše {max_soubezne} požadavků souběžně...")
+    
+    # Jeden vykonavatel pro všechna vlákna - sdílí klienta i limit kvóty, takže
+    # souběžné požadavky jedou co nejblíž kvótě, ale nepřekročí ji. Stránky PDF
+    # posílá víc vláken najednou, do max_soubezne se proto počítají ve vykonavateli
+    vykonavac = vytvorit_vykonavac(max_soubezne)
+    if not vykonavac:
+        return
+    
+    # Metriky sdílejí všechna vlákna - sčítají tokeny, náklady i časy etap
+    metriky = otevrit_metriky(adresar, prometheus_soubor, rezim="4", rozpocet=rozpocet)
+    hotovo = 0
+    
+    if predzpracovani is not None:
+        predzpracovani.naplanovat(obrazky)
+    
+    # Kontextovou cache sdílejí všechna vlákna - vytvoří se jednou při prvním požadavku
+    model = kaskada.modely[0] if kaskada is not None else MODEL_DEFAULT
+    kontext = SpravceKontextoveCache(vykonavac.client, model, PROMPT_EXTRAKCE) if kontextova_cache else None
+    
+    try:
+        # Stav každého obrázku - podle něj se pozná obrázek odložený kvůli rozpočtu
+        stavy = {obrazek_cesta: {} for obrazek_cesta in obrazky}
+        with ThreadPoolExecutor(max_workers=max_soubezne) as executor:
+            futures = {
+                executor.submit(zpracovat_se_zapujckou, zapujcky, obrazek_cesta, vykonavac,
+                                cache=cache, manifest=manifest, predzpracovani=predzpracovani,
+                                kontext=kontext, strukturovany_vystup=strukturovany_vystup,
+                                metriky=metriky, duplicity=duplicity, kaskada=kaskada,
+                                vysledek=stavy[obrazek_cesta]): obrazek_cesta
+                for obrazek_cesta in obrazky
+            }
+            for future in as_completed(futures):
+                if rozpocet is not None and rozpocet.zastaveno:
+                    # Rozpočet je vyčerpaný - obrázky, které ještě nezačaly, zpracuje příští běh
+                    for cekajici in futures:
+                        cekajici.cancel()
+                if future.cancelled():
+                    continue
+                obrazek_cesta = futures[future]
+                hotovo += 1
+                try:
+                    vysledek = future.result()
+                except Exception as e:
+                    # zpracovat_jeden_obrazek_s_metrami chyby API zachytává sám, sem se dostanou jen neočekávané
+                    print(f"❌ Neočekávaná chyba u '{os.path.basename(obrazek_cesta)}': {e}")
+                    continue
+                if vysledek is None:
+                    print(f"[{hotovo}/{len(obrazky)}] {os.path.basename(obrazek_cesta)} zpracovává jiný uzel")
+                    continue
+                if stavy[obrazek_cesta].get("status") == 'ROZPOCET':
+                    print(f"[{hotovo}/{len(obrazky)}] {os.path.basename(obrazek_cesta)} odložen - rozpočet vyčerpán")
+                    continue
+                print(f"[{hotovo}/{len(obrazky)}] {os.path.basename(obrazek_cesta)} dokončen")
+    finally:
+        if predzpracovani is not None:
+            # Obrázky, které nedošly na řadu (jiný uzel, rozpočet), předzpracování nepotřebují
+            predzpracovani.zrusit(obrazky)
+        if kontext is not None:
+            kontext.smazat()
+        if zapujcky is not None:
+            zapujcky.zavrit()
+        metriky.zavrit()
+    
+    vypsat_souhrn(pocet_zpracovanych(obrazky, metriky), metriky, kontext)
+
+def zpracovat_automaticky(adresar="example", pripony=PRIPONY_OBRAZKU, rozpocet=None, kriterium="naklady", vzorek=4,
+                          velikost_davky=5, max_soubezne=8, cache=None, inkrementalne=False, predzpracovani=None,
+                          kontextova_cache=False, strukturovany_vystup=False, prometheus_soubor=None, duplicity=None,
+                          kaskada=None):
+    """
+    Vybere režim podle změřeného vzorku - dávky (režim 2), nebo jednotlivě souběžně (režim 4).
+    
+    Prvních vzorek obrázků zpracuje v dávkách, dalších vzorek jednotlivě
+    souběžně a porovná tokeny a náklady na obrázek (klouzavý průměr
+    z RozpocetBehu) i propustnost. Zbytek adresáře pak zpracuje levnějším
+    (kriterium "naklady"), nebo rychlejším ("rychlost") režimem - rychlejším
+    jen tehdy, když se zbytek při jeho ceně vejde do rozpočtu. Rozpočet hlídá
+    všechny fáze; po jeho vyčerpání se další fáze už nespustí.
+    
+    Args:
+        adresar: Adresář s obrázky
+        pripony: Podporované přípony souborů
+        rozpocet: Volitelný RozpocetBehu (bez něj se jen měří a vybírá režim)
+        kriterium: "naklady" (levnější režim) nebo "rychlost" (rychlejší režim)
+        vzorek: Kolik obrázků změřit každým z režimů
+        velikost_davky: Velikost dávky v režimu 2
+        max_soubezne: Počet souběžných požadavků v režimu 4
+        cache, inkrementalne, predzpracovani, kontextova_cache, strukturovany_vystup, prometheus_soubor,
+        duplicity, kaskada: Jako u zpracovat_davku_uctenek a zpracovat_davku_soubezne
+    """
+    if rozpocet is None:
+        rozpocet = RozpocetBehu()
+    obrazky = najit_obrazky(adresar, pripony)
+    if not obrazky:
+        print(f"V adresáři '{adresar}' nebyly nalezeny žádné obrázky s příponami {pripony}")
+        return
+    if inkrementalne:
+        manifest, obrazky = otevrit_manifest(adresar, obrazky)
+        manifest.zavrit()
+        if not obrazky:
+            print("Všechny obrázky mají aktuální výstup, není co zpracovat.")
+            return
+    
+    rezimy = {"2": "dávky", "4": "jednotlivo souběžně"}
+    spolecne = dict(pripony=pripony, cache=cache, inkrementalne=inkrementalne, predzpracovani=predzpracovani,
+                    kontextova_cache=kontextova_cache, strukturovany_vystup=strukturovany_vystup,
+                    prometheus_soubor=prometheus_soubor, duplicity=duplicity, kaskada=kaskada, rozpocet=rozpocet)
+    
+    def spustit(rezim, cast):
+        if rezim == "2":
+            zpracovat_davku_uctenek(adresar, velikost_davky=velikost_davky, obrazky=cast, **spolecne)
+        else:
+            zpracovat_davku_soubezne(adresar, max_soubezne=max_soubezne, obrazky=cast, **spolecne)
+    
+    # Změříme oba režimy na vzorku - malý adresář měřit nemá smysl
+    propustnost = {}
+    zbytek = obrazky
+    if len(obrazky) > 2 * vzorek:
+        for cislo, rezim in enumerate(rezimy):
+            cast = obrazky[cislo * vzorek:(cislo + 1) * vzorek]
+            print(f"\n=== Vzorek: {len(cast)} obrázků v režimu {rezim} ({rezimy[rezim]}) ===")
+            zacatek = time.perf_counter()
+            spustit(rezim, cast)
+            propustnost[rezim] = len(cast) / (time.perf_counter() - zacatek)
+            if rozpocet.zastaveno:
+                return
+        zbytek = obrazky[2 * vzorek:]
+    
+    na_obrazek = {rezim: rozpocet.na_obrazek(rezim) for rezim in rezimy}
+    if propustnost:
+        print("\n📐 Změřeno na vzorku:")
+        for rezim, popis in rezimy.items():
+            if na_obrazek[rezim] is None:
+                print(f"   režim {rezim} ({popis}): žádný placený požadavek (cache, duplikáty nebo chyby)")
+                continue
+            tokeny, naklady = na_obrazek[rezim]
+            print(f"   režim {rezim} ({popis}): {tokeny:.0f} tokenů a ${naklady:.6f} USD na obrázek, "
+                  f"{propustnost[rezim]:.2f} obrázků/s")
+    
+    # Bez měření volíme podle povahy režimů - dávka sdílí prompt, souběžné požadavky jsou rychlejší
+    zmerene = [rezim for rezim in rezimy if na_obrazek[rezim] is not None]
+    levnejsi = min(zmerene, key=lambda rezim: na_obrazek[rezim][1], default="2")
+    rychlejsi = max(zmerene, key=lambda rezim: propustnost[rezim], default="4")
+    rezim = levnejsi
+    if kriterium == "rychlost":
+        rezim = rychlejsi
+        if rychlejsi != levnejsi and not rozpocet.vejde_se(len(zbytek), rychlejsi):
+            print(f"Zbytek by se v rychlejším režimu {rychlejsi} do rozpočtu nevešel, volím levnější.")
+            rezim = levnejsi
+    print(f"\n➡️  Zbylých {len(zbytek)} obrázků zpracuji v režimu {rezim} ({rezimy[rezim]}).")
+    if zbytek:
+        spustit(rezim, zbytek)
+    if rozpocet.max_usd is not None or rozpocet.max_tokenu is not None:
+        print(f"Čerpání rozpočtu: {rozpocet.popis()}")
+
+class DavkovaUloha:
+    """
+    Asynchronní úloha Batch API nad jedním adresářem jako navazovatelný stavový automat.
+    
+    PRIPRAVENA (požadavky zapsané do JSONL) -> NAHRANA (JSONL nahraný přes
+    Files API) -> ODESLANA (úloha vytvořena) -> DOKONCENA (úloha skončila) ->
+    VYZVEDNUTA (výsledky rozepsané do .json souborů a knihy spotřeby).
+    Po každém přechodu se stav atomicky uloží do ULOHA_SOUBOR, takže přerušený
+    proces (Ctrl+C, pád, vypnutý stroj) pokračuje od posledního dokončeného kroku.
+    Úloha se posílá s jedinečným display_name - pokud proces spadl mezi
+    vytvořením úlohy a uložením stavu, úloha se dohledá a neodešle se podruhé.
+    """
+    
+    KONCOVE_STAVY = ("JOB_STATE_SUCCEEDED", "JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED")
+    
+    def __init__(self, adresar, client, hodiny=time.time, spat=time.sleep):
+        """
+        Args:
+            adresar: Zpracovávaný adresář (stav úlohy se ukládá do něj)
+            client: genai.Client (nebo jeho náhrada s rozhraním files a batches)
+            hodiny: Zdroj času - kvůli testům
+            spat: Funkce pro čekání mezi dotazy na stav - kvůli testům
+        """
+        self.adresar = adresar
+        self.client = client
+        self.hodiny = hodiny
+        self.spat = spat
+        self.cesta = os.path.join(adresar, ULOHA_SOUBOR)
+        self.stav = None
+        if os.path.exists(self.cesta):
+            with open(self.cesta, encoding="utf-8") as f:
+                self.stav = json.load(f)
+    
+    @property
+    def faze(self):
+        """Aktuální fáze úlohy, nebo None, pokud žádná není rozpracovaná."""
+        return self.stav["faze"] if self.stav is not None else None
+    
+    def _ulozit(self, **zmeny):
+        """Přejde do další fáze - stav zapíše atomicky přes dočasný soubor."""
+        self.stav.update(zmeny, aktualizovano=datetime.now().isoformat(timespec="seconds"))
+        docasny = f"{self.cesta}.tmp"
+        with open(docasny, "w", encoding="utf-8") as f:
+            json.dump(self.stav, f, ensure_ascii=False, indent=2)
+        os.replace(docasny, self.cesta)
+    
+    def pripravit(self, obrazky, model=MODEL_DEFAULT, predzpracovani=None, strukturovany_vystup=False,
+                  klice_cache=None, rozpocet=None):
+        """
+        Zapíše požadavky pro všechny obrázky do JSONL souboru (jeden řádek = jeden obrázek).
+        
+        Args:
+            obrazky: Cesty k obrázkům
+            model: Název modelu
+            predzpracovani: Volitelné Predzpracovani
+            strukturovany_vystup: Vynutit JSON odpověď podle SCHEMA_UCTENKY
+            klice_cache: Volitelný slovník cesta -> klíč CacheExtrakci, výsledky se pak uloží do cache
+            rozpocet: Volitelný RozpocetBehu - obrázky, které se do něj podle odhadu ceny nevejdou,
+                      se do úlohy nezařadí (zpracuje je příští úloha)
+        
+        Returns:
+            int: Počet zapsaných požadavků
+        """
+        soubor = os.path.join(self.adresar, ULOHA_POZADAVKY_SOUBOR)
+        generation_config = {}
+        if strukturovany_vystup:
+            generation_config = {"response_mime_type": "application/json", "response_json_schema": SCHEMA_UCTENKY}
+        
+        klice = {}
+        poznamky = {}
+        if predzpracovani is not None:
+            predzpracovani.naplanovat(obrazky)
+        with open(f"{soubor}.tmp", "w", encoding="utf-8") as f:
+            for i, obrazek_cesta in enumerate(obrazky):
+                try:
+                    with open(obrazek_cesta, "rb") as obrazek:
+                        obrazek_data = obrazek.read()
+                except OSError as e:
+                    print(f"Chyba při načítání obrázku '{obrazek_cesta}': {e}")
+                    if predzpracovani is not None:
+                        predzpracovani.zrusit([obrazek_cesta])
+                    continue
+                data, mime_type, odhad_obrazku, poznamka = pripravit_obrazek(obrazek_cesta, obrazek_data,
+                                                                             predzpracovani)
+                if rozpocet is not None:
+                    tokeny = odhad_obrazku + odhadnout_tokeny_textu(PROMPT_EXTRAKCE)
+                    naklady = vypocitat_naklady(tokeny, model) * SLEVA_BATCH_API
+                    if not rozpocet.povolit("5", 1, (tokeny, naklady)):
+                        if predzpracovani is not None:
+                            predzpracovani.zrusit(obrazky[i + 1:])
+                        break
+                    # Odeslaná úloha se zaplatí celá - odhad rovnou započítáme, skutečnou cenu zapíše vyzvednutí
+                    rozpocet.zaplatit(1, tokeny, naklady)
+                klic = f"obrazek-{i}"
+                pozadavek = {"contents": [{"role": "user", "parts": [
+                    {"inline_data": {"mime_type": mime_type, "data": base64.b64encode(data).decode("ascii")}},
+                    {"text": PROMPT_EXTRAKCE},
+                ]}]}
+                if generation_config:
+                    pozadavek["generation_config"] = generation_config
+                f.write(json.dumps({"key": klic, "request": pozadavek}, ensure_ascii=False) + "\n")
+                klice[klic] = os.path.basename(obrazek_cesta)
+                if poznamka:
+                    poznamky[klic] = poznamka
+        os.replace(f"{soubor}.tmp", soubor)
+        
+        self.stav = {
+            "faze": "PRIPRAVENA",
+            "model": model,
+            # Podle display_name se úloha dohledá, pokud proces spadne hned po jejím vytvoření
+            "display_name": f"uctenky-{os.urandom(6).hex()}",
+            "vytvoreno": datetime.now().isoformat(timespec="seconds"),
+            "klice": klice,
+            "poznamky": poznamky,
+            "klice_cache": {klic: klice_cache[os.path.join(self.adresar, nazev)]
+                            for klic, nazev in klice.items()
+                            if klice_cache and os.path.join(self.adresar, nazev) in klice_cache},
+        }
+        self._ulozit()
+        return len(klice)
+    
+    def nahrat(self):
+        """Nahraje JSONL s požadavky přes Files API."""
+        soubor = os.path.join(self.adresar, ULOHA_POZADAVKY_SOUBOR)
+        nahrany = self.client.files.upload(file=soubor, config={"display_name": self.stav["display_name"],
+                                                                "mime_type": "jsonl"})
+        print(f"📤 Požadavky nahrány jako '{nahrany.name}'")
+        self._ulozit(faze="NAHRANA", soubor_pozadavku=nahrany.name)
+    
+    def _najit_odeslanou(self):
+        """Dohledá už vytvořenou úlohu podle display_name (po pádu mezi vytvořením a uložením stavu)."""
+        try:
+            for uloha in self.client.batches.list():
+                if getattr(uloha, "display_name", None) == self.stav["display_name"]:
+                    return uloha
+        except Exception as e:
+            print(f"⚠️  Seznam úloh se nepodařilo načíst ({e}), vytvářím novou.")
+        return None
+    
+    def odeslat(self):
+        """Vytvoří úlohu Batch API nad nahraným souborem."""
+        uloha = self._najit_odeslanou()
+        if uloha is None:
+            uloha = self.client.batches.create(model=self.stav["model"], src=self.stav["soubor_pozadavku"],
+                                               config={"display_name": self.stav["display_name"]})
+        print(f"🚀 Úloha '{uloha.name}' odeslána ({len(self.stav['klice'])} požadavků)")
+        self._ulozit(faze="ODESLANA", uloha=uloha.name, odeslano=self.hodiny())
+    
+    @staticmethod
+    def _nazev_stavu(stav):
+        # SDK vrací enum JobState, náhrady klidně obyčejný text
+        return getattr(stav, "name", None) or str(stav)
+    
+    def zkontrolovat(self):
+        """
+        Zeptá se na stav odeslané úlohy.
+        
+        Returns:
+            bool: True, pokud úloha skončila (úspěšně i neúspěšně)
+        """
+        uloha = self.client.batches.get(name=self.stav["uloha"])
+        stav = self._nazev_stavu(uloha.state)
+        if stav not in self.KONCOVE_STAVY:
+            print(f"⏳ Úloha '{uloha.name}': {stav} (čeká {self.hodiny() - self.stav['odeslano']:.0f} s)")
+            return False
+        
+        vysledky = getattr(getattr(uloha, "dest", None), "file_name", None)
+        chyba = getattr(uloha, "error", None)
+        print(f"🏁 Úloha '{uloha.name}' skončila: {stav}")
+        self._ulozit(faze="DOKONCENA", stav_ulohy=stav, soubor_vysledku=vysledky,
+                     chyba=str(chyba) if chyba else None, trvani_s=self.hodiny() - self.stav["odeslano"])
+        return True
+    
+    @staticmethod
+    def _text_odpovedi(odpoved):
+        """Text první kandidátní odpovědi (bez částí s přemýšlením)."""
+        kandidati = odpoved.get("candidates") or []
+        if not kandidati:
+            raise ValueError("odpověď neobsahuje žádného kandidáta")
+        casti = (kandidati[0].get("content") or {}).get("parts") or []
+        return "".join(cast.get("text", "") for cast in casti if not cast.get("thought"))
+    
+    @staticmethod
+    def _usage_odpovedi(odpoved):
+        """usage_metadata z JSON odpovědi (REST používá camelCase) ve tvaru, kterému rozumí tokeny_odpovedi.
+        
+        Vrací obyčejný SimpleNamespace, takže vyzvednutí výsledků nepotřebuje naimportované SDK.
+        """
+        usage = odpoved.get("usageMetadata") or odpoved.get("usage_metadata") or {}
+        pole = {
+            "prompt_token_count": "promptTokenCount",
+            "candidates_token_count": "candidatesTokenCount",
+            "thoughts_token_count": "thoughtsTokenCount",
+            "cached_content_token_count": "cachedContentTokenCount",
+            "total_token_count": "totalTokenCount",
+        }
+        return SimpleNamespace(**{snake: usage.get(camel, usage.get(snake)) for snake, camel in pole.items()})
+    
+    def vyzvednout(self, cache=None, manifest=None, metriky=None):
+        """
+        Stáhne výsledky a rozepíše je do .json souborů vedle obrázků a do knihy spotřeby.
+        
+        Returns:
+            tuple: (úspěšně uložených obrázků: int, tokeny: int, náklady: float)
+        """
+        if metriky is None:
+            metriky = MetrikyBehu()
+        mereni = metriky.polozka("uloha", self.stav.get("uloha") or self.stav["display_name"], len(self.stav["klice"]))
+        model = self.stav["model"]
+        cas = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        data_reportu = []
+        zbyvajici = dict(self.stav["klice"])
+        uspesne, celkove_tokeny, celkove_naklady = 0, 0, 0.0
+        
+        if self.stav["stav_ulohy"] == "JOB_STATE_SUCCEEDED" and self.stav.get("soubor_vysledku"):
+            with mereni.etapa("sit"):
+                obsah = self.client.files.download(file=self.stav["soubor_vysledku"])
+            if isinstance(obsah, bytes):
+                obsah = obsah.decode("utf-8")
+            for radek in obsah.splitlines():
+                if not radek.strip():
+                    continue
+                with mereni.etapa("parsovani"):
+                    zaznam = json.loads(radek)
+                klic = zaznam.get("key")
+                nazev = zbyvajici.pop(klic, None)
+                if nazev is None:
+                    continue
+                obrazek_cesta = os.path.join(self.adresar, nazev)
+                if "response" not in zaznam:
+                    chyba = zaznam.get("error") or zaznam.get("status") or "odpověď chybí"
+                    data_reportu.append([cas, nazev, 0, 0.0, 'CHYBA_API', f'Batch API: {chyba}'])
+                    continue
+                
+                usage = self._usage_odpovedi(zaznam["response"])
+                vstup, _, vystup = tokeny_odpovedi(usage)
+                tokeny = vstup + vystup
+                naklady = naklady_odpovedi(usage, model) * SLEVA_BATCH_API
+                celkove_tokeny += tokeny
+                celkove_naklady += naklady
+                try:
+                    with mereni.etapa("parsovani", obrazek_cesta):
+                        data = zkontrolovat_data_uctenky(nacist_json_odpovedi(self._text_odpovedi(zaznam["response"])))
+                    with mereni.etapa("zapis", obrazek_cesta):
+                        _, json_text = ulozit_vystup_json(obrazek_cesta, data)
+                        if cache is not None and klic in self.stav["klice_cache"]:
+                            cache.ulozit(self.stav["klice_cache"][klic], model, json_text,
+                                         usage_do_slovniku(usage))
+                except (json.JSONDecodeError, ValueError) as e:
+                    data_reportu.append([cas, nazev, tokeny, naklady, 'CHYBA_JSON', str(e)])
+                    continue
+                except OSError as e:
+                    data_reportu.append([cas, nazev, tokeny, naklady, 'CHYBA_UKLADANI', str(e)])
+                    continue
+                poznamka = f"Batch API úloha {self.stav['uloha']} - presné údaje, {SLEVA_BATCH_API:.0%} ceny"
+                if klic in self.stav["poznamky"]:
+                    poznamka += f"; {self.stav['poznamky'][klic]}"
+                data_reportu.append([cas, nazev, tokeny, naklady, 'USPECH_BATCH_API', poznamka,
+                                     najit_prodejce(data)])
+                uspesne += 1
+        
+        # Obrázky bez výsledku (neúspěšná úloha, chybějící řádek) se zapíšou jako chyba - zkusí je příští běh
+        duvod = self.stav.get("chyba") or f"úloha skončila stavem {self.stav['stav_ulohy']}"
+        for nazev in zbyvajici.values():
+            data_reportu.append([cas, nazev, 0, 0.0, 'CHYBA_API', f'Batch API: výsledek chybí ({duvod})'])
+        
+        with mereni.etapa("zapis"):
+            ulozit_report_spotreby(self.adresar, data_reportu, manifest=manifest)
+            kniha_spotreby(self.adresar).vyprazdnit()
+        metriky.dokoncit(mereni, 'USPECH_BATCH_API' if uspesne == len(self.stav["klice"]) else
+                         'CASTECNE' if uspesne else 'CHYBA_API', uspesnych=uspesne, tokeny=celkove_tokeny,
+                         naklady=celkove_naklady)
+        self._ulozit(faze="VYZVEDNUTA", uspesnych=uspesne)
+        return uspesne, celkove_tokeny, celkove_naklady
+    
+    def uklidit(self):
+        """Po vyzvednutí smaže stav a lokální JSONL s požadavky (výsledky už jsou v knize spotřeby)."""
+        for soubor in (self.cesta, os.path.join(self.adresar, ULOHA_POZADAVKY_SOUBOR)):
+            try:
+                os.remove(soubor)
+            except FileNotFoundError:
+                pass
+        self.stav = None
+    
+    def pokracovat(self, cekat=True, interval=60, cache=None, manifest=None, metriky=None):
+        """
+        Posune úlohu co nejdál - od libovolné fáze až po vyzvednutí výsledků.
+        
+        Args:
+            cekat: Čekat na dokončení úlohy; jinak se stav zkontroluje jen jednou (vhodné pro cron)
+            interval: Kolik sekund čekat mezi dotazy na stav úlohy
+            cache, manifest, metriky: Předají se do vyzvednout()
+        
+        Returns:
+            bool: True, pokud jsou výsledky vyzvednuté
+        """
+        if self.faze == "PRIPRAVENA":
+            self.nahrat()
+        if self.faze == "NAHRANA":
+            self.odeslat()
+        while self.faze == "ODESLANA":
+            if self.zkontrolovat():
+                break
+            if not cekat:
+                print("Úloha ještě běží - výsledky vyzvedne příští spuštění.")
+                return False
+            self.spat(interval)
+        if self.faze == "DOKONCENA":
+            self.vyzvednout(cache=cache, manifest=manifest, metriky=metriky)
+        return self.faze == "VYZVEDNUTA"
+
+def zpracovat_davkovou_ulohou(adresar="example", pripony=PRIPONY_OBRAZKU, cache=None, inkrementalne=True,
+                              predzpracovani=None, strukturovany_vystup=False, prometheus_soubor=None, cekat=True,
+                              interval=60, model=MODEL_DEFAULT, duplicity=None, rozpocet=None):
+    """
+    Zpracuje adresář asynchronní úlohou Batch API - za polovinu ceny, výsledky do 24 hodin.
+    
+    Pokud v adresáři už je rozpracovaná úloha, jen se naváže na ni (nové
+    obrázky se přidají až do další úlohy). Jinak se obrázky vyberou stejně
+    jako v ostatních režimech (manifest, cache) a odešle se nová úloha.
+    Přerušení (Ctrl+C) úlohu nezruší - stačí příkaz spustit znovu.
+    
+    Args:
+        adresar: Adresář s obrázky
+        pripony: Podporované přípony souborů
+        cache: Volitelná CacheExtrakci - obrázky nalezené v cache se do úlohy nezařadí
+        inkrementalne: Přeskočit obrázky s aktuálním výstupem podle manifestu adresáře
+        predzpracovani: Volitelné Predzpracovani - obrázky se před zápisem do úlohy zmenší a překódují
+        strukturovany_vystup: Vynutit JSON odpověď podle SCHEMA_UCTENKY
+        prometheus_soubor: Volitelná cesta k Prometheus textfile se souhrnem běhu
+        cekat: Čekat na dokončení úlohy (jinak jen odeslat / zkontrolovat a skončit)
+        interval: Kolik sekund čekat mezi dotazy na stav úlohy
+        model: Název modelu
+        duplicity: Volitelný IndexDuplicit - kopie už zpracovaných obrázků se do úlohy nezařadí
+        rozpocet: Volitelný RozpocetBehu - nová úloha dostane jen obrázky, které se do něj podle odhadu vejdou
+    
+    Returns:
+        bool: True, pokud jsou výsledky vyzvednuté (nebo nebylo co zpracovat)
+    """
+    client = vytvorit_klienta()
+    if not client:
+        return False
+    uloha = DavkovaUloha(adresar, client)
+    manifest = ManifestZpracovani(adresar) if inkrementalne else None
+    
+    if uloha.faze is not None and uloha.faze != "VYZVEDNUTA":
+        print(f"Navazuji na rozpracovanou úlohu v '{adresar}' (fáze {uloha.faze}).")
+    else:
+        uloha.uklidit()
+        obrazky = najit_obrazky(adresar, pripony)
+        if manifest is not None:
+            obrazky = manifest.vybrat_ke_zpracovani(obrazky)
+        klice_cache = {}
+        if cache is not None or duplicity is not None:
+            zbyvajici = []
+            prompt_klice = prompt_pro_klic(PROMPT_EXTRAKCE, predzpracovani,
+                                           SCHEMA_UCTENKY if strukturovany_vystup else None)
+            for obrazek_cesta in obrazky:
+                try:
+                    with open(obrazek_cesta, "rb") as f:
+                        obrazek_data = f.read()
+                except OSError as e:
+                    # Nečitelný soubor do úlohy nezařadíme, ostatní obrázky se odešlou
+                    print(f"Chyba při načítání obrázku '{obrazek_cesta}': {e}")
+                    cas = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                    ulozit_report_spotreby(adresar, [[cas, os.path.basename(obrazek_cesta), 0, 0.0, 'CHYBA_NACTENI',
+                                                      str(e)]], manifest=manifest)
+                    continue
+                if cache is not None and pouzit_vysledek_z_cache(cache, obrazek_cesta, obrazek_data, prompt_klice,
+                                                                 model, manifest=manifest):
+                    continue
+                if duplicity is not None and pouzit_duplikat(duplicity, obrazek_cesta, obrazek_data,
+                                                             manifest=manifest):
+                    continue
+                if cache is not None:
+                    klice_cache[obrazek_cesta] = CacheExtrakci.vytvorit_klic(obrazek_data, prompt_klice, model)
+                zbyvajici.append(obrazek_cesta)
+            obrazky = zbyvajici
+        if not obrazky:
+            print("Všechny obrázky mají aktuální výstup, není co zpracovat.")
+            return True
+        if rozpocet is not None:
+            rozpocet.pripojit(adresar)
+        pocet = uloha.pripravit(obrazky, model, predzpracovani=predzpracovani,
+                                strukturovany_vystup=strukturovany_vystup, klice_cache=klice_cache, rozpocet=rozpocet)
+        if not pocet:
+            if rozpocet is not None and rozpocet.zastaveno:
+                print("Do rozpočtu se nevejde ani jeden obrázek, úlohu neodesílám.")
+            else:
+                print("Žádný obrázek se nepodařilo načíst, úlohu neodesílám.")
+            uloha.uklidit()
+            return False
+        print(f"Připraveno {pocet} požadavků do '{os.path.join(adresar, ULOHA_POZADAVKY_SOUBOR)}'.")
+    
+    metriky = otevrit_metriky(adresar, prometheus_soubor, rezim="5")
+    try:
+        hotovo = uloha.pokracovat(cekat=cekat, interval=interval, cache=cache, manifest=manifest, metriky=metriky)
+    except KeyboardInterrupt:
+        print(f"\nPřerušeno ve fázi {uloha.faze} - úloha běží dál, pokračujte opětovným spuštěním.")
+        return False
+    finally:
+        metriky.zavrit()
+    
+    if hotovo:
+        print(f"\nHotovo! Úspěšně zpracováno {uloha.stav.get('uspesnych', 0)} z {len(uloha.stav['klice'])} obrázků "
+              f"(úloha trvala {uloha.stav.get('trvani_s', 0) / 60:.1f} min).")
+        vypsat_souhrn(len(uloha.stav["klice"]), metriky)
+        if duplicity is not None:
+            duplicity.potvrdit_hotove([os.path.join(adresar, nazev) for nazev in uloha.stav["klice"].values()])
+        uloha.uklidit()
+    return hotovo
+
+def pocet_zpracovanych(obrazky, metriky):
+    """Kolik obrázků běh skutečně zpracoval - bez těch, které kvůli rozpočtu nechal na příští běh."""
+    if metriky.rozpocet is None:
+        return len(obrazky)
+    return sum(1 for zaznam in metriky.zaznamy if zaznam["status"] != 'ROZPOCET')
+
+def vypsat_souhrn(pocet_obrazku, metriky, kontext=None):
+    """
+    Vypíše souhrn za zpracovaný adresář z metrik běhu.
+    
+    Kromě tokenů a nákladů (včetně uložení kontextové cache) ukáže propustnost,
+    percentily latence a etapy, ve kterých běh strávil nejvíc času.
+    """
+    celkove_tokeny = metriky.tokeny
+    celkove_naklady = metriky.naklady
+    if kontext is not None:
+        celkove_naklady += kontext.naklady_ulozeni()
+    print(f"\n🎯 SÚHRN:")
+    print(f"Celkom spracovaných obrázkov: {pocet_obrazku}")
+    print(f"Celkové tokeny: {celkove_tokeny}")
+    print(f"Celkové náklady: ${celkove_naklady:.6f} USD")
+    if kontext is not None and kontext.naklady_ulozeni():
+        print(f"  z toho uložení kontextové cache: ${kontext.naklady_ulozeni():.6f} USD")
+    print(f"Priemer na obrázok: {celkove_tokeny//pocet_obrazku if pocet_obrazku else 0} tokenov, ${celkove_naklady/pocet_obrazku if pocet_obrazku else 0:.6f} USD")
+    metriky.vypsat()
+    if metriky.soubor is not None:
+        print(f"Metriky jednotlivých položek uloženy do '{metriky.soubor}'")
+
+def zpracovat_jeden_obrazek_s_metrami(nazev_obrazku, vykonavac=None, model=MODEL_DEFAULT, cache=None, manifest=None,
+                                      predzpracovani=None, kontext=None, strukturovany_vystup=False, metriky=None,
+                                      duplicity=None, kaskada=None, vysledek=None):
+    """
+    Spracuje jeden obrázek a vráti tokeny a náklady.
+    
+    Args:
+        nazev_obrazku: Cesta k obrázku
+        vykonavac: Sdílený VykonavacPozadavku nebo genai.Client (pokud není zadán, vytvoří se nový)
+        model: Název modelu
+        cache: Volitelná CacheExtrakci - zásah stojí 0 tokenů
+        manifest: Volitelný ManifestZpracovani, do kterého se zaznamená výsledek
+        predzpracovani: Volitelné Predzpracovani - obrázek se před odesláním zmenší a překóduje
+        kontext: Volitelný SpravceKontextoveCache s PROMPT_EXTRAKCE - prompt se pak neposílá
+        strukturovany_vystup: Vynutit JSON odpověď podle SCHEMA_UCTENKY
+        metriky: Volitelné MetrikyBehu - zaznamenají se časy etap obrázku
+        duplicity: Volitelný IndexDuplicit - kopie už zpracovaného obrázku převezme jeho výsledek
+        kaskada: Volitelná KaskadaModelu - účtenku, která neprojde kontrolou, zpracuje dražší model
+                 (jinak se použije jen model)
+        vysledek: Volitelný slovník, do kterého se zapíše status, data, model, tokeny, naklady_usd,
+                  nesrovnalosti a chyba (pro volající, kteří výsledek nečtou ze souboru - služba)
+    
+    Returns:
+        tuple: (tokeny: int, náklady: float)
+    """
+    if vysledek is None:
+        vysledek = {}
+    if metriky is None:
+        metriky = MetrikyBehu()
+    if kaskada is None:
+        kaskada = KaskadaModelu([model])
+    model = kaskada.nazev
+    mereni = metriky.polozka("obrazek", os.path.basename(nazev_obrazku))
+    
+    try:
+        with mereni.etapa("cteni"):
+            with open(nazev_obrazku, "rb") as f:
+                obrazek_data = f.read()
+    except FileNotFoundError:
+        print(f"Chyba: Obrázek '{nazev_obrazku}' nebyl nalezen.")
+        if predzpracovani is not None:
+            predzpracovani.zrusit([nazev_obrazku])
+        metriky.dokoncit(mereni, 'CHYBA_NACTENI')
+        vysledek.update(status='CHYBA_NACTENI', chyba="Obrázek nebyl nalezen")
+        return 0, 0.0
+    
+    prompt_klice = prompt_pro_klic(PROMPT_EXTRAKCE, predzpracovani, SCHEMA_UCTENKY if strukturovany_vystup else None)
+    if cache is not None:
+        with mereni.etapa("cache"):
+            z_cache = pouzit_vysledek_z_cache(cache, nazev_obrazku, obrazek_data, prompt_klice, model,
+                                              manifest=manifest)
+        if z_cache:
+            if predzpracovani is not None:
+                predzpracovani.zrusit([nazev_obrazku])
+            metriky.dokoncit(mereni, 'CACHE', uspesnych=1)
+            vysledek.update(status='CACHE', data=json.loads(z_cache), tokeny=0, naklady_usd=0.0)
+            return 0, 0.0
+    if duplicity is not None:
+        with mereni.etapa("duplicity"):
+            duplikat = pouzit_duplikat(duplicity, nazev_obrazku, obrazek_data, manifest=manifest)
+        if duplikat:
+            if predzpracovani is not None:
+                predzpracovani.zrusit([nazev_obrazku])
+            metriky.dokoncit(mereni, 'DUPLIKAT', uspesnych=1)
+            vysledek.update(status='DUPLIKAT', data=json.loads(duplikat), tokeny=0, naklady_usd=0.0)
+            return 0, 0.0
+    # Rozpočet hlídá každý požadavek (VykonavacPozadavku.generovat) - vyčerpaný už ani obrázek nenačítáme
+    if metriky.rozpocet_vycerpan:
+        if duplicity is not None:
+            duplicity.zapomenout(nazev_obrazku)
+        if predzpracovani is not None:
+            predzpracovani.zrusit([nazev_obrazku])
+        metriky.dokoncit(mereni, 'ROZPOCET')
+        vysledek.update(status='ROZPOCET', chyba="Rozpočet vyčerpán")
+        return 0, 0.0
+    
+    # Klienta vytvoříme jen pokud nám ho volající nepředal
+    if vykonavac is None:
+        vykonavac = vytvorit_vykonavac()
+        if not vykonavac:
+            if predzpracovani is not None:
+                predzpracovani.zrusit([nazev_obrazku])
+            vysledek.update(status='CHYBA', chyba="Chybí API klíč")
+            return 0, 0.0
+    vykonavac = zajistit_vykonavac(vykonavac)
+    
+    adresar = os.path.dirname(nazev_obrazku) or "."
+    
+    klic_cache = CacheExtrakci.vytvorit_klic(obrazek_data, prompt_klice, model)
+    
+    # Předzpracujeme obrázek (nebo jen určíme MIME typ), vícestránkové PDF rozdělíme na stránky
+    with mereni.etapa("priprava"):
+        stranky = pripravit_dokument(nazev_obrazku, obrazek_data, predzpracovani)
+    poznamka = stranky[0][3] if len(stranky) == 1 else f"PDF {len(stranky)} stran zpracováno po stránkách"
+    
+    # Pokusy modelů kaskády (model, tokeny, náklady, nesrovnalosti) - zahozené se v reportu objeví jako ESKALACE
+    pokusy = []
+    strany = []
+    try:
+        # Výstup se naparsuje a ověří ještě v kaskádě - na disk jde jen platný JSON
+        data, response, problemy = extrahovat_dokument(
+            kaskada, vykonavac, stranky, pokusy, strany, mereni, kontext=kontext,
+            schema=SCHEMA_UCTENKY if strukturovany_vystup else None, metriky=metriky)
+        model_vysledku, tokeny_vysledku, naklady_vysledku, _ = pokusy[-1]
+        
+        # Získáme presné údaje o tokenoch
+        tokeny = sum(pokus[1] for pokus in pokusy)
+        naklady_usd = sum(pokus[2] for pokus in pokusy)
+        
+        print(f"📊 Tokeny: {tokeny}, Náklady: ${naklady_usd:.6f} USD"
+              + (f" ({len(pokusy)} modely, výsledek {model_vysledku})" if len(pokusy) > 1 else ""))
+        
+        with mereni.etapa("zapis"):
+            nazev_vystupu, json_text = ulozit_vystup_json(nazev_obrazku, data)
+            
+            if cache is not None:
+                cache.ulozit(klic_cache, model_vysledku, json_text, usage_do_slovniku(response.usage_metadata))
+            
+            # Uložíme do reportu
+            cas = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            poznamka = 'Spracované jednotlivo - presné údaje' + (f'; {poznamka}' if poznamka else '') \
+                + (f'; nesrovnalosti: {"; ".join(problemy)}' if problemy else '')
+            # U dokumentu po stránkách nesou spotřebu řádky STRANKA, výsledný řádek už jen stav
+            prodejce = najit_prodejce(data)
+            data_reportu = radky_eskalace(cas, os.path.basename(nazev_obrazku), pokusy) \
+                + radky_stranek(cas, os.path.basename(nazev_obrazku), strany, prodejce) + [
+                [cas, os.path.basename(nazev_obrazku), 0 if strany else tokeny_vysledku,
+                 0.0 if strany else naklady_vysledku, 'USPECH_JEDNOTLIVO', poznamka, prodejce, model_vysledku]]
+            ulozit_report_spotreby(adresar, data_reportu, manifest=manifest)
+            if duplicity is not None:
+                duplicity.potvrdit(nazev_obrazku)
+        
+        print(f"✅ Uloženo: {os.path.basename(nazev_vystupu)}")
+        metriky.dokoncit(mereni, 'USPECH_JEDNOTLIVO', uspesnych=1, tokeny=tokeny, naklady=naklady_usd)
+        vysledek.update(status='USPECH_JEDNOTLIVO', data=data, model=model_vysledku, tokeny=tokeny,
+                        naklady_usd=naklady_usd, nesrovnalosti=problemy,
+                        strany=[tokeny_strany for _, tokeny_strany, _ in strany] or None)
+        return tokeny, naklady_usd
+    
+    except (json.JSONDecodeError, ValueError) as e:
+        print(f"❌ Neplatný JSON v odpovědi: {e}")
+        
+        # Tokeny už byly spotřebované, proto je zapíšeme i k chybě
+        cas = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        tokeny = sum(pokus[1] for pokus in pokusy)
+        naklady_usd = sum(pokus[2] for pokus in pokusy)
+        data_reportu = radky_eskalace(cas, os.path.basename(nazev_obrazku), pokusy)
+        if pokusy:
+            data_reportu.append([cas, os.path.basename(nazev_obrazku), pokusy[-1][1], pokusy[-1][2], 'CHYBA_JSON',
+                                 str(e), None, pokusy[-1][0]])
+        else:
+            data_reportu.append([cas, os.path.basename(nazev_obrazku), 0, 0.0, 'CHYBA_JSON', str(e)])
+        ulozit_report_spotreby(adresar, data_reportu, manifest=manifest)
+        if duplicity is not None:
+            duplicity.zapomenout(nazev_obrazku)
+        metriky.dokoncit(mereni, 'CHYBA_JSON', tokeny=tokeny, naklady=naklady_usd)
+        vysledek.update(status='CHYBA_JSON', chyba=str(e), tokeny=tokeny, naklady_usd=naklady_usd)
+        return tokeny, naklady_usd
         
-        print(f"Hotovo! Data byla úspěšně extrahována a uložena do souboru '{nazev_vystupu}'.")
-        print(f"Report o spotřebě uložen do '{os.path.join(adresar, 'report_spotreby.csv')}'")
-
+    except RozpocetVycerpan as e:
+        print(f"⛔ {os.path.basename(nazev_obrazku)}: {e} - obrázek zpracuje příští běh")
+        tokeny = sum(pokus[1] for pokus in pokusy)
+        naklady_usd = sum(pokus[2] for pokus in pokusy)
+        if pokusy:
+            # Nižší modely kaskády (nebo stránky PDF) se už zaplatily
+            cas = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            ulozit_report_spotreby(adresar, radky_eskalace(cas, os.path.basename(nazev_obrazku), pokusy + [None]),
+                                   manifest=manifest)
+        if duplicity is not None:
+            duplicity.zapomenout(nazev_obrazku)
+        metriky.dokoncit(mereni, 'ROZPOCET', tokeny=tokeny, naklady=naklady_usd)
+        vysledek.update(status='ROZPOCET', chyba=str(e), tokeny=tokeny, naklady_usd=naklady_usd)
+        return tokeny, naklady_usd
+    
     except Exception as e:
-        # V případě chyby také uložíme do reportu
+        print(f"❌ Chyba: {e}")
+        
+        # Uložíme chybu do reportu - i s pokusy nižších modelů kaskády, které už se zaplatily
         cas = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        data_reportu = [[cas, os.path.basename(nazev_obrazku), 0, 0.0, 'CHYBA', str(e)]]
-        ulozit_report_spotreby(adresar, data_reportu)
-        print(f"Nastala chyba při komunikaci s Google AI: {e}")
+        tokeny = sum(pokus[1] for pokus in pokusy)
+        naklady_usd = sum(pokus[2] for pokus in pokusy)
+        data_reportu = radky_eskalace(cas, os.path.basename(nazev_obrazku), pokusy + [None]) + [
+            [cas, os.path.basename(nazev_obrazku), 0, 0.0, 'CHYBA', str(e)]]
+        ulozit_report_spotreby(adresar, data_reportu, manifest=manifest)
+        if duplicity is not None:
+            duplicity.zapomenout(nazev_obrazku)
+        metriky.dokoncit(mereni, 'CHYBA', tokeny=tokeny, naklady=naklady_usd)
+        vysledek.update(status='CHYBA', chyba=str(e), tokeny=tokeny, naklady_usd=naklady_usd)
+        return tokeny, naklady_usd
 
-def zpracovat_davku_uctenek(adresar="example", pripony=(".png", ".jpg", ".jpeg"), velikost_davky=5):
+def zpracovat_se_zapujckou(zapujcky, nazev_obrazku, *args, **kwargs):
     """
-    Zpracuje obrázky účtenek v dávkách zadané velikosti.
+    Zpracuje obrázek jako zpracovat_jeden_obrazek_s_metrami, s volitelnou zápůjčkou.
     
     Args:
-        adresar: Adresář s obrázky
-        pripony: Podporované přípony souborů
-        velikost_davky: Kolik obrázků zpracovat najednou (default: 5)
+        zapujcky: ZapujckyObrazku nebo None (bez zápůjček)
+        nazev_obrazku: Cesta k obrázku
+        *args, **kwargs: Další argumenty pro zpracovat_jeden_obrazek_s_metrami
+    
+    Returns:
+        tuple: (tokeny, náklady), nebo None, pokud obrázek zpracovává jiný uzel
     """
-    print(f"Hledám obrázky v adresáři '{adresar}'...")
+    if zapujcky is None:
+        return zpracovat_jeden_obrazek_s_metrami(nazev_obrazku, *args, **kwargs)
+    if not zabrat_obrazky(zapujcky, [nazev_obrazku]):
+        if kwargs.get("predzpracovani") is not None:
+            kwargs["predzpracovani"].zrusit([nazev_obrazku])
+        return None
+    try:
+        return zpracovat_jeden_obrazek_s_metrami(nazev_obrazku, *args, **kwargs)
+    finally:
+        zapujcky.uvolnit(nazev_obrazku)
+
+class SledovacAdresaru:
+    """
+    Hlídá adresáře a hlásí obrázky, které se v nich objevily nebo změnily.
     
-    # Najdeme všechny soubory s podporovanými příponami
-    obrazky = []
-    for soubor in os.listdir(adresar):
-        if soubor.lower().endswith(pripony):
-            cesta_k_souboru = os.path.join(adresar, soubor)
-            obrazky.append(cesta_k_souboru)
+    S knihovnou inotify_simple (Linux) čeká na události jádra, jinak adresáře
+    každých interval sekund projde. Obrázek se ohlásí až ve chvíli, kdy je
+    zapsaný celý: po událostech CLOSE_WRITE a MOVED_TO hned, jinak jakmile
+    se jeho velikost a mtime klid sekund nezměnily. Při startu se ohlásí
+    i obrázky, které už v adresářích jsou.
+    """
     
-    if not obrazky:
-        print(f"V adresáři '{adresar}' nebyly nalezeny žádné obrázky s příponami {pripony}")
-        return
+    def __init__(self, adresare, pripony=PRIPONY_OBRAZKU, interval=2.0, klid=2.0, pouzit_inotify=True):
+        """
+        Args:
+            adresare: Seznam sledovaných adresářů
+            pripony: Podporované přípony souborů
+            interval: Perioda procházení adresářů bez inotify (s)
+            klid: Jak dlouho se soubor nesmí měnit, aby se považoval za zapsaný (s)
+            pouzit_inotify: Použít inotify, pokud je k dispozici
+        """
+        self.adresare = list(adresare)
+        self.pripony = tuple(pripona.lower() for pripona in pripony)
+        self.interval = interval
+        self.klid = klid
+        # cesta -> ((velikost, mtime_ns), čas poslední změny) u souborů, které se možná ještě zapisují
+        self._kandidati = {}
+        # cesta -> (velikost, mtime_ns) naposledy ohlášené verze, aby se neohlásila dvakrát
+        self._ohlasene = {}
+        self._posledni_pruchod = None
+        self._inotify = None
+        self._adresare_wd = {}
+        if pouzit_inotify and INotify is not None:
+            try:
+                self._inotify = INotify()
+                maska = inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO | inotify_flags.CREATE | inotify_flags.MODIFY
+                for adresar in self.adresare:
+                    self._adresare_wd[self._inotify.add_watch(adresar, maska)] = adresar
+            except OSError as e:
+                print(f"⚠️  inotify se nepodařilo zapnout ({e}), adresáře budu procházet každých {interval} s.")
+                self.zavrit()
     
-    print(f"Nalezeno {len(obrazky)} obrázků: {[os.path.basename(img) for img in obrazky]}")
-    print(f"Zpracování v dávkách po {velikost_davky} obrázcích...")
+    @property
+    def rezim(self):
+        """Způsob sledování - "inotify" nebo "polling"."""
+        return "inotify" if self._inotify is not None else "polling"
     
-    # Načteme API klíč
-    print("Načítám API klíč...")
-    api_key = nacti_api_klic()
-    if not api_key:
-        return
+    def _je_obrazek(self, nazev):
+        # Skryté soubory bývají rozepsané dočasné kopie (rsync, prohlížeče)
+        return not nazev.startswith(".") and nazev.lower().endswith(self.pripony)
     
-    # Inicializujeme klienta
-    print("Inicializuji Google AI klienta...")
-    client = genai.Client(api_key=api_key)
-    model = "gemini-2.5-flash-lite-preview-06-17"
+    def _zaznamenat(self, cesta, ted, zapsano=False):
+        """Zaznamená (možnou) změnu souboru; zapsano=True znamená, že zapisovatel soubor zavřel."""
+        try:
+            stat = os.stat(cesta)
+        except OSError:
+            # Soubor mezitím zmizel nebo byl přejmenován
+            self._kandidati.pop(cesta, None)
+            return
+        podpis = (stat.st_size, stat.st_mtime_ns)
+        if self._ohlasene.get(cesta) == podpis:
+            return
+        predchozi = self._kandidati.get(cesta)
+        if zapsano:
+            self._kandidati[cesta] = (podpis, float("-inf"))
+        elif predchozi is None or predchozi[0] != podpis:
+            self._kandidati[cesta] = (podpis, ted)
     
-    # Zpracujeme obrázky v dávkách
-    celkem_zpracovano = 0
+    def _projit(self, ted):
+        """Projde všechny sledované adresáře."""
+        self._posledni_pruchod = ted
+        for adresar in self.adresare:
+            try:
+                with os.scandir(adresar) as polozky:
+                    cesty = [polozka.path for polozka in polozky if polozka.is_file() and self._je_obrazek(polozka.name)]
+            except OSError as e:
+                print(f"⚠️  Adresář '{adresar}' nelze projít: {e}")
+                continue
+            for cesta in cesty:
+                self._zaznamenat(cesta, ted)
     
-    for i in range(0, len(obrazky), velikost_davky):
-        davka = obrazky[i:i + velikost_davky]
-        cislo_davky = (i // velikost_davky) + 1
-        celkem_davek = (len(obrazky) + velikost_davky - 1) // velikost_davky
+    def cekat(self, max_cekani=1.0, konec=None):
+        """
+        Počká na nejbližší zapsané obrázky (nejvýše max_cekani sekund).
         
-        print(f"\n--- Zpracovávám dávku {cislo_davky}/{celkem_davek} ({len(davka)} obrázků) ---")
+        Args:
+            max_cekani: Maximální doba čekání (s)
+            konec: Volitelný threading.Event - čekání bez inotify se po jeho nastavení přeruší
+        
+        Returns:
+            list: (cesta, adresář) obrázků, které jsou zapsané celé
+        """
+        ted = time.monotonic()
+        if self._posledni_pruchod is None:
+            self._projit(ted)
+        elif self._inotify is not None:
+            for udalost in self._inotify.read(timeout=int(max_cekani * 1000)):
+                ted = time.monotonic()
+                if udalost.mask & inotify_flags.Q_OVERFLOW:
+                    # Fronta událostí jádra přetekla - nevíme, co se změnilo, projdeme vše
+                    self._projit(ted)
+                    continue
+                adresar = self._adresare_wd.get(udalost.wd)
+                if adresar is None or not self._je_obrazek(udalost.name):
+                    continue
+                zapsano = bool(udalost.mask & (inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO))
+                self._zaznamenat(os.path.join(adresar, udalost.name), ted, zapsano)
+        else:
+            # Bez inotify čekáme do dalšího průchodu nebo do uklidnění nejbližšího kandidáta
+            dalsi = self._posledni_pruchod + self.interval
+            if self._kandidati:
+                dalsi = min(dalsi, min(zmena for _, zmena in self._kandidati.values()) + self.klid)
+            cekani = min(max(dalsi - ted, 0.0), max_cekani)
+            if konec is not None:
+                konec.wait(cekani)
+            else:
+                time.sleep(cekani)
+            ted = time.monotonic()
+            if ted - self._posledni_pruchod >= self.interval:
+                self._projit(ted)
         
-        # Zpracujeme jednu dávku
-        if zpracovat_jednu_davku(davka, client, model, adresar):
-            celkem_zpracovano += len(davka)
+        hotove = []
+        for cesta, (podpis, zmena) in list(self._kandidati.items()):
+            if ted - zmena < self.klid:
+                continue
+            del self._kandidati[cesta]
+            try:
+                stat = os.stat(cesta)
+            except OSError:
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != podpis:
+                # Soubor se od poslední změny zase změnil - počkáme, až se uklidní
+                self._kandidati[cesta] = ((stat.st_size, stat.st_mtime_ns), ted)
+                continue
+            self._ohlasene[cesta] = podpis
+            hotove.append((cesta, os.path.dirname(cesta)))
+        return hotove
     
-    print(f"\nHotovo! Celkem zpracováno {celkem_zpracovano} obrázků z {len(obrazky)}.")
+    def zavrit(self):
+        """Ukončí sledování přes inotify."""
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
 
-def zpracovat_jednu_davku(davka_obrazky, client, model, adresar):
+def sledovat_adresare(adresare, pripony=PRIPONY_OBRAZKU, max_soubezne=4, cache=None, predzpracovani=None,
+                      kontextova_cache=False, strukturovany_vystup=False, interval=2.0, klid=2.0, pouzit_inotify=True,
+                      duplicity=None, kaskada=None):
     """
-    Zpracuje jednu dávku obrázků.
+    Běží jako démon: nové účtenky v adresářích zpracuje hned, jak se v nich objeví.
+    
+    Sledovač hlásí zapsané obrázky do fronty, ze které je bere max_soubezne
+    pracovních vláken se sdíleným klientem (jako v režimu 4). Obrázky
+    s aktuálním výstupem podle manifestu adresáře se přeskočí, takže po
+    restartu démon dožene jen to, co mezitím přibylo. SIGINT/SIGTERM zastaví
+    příjem nových obrázků, rozpracované požadavky se dokončí; obrázky, které
+    ještě čekaly ve frontě, zpracuje příští spuštění. Druhý signál ukončí
+    démona okamžitě.
+    
+    Args:
+        adresare: Seznam sledovaných adresářů
+        pripony: Podporované přípony souborů
+        max_soubezne: Počet pracovních vláken (souběžných požadavků)
+        cache: Volitelná CacheExtrakci (sdílená všemi vlákny)
+        predzpracovani: Volitelné Predzpracovani - obrázek se začne předzpracovávat už při zařazení do fronty
+        kontextova_cache: Uložit prompt do kontextové cache Gemini místo posílání s každým obrázkem
+        strukturovany_vystup: Vynutit JSON odpověď podle SCHEMA_UCTENKY
+        interval: Perioda procházení adresářů bez inotify (s)
+        klid: Jak dlouho se soubor nesmí měnit, aby se považoval za zapsaný (s)
+        pouzit_inotify: Použít inotify, pokud je k dispozici
+        duplicity: Volitelný IndexDuplicit - kopie už zpracovaného obrázku převezme jeho výsledek
+        kaskada: Volitelná KaskadaModelu - účtenku, která neprojde kontrolou, zpracuje dražší model
     
     Returns:
-        tuple: (úspěch: bool, celkové_tokeny: int, celkové_náklady: float)
+        int: Návratový kód (0 = v pořádku)
     """
-    # Připravíme prompt pro dávkové zpracování
-    davkovy_prompt = """# ROLE A CÍL
-Jsi expertní systém pro dávkovou extrakci dat z více dokumentů najednou. Tvým úkolem je analyzovat VŠECHNY přiložené obrázky účtenek. Pro KAŽDÝ obrázek musíš extrahovat veškeré informace a vytvořit pro něj samostatný JSON objekt. Všechny tyto JSON objekty pak zabal do jednoho hlavního JSON pole.
-
-# METODIKA PRÁCE
-1. **Iteruj přes obrázky:** Postupně projdi každý obrázek, který ti byl poslán.
-2. **Analyzuj každý obrázek samostatně:** Pro každý jednotlivý obrázek aplikuj následující logiku:
-   - Zmapuj dokument a identifikuj bloky informací
-   - Přesně přepisuj všechna data
-   - Vytvoř logicky strukturovaný JSON objekt
-   - Přidej identifikátor: Do JSON objektu přidej klíč "obrazek_index" s pořadovým číslem obrázku (0, 1, 2...)
-3. **Zkompletuj výstup:** Vytvoř pole JSON objektů ve formátu: [{"obrazek_index": 0, "data": {...}}, {"obrazek_index": 1, "data": {...}}, ...]
-
-# ZÁVĚREČNÝ POKYN
-Aplikuj tuto metodiku na VŠECHNY přiložené obrázky. Vytvoř JEDEN JSON výstup obsahující pole objektů, jeden pro každý obrázek."""
+    for adresar in adresare:
+        if not os.path.isdir(adresar):
+            print(f"Chyba: Adresář '{adresar}' neexistuje.")
+            return 1
     
-    # Připravíme obsah pro API
-    contents = [types.Content(role="user", parts=[types.Part.from_text(text=davkovy_prompt)])]
+    # Klient, limit kvóty i kontextová cache zůstávají "teplé" po celou dobu běhu
+    vykonavac = vytvorit_vykonavac(max_soubezne)
+    if not vykonavac:
+        return 1
+    model = kaskada.modely[0] if kaskada is not None else MODEL_DEFAULT
+    kontext = SpravceKontextoveCache(vykonavac.client, model, PROMPT_EXTRAKCE) if kontextova_cache else None
+    manifesty = {adresar: ManifestZpracovani(adresar) for adresar in adresare}
+    metriky = {adresar: otevrit_metriky(adresar, rezim="sledovani") for adresar in adresare}
+    sledovac = SledovacAdresaru(adresare, pripony, interval=interval, klid=klid, pouzit_inotify=pouzit_inotify)
     
-    # Přidáme všechny obrázky do jednoho requestu
-    print("Načítám obrázky v dávce...")
-    for i, obrazek_cesta in enumerate(davka_obrazky):
-        try:
-            with open(obrazek_cesta, "rb") as f:
-                obrazek_data = f.read()
-            
-            # Určíme MIME typ podle přípony
-            pripona = os.path.splitext(obrazek_cesta)[1].lower()
-            if pripona in ['.jpg', '.jpeg']:
-                mime_type = "image/jpeg"
-            elif pripona == '.png':
-                mime_type = "image/png"
-            else:
-                mime_type = "image/png"  # default
-            
-            contents[0].parts.append(types.Part.from_bytes(mime_type=mime_type, data=obrazek_data))
-            print(f"  - Přidán obrázek {i+1}/{len(davka_obrazky)}: {os.path.basename(obrazek_cesta)}")
-            
-        except Exception as e:
-            print(f"Chyba při načítání obrázku '{obrazek_cesta}': {e}")
-            continue
+    fronta = queue.Queue()
+    konec = threading.Event()
+    zamek = threading.Lock()
+    rozpracovane = set()
+    odlozene = set()
+    zpracovano = {adresar: 0 for adresar in adresare}
+    
+    def pracovnik():
+        while True:
+            polozka = fronta.get()
+            if polozka is None:
+                return
+            cesta, adresar = polozka
+            try:
+                zpracovat_jeden_obrazek_s_metrami(cesta, vykonavac, cache=cache, manifest=manifesty[adresar],
+                                                  predzpracovani=predzpracovani, kontext=kontext,
+                                                  strukturovany_vystup=strukturovany_vystup,
+                                                  metriky=metriky[adresar], duplicity=duplicity, kaskada=kaskada)
+                # Latence od posledního zápisu účtenky do adresáře po uložený výstup
+                try:
+                    latence = f" za {time.time() - os.stat(cesta).st_mtime:.1f} s od zápisu"
+                except OSError:
+                    latence = ""
+                print(f"📤 {os.path.basename(cesta)} dokončen{latence}")
+            except Exception as e:
+                # zpracovat_jeden_obrazek_s_metrami chyby API zachytává sám, sem se dostanou jen neočekávané
+                print(f"❌ Neočekávaná chyba u '{os.path.basename(cesta)}': {e}")
+            with zamek:
+                zpracovano[adresar] += 1
+                rozpracovane.discard(cesta)
+                # Soubor se během zpracování změnil - zpracujeme ho znovu
+                if cesta in odlozene and not konec.is_set():
+                    odlozene.discard(cesta)
+                    rozpracovane.add(cesta)
+                    fronta.put((cesta, adresar))
+    
+    def ukoncit(signum, frame):
+        if konec.is_set():
+            raise KeyboardInterrupt
+        print("\n⏹️  Ukončuji - nové obrázky už nepřijímám, dokončuji rozpracované požadavky...")
+        konec.set()
     
-    print("Odesílám dávkový požadavek a čekám na odpověď...")
+    puvodni_obsluhy = {}
+    if threading.current_thread() is threading.main_thread():
+        for signal_ in (signal.SIGINT, signal.SIGTERM):
+            puvodni_obsluhy[signal_] = signal.signal(signal_, ukoncit)
     
+    vlakna = [threading.Thread(target=pracovnik, name=f"pracovnik-{i + 1}", daemon=True) for i in range(max_soubezne)]
+    for vlakno in vlakna:
+        vlakno.start()
+    
+    print(f"👀 Sleduji {', '.join(repr(adresar) for adresar in adresare)} ({sledovac.rezim}), "
+          f"{max_soubezne} souběžných požadavků. Ukončení: Ctrl+C nebo SIGTERM.")
     try:
-        response = client.models.generate_content(model=model, contents=contents)
-        
-        # Získáme počet tokenů a vypočítáme náklady
-        celkove_tokeny = response.usage_metadata.total_token_count
-        celkove_naklady = vypocitat_naklady(celkove_tokeny, model)
-        
-        print(f"Celkem tokenů pro dávku: {celkove_tokeny}")
-        print(f"Celkové náklady dávky: ${celkove_naklady:.6f} USD")
-        
-        # POZNÁMKA: Gemini API neposkytuje rozloženie tokenov na jednotlivé obrázky v dávke
-        # Preto uvedieme celkové tokeny a poznámku, že sú rozdelené na dávku
-        print(f"⚠️  Tokeny sa týkajú celej dávky {len(davka_obrazky)} obrázkov, nie jednotlivých súborov")
-        
-        # Očistíme odpověď od značek kódu
-        cisty_json_text = response.text.replace("```json\n", "").replace("\n```", "").replace("```json", "").replace("```", "").strip()
-        
-        # Parsujeme JSON odpověď
-        vysledky = json.loads(cisty_json_text)
-        
-        if not isinstance(vysledky, list):
-            print("Chyba: Odpověď od AI není ve formátu pole.")
-            return False, 0, 0.0
-        
-        # Uložíme každý výsledek do samostatného JSON souboru
-        print(f"Ukládám výsledky do {len(vysledky)} JSON souborů...")
-        
-        # Pripravíme data pre report
-        cas = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        data_reportu = []
+        while not konec.is_set():
+            for cesta, adresar in sledovac.cekat(konec=konec):
+                with zamek:
+                    if cesta in rozpracovane:
+                        odlozene.add(cesta)
+                        continue
+                try:
+                    if manifesty[adresar].je_aktualni(cesta):
+                        continue
+                except OSError:
+                    continue
+                if predzpracovani is not None:
+                    predzpracovani.naplanovat([cesta])
+                with zamek:
+                    rozpracovane.add(cesta)
+                fronta.put((cesta, adresar))
+                print(f"📥 Nový obrázek: {os.path.basename(cesta)} (ve frontě {fronta.qsize()})")
+    finally:
+        konec.set()
+        # Obrázky, které ještě nezačaly, necháme na příští spuštění - manifest je nezná jako hotové
+        nezapocate = 0
+        while True:
+            try:
+                fronta.get_nowait()
+                nezapocate += 1
+            except queue.Empty:
+                break
+        for _ in vlakna:
+            fronta.put(None)
+        for vlakno in vlakna:
+            vlakno.join()
+        if nezapocate:
+            print(f"Ve frontě zůstalo {nezapocate} nezačatých obrázků, zpracují se při příštím spuštění.")
         
-        uspesne_zpracovano = 0
-        for vysledek in vysledky:
-            obrazek_index = vysledek.get('obrazek_index')
-            if obrazek_index is None or obrazek_index >= len(davka_obrazky):
-                print(f"Varování: Neplatný index obrázku v odpovědi: {obrazek_index}")
-                continue
-            
-            # Získáme původní cestu k obrázku a vytvoříme název JSON souboru
-            puvodni_obrazek = davka_obrazky[obrazek_index]
-            zakladni_nazev = os.path.splitext(puvodni_obrazek)[0]
-            json_soubor = f"{zakladni_nazev}.json"
-            
-            # Uložíme data (bez indexu) do JSON souboru
-            data = vysledek.get('data', vysledek)  # Pokud není 'data', použijeme celý objekt
-            if 'obrazek_index' in data:
-                del data['obrazek_index']  # Odstraníme index z finálních dat
-            
+        sledovac.zavrit()
+        if kontext is not None:
+            kontext.smazat()
+        for adresar in adresare:
+            # Manifest zavřeme, až kniha spotřeby zapíše poslední stavy
+            kniha_spotreby(adresar).vyprazdnit()
+            manifesty[adresar].zavrit()
+            metriky[adresar].zavrit()
+        for signal_, obsluha in puvodni_obsluhy.items():
+            signal.signal(signal_, obsluha)
+    
+    for adresar in adresare:
+        if zpracovano[adresar]:
+            print(f"\n📁 {adresar}: zpracováno {zpracovano[adresar]} obrázků")
+            vypsat_souhrn(zpracovano[adresar], metriky[adresar])
+    if kontext is not None and kontext.naklady_ulozeni():
+        print(f"Uložení kontextové cache: ${kontext.naklady_ulozeni():.6f} USD")
+    return 0
+
+class UlohaSluzby:
+    """Jedna nahraná účtenka ve službě - stav a výsledek zpracování."""
+    
+    # Statusy zpracovat_jeden_obrazek_s_metrami, které znamenají hotový výsledek
+    USPESNE = ('USPECH_JEDNOTLIVO', 'CACHE', 'DUPLIKAT')
+    
+    def __init__(self, uloha_id, cesta):
+        self.id = uloha_id
+        self.cesta = cesta
+        self.stav = "ceka"
+        self.vysledek = {}
+        self.hotovo = threading.Event()
+    
+    def popis(self):
+        """Stav úlohy jako slovník pro JSON odpověď."""
+        popis = {"uloha": self.id, "stav": self.stav, "soubor": os.path.basename(self.cesta)}
+        popis.update((klic, hodnota) for klic, hodnota in self.vysledek.items() if hodnota is not None)
+        return popis
+
+class SluzbaExtrakce:
+    """
+    Fronta nahraných účtenek zpracovávaná pracovními vlákny se sdíleným klientem.
+    
+    Klient, limit kvóty, cache i kontextová cache zůstávají "teplé" po celou
+    dobu běhu služby, takže jeden požadavek neplatí start procesu ani import
+    SDK. Fronta je omezená - když je plná, prijmout() vrátí None a HTTP
+    obsluha odpoví 503. Hotové úlohy si služba pamatuje (nejvýše max_uloh
+    nejnovějších), starší najde podle JSON výstupu v adresáři služby.
+    """
+    
+    def __init__(self, adresar, vykonavac, max_soubezne=4, max_fronta=32, max_uloh=1000, **zpracovani):
+        """
+        Args:
+            adresar: Adresář pro nahrané obrázky, jejich výstupy, knihu spotřeby a metriky
+            vykonavac: Sdílený VykonavacPozadavku
+            max_soubezne: Počet pracovních vláken (souběžných požadavků)
+            max_fronta: Kolik nahraných účtenek smí čekat na zpracování
+            max_uloh: Kolik dokončených úloh držet v paměti
+            **zpracovani: Další parametry pro zpracovat_jeden_obrazek_s_metrami
+                          (cache, predzpracovani, kontext, strukturovany_vystup, duplicity, kaskada)
+        """
+        os.makedirs(adresar, exist_ok=True)
+        self.adresar = adresar
+        self.vykonavac = vykonavac
+        self.max_soubezne = max_soubezne
+        self.max_uloh = max_uloh
+        self.zpracovani = zpracovani
+        self.metriky = otevrit_metriky(adresar, rezim="sluzba")
+        self.prijato = 0
+        self.zpracovano = 0
+        self._fronta = queue.Queue(max_fronta)
+        self._ulohy = {}
+        self._zamek = threading.Lock()
+        self._zavreno = False
+        self._vlakna = [threading.Thread(target=self._pracovnik, name=f"sluzba-{i + 1}", daemon=True)
+                        for i in range(max_soubezne)]
+        for vlakno in self._vlakna:
+            vlakno.start()
+    
+    def _pracovnik(self):
+        while True:
+            uloha = self._fronta.get()
+            if uloha is None:
+                return
+            uloha.stav = "bezi"
             try:
-                with open(json_soubor, "w", encoding="utf-8") as f:
-                    json.dump(data, f, ensure_ascii=False, indent=2)
-                
-                print(f"  - Uloženo: {os.path.basename(json_soubor)}")
-                
-                # Přidáme do reportu - používáme celkové údaje pre celú dávku
-                data_reportu.append([
-                    cas, 
-                    os.path.basename(puvodni_obrazek), 
-                    celkove_tokeny,  # Celkové tokeny pro celou dávku
-                    celkove_naklady, # Celkové náklady pre celú dávku
-                    'USPECH_DAVKA', 
-                    f'Dávka {len(davka_obrazky)} obrázkov - tokeny/náklady sú pre celú dávku'
-                ])
-                uspesne_zpracovano += 1
-                
+                zpracovat_jeden_obrazek_s_metrami(uloha.cesta, self.vykonavac, metriky=self.metriky,
+                                                  vysledek=uloha.vysledek, **self.zpracovani)
             except Exception as e:
-                print(f"Chyba při ukládání {json_soubor}: {e}")
-                data_reportu.append([
-                    cas, 
-                    os.path.basename(puvodni_obrazek), 
-                    0, 
-                    0.0, 
-                    'CHYBA_UKLADANI', 
-                    str(e)
-                ])
-        
-        # Uložíme report
-        ulozit_report_spotreby(adresar, data_reportu)
-        
-        print(f"Dávka dokončena! Zpracováno {uspesne_zpracovano}/{len(vysledky)} obrázků.")
-        return True, celkove_tokeny, celkove_naklady
-        
-    except json.JSONDecodeError as e:
-        print(f"Chyba při parsování JSON odpovědi: {e}")
-        print("Surová odpověď:")
-        print(response.text)
+                # zpracovat_jeden_obrazek_s_metrami chyby API zachytává sám, sem se dostanou jen neočekávané
+                print(f"❌ Neočekávaná chyba u '{os.path.basename(uloha.cesta)}': {e}")
+                uloha.vysledek.update(status='CHYBA', chyba=str(e))
+            uloha.stav = "hotovo" if uloha.vysledek.get("status") in UlohaSluzby.USPESNE else "chyba"
+            with self._zamek:
+                self.zpracovano += 1
+            uloha.hotovo.set()
+    
+    def prijmout(self, obsah, pripona):
+        """
+        Uloží nahraný obrázek a zařadí ho do fronty.
         
-        # Uložíme chybu do reportu pro všechny soubory v dávce
-        cas = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        data_reportu = []
-        for obrazek_cesta in davka_obrazky:
-            data_reportu.append([
-                cas, 
-                os.path.basename(obrazek_cesta), 
-                0, 
-                0.0, 
-                'CHYBA_JSON', 
-                str(e)
-            ])
-        ulozit_report_spotreby(adresar, data_reportu)
-        return False, 0, 0.0
+        Args:
+            obsah: Bajty obrázku
+            pripona: Přípona souboru (.png, .jpg)
         
-    except Exception as e:
-        print(f"Nastala chyba při komunikaci s Google AI: {e}")
+        Returns:
+            UlohaSluzby nebo None, pokud je fronta plná (nebo se služba ukončuje)
+        """
+        if self._zavreno or self._fronta.full():
+            return None
+        uloha_id = f"{datetime.now():%Y%m%d-%H%M%S}-{os.urandom(4).hex()}"
+        cesta = os.path.join(self.adresar, uloha_id + pripona)
+        with open(cesta, "wb") as f:
+            f.write(obsah)
+        uloha = UlohaSluzby(uloha_id, cesta)
+        with self._zamek:
+            self._ulohy[uloha_id] = uloha
+            # Zapomeneme nejstarší dokončené úlohy - jejich výsledek zůstává v JSON souboru
+            if len(self._ulohy) > self.max_uloh:
+                for stara in [u for u in self._ulohy.values() if u.hotovo.is_set()][:len(self._ulohy) - self.max_uloh]:
+                    del self._ulohy[stara.id]
+        if self.zpracovani.get("predzpracovani") is not None:
+            self.zpracovani["predzpracovani"].naplanovat([cesta])
+        try:
+            self._fronta.put_nowait(uloha)
+        except queue.Full:
+            # Mezi kontrolou a zařazením frontu zaplnil jiný požadavek
+            with self._zamek:
+                self._ulohy.pop(uloha_id, None)
+            os.remove(cesta)
+            if self.zpracovani.get("predzpracovani") is not None:
+                self.zpracovani["predzpracovani"].zrusit([cesta])
+            return None
+        with self._zamek:
+            self.prijato += 1
+        return uloha
+    
+    def najit(self, uloha_id):
+        """
+        Vrátí popis úlohy podle ID, nebo None, pokud neexistuje.
         
-        # Uložíme chybu do reportu pro všechny soubory v dávce
-        cas = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        data_reportu = []
-        for obrazek_cesta in davka_obrazky:
-            data_reportu.append([
-                cas, 
-                os.path.basename(obrazek_cesta), 
-                0, 
-                0.0, 
-                'CHYBA_API', 
-                str(e)
-            ])
-        ulozit_report_spotreby(adresar, data_reportu)
-        return False, 0, 0.0
+        Úlohu, kterou už služba zapomněla (nebo dokončila před restartem),
+        najde podle JSON výstupu v adresáři služby.
+        """
+        if not re.fullmatch(r"\d{8}-\d{6}-[0-9a-f]{8}", uloha_id):
+            return None
+        with self._zamek:
+            uloha = self._ulohy.get(uloha_id)
+        if uloha is not None:
+            return uloha.popis()
+        try:
+            with open(os.path.join(self.adresar, f"{uloha_id}.json"), encoding="utf-8") as f:
+                return {"uloha": uloha_id, "stav": "hotovo", "data": json.load(f)}
+        except (OSError, json.JSONDecodeError):
+            return None
+    
+    def stav(self):
+        """Stav služby pro /zdravi."""
+        with self._zamek:
+            return {"stav": "ukoncuje se" if self._zavreno else "ok", "ve_fronte": self._fronta.qsize(),
+                    "max_fronta": self._fronta.maxsize, "soubezne": self.max_soubezne,
+                    "prijato": self.prijato, "zpracovano": self.zpracovano}
+    
+    def zavrit(self):
+        """Přestane přijímat účtenky, dokončí frontu a zavře knihu spotřeby a metriky."""
+        self._zavreno = True
+        for _ in self._vlakna:
+            self._fronta.put(None)
+        for vlakno in self._vlakna:
+            vlakno.join()
+        kniha_spotreby(self.adresar).vyprazdnit()
+        self.metriky.zavrit()
 
-def zpracovat_davku_jednotlivo(adresar="example", pripony=(".png", ".jpg", ".jpeg")):
+class ObsluhaSluzby(http.server.BaseHTTPRequestHandler):
     """
-    Spracuje obrázky jednotlivo pre presnejšie sledovanie tokenov a nákladov.
-    Pomalšie, ale poskytuje presné údaje pre každý súbor.
+    HTTP rozhraní SluzbaExtrakce.
     
-    Args:
-        adresar: Adresář s obrázky
-        pripony: Podporované přípony souborů
+    POST /uctenky        tělo = obrázek nebo PDF (typ se pozná podle obsahu, jinak podle Content-Type
+                         nebo ?nazev=soubor.jpg); odpoví výsledkem, nebo s ?cekat=0 hned 202 s ID úlohy
+    GET  /ulohy/<id>     stav a výsledek úlohy
+    GET  /zdravi         stav fronty služby
     """
-    print(f"Hledám obrázky v adresáři '{adresar}'...")
     
-    # Najdeme všechny soubory s podporovanými příponami
-    obrazky = []
-    for soubor in os.listdir(adresar):
-        if soubor.lower().endswith(pripony):
-            cesta_k_souboru = os.path.join(adresar, soubor)
-            obrazky.append(cesta_k_souboru)
+    server_version = "extract-bill-json"
+    protocol_version = "HTTP/1.1"
     
-    if not obrazky:
-        print(f"V adresáři '{adresar}' nebyly nalezeny žádné obrázky s příponami {pripony}")
-        return
+    def _odeslat(self, kod, telo, hlavicky=None):
+        data = json.dumps(telo, ensure_ascii=False).encode("utf-8")
+        self.send_response(kod)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for nazev, hodnota in (hlavicky or {}).items():
+            self.send_header(nazev, hodnota)
+        self.end_headers()
+        self.wfile.write(data)
     
-    print(f"Nalezeno {len(obrazky)} obrázků: {[os.path.basename(img) for img in obrazky]}")
-    print("Zpracovávám každý obrázek jednotlivo pre presné sledovanie tokenů...")
+    def _odmitnout(self, kod, chyba, hlavicky=None):
+        # Tělo požadavku jsme nepřečetli - spojení nejde použít pro další požadavek
+        self.close_connection = True
+        self._odeslat(kod, {"chyba": chyba}, hlavicky)
     
-    celkove_tokeny = 0
-    celkove_naklady = 0.0
+    def do_GET(self):
+        cesta = urlsplit(self.path).path
+        sluzba = self.server.sluzba
+        if cesta == "/zdravi":
+            self._odeslat(200, sluzba.stav())
+        elif cesta.startswith("/ulohy/"):
+            popis = sluzba.najit(cesta[len("/ulohy/"):])
+            if popis is None:
+                self._odeslat(404, {"chyba": "Úloha neexistuje"})
+            else:
+                self._odeslat(200, popis)
+        else:
+            self._odeslat(404, {"chyba": "Neznámá cesta"})
     
-    # Zpracujeme každý obrázek jednotlivo
-    for i, obrazek_cesta in enumerate(obrazky, 1):
-        print(f"\n--- Zpracovávám obrázek {i}/{len(obrazky)}: {os.path.basename(obrazek_cesta)} ---")
+    def do_POST(self):
+        adresa = urlsplit(self.path)
+        if adresa.path != "/uctenky":
+            return self._odmitnout(404, "Neznámá cesta")
+        parametry = parse_qs(adresa.query)
+        try:
+            delka = int(self.headers["Content-Length"])
+        except (TypeError, ValueError):
+            return self._odmitnout(411, "Chybí Content-Length")
+        if delka > SLUZBA_MAX_BAJTU:
+            return self._odmitnout(413, f"Obrázek je větší než {SLUZBA_MAX_BAJTU // (1024 * 1024)} MB")
+        obsah = self.rfile.read(delka)
+        mime_type = mime_typ_z_obsahu(obsah) or self.headers.get_content_type()
+        if "nazev" in parametry and mime_type not in MIME_PODLE_PRIPONY.values():
+            mime_type = MIME_PODLE_PRIPONY.get(os.path.splitext(parametry["nazev"][0])[1].lower())
+        pripona = next((pripona for pripona, typ in MIME_PODLE_PRIPONY.items() if typ == mime_type), None)
+        if pripona is None:
+            return self._odeslat(415, {"chyba": "Podporované jsou obrázky PNG, JPEG, WebP, HEIC a PDF"})
         
-        # Spracujeme jednotlivý obrázek
-        tokeny, naklady = zpracovat_jeden_obrazek_s_metrami(obrazek_cesta)
-        if tokeny > 0:
-            celkove_tokeny += tokeny
-            celkove_naklady += naklady
-    
-    print(f"\n🎯 SÚHRN:")
-    print(f"Celkom spracovaných obrázkov: {len(obrazky)}")
-    print(f"Celkové tokeny: {celkove_tokeny}")
-    print(f"Celkové náklady: ${celkove_naklady:.6f} USD")
-    print(f"Priemer na obrázok: {celkove_tokeny//len(obrazky) if obrazky else 0} tokenov, ${celkove_naklady/len(obrazky) if obrazky else 0:.6f} USD")
+        sluzba = self.server.sluzba
+        uloha = sluzba.prijmout(obsah, pripona)
+        if uloha is None:
+            # Zpětný tlak - klient má to zkusit znovu, až se fronta uvolní
+            return self._odeslat(503, {"chyba": "Fronta je plná"}, {"Retry-After": "5"})
+        odkaz = f"/ulohy/{uloha.id}"
+        if parametry.get("cekat", ["1"])[0] != "0" and uloha.hotovo.wait(self.server.casovy_limit):
+            return self._odeslat(200 if uloha.stav == "hotovo" else 502, uloha.popis())
+        self._odeslat(202, {"uloha": uloha.id, "stav": uloha.stav, "odkaz": odkaz}, {"Location": odkaz})
 
-def zpracovat_jeden_obrazek_s_metrami(nazev_obrazku):
+def spustit_sluzbu(adresar=SLUZBA_ADRESAR, host="127.0.0.1", port=8080, max_soubezne=4, max_fronta=32,
+                   casovy_limit=120, cache=None, predzpracovani=None, kontextova_cache=False,
+                   strukturovany_vystup=False, duplicity=None, kaskada=None):
     """
-    Spracuje jeden obrázek a vráti tokeny a náklady.
+    Lokální HTTP služba - účtenky zpracovává proces, který drží klienta teplého.
+    
+    Na rozdíl od spouštění skriptu pro každou účtenku se klient, connection
+    pool, limit kvóty i kontextová cache vytvoří jednou. Požadavky obsluhují
+    vlákna HTTP serveru, samotnou extrakci max_soubezne pracovních vláken
+    služby. SIGINT/SIGTERM zastaví příjem, účtenky ve frontě se dokončí.
+    
+    Args:
+        adresar: Adresář pro nahrané obrázky, jejich výstupy, knihu spotřeby a metriky
+        host: Adresa, na které služba poslouchá (default jen lokálně)
+        port: Port služby
+        max_soubezne: Počet souběžných požadavků na API
+        max_fronta: Kolik účtenek smí čekat ve frontě, než služba začne odpovídat 503
+        casovy_limit: Jak dlouho (s) POST čeká na výsledek, než odpoví 202 s ID úlohy
+        cache: Volitelná CacheExtrakci (sdílená všemi vlákny)
+        predzpracovani: Volitelné Predzpracovani
+        kontextova_cache: Uložit prompt do kontextové cache Gemini místo posílání s každým obrázkem
+        strukturovany_vystup: Vynutit JSON odpověď podle SCHEMA_UCTENKY
+        duplicity: Volitelný IndexDuplicit - kopie už zpracovaného obrázku převezme jeho výsledek
+        kaskada: Volitelná KaskadaModelu - účtenku, která neprojde kontrolou, zpracuje dražší model
     
     Returns:
-        tuple: (tokeny: int, náklady: float)
+        int: Návratový kód (0 = v pořádku)
     """
-    # Načteme API klíč
-    api_key = nacti_api_klic()
-    if not api_key:
-        return 0, 0.0
-
+    vykonavac = vytvorit_vykonavac(max_soubezne)
+    if not vykonavac:
+        return 1
+    model = kaskada.modely[0] if kaskada is not None else MODEL_DEFAULT
+    kontext = SpravceKontextoveCache(vykonavac.client, model, PROMPT_EXTRAKCE) if kontextova_cache else None
     try:
-        with open(nazev_obrazku, "rb") as f:
-            obrazek_data = f.read()
-    except FileNotFoundError:
-        print(f"Chyba: Obrázek '{nazev_obrazku}' nebyl nalezen.")
-        return 0, 0.0
+        server = http.server.ThreadingHTTPServer((host, port), ObsluhaSluzby)
+    except OSError as e:
+        print(f"Chyba: Na {host}:{port} nelze poslouchat: {e}")
+        return 1
+    server.daemon_threads = True
+    server.casovy_limit = casovy_limit
+    server.sluzba = SluzbaExtrakce(adresar, vykonavac, max_soubezne=max_soubezne, max_fronta=max_fronta,
+                                   model=model, cache=cache, predzpracovani=predzpracovani, kontext=kontext,
+                                   strukturovany_vystup=strukturovany_vystup, duplicity=duplicity, kaskada=kaskada)
     
-    # Vytvoríme názov výstupného JSON súboru
-    zakladni_nazev = os.path.splitext(nazev_obrazku)[0]
-    nazev_vystupu = f"{zakladni_nazev}.json"
-    adresar = os.path.dirname(nazev_obrazku) or "."
+    def ukoncit(signum, frame):
+        print("\n⏹️  Ukončuji - nové účtenky už nepřijímám, dokončuji frontu...")
+        # shutdown() čeká na smyčku serve_forever, proto z jiného vlákna než z obsluhy signálu
+        threading.Thread(target=server.shutdown, daemon=True).start()
+    
+    puvodni_obsluhy = {}
+    if threading.current_thread() is threading.main_thread():
+        for signal_ in (signal.SIGINT, signal.SIGTERM):
+            puvodni_obsluhy[signal_] = signal.signal(signal_, ukoncit)
+    
+    print(f"🌐 Služba poslouchá na http://{host}:{server.server_address[1]} (POST /uctenky), "
+          f"{max_soubezne} souběžných požadavků, fronta {max_fronta}. Ukončení: Ctrl+C nebo SIGTERM.")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        server.sluzba.zavrit()
+        if kontext is not None:
+            kontext.smazat()
+        for signal_, obsluha in puvodni_obsluhy.items():
+            signal.signal(signal_, obsluha)
+    
+    sluzba = server.sluzba
+    if sluzba.zpracovano:
+        print(f"\n📁 {adresar}: zpracováno {sluzba.zpracovano} účtenek")
+        vypsat_souhrn(sluzba.zpracovano, sluzba.metriky)
+    if kontext is not None and kontext.naklady_ulozeni():
+        print(f"Uložení kontextové cache: ${kontext.naklady_ulozeni():.6f} USD")
+    return 0
+
+def vypsat_tabulku(hlavicka, radky):
+    """Vypíše řádky jako jednoduchou textovou tabulku zarovnanou podle nejširší hodnoty."""
+    texty = [[f"{hodnota:.6f}" if isinstance(hodnota, float) else str(hodnota) for hodnota in radek]
+             for radek in radky]
+    sirky = [max(len(str(h)), *(len(radek[i]) for radek in texty)) for i, h in enumerate(hlavicka)]
+    print("  ".join(str(h).ljust(sirka) for h, sirka in zip(hlavicka, sirky)))
+    for radek in texty:
+        print("  ".join(hodnota.rjust(sirka) if i >= len(hlavicka) - 3 else hodnota.ljust(sirka)
+                        for i, (hodnota, sirka) in enumerate(zip(radek, sirky))))
+
+def prikaz_report(args):
+    """Příkaz 'report' - souhrny, import a export knihy spotřeby."""
+    kniha = kniha_spotreby(args.adresar)
+    if args.akce == "souhrn":
+        radky = kniha.souhrn(args.podle, od=args.od, do=args.do, status=args.status)
+        if not radky or not radky[0][-3]:
+            print("Kniha spotřeby neobsahuje žádné odpovídající záznamy.")
+            return 0
+        vypsat_tabulku(list(args.podle) + ["pocet", "tokeny", "naklady_usd"], radky)
+    elif args.akce == "import":
+        pocet = kniha.importovat_csv(args.soubor)
+        print(f"Naimportováno {pocet} řádků z '{args.soubor}' do '{kniha.cesta}'.")
+    elif args.akce == "export":
+        pocet = kniha.exportovat_csv(args.soubor, od=args.od, do=args.do, status=args.status)
+        print(f"Vyexportováno {pocet} řádků z '{kniha.cesta}' do '{args.soubor}'.")
+    return 0
+
+def _pripravit_zpracovani(args):
+    """Cache výsledků, předzpracování a index duplicit podle společných voleb příkazů zpracovat a sledovat."""
+    predzpracovani = None
+    if args.predzpracovat:
+        if Image is None:
+            print("Předzpracování vyžaduje knihovnu Pillow (pip install pillow). Posílám původní obrázky.")
+        else:
+            predzpracovani = Predzpracovani()
+    cache = None if args.bez_cache else CacheExtrakci()
+    duplicity = None
+    if args.duplicity:
+        if Image is None:
+            print("Hledání duplicit vyžaduje knihovnu Pillow (pip install pillow). Duplicity nekontroluji.")
+        else:
+            duplicity = IndexDuplicit(max_vzdalenost=args.max_vzdalenost)
+    if not args.bez_indexu and not args.bez_json_souboru:
+        nastavit_index_uctenek(IndexUctenek())
+    if args.proud:
+        nastavit_proud_vysledku(ProudVysledku(args.proud, max_bajtu=int(args.proud_max_mb * 1024 * 1024)),
+                                json_soubory=not args.bez_json_souboru)
+    return cache, predzpracovani, duplicity
+
+def _ukoncit_zpracovani(cache, predzpracovani, duplicity=None):
+    if predzpracovani is not None:
+        predzpracovani.zavrit()
+    if cache is not None:
+        cache.zavrit()
+    if duplicity is not None:
+        duplicity.zavrit()
+    zavrit_index_uctenek()
+    zavrit_proud_vysledku()
+
+def zavrit_index_uctenek():
+    """Dopíše knihy spotřeby (ty do indexu zapisují) a zavře nastavený index účtenek."""
+    index = _index_uctenek
+    if index is not None:
+        zavrit_knihy_spotreby()
+        nastavit_index_uctenek(None)
+        index.zavrit()
 
-    # Inicializujeme klienta
-    client = genai.Client(api_key=api_key)
-    model = "gemini-2.5-flash-lite-preview-06-17"
+def prikaz_index(args):
+    """Příkaz 'index' - dorovná vyhledávací index účtenek podle výstupů v adresářích."""
+    for adresar in args.adresare:
+        if not os.path.isdir(adresar):
+            print(f"Chyba: Adresář '{adresar}' neexistuje.")
+            return 1
+    index = IndexUctenek()
+    try:
+        if args.znovu:
+            index.smazat_vse()
+        zacatek = time.perf_counter()
+        zaindexovano, odebrano = index.aktualizovat(args.adresare)
+        print(f"Zaindexováno {zaindexovano} a odebráno {odebrano} účtenek za {time.perf_counter() - zacatek:.1f} s, "
+              f"v indexu '{index.cesta}' je {index.pocet()} účtenek.")
+    finally:
+        index.zavrit()
+    return 0
+
+def prikaz_hledat(args):
+    """Příkaz 'hledat' - dotaz nad indexem účtenek."""
+    if not os.path.exists(INDEX_UCTENEK_SOUBOR):
+        print(f"Index '{INDEX_UCTENEK_SOUBOR}' neexistuje - vytvořte ho příkazem 'index ADRESAR'.")
+        return 1
+    index = IndexUctenek()
+    try:
+        zacatek = time.perf_counter()
+        vysledky = index.hledat(" ".join(args.text) or None, prodejce=args.prodejce, od=args.od, do=args.do,
+                                min_castka=args.min, max_castka=args.max, sazba_dph=args.sazba_dph, mena=args.mena,
+                                limit=args.limit)
+        trvani_ms = (time.perf_counter() - zacatek) * 1000
+    finally:
+        index.zavrit()
+    if args.json:
+        print(json.dumps(vysledky, ensure_ascii=False, indent=2))
+        return 0
+    if not vysledky:
+        print(f"Žádná účtenka neodpovídá dotazu ({trvani_ms:.1f} ms).")
+        return 0
+    vypsat_tabulku(["soubor", "prodejce", "datum", "celkem", "mena"], [
+        [os.path.relpath(radek["soubor"]), radek["prodejce"] or "-", radek["datum"] or "-",
+         f"{radek['celkem']:.2f}" if radek["celkem"] is not None else "-", radek["mena"] or "-"]
+        for radek in vysledky
+    ])
+    print(f"\n{len(vysledky)} účtenek za {trvani_ms:.1f} ms" + (" (dosažen --limit)" if len(vysledky) == args.limit else ""))
+    return 0
+
+def _kaskada(args):
+    """KaskadaModelu podle --model a --eskalovat (bez --eskalovat jen jeden model, bez kontroly)."""
+    modely = [args.model]
+    if args.eskalovat is not None:
+        # Samotné --eskalovat = dražší modely výchozí kaskády
+        modely += args.eskalovat or [model for model in KASKADA_MODELU[1:] if model != args.model]
+    return KaskadaModelu(modely, tolerance=args.tolerance)
+
+def _rozpocet(args):
+    """RozpocetBehu podle voleb --max-usd, --max-tokenu, --za-den a --pri-vycerpani (None = bez rozpočtu)."""
+    if args.max_usd is None and args.max_tokenu is None:
+        return None
+    # Příkaz uloha volbu --pri-vycerpani nemá - přípravu úlohy nemá smysl pozastavovat
+    return RozpocetBehu(max_usd=args.max_usd, max_tokenu=args.max_tokenu, za_den=args.za_den,
+                        pozastavit=getattr(args, "pri_vycerpani", "stop") == "pauza")
+
+def prikaz_zpracovat(args):
+    """Příkaz 'zpracovat' - jeden obrázek, nebo adresář v režimech 2-4, volitelně rozdělený mezi víc uzlů."""
+    if args.soubezne <= 0 or args.velikost_davky <= 0 or args.pamet_mb <= 0 or args.vzorek <= 0:
+        print("Počet souběžných požadavků, velikost dávky, limit paměti i vzorek musí být kladná čísla.")
+        return 2
+    if os.path.isfile(args.adresar):
+        # Jeden obrázek - režim 1 bez menu
+        cache, predzpracovani, duplicity = _pripravit_zpracovani(args)
+        try:
+            extrahovat_data_z_uctenky(args.adresar, cache=cache, predzpracovani=predzpracovani,
+                                      strukturovany_vystup=not args.bez_schematu,
+                                      prometheus_soubor=args.prometheus, duplicity=duplicity, kaskada=_kaskada(args))
+        finally:
+            _ukoncit_zpracovani(cache, predzpracovani, duplicity)
+        return 0
+    if not os.path.isdir(args.adresar):
+        print(f"Chyba: Adresář ani obrázek '{args.adresar}' neexistuje.")
+        return 1
+    # Víc uzlů nad sdíleným adresářem - každý si vede vlastní knihu spotřeby, manifest a metriky
+    if args.uzel or args.shard is not None or args.zapujcky:
+        nastavit_uzel(args.uzel or socket.gethostname())
     
-    # Určíme MIME typ
-    pripona = os.path.splitext(nazev_obrazku)[1].lower()
-    if pripona in ['.jpg', '.jpeg']:
-        mime_type = "image/jpeg"
-    elif pripona == '.png':
-        mime_type = "image/png"
-    else:
-        mime_type = "image/png"  # default
-    
-    contents = [
-        types.Content(
-            role="user",
-            parts=[
-                types.Part.from_bytes(mime_type=mime_type, data=obrazek_data),
-                types.Part.from_text(text="""# ROLE A CÍL
-Jsi autonomní systém pro inteligentní extrakci dat z dokumentů. Tvým úkolem je analyzovat přiložený obrázek účtenky, porozumět její struktuře a převést VŠECHNY informace do logicky uspořádaného formátu JSON. Každá účtenka je jiná, proto se nespoléhej na pevně danou šablonu, ale na svou schopnost porozumět kontextu.
+    cache, predzpracovani, duplicity = _pripravit_zpracovani(args)
+    spolecne = dict(cache=cache, inkrementalne=not args.vse, predzpracovani=predzpracovani,
+                    strukturovany_vystup=not args.bez_schematu, prometheus_soubor=args.prometheus, duplicity=duplicity, kaskada=_kaskada(args),
+                    rozpocet=_rozpocet(args))
+    if args.rezim != "auto":
+        spolecne.update(shard=args.shard, zapujcky=args.zapujcky, platnost_zapujcek=args.platnost_zapujcek)
+    try:
+        if args.rezim == "auto":
+            zpracovat_automaticky(args.adresar, kriterium=args.kriterium, vzorek=args.vzorek,
+                                  velikost_davky=args.velikost_davky, max_soubezne=args.soubezne, **spolecne)
+        elif args.rezim == "2":
+            zpracovat_davku_uctenek(args.adresar, velikost_davky=args.velikost_davky,
+                                    max_bajtu_v_pameti=int(args.pamet_mb * 1024 * 1024), **spolecne)
+        elif args.rezim == "3":
+            zpracovat_davku_jednotlivo(args.adresar, **spolecne)
+        else:
+            zpracovat_davku_soubezne(args.adresar, max_soubezne=args.soubezne, **spolecne)
+    finally:
+        _ukoncit_zpracovani(cache, predzpracovani, duplicity)
+    return 0
 
-# METODIKA PRÁCE
-Postupuj jako člověk, který se snaží data uspořádat do přehledné struktury:
-1.  **Zmapuj Dokument:** Projdi si celou účtenku a identifikuj vizuálně a logicky oddělené bloky informací (např. hlavička s prodejcem, seznam položek, souhrn plateb, detaily o transakci, daňový rozpis, čárový kód atd.).
-2.  **Přesně Přepisuj:** Při čtení dat buď maximálně přesný. Zkontroluj si dvakrát složitá slova a čísla.
-3.  **Logicky Zoskupuj:** Vytvoř JSON pole, kde každý objekt reprezentuje jeden logický blok, který jsi identifikoval v kroku 1.
-4.  **Sám Vytvoř Popisky:** Pro každý blok vytvoř popisný název (`\"typ\"`) a pro každou informaci uvnitř bloku vytvoř jasný a logický klíč (např. `\"sazba_dph\"`, `\"celkova_castka\"`, `\"nazev_polozky\"`). Klíče by měly být konzistentní a srozumitelné.
-5.  **Nezapomeň na Nic:** Ujisti se, že jsi přepsal VŠECHNY informace z účtenky, včetně číselných kódů, poznámek a dalších detailů.
+def prikaz_uloha(args):
+    """Příkaz 'uloha' - asynchronní zpracování adresáře přes Batch API."""
+    if not os.path.isdir(args.adresar):
+        print(f"Chyba: Adresář '{args.adresar}' neexistuje.")
+        return 1
+    cache, predzpracovani, duplicity = _pripravit_zpracovani(args)
+    try:
+        hotovo = zpracovat_davkovou_ulohou(args.adresar, cache=cache, inkrementalne=not args.vse,
+                                           predzpracovani=predzpracovani, strukturovany_vystup=not args.bez_schematu,
+                                           prometheus_soubor=args.prometheus, cekat=not args.bez_cekani,
+                                           interval=args.interval, model=args.model, duplicity=duplicity,
+                                           rozpocet=_rozpocet(args))
+    finally:
+        _ukoncit_zpracovani(cache, predzpracovani, duplicity)
+    # Kód 3 = úloha ještě běží, cron ji zkusí příště
+    return 0 if hotovo else 3
 
-# PŘÍKLAD MYŠLENÍ (ne formátu!)
-- \"Tohle je jasně hlavička, nazvu ji 'informace_o_prodejci'.\"
-- \"Tady začíná seznam zboží. Každý řádek bude samostatný objekt typu 'polozka_nakupu'.\"
-- \"Aha, sekce o DPH. Nazvu ji 'danovy_rozpis' a uvnitř budou klíče 'sazba', 'zaklad', 'dan'.\"
-- \"Na konci je dlouhé číslo pod čárami. To je asi interní kód nebo EAN. Nazvu ho 'identifikator_dokladu'.\"
-- \"Informace o platbě kartou jsou pohromadě, vytvořím pro ně blok 'detaily_platebni_transakce'.\"
+def prikaz_sledovat(args):
+    """Příkaz 'sledovat' - démon zpracovávající nové účtenky ve sledovaných adresářích."""
+    if args.soubezne <= 0:
+        print("Počet souběžných požadavků musí být kladné číslo.")
+        return 2
+    cache, predzpracovani, duplicity = _pripravit_zpracovani(args)
+    try:
+        return sledovat_adresare(args.adresare, max_soubezne=args.soubezne, cache=cache,
+                                 predzpracovani=predzpracovani, strukturovany_vystup=not args.bez_schematu,
+                                 interval=args.interval, klid=args.klid,
+                                 pouzit_inotify=not args.polling, duplicity=duplicity, kaskada=_kaskada(args))
+    finally:
+        _ukoncit_zpracovani(cache, predzpracovani, duplicity)
 
-# ZÁVĚREČNÝ POKYN
-Aplikuj tuto metodiku na přiloženou účtenku. Vytvoř logický, přehledný a kompletní JSON přepis. Nesnaž se napodobit žádný konkrétní příklad, ale vytvoř tu nejlepší možnou strukturu pro data, která vidíš. Začni generovat:"""),
-            ],
-        ),
-    ]
+def prikaz_sluzba(args):
+    """Příkaz 'sluzba' - lokální HTTP služba pro extrakci nahraných účtenek."""
+    if args.soubezne <= 0 or args.fronta <= 0 or args.casovy_limit <= 0:
+        print("Počet souběžných požadavků, velikost fronty i časový limit musí být kladná čísla.")
+        return 2
+    cache, predzpracovani, duplicity = _pripravit_zpracovani(args)
+    try:
+        return spustit_sluzbu(args.adresar, host=args.host, port=args.port, max_soubezne=args.soubezne,
+                              max_fronta=args.fronta, casovy_limit=args.casovy_limit, cache=cache,
+                              predzpracovani=predzpracovani, strukturovany_vystup=not args.bez_schematu,
+                              duplicity=duplicity, kaskada=_kaskada(args))
+    finally:
+        _ukoncit_zpracovani(cache, predzpracovani, duplicity)
 
+def prikaz_exportovat(args):
+    """Příkaz 'exportovat' - převede proudy výsledků do jednoho Parquet/Arrow souboru."""
+    for vstup in args.vstupy:
+        if not os.path.exists(vstup):
+            print(f"Chyba: '{vstup}' neexistuje.")
+            return 1
     try:
-        response = client.models.generate_content(model=model, contents=contents)
-        
-        # Získáme presné údaje o tokenoch
-        tokeny = response.usage_metadata.total_token_count
-        naklady_usd = vypocitat_naklady(tokeny, model)
-        
-        print(f"📊 Tokeny: {tokeny}, Náklady: ${naklady_usd:.6f} USD")
-        
-        # Uložíme výstup
-        cisty_json_text = response.text.replace("```json\n", "").replace("\n```", "").strip()
-        with open(nazev_vystupu, "w", encoding="utf-8") as f:
-            f.write(cisty_json_text)
-        
-        # Uložíme do reportu
-        cas = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        data_reportu = [[cas, os.path.basename(nazev_obrazku), tokeny, naklady_usd, 'USPECH_JEDNOTLIVO', 'Spracované jednotlivo - presné údaje']]
-        ulozit_report_spotreby(adresar, data_reportu)
-        
-        print(f"✅ Uloženo: {os.path.basename(nazev_vystupu)}")
-        return tokeny, naklady_usd
-        
-    except Exception as e:
-        print(f"❌ Chyba: {e}")
-        
-        # Uložíme chybu do reportu
-        cas = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        data_reportu = [[cas, os.path.basename(nazev_obrazku), 0, 0.0, 'CHYBA', str(e)]]
-        ulozit_report_spotreby(adresar, data_reportu)
-        return 0, 0.0
+        pocet = exportovat_vysledky(args.vstupy, args.cil)
+    except RuntimeError as e:
+        print(f"Chyba: {e}")
+        return 1
+    print(f"Vyexportováno {pocet} účtenek do '{args.cil}'.")
+    return 0
+
+def prikazova_radka(argv):
+    """
+    Neinteraktivní příkazy (bez argumentů se spustí interaktivní menu).
+    
+    Příklady:
+        python extract-bill-json.py report souhrn -a example --podle prodejce mesic
+        python extract-bill-json.py report export report_spotreby.csv -a example --od 2025-06-01
+        python extract-bill-json.py report import stary_report.csv -a example
+        python extract-bill-json.py zpracovat /mnt/archiv --rezim 2 --shard 0/4 --zapujcky
+        python extract-bill-json.py uloha archiv/2025-06 --bez-cekani
+        python extract-bill-json.py sledovat prichozi/ --soubezne 8
+        python extract-bill-json.py zpracovat archiv/2025-06 --rezim 4 --eskalovat gemini-2.5-flash
+        python extract-bill-json.py index example archiv/2025-06
+        python extract-bill-json.py hledat --prodejce albert --min 500 --od 2025-01-01
+        python extract-bill-json.py zpracovat /mnt/archiv --proud vysledky/ --bez-json-souboru
+        python extract-bill-json.py exportovat vysledky/ -o uctenky.parquet
+        python extract-bill-json.py zpracovat example/uctenka.png --model gemini-2.5-flash
+        python extract-bill-json.py sluzba --port 8080 --soubezne 8
+        python extract-bill-json.py zpracovat archiv/2025-06 --rezim auto --max-usd 2 --za-den --pri-vycerpani pauza
+    """
+    parser = argparse.ArgumentParser(prog="extract-bill-json.py",
+                                     description="Extrakce dat z účtenek pomocí Google AI.")
+    prikazy = parser.add_subparsers(dest="prikaz", required=True)
+    
+    report = prikazy.add_parser("report", help="Dotazy nad knihou spotřeby (tokeny a náklady)")
+    akce = report.add_subparsers(dest="akce", required=True)
+    kniha = argparse.ArgumentParser(add_help=False)
+    kniha.add_argument("-a", "--adresar", default="example", help="Adresář s knihou spotřeby (default: example)")
+    kniha.add_argument("--uzel", help="Kniha spotřeby daného uzlu (po zpracování s --shard/--zapujcky)")
+    filtry = argparse.ArgumentParser(add_help=False, parents=[kniha])
+    filtry.add_argument("--od", help="Od data (YYYY-MM-DD)")
+    filtry.add_argument("--do", help="Do data včetně (YYYY-MM-DD)")
+    filtry.add_argument("--status", help="Prefix statusu, např. USPECH nebo CHYBA")
+    souhrn = akce.add_parser("souhrn", parents=[filtry], help="Počty, tokeny a náklady po skupinách")
+    souhrn.add_argument("--podle", nargs="*", choices=sorted(KnihaSpotreby.SKUPINY), default=["mesic"],
+                        help="Seskupit podle (default: mesic); bez hodnot = jeden celkový součet")
+    export = akce.add_parser("export", parents=[filtry], help="Vyexportovat knihu do CSV")
+    export.add_argument("soubor", help="Cílový CSV soubor")
+    import_ = akce.add_parser("import", parents=[kniha], help="Naimportovat CSV report do knihy")
+    import_.add_argument("soubor", help="Zdrojový CSV soubor")
+    
+    # Volby společné pro zpracovat i sledovat
+    volby = argparse.ArgumentParser(add_help=False)
+    volby.add_argument("--bez-cache", action="store_true", help="Nepoužívat cache výsledků")
+    volby.add_argument("--bez-schematu", action="store_true", help="Nevynucovat JSON výstup podle schématu")
+    volby.add_argument("--predzpracovat", action="store_true",
+                       help="Předzpracovat obrázky - oříznout, odstíny šedi, zmenšit")
+    volby.add_argument("--bez-indexu", action="store_true",
+                       help="Nezapisovat nové výstupy do vyhledávacího indexu účtenek")
+    volby.add_argument("--duplicity", action="store_true",
+                       help="Rozpoznávat kopie už zpracovaného obrázku (tentýž soubor, nebo tentýž snímek "
+                            "podle EXIF překódovaný či zmenšený) a převzít jejich výsledek; "
+                            "jinou fotku téže účtenky nerozpozná")
+    volby.add_argument("--max-vzdalenost", type=int, default=4,
+                       help="Nejvyšší Hammingova vzdálenost hashů kandidáta na duplikát (default: 4 z 64 bitů); "
+                            "duplikát se navíc potvrzuje shodou dat nebo snímku podle EXIF ve stejném adresáři")
+    volby.add_argument("--model", default=MODEL_DEFAULT, help=f"Model pro extrakci (default: {MODEL_DEFAULT})")
+    volby.add_argument("--proud", metavar="ADRESAR",
+                       help="Připisovat výsledky i do souhrnného proudu JSON Lines v tomto adresáři")
+    volby.add_argument("--proud-max-mb", type=float, default=256,
+                       help="Po kolika MB začít další soubor proudu (default: 256)")
+    volby.add_argument("--bez-json-souboru", action="store_true",
+                       help="Nezapisovat JSON vedle každého obrázku, výsledky jen do proudu (vyžaduje --proud)")
+    synchronni = argparse.ArgumentParser(add_help=False, parents=[volby])
+    synchronni.add_argument("--eskalovat", nargs="*", metavar="MODEL",
+                            help="Účtenky, které neprojdou kontrolou (součty, DPH, datum), zpracovat dražšími "
+                                 f"modely v tomto pořadí (bez modelů: {', '.join(KASKADA_MODELU[1:])})")
+    synchronni.add_argument("--tolerance", type=float, default=1.0,
+                            help="Povolený rozdíl částek při kontrole účtenky (default: 1.0)")
+    
+    # Rozpočet pro zpracovat i uloha
+    rozpoctove = argparse.ArgumentParser(add_help=False)
+    rozpoctove.add_argument("--max-usd", type=float, help="Strop nákladů v USD - pak se další požadavky neodešlou")
+    rozpoctove.add_argument("--max-tokenu", type=int, help="Strop spotřebovaných tokenů")
+    rozpoctove.add_argument("--za-den", action="store_true",
+                            help="Strop platí pro celý den včetně dřívějších běhů - počítá se jen kniha spotřeby "
+                                 "tohoto adresáře, ne jiné adresáře, sledovat ani sluzba")
+    
+    zpracovat = prikazy.add_parser("zpracovat", parents=[synchronni, rozpoctove],
+                                   help="Zpracovat adresář nebo jeden obrázek bez interaktivního menu")
+    zpracovat.add_argument("adresar", metavar="cesta", help="Adresář s obrázky nebo jeden obrázek")
+    zpracovat.add_argument("-r", "--rezim", choices=["2", "3", "4", "auto"], default="4",
+                           help="2 = dávky, 3 = jednotlivo, 4 = jednotlivo souběžně, auto = změřit 2 a 4 na vzorku "
+                                "a zbytek zpracovat lepším z nich (default: 4)")
+    zpracovat.add_argument("--kriterium", choices=["naklady", "rychlost"], default="naklady",
+                           help="Podle čeho režim auto vybírá (default: naklady)")
+    zpracovat.add_argument("--vzorek", type=int, default=4,
+                           help="Kolik obrázků režim auto měří každým režimem (default: 4)")
+    zpracovat.add_argument("--pri-vycerpani", choices=["stop", "pauza"], default="stop",
+                           help="Po vyčerpání rozpočtu skončit, nebo (s --za-den) počkat do dalšího dne "
+                                "(default: stop)")
+    zpracovat.add_argument("-s", "--soubezne", type=int, default=8,
+                           help="Počet souběžných požadavků v režimu 4 (default: 8)")
+    zpracovat.add_argument("--velikost-davky", type=int, default=5, help="Velikost dávky v režimu 2 (default: 5)")
+    zpracovat.add_argument("--pamet-mb", type=float, default=64,
+                           help="Kolik MB obrázků smí režim 2 držet v paměti včetně dávky načítané dopředu "
+                                "(default: 64)")
+    zpracovat.add_argument("--vse", action="store_true",
+                           help="Zpracovat i obrázky, které už mají aktuální výstup")
+    zpracovat.add_argument("--prometheus", help="Cesta k Prometheus textfile se souhrnem běhu")
+    zpracovat.add_argument("--shard", type=parsovat_shard,
+                           help="Zpracovat jen díl i/N adresáře (0/4 až 3/4) podle hashe názvu souboru")
+    zpracovat.add_argument("--zapujcky", action="store_true",
+                           help="Zabírat obrázky soubory zápůjček, aby je nezpracovaly i jiné uzly")
+    zpracovat.add_argument("--platnost-zapujcek", type=float, default=600,
+                           help="Po kolika sekundách bez obnovení převezmou zápůjčku jiné uzly (default: 600)")
+    zpracovat.add_argument("--uzel", help="Název uzlu pro stavové soubory (default s --shard/--zapujcky: hostname)")
+    
+    uloha = prikazy.add_parser("uloha", parents=[volby, rozpoctove],
+                               help="Zpracovat adresář asynchronní úlohou Batch API (poloviční cena, do 24 h)")
+    uloha.add_argument("adresar", help="Adresář s obrázky")
+    uloha.add_argument("--bez-cekani", action="store_true",
+                       help="Jen odeslat / zkontrolovat úlohu a skončit (kód 3 = ještě běží); vhodné pro cron")
+    uloha.add_argument("--interval", type=float, default=60, help="Sekundy mezi dotazy na stav úlohy (default: 60)")
+    uloha.add_argument("--vse", action="store_true", help="Zpracovat i obrázky, které už mají aktuální výstup")
+    uloha.add_argument("--prometheus", help="Cesta k Prometheus textfile se souhrnem běhu")
+    
+    sledovat = prikazy.add_parser("sledovat", parents=[synchronni],
+                                  help="Démon - zpracuje nové účtenky, jakmile se objeví v adresářích")
+    sledovat.add_argument("adresare", nargs="+", help="Sledované adresáře")
+    sledovat.add_argument("-s", "--soubezne", type=int, default=4, help="Počet souběžných požadavků (default: 4)")
+    sledovat.add_argument("--klid", type=float, default=2.0,
+                          help="Kolik sekund se soubor nesmí měnit, aby se považoval za zapsaný (default: 2)")
+    sledovat.add_argument("--interval", type=float, default=2.0,
+                          help="Perioda procházení adresářů bez inotify v sekundách (default: 2)")
+    sledovat.add_argument("--polling", action="store_true", help="Nepoužívat inotify, jen procházet adresáře")
+    
+    sluzba = prikazy.add_parser("sluzba", parents=[synchronni],
+                                help="Lokální HTTP služba - POST /uctenky s obrázkem vrátí extrahovaná data")
+    sluzba.add_argument("-a", "--adresar", default=SLUZBA_ADRESAR,
+                        help=f"Adresář pro nahrané obrázky a výstupy (default: {SLUZBA_ADRESAR})")
+    sluzba.add_argument("--host", default="127.0.0.1", help="Adresa, na které služba poslouchá (default: 127.0.0.1)")
+    sluzba.add_argument("--port", type=int, default=8080, help="Port služby (default: 8080)")
+    sluzba.add_argument("-s", "--soubezne", type=int, default=4, help="Počet souběžných požadavků (default: 4)")
+    sluzba.add_argument("--fronta", type=int, default=32,
+                        help="Kolik účtenek smí čekat ve frontě, pak služba odpovídá 503 (default: 32)")
+    sluzba.add_argument("--casovy-limit", type=float, default=120,
+                        help="Jak dlouho POST čeká na výsledek, než vrátí 202 s ID úlohy (default: 120 s)")
+    
+    index = prikazy.add_parser("index", help="Dorovnat vyhledávací index účtenek podle JSON výstupů")
+    index.add_argument("adresare", nargs="+", help="Adresáře s obrázky a jejich JSON výstupy")
+    index.add_argument("--znovu", action="store_true", help="Smazat index a zaindexovat vše znovu")
+    
+    hledat = prikazy.add_parser("hledat", help="Vyhledat účtenky v indexu")
+    hledat.add_argument("text", nargs="*", help="Slova kdekoliv na účtence (bez ohledu na diakritiku)")
+    hledat.add_argument("-p", "--prodejce", help="Slova v názvu prodejce")
+    hledat.add_argument("--od", help="Od data účtenky (YYYY-MM-DD)")
+    hledat.add_argument("--do", help="Do data účtenky včetně (YYYY-MM-DD)")
+    hledat.add_argument("--min", type=float, help="Celková částka alespoň")
+    hledat.add_argument("--max", type=float, help="Celková částka nejvýše")
+    hledat.add_argument("--sazba-dph", type=float, help="Účtenka obsahuje DPH v této sazbě (%%)")
+    hledat.add_argument("--mena", help="Měna celkové částky (CZK, EUR...)")
+    hledat.add_argument("--limit", type=int, default=50, help="Nejvýše kolik účtenek vypsat (default: 50)")
+    hledat.add_argument("--json", action="store_true", help="Vypsat výsledky jako JSON")
+    
+    exportovat = prikazy.add_parser("exportovat", help="Vyexportovat proudy výsledků do Parquet nebo Arrow")
+    exportovat.add_argument("vstupy", nargs="+", help="Soubory proudu nebo adresáře s nimi (vysledky-*.jsonl)")
+    exportovat.add_argument("-o", "--cil", required=True,
+                            help="Cílový soubor; .parquet = Parquet, jinak Arrow IPC (.arrow, .feather)")
+    
+    args = parser.parse_args(argv)
+    if args.prikaz == "zpracovat":
+        if args.pri_vycerpani == "pauza" and not args.za_den:
+            parser.error("--pri-vycerpani pauza vyžaduje --za-den")
+        if args.rezim == "auto" and (args.shard is not None or args.zapujcky):
+            parser.error("--rezim auto nelze kombinovat s --shard ani --zapujcky")
+    if getattr(args, "bez_json_souboru", False):
+        # Duplicity i zápůjčky poznávají hotové obrázky podle JSON souboru vedle obrázku
+        if not args.proud:
+            parser.error("--bez-json-souboru vyžaduje --proud")
+        if args.duplicity or getattr(args, "zapujcky", False):
+            parser.error("--bez-json-souboru nelze kombinovat s --duplicity ani --zapujcky")
+    if args.prikaz == "report":
+        nastavit_uzel(args.uzel)
+        return prikaz_report(args)
+    if args.prikaz == "zpracovat":
+        return prikaz_zpracovat(args)
+    if args.prikaz == "uloha":
+        return prikaz_uloha(args)
+    if args.prikaz == "sledovat":
+        return prikaz_sledovat(args)
+    if args.prikaz == "sluzba":
+        return prikaz_sluzba(args)
+    if args.prikaz == "index":
+        return prikaz_index(args)
+    if args.prikaz == "hledat":
+        return prikaz_hledat(args)
+    if args.prikaz == "exportovat":
+        return prikaz_exportovat(args)
+    return 2
 
 if __name__ == "__main__":
+    # S argumenty běží neinteraktivní příkazy (report, zpracovat, sledovat, sluzba), bez nich interaktivní menu
+    if len(sys.argv) > 1:
+        sys.exit(prikazova_radka(sys.argv[1:]))
+    
     # Volba: zpracovat jeden obrázek nebo všechny v adresáři
     print("1 - Zpracovat jeden obrázek")
     print("2 - Zpracovat všechny obrázky v adresáři naraz (dávka - rychlejšie, ale nepresné tokeny)")
     print("3 - Zpracovat všechny obrázky jednotlivo (pomalšie, ale presné tokeny pre každý súbor)")
+    print("4 - Zpracovat všechny obrázky jednotlivo a souběžně (rychlé a presné tokeny pre každý súbor)")
+    print("5 - Odeslat všechny obrázky jako asynchronní úlohu Batch API (poloviční cena, výsledky do 24 h)")
+    print("6 - Změřit režimy 2 a 4 na vzorku a zbytek zpracovat levnějším z nich")
+    # Menu se ptá jen na to, co daný režim nutně potřebuje - ostatní volby mají výchozí hodnoty příkazové řádky
+    print("Další volby (rozpočet, kaskáda modelů, předzpracování, duplicity, proud výsledků...) nabízí příkazová "
+          "řádka: python extract-bill-json.py zpracovat --help")
     
-    volba = input("Vaše volba (1, 2 nebo 3): ").strip()
+    volba = input("Vaše volba (1, 2, 3, 4, 5 nebo 6): ").strip()
     
     if volba == "1":
         # Původní funkcionalita - jeden obrázek
         jmeno_souboru_s_obrazkem = "example/uctenka.png"
-        extrahovat_data_z_uctenky(jmeno_souboru_s_obrazkem)
-    elif volba == "2":
-        # Nová funkcionalita - dávkové zpracování
+        sys.exit(prikazova_radka(["zpracovat", jmeno_souboru_s_obrazkem]))
+    elif volba in ("2", "3", "4", "5", "6"):
         adresar = input("Zadejte adresář (nebo stiskněte Enter pro 'example'): ").strip()
         if not adresar:
             adresar = "example"
-        
+    else:
+        print("Neplatná volba.")
+        sys.exit(1)
+    
+    if volba == "2":
         # Dotaz na velikost dávky
         try:
             velikost_str = input("Zadejte velikost dávky (nebo stiskněte Enter pro default 5): ").strip()
@@ -573,13 +6590,32 @@ if __name__ == "__main__":
             print("Neplatné číslo. Používám default velikost dávky 5.")
             velikost_davky = 5
         
-        zpracovat_davku_uctenek(adresar, velikost_davky=velikost_davky)
+        argumenty = ["zpracovat", adresar, "--rezim", "2", "--velikost-davky", str(velikost_davky)]
     elif volba == "3":
-        # Nová funkcionalita - spracovanie jednotlivo
-        adresar = input("Zadejte adresář (nebo stiskněte Enter pro 'example'): ").strip()
-        if not adresar:
-            adresar = "example"
+        argumenty = ["zpracovat", adresar, "--rezim", "3"]
+    elif volba == "4":
+        # Souběžné spracovanie jednotlivo so zdieľaným klientom
+        try:
+            soubezne_str = input("Zadejte počet souběžných požadavků (nebo stiskněte Enter pro default 8): ").strip()
+            if soubezne_str:
+                max_soubezne = int(soubezne_str)
+                if max_soubezne <= 0:
+                    print("Počet souběžných požadavků musí být kladné číslo. Používám default 8.")
+                    max_soubezne = 8
+            else:
+                max_soubezne = 8
+        except ValueError:
+            print("Neplatné číslo. Používám default 8 souběžných požadavků.")
+            max_soubezne = 8
         
-        zpracovat_davku_jednotlivo(adresar)
+        argumenty = ["zpracovat", adresar, "--rezim", "4", "--soubezne", str(max_soubezne)]
+    elif volba == "5":
+        # Asynchronní úloha Batch API - rozpracovanou úlohu v adresáři stačí spustit znovu
+        argumenty = ["uloha", adresar]
+        if input("Počkat na dokončení úlohy (A/n)? ").strip().lower() == "n":
+            argumenty.append("--bez-cekani")
     else:
-        print("Neplatná volba.")
\ No newline at end of file
+        # Automatický výběr režimu - vzorek změří oba režimy, zbytek dostane ten levnější
+        argumenty = ["zpracovat", adresar, "--rezim", "auto"]
+    
+    sys.exit(prikazova_radka(argumenty))
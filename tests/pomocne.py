@@ -0,0 +1,70 @@
+"""
+Společné pomůcky testů - načtení skriptu a falešného klienta z benchmarku.
+
+Testy nevolají Google AI ani nepotřebují nainstalované google-genai:
+používají stejného falešného klienta jako benchmark-bill-json.py.
+"""
+import importlib.util
+import os
+import shutil
+import sys
+import unittest
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+KOREN = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PRIKLADY = os.path.join(KOREN, "example")
+
+def _nacist_modul(nazev, soubor):
+    """Načte skript jako modul (název se pomlčkami nejde importovat)."""
+    if nazev in sys.modules:
+        return sys.modules[nazev]
+    spec = importlib.util.spec_from_file_location(nazev, os.path.join(KOREN, soubor))
+    modul = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = modul
+    spec.loader.exec_module(modul)
+    return modul
+
+benchmark = _nacist_modul("benchmark_bill_json", "benchmark-bill-json.py")
+skript = _nacist_modul("extract_bill_json", "extract-bill-json.py")
+
+def _je_sdk():
+    try:
+        return importlib.util.find_spec("google.genai") is not None
+    except ImportError:
+        return False
+
+# Synchronní režimy skládají požadavky z typů SDK (types.Part) - bez google-genai se jejich testy přeskočí
+vyzaduje_sdk = unittest.skipUnless(_je_sdk(), "vyžaduje google-genai")
+
+def falesny_klient(latence=0.0, chybovost=0.0):
+    """
+    Falešný genai.Client s vestavěnou ukázkovou odpovědí.
+
+    Args:
+        latence: Doba běhu úlohy Batch API (a požadavků) v sekundách
+        chybovost: Podíl požadavků končících chybou 503
+    """
+    return benchmark.FalesnyKlient(skript, benchmark.nacist_nahravky(None, skript), latence=latence,
+                                   latence_na_obrazek=0.0, chybovost=chybovost)
+
+@contextmanager
+def falesne_api(klient):
+    """Podstrčí zpracování falešného klienta místo genai.Client a API klíč - stejně jako benchmark."""
+    puvodni = skript.genai, skript.nacti_api_klic
+    skript.genai = SimpleNamespace(Client=lambda **kwargs: klient)
+    skript.nacti_api_klic = lambda *args, **kwargs: "test"
+    try:
+        yield klient
+    finally:
+        skript.genai, skript.nacti_api_klic = puvodni
+
+def pripravit_obrazky(adresar, pocet=2):
+    """Zkopíruje do adresáře ukázkové účtenky a vrátí jejich cesty."""
+    vzory = skript.najit_obrazky(PRIKLADY)[:pocet]
+    cesty = []
+    for vzor in vzory:
+        cesta = os.path.join(adresar, os.path.basename(vzor))
+        shutil.copyfile(vzor, cesta)
+        cesty.append(cesta)
+    return cesty
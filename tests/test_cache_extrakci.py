@@ -0,0 +1,123 @@
+"""Cache extrakce: složení klíče, čtení a ukládání, čištění podle stáří a velikosti."""
+import json
+import os
+import tempfile
+import time
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+
+from pomocne import falesne_api, falesny_klient, pripravit_obrazky, skript, vyzaduje_sdk
+
+class TestKlicCache(unittest.TestCase):
+
+    def test_klic_zavisi_na_obrazku_promptu_a_modelu(self):
+        klic = skript.CacheExtrakci.vytvorit_klic(b"obrazek", "prompt", "model")
+        self.assertEqual(klic, skript.CacheExtrakci.vytvorit_klic(b"obrazek", "prompt", "model"))
+        self.assertNotEqual(klic, skript.CacheExtrakci.vytvorit_klic(b"obrazek2", "prompt", "model"))
+        self.assertNotEqual(klic, skript.CacheExtrakci.vytvorit_klic(b"obrazek", "prompt2", "model"))
+        self.assertNotEqual(klic, skript.CacheExtrakci.vytvorit_klic(b"obrazek", "prompt", "model2"))
+
+    def test_hranice_casti_klice_jsou_jednoznacne(self):
+        # Bez délek by "ab" + "c" a "a" + "bc" daly stejný hash
+        self.assertNotEqual(skript.CacheExtrakci.vytvorit_klic(b"x", "c", "ab"),
+                            skript.CacheExtrakci.vytvorit_klic(b"x", "bc", "a"))
+
+    def test_schema_je_soucasti_promptu_klice(self):
+        bez_schematu = skript.prompt_pro_klic(skript.PROMPT_EXTRAKCE)
+        se_schematem = skript.prompt_pro_klic(skript.PROMPT_EXTRAKCE, schema=skript.SCHEMA_UCTENKY)
+        self.assertEqual(bez_schematu, skript.PROMPT_EXTRAKCE)
+        self.assertNotEqual(skript.CacheExtrakci.vytvorit_klic(b"x", bez_schematu, "model"),
+                            skript.CacheExtrakci.vytvorit_klic(b"x", se_schematem, "model"))
+
+class TestCacheExtrakci(unittest.TestCase):
+
+    def setUp(self):
+        self._adresar = tempfile.TemporaryDirectory(prefix="test-cache-")
+        self.cesta = os.path.join(self._adresar.name, "cache.sqlite")
+
+    def tearDown(self):
+        self._adresar.cleanup()
+
+    def cache(self, **kwargs):
+        cache = skript.CacheExtrakci(self.cesta, **kwargs)
+        self.addCleanup(cache.zavrit)
+        return cache
+
+    def klice(self, cache):
+        return sorted(radek[0] for radek in cache._db.execute("SELECT klic FROM vysledky"))
+
+    def test_ulozeni_a_nacteni(self):
+        cache = self.cache()
+        self.assertIsNone(cache.nacist("a"))
+        cache.ulozit("a", "model", '{"celkem": 1}', {"total_token_count": 10})
+        self.assertEqual(cache.nacist("a"), ('{"celkem": 1}', {"total_token_count": 10}))
+        self.assertEqual((cache.zasahy, cache.minuti), (1, 1))
+
+    def test_cisteni_podle_stari(self):
+        cache = self.cache(max_vek_dni=1, max_velikost_mb=None)
+        cache.ulozit("stary", "model", "{}", {})
+        cache.ulozit("novy", "model", "{}", {})
+        cache._db.execute("UPDATE vysledky SET ulozeno = ? WHERE klic = 'stary'", (time.time() - 2 * 86400,))
+        cache._db.commit()
+
+        self.assertEqual(cache.vycistit(), 1)
+        self.assertEqual(self.klice(cache), ["novy"])
+
+    def test_cisteni_podle_velikosti_maze_nejdele_nepouzite(self):
+        # Limit se vejde na dva ze tří záznamů
+        zaznam = json.dumps({"text": "x" * 400})
+        cache = self.cache(max_vek_dni=None, max_velikost_mb=2.5 * len(zaznam) / (1024 * 1024))
+        for stari, klic in enumerate(("a", "b", "c")):
+            cache.ulozit(klic, "model", zaznam, {})
+            cache._db.execute("UPDATE vysledky SET pouzito = ? WHERE klic = ?", (time.time() - 100 + stari, klic))
+        cache._db.commit()
+        cache.nacist("a")  # použití záznam posune na konec fronty
+
+        self.assertEqual(cache.vycistit(), 1)
+        self.assertEqual(self.klice(cache), ["a", "c"])
+
+@vyzaduje_sdk
+class TestCacheVDavkach(unittest.TestCase):
+
+    def setUp(self):
+        self._adresar = tempfile.TemporaryDirectory(prefix="test-cache-davky-")
+        self.adresar = self._adresar.name
+        self.obrazky = pripravit_obrazky(self.adresar)
+        self._ticho = redirect_stdout(StringIO())
+        self._ticho.__enter__()
+
+    def tearDown(self):
+        skript.zavrit_knihy_spotreby()
+        self._ticho.__exit__(None, None, None)
+        self._adresar.cleanup()
+
+    def zpracovat(self, klient, cache):
+        with falesne_api(klient):
+            skript.zpracovat_davku_uctenek(self.adresar, cache=cache, velikost_davky=5)
+
+    def test_druhy_beh_jde_z_cache(self):
+        cache = skript.CacheExtrakci(os.path.join(self.adresar, "cache.sqlite"))
+        self.addCleanup(cache.zavrit)
+        klient = falesny_klient()
+        self.zpracovat(klient, cache)
+        volani = klient.models.pocet_volani
+        self.zpracovat(klient, cache)
+
+        self.assertEqual(klient.models.pocet_volani, volani)
+        self.assertEqual(cache.zasahy, len(self.obrazky))
+
+    def test_rozbity_odkaz_jde_do_knihy_a_beh_pokracuje(self):
+        os.symlink(os.path.join(self.adresar, "neexistuje.jpg"), os.path.join(self.adresar, "zz_rozbity.jpg"))
+        cache = skript.CacheExtrakci(os.path.join(self.adresar, "cache.sqlite"))
+        self.addCleanup(cache.zavrit)
+        self.zpracovat(falesny_klient(), cache)
+
+        radky = skript.kniha_spotreby(self.adresar).radky()
+        stavy = {radek[1]: radek[4] for radek in radky}
+        self.assertEqual(stavy["zz_rozbity.jpg"], "CHYBA_NACTENI")
+        for obrazek in self.obrazky:
+            self.assertTrue(os.path.exists(os.path.splitext(obrazek)[0] + ".json"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+"""Stavový automat úlohy Batch API: odeslání, navázání, dohledání podle display_name a vyzvednutí."""
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+
+from pomocne import falesne_api, falesny_klient, pripravit_obrazky, skript
+
+class TestDavkovaUloha(unittest.TestCase):
+
+    def setUp(self):
+        self._adresar = tempfile.TemporaryDirectory(prefix="test-uloha-")
+        self.adresar = self._adresar.name
+        self.obrazky = pripravit_obrazky(self.adresar)
+        self._ticho = redirect_stdout(StringIO())
+        self._ticho.__enter__()
+
+    def tearDown(self):
+        skript.zavrit_knihy_spotreby()
+        self._ticho.__exit__(None, None, None)
+        self._adresar.cleanup()
+
+    def uloha(self, klient):
+        # Nová instance čte stav jen ze souboru - jako proces spuštěný znovu po přerušení
+        return skript.DavkovaUloha(self.adresar, klient, spat=lambda sekund: None)
+
+    def json_vystupy(self):
+        return sorted(soubor for soubor in os.listdir(self.adresar) if soubor.endswith(".json")
+                      and soubor != skript.ULOHA_SOUBOR)
+
+    def test_odeslani_a_vyzvednuti(self):
+        klient = falesny_klient()
+        uloha = self.uloha(klient)
+        self.assertEqual(uloha.pripravit(self.obrazky), len(self.obrazky))
+        self.assertEqual(uloha.faze, "PRIPRAVENA")
+
+        self.assertTrue(uloha.pokracovat(interval=0))
+        self.assertEqual(uloha.faze, "VYZVEDNUTA")
+        self.assertEqual(uloha.stav["uspesnych"], len(self.obrazky))
+        self.assertEqual(len(self.json_vystupy()), len(self.obrazky))
+        self.assertEqual(len(klient.batches.ulohy), 1)
+
+        radky = skript.kniha_spotreby(self.adresar).radky()
+        self.assertEqual(sorted(radek[4] for radek in radky), ["USPECH_BATCH_API"] * len(self.obrazky))
+
+        uloha.uklidit()
+        self.assertIsNone(self.uloha(klient).faze)
+
+    def test_navazani_po_preruseni(self):
+        klient = falesny_klient()
+        uloha = self.uloha(klient)
+        uloha.pripravit(self.obrazky)
+        uloha.nahrat()
+
+        navazana = self.uloha(klient)
+        self.assertEqual(navazana.faze, "NAHRANA")
+        self.assertEqual(navazana.stav["soubor_pozadavku"], uloha.stav["soubor_pozadavku"])
+        self.assertTrue(navazana.pokracovat(interval=0))
+        self.assertEqual(len(klient.files.soubory), 2)  # požadavky + výsledky, nic se nenahrálo podruhé
+        self.assertEqual(len(klient.batches.ulohy), 1)
+
+    def test_prevzeti_podle_display_name(self):
+        klient = falesny_klient()
+        uloha = self.uloha(klient)
+        uloha.pripravit(self.obrazky)
+        uloha.nahrat()
+        # Proces spadl hned po vytvoření úlohy - stav zůstal ve fázi NAHRANA
+        odeslana = klient.batches.create(model=uloha.stav["model"], src=uloha.stav["soubor_pozadavku"],
+                                         config={"display_name": uloha.stav["display_name"]})
+
+        navazana = self.uloha(klient)
+        self.assertTrue(navazana.pokracovat(interval=0))
+        self.assertEqual(len(klient.batches.ulohy), 1)
+        self.assertEqual(navazana.stav["uloha"], odeslana.name)
+        self.assertEqual(len(self.json_vystupy()), len(self.obrazky))
+
+    def test_bez_cekani_vyzvedne_az_dalsi_beh(self):
+        klient = falesny_klient(latence=3600)
+        uloha = self.uloha(klient)
+        uloha.pripravit(self.obrazky)
+
+        self.assertFalse(uloha.pokracovat(cekat=False))
+        self.assertEqual(uloha.faze, "ODESLANA")
+        self.assertEqual(self.json_vystupy(), [])
+
+        for stav in klient.batches.ulohy.values():
+            stav["trvani"] = 0
+        navazana = self.uloha(klient)
+        self.assertTrue(navazana.pokracovat(cekat=False))
+        self.assertEqual(len(self.json_vystupy()), len(self.obrazky))
+        self.assertEqual(len(klient.batches.ulohy), 1)
+
+    def test_chybejici_vysledky_jdou_do_knihy_jako_chyba(self):
+        klient = falesny_klient(chybovost=1.0)
+        uloha = self.uloha(klient)
+        uloha.pripravit(self.obrazky)
+
+        self.assertTrue(uloha.pokracovat(interval=0))
+        self.assertEqual(uloha.stav["uspesnych"], 0)
+        self.assertEqual(self.json_vystupy(), [])
+        radky = skript.kniha_spotreby(self.adresar).radky()
+        self.assertEqual(sorted(radek[4] for radek in radky), ["CHYBA_API"] * len(self.obrazky))
+
+    def test_necitelny_soubor_s_cache_jde_do_knihy(self):
+        os.symlink(os.path.join(self.adresar, "neexistuje.jpg"), os.path.join(self.adresar, "zz_rozbity.jpg"))
+        cache = skript.CacheExtrakci(os.path.join(self.adresar, "cache.sqlite"))
+        self.addCleanup(cache.zavrit)
+        with falesne_api(falesny_klient()):
+            self.assertTrue(skript.zpracovat_davkovou_ulohou(self.adresar, cache=cache, interval=0))
+
+        self.assertEqual(len(self.json_vystupy()), len(self.obrazky))
+        stavy = {radek[1]: radek[4] for radek in skript.kniha_spotreby(self.adresar).radky()}
+        self.assertEqual(stavy["zz_rozbity.jpg"], "CHYBA_NACTENI")
+
+if __name__ == "__main__":
+    unittest.main()
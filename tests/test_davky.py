@@ -0,0 +1,149 @@
+"""Dávky režimu 2: obálky výsledků, půlení neúspěšné dávky a přiřazení výsledků k obrázkům."""
+import json
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+from types import SimpleNamespace
+
+from pomocne import pripravit_obrazky, skript, vyzaduje_sdk
+
+class TestRozdelitVysledkyDavky(unittest.TestCase):
+
+    def setUp(self):
+        self._ticho = redirect_stdout(StringIO())
+        self._ticho.__enter__()
+
+    def tearDown(self):
+        self._ticho.__exit__(None, None, None)
+
+    def test_platne_obalky(self):
+        vysledky = [
+            {"obrazek_index": 1, "data": {"celkem": 2}},
+            {"obrazek_index": 0, "data": [{"celkem": 1}]},
+        ]
+        self.assertEqual(skript.rozdelit_vysledky_davky(vysledky, 2), {0: [{"celkem": 1}], 1: {"celkem": 2}})
+
+    def test_data_bez_obalky_prijdou_bez_indexu(self):
+        self.assertEqual(skript.rozdelit_vysledky_davky([{"obrazek_index": 0, "celkem": 1}], 1), {0: {"celkem": 1}})
+
+    def test_neplatne_obalky_se_preskoci(self):
+        vysledky = [
+            {"data": {}},                               # bez indexu
+            {"obrazek_index": True, "data": {}},        # bool není index
+            {"obrazek_index": "1", "data": {}},
+            {"obrazek_index": 3, "data": {}},           # mimo rozsah
+            {"obrazek_index": 0, "data": "text"},       # data ve špatném tvaru
+            {"obrazek_index": 1, "data": {"celkem": 1}},
+            {"obrazek_index": 1, "data": {"celkem": 2}},  # duplicitní index
+            "obalka",
+        ]
+        self.assertEqual(skript.rozdelit_vysledky_davky(vysledky, 3), {1: {"celkem": 1}})
+
+    def test_odpoved_musi_byt_pole(self):
+        with self.assertRaises(ValueError):
+            skript.rozdelit_vysledky_davky({"obrazek_index": 0}, 1)
+
+class ChybaApi(Exception):
+    """Neopakovatelná chyba API (VykonavacPozadavku ji neopakuje)."""
+    code = 400
+
+class SkriptovaneModely:
+    """Náhrada client.models - odpověď dávky určí pravidlo, výsledek nese název svého obrázku."""
+
+    def __init__(self, nazvy_podle_dat, pravidlo):
+        """
+        Args:
+            nazvy_podle_dat: Slovník data obrázku -> název souboru
+            pravidlo: Funkce (názvy odeslaných obrázků) -> indexy, které odpověď vrátí; smí vyhodit výjimku
+        """
+        self.nazvy_podle_dat = nazvy_podle_dat
+        self.pravidlo = pravidlo
+        self.davky = []
+
+    def generate_content(self, model, contents, config=None):
+        nazvy = [self.nazvy_podle_dat[cast.inline_data.data] for obsah in contents for cast in obsah.parts
+                 if getattr(cast, "inline_data", None) is not None]
+        self.davky.append(nazvy)
+        text = json.dumps([{"obrazek_index": i, "data": {"soubor": nazvy[i]}} for i in self.pravidlo(nazvy)])
+        usage = SimpleNamespace(prompt_token_count=100 * len(nazvy), candidates_token_count=10 * len(nazvy),
+                                total_token_count=110 * len(nazvy))
+        return SimpleNamespace(text=text, usage_metadata=usage)
+
+@vyzaduje_sdk
+class TestZpracovatJednuDavku(unittest.TestCase):
+
+    def setUp(self):
+        self._adresar = tempfile.TemporaryDirectory(prefix="test-davky-")
+        self.adresar = self._adresar.name
+        self.obrazky = pripravit_obrazky(self.adresar, pocet=4)
+        self._ticho = redirect_stdout(StringIO())
+        self._ticho.__enter__()
+
+    def tearDown(self):
+        skript.zavrit_knihy_spotreby()
+        self._ticho.__exit__(None, None, None)
+        self._adresar.cleanup()
+
+    def zpracovat(self, obrazky, pravidlo):
+        nazvy_podle_dat = {}
+        for obrazek in self.obrazky:
+            with open(obrazek, "rb") as f:
+                nazvy_podle_dat[f.read()] = os.path.basename(obrazek)
+        self.modely = SkriptovaneModely(nazvy_podle_dat, pravidlo)
+        vykonavac = skript.VykonavacPozadavku(SimpleNamespace(models=self.modely))
+        uspesne, _, _ = skript.zpracovat_jednu_davku(obrazky, vykonavac, skript.MODEL_DEFAULT, self.adresar)
+        return uspesne
+
+    def vystup(self, obrazek):
+        with open(os.path.splitext(obrazek)[0] + ".json", encoding="utf-8") as f:
+            return json.load(f)
+
+    def stavy(self):
+        return {radek[1]: radek[4] for radek in skript.kniha_spotreby(self.adresar).radky()}
+
+    def test_neuspesna_davka_se_puli_az_po_obrazky(self):
+        def jen_jednotlive(nazvy):
+            if len(nazvy) > 1:
+                raise ChybaApi("400 dávka je moc velká")
+            return [0]
+
+        self.assertEqual(self.zpracovat(self.obrazky, jen_jednotlive), 4)
+        self.assertEqual([len(davka) for davka in self.modely.davky], [4, 2, 1, 1, 2, 1, 1])
+        for obrazek in self.obrazky:
+            self.assertEqual(self.vystup(obrazek), {"soubor": os.path.basename(obrazek)})
+
+    def test_chybejici_vysledek_se_zkusi_samostatne(self):
+        druhy = os.path.basename(self.obrazky[1])
+
+        def bez_druheho(nazvy):
+            return [i for i, nazev in enumerate(nazvy) if nazev != druhy or len(nazvy) == 1]
+
+        self.assertEqual(self.zpracovat(self.obrazky, bez_druheho), 4)
+        self.assertEqual(self.modely.davky[1:], [[druhy]])
+        self.assertEqual(self.vystup(self.obrazky[1]), {"soubor": druhy})
+
+    def test_necitelny_obrazek_neposune_indexy(self):
+        rozbity = os.path.join(self.adresar, "rozbity.png")
+        os.symlink(os.path.join(self.adresar, "neexistuje.png"), rozbity)
+        davka = [self.obrazky[0], rozbity] + self.obrazky[1:]
+
+        self.assertEqual(self.zpracovat(davka, lambda nazvy: range(len(nazvy))), 4)
+        self.assertEqual(len(self.modely.davky), 1)
+        for obrazek in self.obrazky:
+            self.assertEqual(self.vystup(obrazek), {"soubor": os.path.basename(obrazek)})
+        self.assertEqual(self.stavy()["rozbity.png"], "CHYBA_NACTENI")
+
+    def test_chyba_jednotliveho_obrazku_se_zapise(self):
+        def vzdy_chyba(nazvy):
+            raise ChybaApi("400 neplatný požadavek")
+
+        self.assertEqual(self.zpracovat(self.obrazky[:2], vzdy_chyba), 0)
+        self.assertEqual([len(davka) for davka in self.modely.davky], [2, 1, 1])
+        stavy = self.stavy()
+        for obrazek in self.obrazky[:2]:
+            self.assertEqual(stavy[os.path.basename(obrazek)], "CHYBA_API")
+
+if __name__ == "__main__":
+    unittest.main()
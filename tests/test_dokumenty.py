@@ -0,0 +1,120 @@
+"""Dokumenty: MIME typ podle obsahu, počet stran PDF a spojení výsledků stránek."""
+import json
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
+
+from pomocne import skript, vyzaduje_sdk
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\0" * 8
+JPEG = b"\xff\xd8\xff\xe0" + b"\0" * 12
+PDF = b"%PDF-1.7\n"
+
+class TestMimeTyp(unittest.TestCase):
+
+    def test_magic_bytes(self):
+        for data, ocekavano in ((PNG, "image/png"), (JPEG, "image/jpeg"), (b"RIFF\0\0\0\0WEBPVP8 ", "image/webp"),
+                                (PDF, "application/pdf"), (b"\0\0\0\x18ftypheic", "image/heic"),
+                                (b"\0\0\0\x18ftypmif1", "image/heif"), (b"GIF89a", None), (b"", None)):
+            self.assertEqual(skript.mime_typ_z_obsahu(data), ocekavano, data)
+
+    def test_obsah_ma_prednost_pred_priponou(self):
+        with tempfile.TemporaryDirectory(prefix="test-mime-") as adresar:
+            cesta = os.path.join(adresar, "fotka.jpg")
+            with open(cesta, "wb") as f:
+                f.write(PNG)
+            self.assertEqual(skript.urcit_mime_typ(cesta), "image/png")
+            self.assertEqual(skript.urcit_mime_typ(cesta, data=PDF), "application/pdf")
+
+    def test_neznamy_obsah_podle_pripony(self):
+        self.assertEqual(skript.urcit_mime_typ("sken.PDF", data=b"neznamy"), "application/pdf")
+        self.assertEqual(skript.urcit_mime_typ("neexistuje.webp"), "image/webp")
+        self.assertEqual(skript.urcit_mime_typ("neexistuje.bin"), "image/png")
+
+class TestPdf(unittest.TestCase):
+
+    def test_pocet_stran_bez_pdfium(self):
+        data = PDF + b"<< /Type /Pages /Count 3 >> " + b"<< /Type /Page >> " * 2 + b"<</Type/Page>>"
+        with mock.patch.object(skript, "pdfium", None):
+            self.assertEqual(skript.pocet_stran_pdf(data), 3)
+            self.assertEqual(skript.pocet_stran_pdf(PDF), 1)
+
+    def test_bez_pdfium_se_pdf_posle_cele(self):
+        with mock.patch.object(skript, "pdfium", None):
+            stranky = skript.pripravit_dokument("sken.pdf", PDF + b"<< /Type /Page >> " * 2)
+        self.assertEqual(len(stranky), 1)
+        self.assertEqual(stranky[0][1], "application/pdf")
+
+class TestSpojitStranky(unittest.TestCase):
+
+    def test_bloky_v_poradi_stran_bez_opakovani(self):
+        hlavicka = {"typ": "prodejce", "nazev": "Velkoobchod s.r.o."}
+        stranky = [
+            [hlavicka, {"typ": "polozky", "polozky": [{"nazev": "Mouka", "cena": 100}]}],
+            [hlavicka, {"typ": "polozky", "polozky": [{"nazev": "Cukr", "cena": 50}]}],
+            {"typ": "souhrn", "celkem": 150},
+        ]
+        self.assertEqual(skript.spojit_stranky(stranky), [
+            {"strana": 1, **hlavicka},
+            {"strana": 1, "typ": "polozky", "polozky": [{"nazev": "Mouka", "cena": 100}]},
+            {"strana": 2, "typ": "polozky", "polozky": [{"nazev": "Cukr", "cena": 50}]},
+            {"strana": 3, "typ": "souhrn", "celkem": 150},
+        ])
+
+    def test_soucet_usage_stranek(self):
+        odpovedi = [SimpleNamespace(usage_metadata=SimpleNamespace(prompt_token_count=100, total_token_count=120,
+                                                                   candidates_token_count=20)),
+                    SimpleNamespace(usage_metadata=SimpleNamespace(prompt_token_count=50, total_token_count=60,
+                                                                   candidates_token_count=None))]
+        usage = skript.secist_usage(odpovedi)
+        self.assertEqual((usage.prompt_token_count, usage.candidates_token_count, usage.total_token_count,
+                          usage.cached_content_token_count), (150, 20, 180, 0))
+
+class StrankoveModely:
+    """Náhrada client.models - odpoví výsledkem stránky podle dat jejího obrázku."""
+
+    def __init__(self, odpovedi):
+        self.odpovedi = odpovedi
+
+    def generate_content(self, model, contents, config=None):
+        data = next(cast.inline_data.data for cast in contents[0].parts if cast.inline_data is not None)
+        usage = SimpleNamespace(prompt_token_count=300, candidates_token_count=100, total_token_count=400)
+        return SimpleNamespace(text=json.dumps(self.odpovedi[data]), usage_metadata=usage)
+
+@vyzaduje_sdk
+class TestExtrakceStranek(unittest.TestCase):
+
+    def setUp(self):
+        self._ticho = redirect_stdout(StringIO())
+        self._ticho.__enter__()
+
+    def tearDown(self):
+        self._ticho.__exit__(None, None, None)
+
+    def test_stranky_se_spoji_a_kontroluje_se_cely_dokument(self):
+        hlavicka = {"typ": "prodejce", "nazev": "Velkoobchod s.r.o.", "datum": "05.03.2024"}
+        odpovedi = {
+            b"strana1": [hlavicka, {"typ": "polozka", "nazev": "Mouka", "cena": 100}],
+            b"strana2": [hlavicka, {"typ": "polozka", "nazev": "Cukr", "cena": 50}, {"celkem": 150}],
+        }
+        vykonavac = skript.VykonavacPozadavku(SimpleNamespace(models=StrankoveModely(odpovedi)),
+                                              limity={"levny": (10_000, 10**9), "drahy": (10_000, 10**9)})
+        stranky = [([skript.types.Part.from_bytes(data=data, mime_type="image/jpeg")], 500) for data in odpovedi]
+        pokusy, strany = [], []
+
+        data, odpoved, problemy = skript.KaskadaModelu(["levny", "drahy"]).generovat_stranky(
+            vykonavac, stranky, pokusy, strany, skript.MereniPolozky("obrazek", "faktura.pdf"))
+
+        # Součet je jen na poslední stránce - po spojení celý dokument projde kontrolou
+        self.assertEqual(problemy, [])
+        self.assertEqual([blok["strana"] for blok in data], [1, 1, 2, 2])
+        self.assertEqual(odpoved.usage_metadata.total_token_count, 800)
+        self.assertEqual([(model, tokeny) for model, tokeny, _ in strany], [("levny", 400), ("levny", 400)])
+        self.assertEqual(len(pokusy), 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+"""Hledání duplicit: multi-index hledání v Hammingově vzdálenosti a potvrzení kopie téhož snímku."""
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from pomocne import PRIKLADY, skript
+
+class TestIndexHashu(unittest.TestCase):
+
+    def test_najde_totez_co_linearni_pruchod(self):
+        nahoda = random.Random(7)
+        index = skript.IndexHashu()
+        hashe = [nahoda.getrandbits(64) for _ in range(300)]
+        # Blízké varianty, aby bylo co najít i ve větších vzdálenostech
+        for zaklad in hashe[:50]:
+            for pocet_bitu in (1, 3, 6, 9):
+                hashe.append(zaklad ^ sum(1 << bit for bit in nahoda.sample(range(64), pocet_bitu)))
+        hodnoty = {}
+        for poradi, hash_obrazku in enumerate(hashe):
+            index.pridat(hash_obrazku, poradi)
+            hodnoty.setdefault(hash_obrazku, poradi)
+
+        for hledany in hashe[:60]:
+            for max_vzdalenost in (0, 3, 4, 8):
+                ocekavane = sorted((bin(hledany ^ hash_obrazku).count("1"), poradi)
+                                   for hash_obrazku, poradi in hodnoty.items()
+                                   if bin(hledany ^ hash_obrazku).count("1") <= max_vzdalenost)
+                self.assertEqual(sorted(index.najit(hledany, max_vzdalenost)), ocekavane)
+
+    def test_stejny_hash_podruhe_neprepise_hodnotu(self):
+        index = skript.IndexHashu()
+        index.pridat(0xABCD, "prvni")
+        index.pridat(0xABCD, "druhy")
+        self.assertEqual(index.pocet, 1)
+        self.assertEqual(index.najit(0xABCD, 0), [(0, "prvni")])
+
+@unittest.skipIf(skript.Image is None, "vyžaduje Pillow")
+class TestIndexDuplicit(unittest.TestCase):
+
+    def setUp(self):
+        self._adresar = tempfile.TemporaryDirectory(prefix="test-duplicity-")
+        self.adresar = self._adresar.name
+        self.duplicity = skript.IndexDuplicit(os.path.join(self.adresar, "duplicity.sqlite"))
+        self.addCleanup(self.duplicity.zavrit)
+        vzory = skript.najit_obrazky(PRIKLADY)
+        self.original = self.fotka("original.jpg", vzory[0])
+        self.jina_uctenka = self.fotka("jina.jpg", vzory[1], cas="2025:06:01 10:05:00")
+
+    def tearDown(self):
+        self._adresar.cleanup()
+
+    def fotka(self, nazev, vzor, cas="2025:06:01 10:00:00", zmensit=1.0, kvalita=90):
+        """Uloží vzor jako JPEG s EXIF snímku (fotoaparát a čas pořízení)."""
+        obrazek = skript.Image.open(vzor).convert("RGB")
+        if zmensit != 1.0:
+            obrazek = obrazek.resize((int(obrazek.width * zmensit), int(obrazek.height * zmensit)))
+        exif = skript.Image.Exif()
+        exif[272] = "Pixel 7"
+        exif[306] = cas
+        cesta = os.path.join(self.adresar, nazev)
+        obrazek.save(cesta, "JPEG", quality=kvalita, exif=exif)
+        return cesta
+
+    def data(self, cesta):
+        with open(cesta, "rb") as f:
+            return f.read()
+
+    def zpracovat(self, cesta):
+        """Jako po úspěšné extrakci - výstup vedle obrázku a potvrzení do indexu."""
+        self.assertIsNone(self.duplicity.najit(cesta, self.data(cesta)))
+        with open(os.path.splitext(cesta)[0] + ".json", "w", encoding="utf-8") as f:
+            f.write("{}")
+        self.duplicity.potvrdit(cesta)
+
+    def test_totozna_kopie_souboru(self):
+        self.zpracovat(self.original)
+        kopie = os.path.join(self.adresar, "kopie.jpg")
+        shutil.copyfile(self.original, kopie)
+
+        shoda = self.duplicity.najit(kopie, self.data(kopie))
+        self.assertIsNotNone(shoda)
+        self.assertEqual(shoda[1], os.path.abspath(self.original))
+
+    def test_prekodovana_kopie_tehoz_snimku(self):
+        self.zpracovat(self.original)
+        kopie = self.fotka("zmensena.jpg", self.original, zmensit=0.5, kvalita=60)
+
+        self.assertIsNotNone(self.duplicity.najit(kopie, self.data(kopie)))
+
+    def test_jina_fotka_neni_duplikat(self):
+        self.zpracovat(self.original)
+        # Stejný obsah, ale jiný snímek - samostatná fotka se zpracuje znovu
+        jiny_snimek = self.fotka("jiny_snimek.jpg", self.original, cas="2025:06:01 10:00:07", kvalita=70)
+
+        self.assertIsNone(self.duplicity.najit(jiny_snimek, self.data(jiny_snimek)))
+        self.assertIsNone(self.duplicity.najit(self.jina_uctenka, self.data(self.jina_uctenka)))
+
+    def test_kopie_v_jinem_adresari_neni_duplikat(self):
+        self.zpracovat(self.original)
+        os.mkdir(os.path.join(self.adresar, "jinde"))
+        kopie = os.path.join(self.adresar, "jinde", "kopie.jpg")
+        shutil.copyfile(self.original, kopie)
+
+        self.assertIsNone(self.duplicity.najit(kopie, self.data(kopie)))
+
+    def test_nepotvrzeny_obrazek_neni_originalem(self):
+        self.duplicity.najit(self.original, self.data(self.original))
+        self.duplicity.zapomenout(self.original)
+        kopie = os.path.join(self.adresar, "kopie.jpg")
+        shutil.copyfile(self.original, kopie)
+
+        self.assertIsNone(self.duplicity.najit(kopie, self.data(kopie)))
+
+    def test_index_prezije_znovuotevreni(self):
+        self.zpracovat(self.original)
+        self.duplicity.zavrit()
+        self.duplicity = skript.IndexDuplicit(os.path.join(self.adresar, "duplicity.sqlite"))
+        self.addCleanup(self.duplicity.zavrit)
+        kopie = os.path.join(self.adresar, "kopie.jpg")
+        shutil.copyfile(self.original, kopie)
+
+        self.assertIsNotNone(self.duplicity.najit(kopie, self.data(kopie)))
+
+if __name__ == "__main__":
+    unittest.main()
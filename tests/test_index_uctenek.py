@@ -0,0 +1,133 @@
+"""Index účtenek: normalizace volně strukturovaného JSON, fulltext bez diakritiky a dotazy nad poli."""
+import json
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+
+from pomocne import skript
+
+def uctenka(prodejce, datum, polozky, dph, celkem, mena="Kč"):
+    """JSON účtenky v podobě, jakou vrací model - bloky s typem a vlastními názvy klíčů."""
+    return [
+        {"typ": "informace_o_prodejci", "nazev_prodejce": prodejce, "ico": "12345678"},
+        {"typ": "hlavicka", "datum_a_cas": f"{datum} 10:15"},
+        {"typ": "seznam_polozek", "polozky": [
+            {"nazev": nazev, "mnozstvi": mnozstvi, "cena_celkem": cena} for nazev, mnozstvi, cena in polozky
+        ]},
+        {"typ": "danovy_rozpis", "radky": [
+            {"sazba_dph": f"{sazba} %", "zaklad_dane": zaklad, "dph": dan} for sazba, zaklad, dan in dph
+        ]},
+        {"typ": "souhrn", "mezisoucet": celkem, "celkem_k_uhrade": f"{celkem:.2f} {mena}".replace(".", ",")},
+    ]
+
+class TestParsovani(unittest.TestCase):
+
+    def test_castky(self):
+        for hodnota, ocekavano in (("1 234,50 Kč", 1234.5), ("1.234,5", 1234.5), ("1,234.50 EUR", 1234.5),
+                                   ("12.000", 12000.0), ("-15,90", -15.9), (42, 42.0), ("1'000", 1000.0)):
+            self.assertEqual(skript.parsovat_castku(hodnota), ocekavano, hodnota)
+        for hodnota in (None, True, "bez čísla", {"castka": 1}):
+            self.assertIsNone(skript.parsovat_castku(hodnota))
+
+    def test_data(self):
+        for hodnota, ocekavano in (("31.12.2024", "2024-12-31"), ("Dne 1. 2. 24 v 8:00", "2024-02-01"),
+                                   ("2024-03-05T10:00", "2024-03-05"), ("31/12/2024", "2024-12-31")):
+            self.assertEqual(skript.parsovat_datum(hodnota), ocekavano, hodnota)
+        for hodnota in ("31.02.2024", "bez data", 20240101):
+            self.assertIsNone(skript.parsovat_datum(hodnota))
+
+class TestNormalizovatUctenku(unittest.TestCase):
+
+    def test_spolecna_pole(self):
+        data = uctenka("Pekařství U Mlýna s.r.o.", "05.03.2024",
+                       [("Rohlík", 4, "12,00"), ("Chléb kmínový", 1, "45,90")],
+                       [(12, "51,70", "6,20")], 57.9)
+        pole = skript.normalizovat_uctenku(data)
+
+        self.assertEqual(pole["prodejce"], "Pekařství U Mlýna s.r.o.")
+        self.assertEqual(pole["datum"], "2024-03-05")
+        self.assertEqual(pole["celkem"], 57.9)
+        self.assertEqual(pole["mena"], "CZK")
+        self.assertEqual(pole["dph"], [(12.0, 51.7, 6.2)])
+        self.assertEqual(pole["polozky"], [("Rohlík", 4.0, 12.0), ("Chléb kmínový", 1.0, 45.9)])
+        self.assertIn("Chléb kmínový", pole["text"])
+
+    def test_mezisoucet_ani_dph_nejsou_celkem(self):
+        data = {"polozky": [{"nazev": "Káva", "celkem": 500}], "rekapitulace_dph": {"celkem_dph": 80},
+                "celkem_bez_dph": 400, "mezisoucet_celkem": 450, "celkem": "480 EUR"}
+        pole = skript.normalizovat_uctenku(data)
+        self.assertEqual(pole["celkem"], 480.0)
+        self.assertEqual(pole["mena"], "EUR")
+        self.assertIsNone(pole["datum"])
+
+class TestIndexUctenek(unittest.TestCase):
+
+    def setUp(self):
+        self._adresar = tempfile.TemporaryDirectory(prefix="test-index-")
+        self.adresar = self._adresar.name
+        self.index = skript.IndexUctenek(os.path.join(self.adresar, "index.sqlite"))
+        self.addCleanup(self.index.zavrit)
+        self._ticho = redirect_stdout(StringIO())
+        self._ticho.__enter__()
+
+        self.ulozit("pekarna", uctenka("Pekařství U Mlýna", "05.03.2024", [("Rohlík", 4, "12,00")],
+                                       [(12, "10,71", "1,29")], 12.0))
+        self.ulozit("drogerie", uctenka("Drogerie Lesk", "20.04.2024", [("Šampon na vlasy", 1, "129,00")],
+                                        [(21, "106,61", "22,39")], 129.0))
+        self.ulozit("kavarna", uctenka("Kavárna Na Rohu", "02.05.2024", [("Espresso", 2, "5,80")],
+                                       [(20, "4,83", "0,97")], 5.8, mena="EUR"))
+        self.assertEqual(self.index.aktualizovat([self.adresar]), (3, 0))
+
+    def tearDown(self):
+        self._ticho.__exit__(None, None, None)
+        self._adresar.cleanup()
+
+    def ulozit(self, nazev, data):
+        """Obrázek a jeho JSON výstup - index bere jen JSON se jménem některého obrázku."""
+        with open(os.path.join(self.adresar, f"{nazev}.png"), "wb") as f:
+            f.write(b"\x89PNG\r\n\x1a\n")
+        with open(os.path.join(self.adresar, f"{nazev}.json"), "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+
+    def nalezene(self, **kwargs):
+        return [os.path.basename(radek["soubor"]) for radek in self.index.hledat(**kwargs)]
+
+    def test_fulltext_bez_diakritiky_a_jako_zacatek_slova(self):
+        self.assertEqual(self.nalezene(text="rohlik"), ["pekarna.json"])
+        self.assertEqual(self.nalezene(text="SAMP"), ["drogerie.json"])
+        self.assertEqual(self.nalezene(text="pekarstvi rohlik"), ["pekarna.json"])
+        self.assertEqual(self.nalezene(text="rohlik sampon"), [])
+
+    def test_prodejce_hleda_jen_v_nazvu_prodejce(self):
+        self.assertEqual(self.nalezene(prodejce="rohu"), ["kavarna.json"])
+        self.assertEqual(self.nalezene(prodejce="espresso"), [])
+
+    def test_pole_a_razeni_od_nejnovejsi(self):
+        self.assertEqual(self.nalezene(), ["kavarna.json", "drogerie.json", "pekarna.json"])
+        self.assertEqual(self.nalezene(od="2024-04-01", do="2024-04-30"), ["drogerie.json"])
+        self.assertEqual(self.nalezene(min_castka=10, max_castka=100), ["pekarna.json"])
+        self.assertEqual(self.nalezene(sazba_dph=21), ["drogerie.json"])
+        self.assertEqual(self.nalezene(mena="eur"), ["kavarna.json"])
+        self.assertEqual(self.nalezene(limit=1), ["kavarna.json"])
+
+    def test_uvozovky_v_dotazu_nerozbiji_fts(self):
+        self.assertEqual(self.nalezene(text='"rohlik'), ["pekarna.json"])
+        self.assertEqual(self.nalezene(text="AND OR NOT *"), [])
+
+    def test_aktualizace_preindexuje_zmenene_a_odebere_smazane(self):
+        self.assertEqual(self.index.aktualizovat([self.adresar]), (0, 0))
+        self.ulozit("pekarna", uctenka("Pekařství U Mlýna", "05.03.2024", [("Bageta", 1, "30,00")],
+                                       [(12, "26,79", "3,21")], 30.0))
+        cesta = os.path.join(self.adresar, "pekarna.json")
+        os.utime(cesta, (os.stat(cesta).st_atime, os.stat(cesta).st_mtime + 10))
+        os.remove(os.path.join(self.adresar, "drogerie.json"))
+
+        self.assertEqual(self.index.aktualizovat([self.adresar]), (1, 1))
+        self.assertEqual(self.nalezene(text="bageta"), ["pekarna.json"])
+        self.assertEqual(self.nalezene(text="rohlik"), [])
+        self.assertEqual(self.index.pocet(), 2)
+
+if __name__ == "__main__":
+    unittest.main()
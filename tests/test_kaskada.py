@@ -0,0 +1,132 @@
+"""Kaskáda modelů: aritmetická kontrola účtenky a předání dražšímu modelu jen při nesrovnalosti."""
+import json
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+from types import SimpleNamespace
+
+from pomocne import skript, vyzaduje_sdk
+
+def uctenka(polozky=(("Rohlík", "100,00"), ("Máslo", "20,50")), dph=((21, "99,59", "20,91"),), celkem="120,50 Kč",
+            datum="05.03.2024"):
+    """Účtenka, jejíž položky, DPH a celková částka k sobě sedí (pokud je test nezmění)."""
+    data = {
+        "prodejce": "Potraviny Na Rohu",
+        "polozky": [{"nazev": nazev, "cena_celkem": cena} for nazev, cena in polozky],
+        "danovy_rozpis": [{"sazba": f"{sazba} %", "zaklad": zaklad, "dan": dan} for sazba, zaklad, dan in dph],
+        "celkem_k_uhrade": celkem,
+    }
+    if datum is not None:
+        data["datum"] = datum
+    return data
+
+class TestOveritUctenku(unittest.TestCase):
+
+    def test_souhlasna_uctenka_projde(self):
+        self.assertEqual(skript.overit_uctenku(uctenka()), [])
+
+    def test_chybi_datum_a_celkem(self):
+        problemy = skript.overit_uctenku({"prodejce": "Potraviny"})
+        self.assertEqual(problemy, ["chybí čitelné datum", "chybí celková částka"])
+
+    def test_soucet_polozek_nesedi(self):
+        problemy = skript.overit_uctenku(uctenka(polozky=(("Rohlík", "100,00"), ("Máslo", "30,50"))))
+        self.assertEqual(len(problemy), 1)
+        self.assertIn("součet položek 130.50", problemy[0])
+
+    def test_dan_nesedi_na_zaklad_a_sazbu(self):
+        problemy = skript.overit_uctenku(uctenka(dph=((15, "99,59", "20,91"),)))
+        self.assertEqual(len(problemy), 1)
+        self.assertIn("DPH 15 %", problemy[0])
+
+    def test_zaklad_a_dan_nesedi_na_celkem(self):
+        problemy = skript.overit_uctenku(uctenka(dph=((21, "90,00", "18,90"),)))
+        self.assertEqual(problemy, ["základ + DPH 108.90 nesedí na celkem 120.50"])
+
+    def test_zaokrouhleni_do_tolerance(self):
+        # Rozdíl 1 Kč (zaokrouhlení hotovosti) projde výchozí tolerancí, přísnější ne
+        self.assertEqual(skript.overit_uctenku(uctenka(celkem="121,50 Kč")), [])
+        self.assertNotEqual(skript.overit_uctenku(uctenka(celkem="121,50 Kč"), tolerance=0.1), [])
+
+class SkriptovaneModely:
+    """Náhrada client.models - každý model odpoví svým připraveným textem."""
+
+    def __init__(self, odpovedi):
+        self.odpovedi = odpovedi
+        self.volane = []
+
+    def generate_content(self, model, contents, config=None):
+        self.volane.append(model)
+        usage = SimpleNamespace(prompt_token_count=1000, candidates_token_count=200, total_token_count=1200)
+        return SimpleNamespace(text=self.odpovedi[model], usage_metadata=usage)
+
+@vyzaduje_sdk
+class TestKaskadaModelu(unittest.TestCase):
+
+    def setUp(self):
+        self._ticho = redirect_stdout(StringIO())
+        self._ticho.__enter__()
+
+    def tearDown(self):
+        self._ticho.__exit__(None, None, None)
+
+    def generovat(self, modely, odpovedi):
+        self.modely = SkriptovaneModely(odpovedi)
+        vykonavac = skript.VykonavacPozadavku(SimpleNamespace(models=self.modely),
+                                              limity={model: (10_000, 10**9) for model in modely})
+        self.pokusy = []
+        self.metriky = skript.MetrikyBehu()
+        return skript.KaskadaModelu(modely).generovat(vykonavac, [], 1000, self.pokusy,
+                                                      skript.MereniPolozky("obrazek", "test"), metriky=self.metriky)
+
+    def test_proslou_uctenku_drazsi_model_nedostane(self):
+        data, _, problemy = self.generovat(["levny", "drahy"], {"levny": json.dumps(uctenka())})
+        self.assertEqual(self.modely.volane, ["levny"])
+        self.assertEqual((data, problemy), (uctenka(), []))
+        self.assertEqual(self.metriky.urovne["levny"]["proslo"], 1)
+
+    def test_nesrovnalost_eskaluje(self):
+        spatna = uctenka(celkem="1 205,00 Kč")
+        data, _, problemy = self.generovat(["levny", "drahy"], {"levny": json.dumps(spatna),
+                                                                "drahy": json.dumps(uctenka())})
+        self.assertEqual(self.modely.volane, ["levny", "drahy"])
+        self.assertEqual((data, problemy), (uctenka(), []))
+        self.assertEqual([pokus[0] for pokus in self.pokusy], ["levny", "drahy"])
+        self.assertTrue(self.pokusy[0][3])
+
+        radky = skript.radky_eskalace("2024-03-05 10:00:00", "uctenka.png", self.pokusy)
+        self.assertEqual(len(radky), 1)
+        self.assertEqual((radky[0][4], radky[0][7]), ("ESKALACE", "levny"))
+
+    def test_neplatny_json_eskaluje(self):
+        data, _, _ = self.generovat(["levny", "drahy"], {"levny": "tohle není JSON",
+                                                         "drahy": json.dumps(uctenka())})
+        self.assertEqual(data, uctenka())
+        self.assertIn("neplatný JSON", self.pokusy[0][3][0])
+
+    def test_posledni_model_se_prijme_i_s_nesrovnalosti(self):
+        spatna = uctenka(celkem="1 205,00 Kč")
+        data, _, problemy = self.generovat(["levny", "drahy"], {"levny": json.dumps(spatna),
+                                                                "drahy": json.dumps(spatna)})
+        self.assertEqual(data, spatna)
+        self.assertTrue(problemy)
+        self.assertEqual(self.metriky.urovne["drahy"]["proslo"], 0)
+
+    def test_neplatny_json_posledniho_modelu_vyhodi_chybu(self):
+        with self.assertRaises(ValueError):
+            self.generovat(["levny", "drahy"], {"levny": "{", "drahy": "{"})
+        self.assertEqual(len(self.pokusy), 2)
+
+    def test_jediny_model_neoveruje(self):
+        spatna = uctenka(celkem="1 205,00 Kč")
+        data, _, problemy = self.generovat(["levny"], {"levny": json.dumps(spatna)})
+        self.assertEqual((data, problemy), (spatna, []))
+        self.assertEqual(self.metriky.urovne, {})
+
+    def test_vyssi_kaskada_overuje_i_jediny_model(self):
+        kaskada = skript.KaskadaModelu(["levny", "drahy"]).vyssi()
+        self.assertEqual(kaskada.modely, ["drahy"])
+        self.assertTrue(kaskada.overovat)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+"""Kontextová cache promptu: minimum modelu, vytvoření, prodloužení, obnova po vypršení a smazání."""
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+
+from pomocne import falesny_klient, skript
+
+# Dost dlouhý prompt, aby ho model přijal do cache (minimum je 1024 tokenů)
+DLOUHY_PROMPT = "Vytáhni z účtenky všechny položky. " * 120
+
+class Hodiny:
+    """Ručně posouvaný čas místo time.time."""
+
+    def __init__(self):
+        self.ted = 1000.0
+
+    def __call__(self):
+        return self.ted
+
+class TestSpravceKontextoveCache(unittest.TestCase):
+
+    def setUp(self):
+        self.klient = falesny_klient()
+        self.prodlouzeni = []
+        puvodni_update = self.klient.caches.update
+
+        def update(name, config):
+            self.prodlouzeni.append((name, config["ttl"]))
+            return puvodni_update(name, config)
+        self.klient.caches.update = update
+        self.hodiny = Hodiny()
+        self._ticho = redirect_stdout(StringIO())
+        self._ticho.__enter__()
+
+    def tearDown(self):
+        self._ticho.__exit__(None, None, None)
+
+    def spravce(self, prompt=DLOUHY_PROMPT):
+        return skript.SpravceKontextoveCache(self.klient, skript.MODEL_DEFAULT, prompt, ttl_sekund=3600,
+                                             obnovit_pred_sekund=300, hodiny=self.hodiny)
+
+    def test_kratky_prompt_se_do_cache_neposila(self):
+        kontext = self.spravce(skript.PROMPT_EXTRAKCE)
+        self.assertIsNone(kontext.nazev())
+        self.assertEqual(self.klient.caches.kontexty, {})
+        self.assertIsNotNone(skript.duvod_bez_kontextove_cache(skript.MODEL_DEFAULT, skript.PROMPT_DAVKA))
+
+    def test_vytvoreni_az_pri_prvnim_pozadavku(self):
+        kontext = self.spravce()
+        self.assertEqual(self.klient.caches.kontexty, {})
+        nazev = kontext.nazev()
+        self.assertEqual(self.klient.caches.kontexty, {nazev: DLOUHY_PROMPT})
+        self.hodiny.ted += 60
+        self.assertEqual(kontext.nazev(), nazev)
+        self.assertEqual(self.prodlouzeni, [])
+
+    def test_prodlouzeni_pred_vyprsenim(self):
+        kontext = self.spravce()
+        nazev = kontext.nazev()
+        self.hodiny.ted += 3400
+        self.assertEqual(kontext.nazev(), nazev)
+        self.assertEqual(self.prodlouzeni, [(nazev, "3600s")])
+        # Po prodloužení platí další hodinu od teď
+        self.hodiny.ted += 3000
+        self.assertEqual(kontext.nazev(), nazev)
+        self.assertEqual(len(self.klient.caches.kontexty), 1)
+
+    def test_vyprsela_cache_se_vytvori_znovu(self):
+        kontext = self.spravce()
+        prvni = kontext.nazev()
+        self.hodiny.ted += 4000
+        druhy = kontext.nazev()
+        self.assertNotEqual(druhy, prvni)
+        self.assertEqual(self.prodlouzeni, [])
+        # Platí se uložení první instance po celé TTL a druhé od jejího vytvoření
+        self.hodiny.ted += 1800
+        hodin = (3600 + 1800) / 3600
+        self.assertAlmostEqual(kontext.naklady_ulozeni(),
+                               kontext.tokenu_v_cache / 1_000_000 * skript.CENA_ULOZENI_CACHE_ZA_HODINU * hodin)
+
+    def test_nepovedene_prodlouzeni_vytvori_novou(self):
+        kontext = self.spravce()
+        prvni = kontext.nazev()
+
+        def update(name, config):
+            raise RuntimeError("404 NOT_FOUND")
+        self.klient.caches.update = update
+        self.hodiny.ted += 3400
+        self.assertNotEqual(kontext.nazev(), prvni)
+
+    def test_smazani(self):
+        kontext = self.spravce()
+        kontext.nazev()
+        self.hodiny.ted += 1800
+        kontext.smazat()
+        self.assertEqual(self.klient.caches.kontexty, {})
+        self.assertIsNone(kontext.nazev())
+
+        naklady = kontext.naklady_ulozeni()
+        self.assertGreater(naklady, 0)
+        self.hodiny.ted += 3600
+        self.assertEqual(kontext.naklady_ulozeni(), naklady)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+"""Manifest zpracování: co inkrementální běh přeskočí, co zopakuje a navázání přerušeného běhu."""
+import os
+import tempfile
+import time
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+
+from pomocne import falesne_api, falesny_klient, pripravit_obrazky, skript, vyzaduje_sdk
+
+class TestManifestZpracovani(unittest.TestCase):
+
+    def setUp(self):
+        self._adresar = tempfile.TemporaryDirectory(prefix="test-manifest-")
+        self.adresar = self._adresar.name
+        self.obrazky = pripravit_obrazky(self.adresar)
+        self.manifest = self.otevrit()
+
+    def tearDown(self):
+        self._adresar.cleanup()
+
+    def otevrit(self):
+        manifest = skript.ManifestZpracovani(self.adresar)
+        self.addCleanup(manifest.zavrit)
+        return manifest
+
+    def zpracovat(self, obrazek, status="USPECH"):
+        """Jako po extrakci - výstup vedle obrázku a záznam do manifestu."""
+        with open(os.path.splitext(obrazek)[0] + ".json", "w", encoding="utf-8") as f:
+            f.write("{}")
+        self.manifest.zaznamenat(obrazek, status)
+
+    def test_zpracovany_obrazek_se_preskoci(self):
+        self.assertEqual(self.manifest.vybrat_ke_zpracovani(self.obrazky), self.obrazky)
+        self.zpracovat(self.obrazky[0])
+        self.assertEqual(self.manifest.vybrat_ke_zpracovani(self.obrazky), self.obrazky[1:])
+
+    def test_chyba_se_zopakuje(self):
+        self.zpracovat(self.obrazky[0], status="CHYBA_API")
+        self.assertIn(self.obrazky[0], self.manifest.vybrat_ke_zpracovani(self.obrazky))
+
+    def test_chybejici_vystup_se_zopakuje(self):
+        self.zpracovat(self.obrazky[0])
+        os.remove(os.path.splitext(self.obrazky[0])[0] + ".json")
+        self.assertIn(self.obrazky[0], self.manifest.vybrat_ke_zpracovani(self.obrazky))
+
+    def test_zmeneny_obsah_se_zpracuje_znovu(self):
+        self.zpracovat(self.obrazky[0])
+        with open(self.obrazky[0], "ab") as f:
+            f.write(b"\0")
+        self.assertIn(self.obrazky[0], self.manifest.vybrat_ke_zpracovani(self.obrazky))
+
+    def test_jen_novy_mtime_rozhodne_hash_jednou(self):
+        self.zpracovat(self.obrazky[0])
+        budouci = time.time() + 60
+        os.utime(self.obrazky[0], (budouci, budouci))
+
+        hashovano = []
+
+        def hash_souboru(cesta):
+            hashovano.append(cesta)
+            return skript.ManifestZpracovani.hash_souboru(cesta)
+
+        self.manifest.hash_souboru = hash_souboru
+        self.assertTrue(self.manifest.je_aktualni(self.obrazky[0]))
+        self.assertTrue(self.manifest.je_aktualni(self.obrazky[0]))
+        self.assertEqual(hashovano, [self.obrazky[0]])
+
+        # Kontrola nic nezapisuje - v manifestu zůstal původní mtime
+        mtime = self.manifest._db.execute("SELECT mtime FROM soubory WHERE soubor = ?",
+                                          (os.path.basename(self.obrazky[0]),)).fetchone()[0]
+        self.assertNotEqual(mtime, budouci)
+
+    def test_vystup_bez_zaznamu_plati_kdyz_je_novejsi(self):
+        vystup = os.path.splitext(self.obrazky[0])[0] + ".json"
+        with open(vystup, "w", encoding="utf-8") as f:
+            f.write("{}")
+        stary = os.stat(self.obrazky[0]).st_mtime - 60
+        self.assertTrue(self.manifest.je_aktualni(self.obrazky[0]))
+        os.utime(vystup, (stary, stary))
+        self.assertFalse(self.manifest.je_aktualni(self.obrazky[0]))
+
+    def test_stav_prezije_znovuotevreni(self):
+        self.zpracovat(self.obrazky[0])
+        self.assertEqual(self.otevrit().vybrat_ke_zpracovani(self.obrazky), self.obrazky[1:])
+
+@vyzaduje_sdk
+class TestNavazaniBehu(unittest.TestCase):
+
+    def setUp(self):
+        self._adresar = tempfile.TemporaryDirectory(prefix="test-manifest-beh-")
+        self.adresar = self._adresar.name
+        self.obrazky = pripravit_obrazky(self.adresar, pocet=3)
+        self._ticho = redirect_stdout(StringIO())
+        self._ticho.__enter__()
+
+    def tearDown(self):
+        skript.zavrit_knihy_spotreby()
+        self._ticho.__exit__(None, None, None)
+        self._adresar.cleanup()
+
+    def test_dalsi_beh_posle_jen_nezpracovane(self):
+        klient = falesny_klient()
+        with falesne_api(klient):
+            # Přerušený běh - stihl jen první dva obrázky
+            skript.zpracovat_davku_jednotlivo(self.adresar, inkrementalne=True, obrazky=self.obrazky[:2])
+            self.assertEqual(klient.models.pocet_volani, 2)
+            skript.zpracovat_davku_jednotlivo(self.adresar, inkrementalne=True)
+        self.assertEqual(klient.models.pocet_volani, 3)
+        for obrazek in self.obrazky:
+            self.assertTrue(os.path.exists(os.path.splitext(obrazek)[0] + ".json"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+"""Rozpočítání tokenů a nákladů dávky na obrázky - součet musí dát přesně cenu celé dávky."""
+import random
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+from types import SimpleNamespace
+
+from pomocne import falesne_api, falesny_klient, pripravit_obrazky, skript, vyzaduje_sdk
+
+class TestRozdelitUmerne(unittest.TestCase):
+
+    def test_soucet_sedi_a_casti_jsou_umerne(self):
+        nahoda = random.Random(12)
+        for _ in range(200):
+            vahy = [nahoda.randint(0, 5000) for _ in range(nahoda.randint(1, 12))]
+            celek = nahoda.randint(0, 100_000)
+            casti = skript._rozdelit_umerne(celek, vahy)
+            self.assertEqual(sum(casti), celek)
+            ucinne = vahy if sum(vahy) else [1] * len(vahy)
+            for cast, vaha in zip(casti, ucinne):
+                self.assertLess(abs(cast - celek * vaha / sum(ucinne)), 1)
+
+    def test_nejvetsi_zbytky_dostanou_navic(self):
+        self.assertEqual(skript._rozdelit_umerne(10, [1, 1, 1]), [4, 3, 3])
+        self.assertEqual(skript._rozdelit_umerne(5, [1, 3]), [1, 4])
+
+    def test_nulove_vahy_deli_rovnym_dilem(self):
+        self.assertEqual(skript._rozdelit_umerne(7, [0, 0]), [4, 3])
+        self.assertEqual(skript._rozdelit_umerne(7, []), [])
+
+class TestRozpocitatNakladyDavky(unittest.TestCase):
+
+    def test_soucet_obrazku_je_cena_davky(self):
+        usage = SimpleNamespace(prompt_token_count=5003, cached_content_token_count=1201,
+                                candidates_token_count=907, thoughts_token_count=55)
+        podily = skript.rozpocitat_naklady_davky(usage, skript.MODEL_DEFAULT, [1200, 800, 2500], [300, 310, 90])
+
+        self.assertEqual(len(podily), 3)
+        self.assertEqual(sum(tokeny for tokeny, _ in podily), 5003 + 907 + 55)
+        self.assertAlmostEqual(sum(naklady for _, naklady in podily),
+                               skript.naklady_odpovedi(usage, skript.MODEL_DEFAULT), places=12)
+
+    def test_vetsi_obrazek_a_delsi_vystup_plati_vic(self):
+        usage = SimpleNamespace(prompt_token_count=3000, candidates_token_count=600)
+        (tokeny_maly, naklady_maly), (tokeny_velky, naklady_velky) = skript.rozpocitat_naklady_davky(
+            usage, skript.MODEL_DEFAULT, [1000, 2000], [100, 500])
+        self.assertEqual((tokeny_maly, tokeny_velky), (1000 + 100, 2000 + 500))
+        self.assertLess(naklady_maly, naklady_velky)
+
+    def test_jen_celkovy_pocet_tokenu(self):
+        usage = SimpleNamespace(total_token_count=999)
+        podily = skript.rozpocitat_naklady_davky(usage, skript.MODEL_DEFAULT, [1, 1, 1], [5, 5, 5])
+        self.assertEqual([tokeny for tokeny, _ in podily], [333, 333, 333])
+
+@vyzaduje_sdk
+class TestNakladyVKnize(unittest.TestCase):
+
+    def setUp(self):
+        self._adresar = tempfile.TemporaryDirectory(prefix="test-naklady-")
+        self.adresar = self._adresar.name
+        self.obrazky = pripravit_obrazky(self.adresar, pocet=3)
+        self._ticho = redirect_stdout(StringIO())
+        self._ticho.__enter__()
+
+    def tearDown(self):
+        skript.zavrit_knihy_spotreby()
+        self._ticho.__exit__(None, None, None)
+        self._adresar.cleanup()
+
+    def test_radky_davky_daji_cenu_odpovedi(self):
+        klient = falesny_klient()
+        with falesne_api(klient):
+            skript.zpracovat_davku_uctenek(self.adresar, velikost_davky=5)
+
+        radky = [radek for radek in skript.kniha_spotreby(self.adresar).radky() if radek[4] == 'USPECH_DAVKA']
+        self.assertEqual(len(radky), len(self.obrazky))
+        self.assertEqual(klient.models.pocet_volani, 1)
+        self.assertEqual(sum(int(radek[2]) for radek in radky), klient.models.tokeny)
+        self.assertAlmostEqual(sum(float(radek[3]) for radek in radky), klient.models.naklady, places=9)
+
+if __name__ == "__main__":
+    unittest.main()
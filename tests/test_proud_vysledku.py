@@ -0,0 +1,110 @@
+"""Proud výsledků: rotace souborů JSON Lines, fsync a načtení proudů zpět."""
+import json
+import os
+import tempfile
+import time
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+from unittest import mock
+
+from pomocne import skript
+
+class TestProudVysledku(unittest.TestCase):
+
+    def setUp(self):
+        self._adresar = tempfile.TemporaryDirectory(prefix="test-proud-")
+        self.adresar = os.path.join(self._adresar.name, "proud")
+        self._ticho = redirect_stdout(StringIO())
+        self._ticho.__enter__()
+
+    def tearDown(self):
+        skript.zavrit_proud_vysledku()
+        self._ticho.__exit__(None, None, None)
+        self._adresar.cleanup()
+
+    def proud(self, **kwargs):
+        proud = skript.ProudVysledku(self.adresar, **kwargs)
+        self.addCleanup(proud.zavrit)
+        return proud
+
+    def radky(self, soubor):
+        with open(soubor, encoding="utf-8") as f:
+            return [json.loads(radek) for radek in f]
+
+    def test_po_max_bajtu_pokracuje_dalsim_souborem(self):
+        proud = self.proud(max_bajtu=1)
+        for cislo in range(3):
+            proud.zapsat(f"uctenka{cislo}.png", {"celkem": cislo})
+        proud.zavrit()
+
+        self.assertEqual([os.path.basename(soubor) for soubor in proud.soubory],
+                         [f"{proud.zaklad}-{cislo:04d}.jsonl" for cislo in range(3)])
+        for cislo, soubor in enumerate(proud.soubory):
+            self.assertEqual([radek["data"] for radek in self.radky(soubor)], [{"celkem": cislo}])
+        self.assertEqual(proud.zapsano, 3)
+
+    def test_pod_limitem_zustane_jeden_soubor(self):
+        proud = self.proud()
+        for cislo in range(5):
+            proud.zapsat(f"uctenka{cislo}.png", {"celkem": cislo})
+        proud.zavrit()
+
+        self.assertEqual(len(proud.soubory), 1)
+        radky = self.radky(proud.soubory[0])
+        self.assertEqual(len(radky), 5)
+        self.assertEqual(radky[0]["obrazek"], os.path.abspath("uctenka0.png"))
+        self.assertIn("prodejce", radky[0]["pole"])
+        self.assertNotIn("text", radky[0]["pole"])
+
+    def test_rotace_a_zavreni_ulozi_na_disk(self):
+        with mock.patch.object(skript.os, "fsync") as fsync:
+            proud = self.proud(max_bajtu=1, fsync_interval=60)
+            proud.zapsat("a.png", {})
+            proud.zapsat("b.png", {})
+            proud.zavrit()
+        self.assertEqual(fsync.call_count, 2)
+
+    def test_fsync_v_klidu_po_intervalu(self):
+        with mock.patch.object(skript.os, "fsync") as fsync:
+            proud = self.proud(fsync_interval=0.01)
+            proud.zapsat("a.png", {})
+            konec = time.monotonic() + 5
+            while not fsync.called and time.monotonic() < konec:
+                time.sleep(0.01)
+            self.assertEqual(fsync.call_count, 1)
+            proud.zavrit()
+        # Zavření už nemá co uložit
+        self.assertEqual(fsync.call_count, 1)
+
+    def test_nacteni_proudu_plati_posledni_vysledek(self):
+        prvni = self.proud()
+        prvni.zapsat("a.png", {"celkem": 1})
+        prvni.zapsat("b.png", {"celkem": 2})
+        prvni.zavrit()
+        druhy = skript.ProudVysledku(self.adresar)
+        druhy.zaklad = prvni.zaklad + "z"  # novější běh - později v pořadí názvů
+        druhy.zapsat("a.png", {"celkem": 10})
+        druhy.zavrit()
+        with open(druhy.soubory[0], "a", encoding="utf-8") as f:
+            f.write('{"obrazek": "prerusen')
+
+        vysledky = skript.nacist_proudy_vysledku([self.adresar])
+        self.assertEqual({os.path.basename(v["obrazek"]): v["data"]["celkem"] for v in vysledky},
+                         {"a.png": 10, "b.png": 2})
+
+    def test_bez_json_souboru_vedle_obrazku(self):
+        obrazek = os.path.join(self._adresar.name, "uctenka.png")
+        proud = skript.ProudVysledku(self.adresar)
+        skript.nastavit_proud_vysledku(proud, json_soubory=False)
+        vystup = skript.zapsat_vystup(obrazek, '{"celkem": 5}')
+        skript.zavrit_proud_vysledku()
+
+        self.assertFalse(os.path.exists(vystup))
+        self.assertEqual([radek["data"] for radek in self.radky(proud.soubory[0])], [{"celkem": 5}])
+        # Po zavření proudu se zase zapisuje JSON vedle obrázku
+        skript.zapsat_vystup(obrazek, '{"celkem": 6}')
+        self.assertTrue(os.path.exists(vystup))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,171 @@
+"""Rozpočet běhu: povolování podle odhadu, čekání na rozpracované požadavky, denní strop a úloha Batch API."""
+import os
+import tempfile
+import threading
+import unittest
+from contextlib import redirect_stdout
+from datetime import datetime
+from io import StringIO
+
+from pomocne import falesne_api, falesny_klient, pripravit_obrazky, skript
+
+class TestRozpocetBehu(unittest.TestCase):
+
+    def setUp(self):
+        self._ticho = redirect_stdout(StringIO())
+        self._ticho.__enter__()
+
+    def tearDown(self):
+        self._ticho.__exit__(None, None, None)
+
+    def test_bez_prumeru_rozhoduje_odhad_pozadavku(self):
+        rozpocet = skript.RozpocetBehu(max_usd=1.0)
+        self.assertTrue(rozpocet.povolit("3", 1, (100, 0.4)))
+        rozpocet.zaplatit(1, 100, 0.4)
+        self.assertTrue(rozpocet.povolit("3", 1, (100, 0.4)))
+        rozpocet.zaplatit(1, 100, 0.4)
+
+        self.assertFalse(rozpocet.povolit("3", 1, (100, 0.4)))
+        self.assertTrue(rozpocet.zastaveno)
+        self.assertAlmostEqual(rozpocet.utraceno_usd, 0.8)
+
+    def test_prumer_rezimu_ma_prednost_pred_odhadem(self):
+        rozpocet = skript.RozpocetBehu(max_tokenu=1000)
+        rozpocet.zaznamenat("2", 5, 1500, 0.05)
+        rozpocet.zaznamenat("2", 5, 500, 0.01)
+        self.assertEqual(rozpocet.na_obrazek("2"), (200, 0.006))
+
+        # Dávka 5 obrázků po 200 tokenech se vejde, i když by podle odhadu požadavku nestačilo
+        self.assertTrue(rozpocet.povolit("2", 5, (5000, 0.0)))
+        rozpocet.zaplatit(5, 1000, 0.03)
+        self.assertFalse(rozpocet.vejde_se(1, "2"))
+
+    def test_ceka_na_cenu_rozpracovanych_pozadavku(self):
+        rozpocet = skript.RozpocetBehu(max_usd=1.0)
+        self.assertTrue(rozpocet.povolit("4", 1, (0, 0.6)))
+        vysledek = []
+        vlakno = threading.Thread(target=lambda: vysledek.append(rozpocet.povolit("4", 1, (0, 0.6))))
+        vlakno.start()
+        vlakno.join(0.2)
+        self.assertTrue(vlakno.is_alive())  # rezervace prvního požadavku druhý zatím nepustí
+
+        rozpocet.zaplatit(1, 10, 0.1)  # skutečná cena vyšla levněji
+        vlakno.join(5)
+        self.assertEqual(vysledek, [True])
+
+    def test_zaznamenat_ignoruje_polozky_zdarma(self):
+        rozpocet = skript.RozpocetBehu(max_usd=1.0)
+        rozpocet.zaznamenat("2", 1, 0, 0.0)
+        self.assertIsNone(rozpocet.na_obrazek("2"))
+
+class TestDenniRozpocet(unittest.TestCase):
+
+    def setUp(self):
+        self._adresar = tempfile.TemporaryDirectory(prefix="test-rozpocet-")
+        self.adresar = self._adresar.name
+        self._ticho = redirect_stdout(StringIO())
+        self._ticho.__enter__()
+
+    def tearDown(self):
+        skript.zavrit_knihy_spotreby()
+        self._ticho.__exit__(None, None, None)
+        self._adresar.cleanup()
+
+    def zapsat_utratu(self, naklady, tokeny=1000):
+        cas = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        skript.ulozit_report_spotreby(self.adresar, [[cas, "dnes.png", tokeny, naklady, 'USPECH', '']])
+        skript.ulozit_report_spotreby(self.adresar, [["2000-01-01 10:00:00", "kdysi.png", tokeny, 5.0, 'USPECH', '']])
+
+    def test_zapocita_dnesni_knihu_spotreby(self):
+        self.zapsat_utratu(0.9)
+        rozpocet = skript.RozpocetBehu(max_usd=1.0, za_den=True)
+        rozpocet.pripojit(self.adresar)
+
+        self.assertAlmostEqual(rozpocet.utraceno_usd, 0.9)
+        self.assertFalse(rozpocet.povolit("3", 1, (100, 0.2)))
+
+    def test_novy_den_nacte_knihu_mimo_zamek(self):
+        self.zapsat_utratu(0.25)
+        rozpocet = skript.RozpocetBehu(max_usd=1.0, za_den=True)
+        rozpocet.pripojit(self.adresar)
+        rozpocet._den = "2000-01-01"
+        rozpocet.utraceno_usd = 0.99
+
+        zamek_volny = []
+        spotreba_dne = rozpocet._spotreba_dne
+
+        def zkusit_zamek():
+            ziskan = rozpocet._zamek.acquire(timeout=1)
+            if ziskan:
+                rozpocet._zamek.release()
+            zamek_volny.append(ziskan)
+
+        def spotreba_pri_volnem_zamku():
+            # Jiné vlákno musí zámek dostat, zatímco se čte kniha
+            vlakno = threading.Thread(target=zkusit_zamek)
+            vlakno.start()
+            vlakno.join()
+            return spotreba_dne()
+
+        rozpocet._spotreba_dne = spotreba_pri_volnem_zamku
+        self.assertTrue(rozpocet.povolit("3", 1, (100, 0.2)))
+        self.assertEqual(zamek_volny, [True])
+        self.assertEqual(rozpocet._den, datetime.now().strftime('%Y-%m-%d'))
+        self.assertAlmostEqual(rozpocet.utraceno_usd, 0.25)
+
+class TestRozpocetUlohy(unittest.TestCase):
+
+    def setUp(self):
+        self._adresar = tempfile.TemporaryDirectory(prefix="test-rozpocet-uloha-")
+        self.adresar = self._adresar.name
+        self.obrazky = pripravit_obrazky(self.adresar, pocet=3)
+        self._ticho = redirect_stdout(StringIO())
+        self._ticho.__enter__()
+
+    def tearDown(self):
+        skript.zavrit_knihy_spotreby()
+        self._ticho.__exit__(None, None, None)
+        self._adresar.cleanup()
+
+    def odhad(self, obrazek):
+        """Odhad ceny požadavku obrázku v úloze - stejně jako DavkovaUloha.pripravit."""
+        with open(obrazek, "rb") as f:
+            odhad_obrazku = skript.pripravit_obrazek(obrazek, f.read(), None)[2]
+        tokeny = odhad_obrazku + skript.odhadnout_tokeny_textu(skript.PROMPT_EXTRAKCE)
+        return skript.vypocitat_naklady(tokeny, skript.MODEL_DEFAULT) * skript.SLEVA_BATCH_API
+
+    def zpracovat(self, klient, rozpocet):
+        with falesne_api(klient):
+            return skript.zpracovat_davkovou_ulohou(self.adresar, inkrementalne=False, interval=0,
+                                                    rozpocet=rozpocet)
+
+    def json_vystupy(self):
+        return sorted(soubor for soubor in os.listdir(self.adresar) if soubor.endswith(".json"))
+
+    def test_uloha_dostane_jen_obrazky_do_rozpoctu(self):
+        obrazky = sorted(self.obrazky)
+        strop = self.odhad(obrazky[0]) + self.odhad(obrazky[1]) * 1.5
+        klient = falesny_klient()
+        rozpocet = skript.RozpocetBehu(max_usd=strop)
+
+        self.assertTrue(self.zpracovat(klient, rozpocet))
+        self.assertTrue(rozpocet.zastaveno)
+        self.assertEqual(len(self.json_vystupy()), 2)
+        self.assertFalse(os.path.exists(os.path.splitext(obrazky[2])[0] + ".json"))
+
+    def test_vycerpany_rozpocet_uloha_neodesle(self):
+        klient = falesny_klient()
+        self.assertFalse(self.zpracovat(klient, skript.RozpocetBehu(max_usd=1e-12)))
+        self.assertEqual(klient.batches.ulohy, {})
+        self.assertIsNone(skript.DavkovaUloha(self.adresar, klient).faze)
+
+    def test_denni_rozpocet_uloh_pocita_knihu_adresare(self):
+        cas = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        skript.ulozit_report_spotreby(self.adresar, [[cas, "rano.png", 1000, 1.0, 'USPECH', '']])
+        klient = falesny_klient()
+
+        self.assertFalse(self.zpracovat(klient, skript.RozpocetBehu(max_usd=1.0, za_den=True)))
+        self.assertEqual(klient.batches.ulohy, {})
+
+if __name__ == "__main__":
+    unittest.main()
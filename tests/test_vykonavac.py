@@ -0,0 +1,179 @@
+"""Kvóta a opakování požadavků: token bucket modelu, exponenciální čekání a souběh požadavků."""
+import threading
+import time
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
+
+from pomocne import skript
+
+class FalesneHodiny:
+    """Náhrada modulu time ve skriptu - sleep jen posune monotonic a zapíše se."""
+
+    def __init__(self):
+        self.ted = 1000.0
+        self.spanky = []
+
+    def monotonic(self):
+        return self.ted
+
+    def sleep(self, sekundy):
+        self.spanky.append(sekundy)
+        self.ted += sekundy
+
+    def __getattr__(self, nazev):
+        return getattr(time, nazev)
+
+class ChybaApi(Exception):
+
+    def __init__(self, code):
+        super().__init__(f"{code} chyba API")
+        self.code = code
+
+class PostupneModely:
+    """Náhrada client.models - vyhodí připravené chyby a pak odpoví."""
+
+    def __init__(self, chyby):
+        self.chyby = list(chyby)
+        self.pocet_volani = 0
+
+    def generate_content(self, model, contents, config=None):
+        self.pocet_volani += 1
+        if self.chyby:
+            raise self.chyby.pop(0)
+        return SimpleNamespace(text="{}", usage_metadata=SimpleNamespace(prompt_token_count=100,
+                                                                         total_token_count=110))
+
+class TestOmezovacRychlosti(unittest.TestCase):
+
+    def setUp(self):
+        self.hodiny = FalesneHodiny()
+        zaplata = mock.patch.object(skript, "time", self.hodiny)
+        zaplata.start()
+        self.addCleanup(zaplata.stop)
+
+    def test_pozadavky_nad_rpm_pockaji(self):
+        omezovac = skript.OmezovacRychlosti(rpm=2, tpm=1000)
+        omezovac.ziskat(100)
+        omezovac.ziskat(100)
+        self.assertEqual(self.hodiny.spanky, [])
+        omezovac.ziskat(100)
+        self.assertAlmostEqual(sum(self.hodiny.spanky), 30.0)
+
+    def test_tokeny_nad_tpm_pockaji(self):
+        omezovac = skript.OmezovacRychlosti(rpm=100, tpm=600)
+        omezovac.ziskat(600)
+        omezovac.ziskat(300)
+        self.assertAlmostEqual(sum(self.hodiny.spanky), 30.0)
+
+    def test_pozadavek_nad_celou_kvotu_neceka_navzdy(self):
+        omezovac = skript.OmezovacRychlosti(rpm=100, tpm=600)
+        omezovac.ziskat(10_000)
+        self.assertEqual(self.hodiny.spanky, [])
+
+    def test_skutecna_spotreba_opravi_odhad(self):
+        omezovac = skript.OmezovacRychlosti(rpm=100, tpm=600)
+        omezovac.ziskat(100)
+        omezovac.upravit(100, 400)  # odpověď stála víc, zbývá 200 tokenů
+        omezovac.ziskat(300)
+        self.assertAlmostEqual(sum(self.hodiny.spanky), 10.0)
+
+    def test_vyprazdneni_po_429(self):
+        omezovac = skript.OmezovacRychlosti(rpm=60, tpm=6000)
+        omezovac.vyprazdnit()
+        omezovac.ziskat(60)
+        self.assertAlmostEqual(sum(self.hodiny.spanky), 1.0)
+
+class TestVykonavacPozadavku(unittest.TestCase):
+
+    def setUp(self):
+        self.hodiny = FalesneHodiny()
+        for zaplata in (mock.patch.object(skript, "time", self.hodiny),
+                        mock.patch.object(skript.random, "uniform", lambda a, b: b)):
+            zaplata.start()
+            self.addCleanup(zaplata.stop)
+        self._ticho = redirect_stdout(StringIO())
+        self._ticho.__enter__()
+
+    def tearDown(self):
+        self._ticho.__exit__(None, None, None)
+
+    def vykonavac(self, chyby, **kwargs):
+        self.modely = PostupneModely(chyby)
+        return skript.VykonavacPozadavku(SimpleNamespace(models=self.modely), limity={"model": (60, 600_000)},
+                                         zakladni_cekani=0.1, **kwargs)
+
+    def test_opakovatelne_chyby(self):
+        for kod in skript.OPAKOVATELNE_KODY:
+            self.assertTrue(skript.VykonavacPozadavku.je_opakovatelna(ChybaApi(kod)))
+        self.assertFalse(skript.VykonavacPozadavku.je_opakovatelna(ChybaApi(400)))
+        self.assertTrue(skript.VykonavacPozadavku.je_opakovatelna(SimpleNamespace(status_code=503)))
+        self.assertTrue(skript.VykonavacPozadavku.je_opakovatelna(ConnectionResetError()))
+        self.assertTrue(skript.VykonavacPozadavku.je_opakovatelna(TimeoutError()))
+        self.assertTrue(skript.VykonavacPozadavku.je_opakovatelna(type("ReadTimeout", (Exception,), {})()))
+        self.assertFalse(skript.VykonavacPozadavku.je_opakovatelna(ValueError()))
+
+    def test_cekani_roste_exponencialne_do_meze(self):
+        vykonavac = self.vykonavac([ChybaApi(503)] * 3, max_cekani=0.3)
+        vykonavac.generovat("model", [], odhad_tokenu=10)
+
+        self.assertEqual(self.modely.pocet_volani, 4)
+        self.assertEqual((vykonavac.pocet_pozadavku, vykonavac.pocet_opakovani), (4, 3))
+        self.assertEqual([round(spanek, 6) for spanek in self.hodiny.spanky], [0.1, 0.2, 0.3])
+
+    def test_neopakovatelna_chyba_hned_skonci(self):
+        vykonavac = self.vykonavac([ChybaApi(400)])
+        with self.assertRaises(ChybaApi):
+            vykonavac.generovat("model", [], odhad_tokenu=10)
+        self.assertEqual(self.modely.pocet_volani, 1)
+        self.assertEqual(self.hodiny.spanky, [])
+
+    def test_po_max_pokusu_vyhodi_posledni_chybu(self):
+        posledni = ChybaApi(502)
+        vykonavac = self.vykonavac([ChybaApi(503), ChybaApi(500), posledni], max_pokusu=3)
+        with self.assertRaises(ChybaApi) as kontext:
+            vykonavac.generovat("model", [], odhad_tokenu=10)
+        self.assertIs(kontext.exception, posledni)
+        self.assertEqual(self.modely.pocet_volani, 3)
+
+    def test_429_vyprazdni_kvotu(self):
+        vykonavac = self.vykonavac([ChybaApi(429)])
+        vykonavac.generovat("model", [], odhad_tokenu=10)
+        # Po čekání na opakování (0.1 s) ještě dočká na celý požadavek z kvóty 60 RPM
+        self.assertAlmostEqual(sum(self.hodiny.spanky), 1.0)
+
+        vykonavac = self.vykonavac([ChybaApi(503)])
+        self.hodiny.spanky.clear()
+        vykonavac.generovat("model", [], odhad_tokenu=10)
+        self.assertAlmostEqual(sum(self.hodiny.spanky), 0.1)
+
+class TestSoubeznePozadavky(unittest.TestCase):
+
+    def test_max_soubezne_omezi_pozadavky_ve_vzduchu(self):
+        zamek = threading.Lock()
+        stav = {"ted": 0, "nejvic": 0}
+
+        def generate_content(model, contents, config=None):
+            with zamek:
+                stav["ted"] += 1
+                stav["nejvic"] = max(stav["nejvic"], stav["ted"])
+            time.sleep(0.05)
+            with zamek:
+                stav["ted"] -= 1
+            return SimpleNamespace(usage_metadata=SimpleNamespace(prompt_token_count=1))
+
+        klient = SimpleNamespace(models=SimpleNamespace(generate_content=generate_content))
+        vykonavac = skript.VykonavacPozadavku(klient, limity={"model": (10_000, 10**9)}, max_soubezne=2)
+        vlakna = [threading.Thread(target=vykonavac.generovat, args=("model", [])) for _ in range(6)]
+        for vlakno in vlakna:
+            vlakno.start()
+        for vlakno in vlakna:
+            vlakno.join()
+
+        self.assertEqual(stav["nejvic"], 2)
+        self.assertEqual(vykonavac.pocet_pozadavku, 6)
+
+if __name__ == "__main__":
+    unittest.main()
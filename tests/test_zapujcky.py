@@ -0,0 +1,96 @@
+"""Zápůjčky obrázků mezi uzly: výlučnost, obnovování, propadnutí a převzetí."""
+import json
+import os
+import tempfile
+import time
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+
+from pomocne import skript
+
+class TestZapujckyObrazku(unittest.TestCase):
+
+    def setUp(self):
+        self._adresar = tempfile.TemporaryDirectory(prefix="test-zapujcky-")
+        self.adresar = self._adresar.name
+        self.otevrene = []
+        self._ticho = redirect_stdout(StringIO())
+        self._ticho.__enter__()
+
+    def tearDown(self):
+        for zapujcky in self.otevrene:
+            zapujcky.zavrit()
+        self._ticho.__exit__(None, None, None)
+        self._adresar.cleanup()
+
+    def uzel(self, vlastnik, platnost=600):
+        zapujcky = skript.ZapujckyObrazku(self.adresar, vlastnik=vlastnik, platnost=platnost)
+        self.otevrene.append(zapujcky)
+        return zapujcky
+
+    def soubor(self, obrazek):
+        return os.path.join(self.adresar, skript.ZAPUJCKY_ADRESAR, f"{obrazek}.lease")
+
+    def vlastnik(self, obrazek):
+        with open(self.soubor(obrazek), encoding="utf-8") as f:
+            return json.load(f)["vlastnik"]
+
+    def zestarnout(self, obrazek, sekund):
+        cas = time.time() - sekund
+        os.utime(self.soubor(obrazek), (cas, cas))
+
+    def test_zapujcku_drzi_jen_jeden_uzel(self):
+        a, b = self.uzel("a"), self.uzel("b")
+        self.assertTrue(a.zabrat("uctenka.png"))
+        self.assertFalse(b.zabrat("uctenka.png"))
+        self.assertTrue(b.zabrat("uctenka2.png"))
+
+        a.uvolnit("uctenka.png")
+        self.assertFalse(os.path.exists(self.soubor("uctenka.png")))
+        self.assertTrue(b.zabrat("uctenka.png"))
+        self.assertEqual(self.vlastnik("uctenka.png"), "b")
+
+    def test_platna_zapujcka_se_neprevezme(self):
+        a, b = self.uzel("a"), self.uzel("b")
+        a.zabrat("uctenka.png")
+        self.zestarnout("uctenka.png", 500)
+        self.assertFalse(b.zabrat("uctenka.png"))
+        self.assertEqual(self.vlastnik("uctenka.png"), "a")
+
+    def test_propadla_zapujcka_se_prevezme(self):
+        a, b = self.uzel("a"), self.uzel("b")
+        a.zabrat("uctenka.png")
+        self.zestarnout("uctenka.png", 700)
+
+        self.assertTrue(b.zabrat("uctenka.png"))
+        self.assertEqual(self.vlastnik("uctenka.png"), "b")
+        # Uzel, kterému zápůjčka propadla, už cizí zápůjčku nesmaže
+        a.uvolnit("uctenka.png")
+        self.assertEqual(self.vlastnik("uctenka.png"), "b")
+        self.assertEqual(os.listdir(os.path.join(self.adresar, skript.ZAPUJCKY_ADRESAR)), ["uctenka.png.lease"])
+
+    def test_obnovovani_drzi_zapujcku_platnou(self):
+        a, b = self.uzel("a", platnost=0.6), self.uzel("b", platnost=0.6)
+        a.zabrat("uctenka.png")
+        time.sleep(1.2)
+        self.assertFalse(b.zabrat("uctenka.png"))
+
+        a.zavrit()
+        self.assertFalse(os.path.exists(self.soubor("uctenka.png")))
+        self.assertTrue(b.zabrat("uctenka.png"))
+
+    def test_prevzata_zapujcka_se_prestane_obnovovat(self):
+        a, b = self.uzel("a", platnost=0.6), self.uzel("b", platnost=0.6)
+        a.zabrat("uctenka.png")
+        # Uzel "a" stál déle než platnost (např. uspaný stroj) - mezitím zápůjčku převzal "b"
+        os.unlink(self.soubor("uctenka.png"))
+        self.assertTrue(b.zabrat("uctenka.png"))
+        time.sleep(0.5)
+        self.assertNotIn(self.soubor("uctenka.png"), a._drzene)
+
+        a.zavrit()
+        self.assertEqual(self.vlastnik("uctenka.png"), "b")
+
+if __name__ == "__main__":
+    unittest.main()